@@ -0,0 +1,72 @@
+"""
+Micro-benchmark comparing the handler codecs on typical dict payloads.
+
+Usage:
+    python -m benchmarks.codec_bench [--number N]
+"""
+import argparse
+import timeit
+from typing import Any, Dict, List
+from handlers.codec import Codec, CompressedCodec, FastJSONCodec, JSONCodec, MsgpackCodec, PickleCodec
+
+
+def build_payloads() -> Dict[str, Any]:
+    """Small, medium and large dicts shaped like the records stored by the handlers."""
+    small = {'name': 'Ozan Metin', 'email': 'example@example.com'}
+    medium = {
+        'id': 123456,
+        'name': 'Ozan Metin',
+        'email': 'example@example.com',
+        'active': True,
+        'score': 98.25,
+        'tags': ['redis', 'python', 'cache', 'queue'],
+        'address': {'city': 'Istanbul', 'zip': '34000', 'lines': ['Street 1', 'Apt 2']},
+        'history': [{'event': 'login', 'ts': 1700000000 + i} for i in range(10)],
+    }
+    large = {'items': [dict(medium, id=i) for i in range(200)]}
+    return {'small': small, 'medium': medium, 'large': large}
+
+
+def available_codecs() -> List[Codec]:
+    codecs = [JSONCodec(), FastJSONCodec(), PickleCodec()]
+    try:
+        codecs.append(MsgpackCodec())
+    except ImportError:
+        pass
+    codecs.append(CompressedCodec(JSONCodec(), algorithm='zlib'))
+    try:
+        codecs.append(CompressedCodec(FastJSONCodec(), algorithm='lz4'))
+    except ImportError:
+        pass
+    return codecs
+
+
+def bench(codec: Codec, payload: Any, number: int) -> Dict[str, float]:
+    data = codec.dumps(payload)
+    dumps_time = timeit.timeit(lambda: codec.dumps(payload), number=number)
+    loads_time = timeit.timeit(lambda: codec.loads(data), number=number)
+    return {
+        'bytes': len(data),
+        'dumps_us': dumps_time / number * 1e6,
+        'loads_us': loads_time / number * 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='iterations per measurement')
+    args = parser.parse_args()
+
+    print(f"{'payload':<8} {'codec':<16} {'bytes':>8} {'dumps us':>10} {'loads us':>10}")
+    for payload_name, payload in build_payloads().items():
+        number = max(args.number // 50, 1) if payload_name == 'large' else args.number
+        for codec in available_codecs():
+            result = bench(codec, payload, number)
+            print(
+                f"{payload_name:<8} {codec.name:<16} {result['bytes']:>8} "
+                f"{result['dumps_us']:>10.2f} {result['loads_us']:>10.2f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+"""
+Throughput and latency benchmark of the handlers' hot operations.
+
+Every scenario runs at each payload size and concurrency level, with each
+worker thread issuing --ops calls. Results are written as JSON and can be
+compared with a saved baseline; the exit status is 1 when a scenario got
+slower than the threshold allows.
+
+Usage:
+    python -m benchmarks.handler_bench [--url URL | --server | --in-process]
+        [--only kv.get,stream.add_read_ack] [--payloads small,medium]
+        [--concurrency 1,8] [--ops N] [--output report.json]
+        [--compare baseline.json] [--threshold 0.15]
+
+Without a backend option, --url is used when given, then a redis-server
+started on a free port when one is on PATH, then an in-process FakeRedisServer (handlers.testing).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+import redis
+from benchmarks.codec_bench import build_payloads
+from handlers.hashset import RedisHashSet
+from handlers.key_value import RedisKeyValue
+from handlers.pubsub import RedisPubSub
+from handlers.queue import RedisQueue
+from handlers.sorted_set import RedisSortedSet
+from handlers.stream import RedisStream
+from handlers.testing import FakeRedisServer
+
+
+BATCH = 100
+STREAM_BATCH = 10
+
+# A scenario builds its handlers and returns a factory of per-worker
+# operations and a cleanup function. An operation may carry a prepare
+# function, run untimed before every call, e.g. to refill what it consumes.
+Operation = Callable[[], Any]
+Scenario = Callable[[redis.ConnectionPool, Any], Tuple[Callable[[int], Operation], Callable[[], None]]]
+
+
+def kv_set(pool, payload):
+    kv_store = RedisKeyValue('bench:kv', connection_pool=pool)
+
+    def worker(index):
+        counter = itertools.count()
+        return lambda: kv_store.set(f'{index}:{next(counter) % 1000}', payload)
+    return worker, kv_store.clear
+
+
+def kv_get(pool, payload):
+    kv_store = RedisKeyValue('bench:kv', connection_pool=pool)
+    kv_store.set_many({str(n): payload for n in range(1000)})
+
+    def worker(index):
+        counter = itertools.count()
+        return lambda: kv_store.get(str(next(counter) % 1000))
+    return worker, kv_store.clear
+
+
+def kv_get_many(pool, payload):
+    kv_store = RedisKeyValue('bench:kv', connection_pool=pool)
+    kv_store.set_many({str(n): payload for n in range(1000)})
+    keys = [str(n) for n in range(BATCH)]
+    return (lambda index: lambda: kv_store.get_many(keys)), kv_store.clear
+
+
+def hash_set(pool, payload):
+    hash_set = RedisHashSet('bench:hash', connection_pool=pool)
+
+    def worker(index):
+        counter = itertools.count()
+        return lambda: hash_set.set(f'{index}:{next(counter) % 1000}', payload)
+    return worker, hash_set.clear
+
+
+def hash_get(pool, payload):
+    hash_set = RedisHashSet('bench:hash', connection_pool=pool)
+    hash_set.set_many({str(n): payload for n in range(1000)})
+
+    def worker(index):
+        counter = itertools.count()
+        return lambda: hash_set.get(str(next(counter) % 1000))
+    return worker, hash_set.clear
+
+
+def hash_get_many(pool, payload):
+    hash_set = RedisHashSet('bench:hash', connection_pool=pool)
+    hash_set.set_many({str(n): payload for n in range(1000)})
+    keys = [str(n) for n in range(BATCH)]
+    return (lambda index: lambda: hash_set.get_many(keys)), hash_set.clear
+
+
+def hash_get_all(pool, payload):
+    hash_set = RedisHashSet('bench:hash', connection_pool=pool)
+    hash_set.set_many({str(n): payload for n in range(BATCH)})
+    return (lambda index: hash_set.get_all), hash_set.clear
+
+
+def queue_set_get(pool, payload):
+    queue = RedisQueue('bench:queue', connection_pool=pool)
+
+    def worker(index):
+        def operation():
+            queue.set(payload)
+            return queue.get()
+        return operation
+    return worker, queue.clear
+
+
+def queue_get_many(pool, payload):
+    queues = []
+
+    def worker(index):
+        queue = RedisQueue(f'bench:queue:{index}', connection_pool=pool)
+        queues.append(queue)
+        items = [queue._codec.dumps(payload)] * BATCH
+
+        def operation():
+            batch = queue.get_many(BATCH)
+            if len(batch) != BATCH:
+                raise RuntimeError(f'{queue} popped {len(batch)} items instead of {BATCH}')
+            return batch
+        # Pushed raw, so that the refill does not encode the payload every time.
+        operation.prepare = lambda: queue._conn.rpush(queue._name, *items)
+        return operation
+
+    def cleanup():
+        for queue in queues:
+            queue.clear()
+    return worker, cleanup
+
+
+def sorted_set_add_top(pool, payload):
+    sorted_set = RedisSortedSet('bench:sorted_set', connection_pool=pool)
+
+    def worker(index):
+        counter = itertools.count()
+
+        def operation():
+            n = next(counter)
+            sorted_set.incr(f'{index}:{n % 1000}', n)
+            return sorted_set.top(10)
+        return operation
+    return worker, sorted_set.clear
+
+
+def stream_add(pool, payload):
+    stream = RedisStream('bench:stream', group_name='bench', connection_pool=pool, encode_values=True)
+    message = {'payload': payload}
+    return (lambda index: lambda: stream.set(message)), stream.clear
+
+
+def stream_add_read_ack(pool, payload):
+    stream = RedisStream('bench:stream', group_name='bench', connection_pool=pool, encode_values=True)
+    stream.clear()
+    stream._create_consumer_group()
+    messages = [{'payload': payload}] * STREAM_BATCH
+
+    def worker(index):
+        consumer = RedisStream('bench:stream', group_name='bench', consumer_name=f'worker{index}', connection_pool=pool, encode_values=True)
+
+        def operation():
+            # Workers share the group, so a read may return another worker's batch.
+            consumer.add_many(messages)
+            data = consumer.get(count=STREAM_BATCH, block=None)
+            return consumer.ack(message['id'] for message in data['datas'])
+        return operation
+    return worker, stream.clear
+
+
+def pubsub_round_trip(pool, payload):
+    pubsub = RedisPubSub(connection_pool=pool)
+
+    def worker(index):
+        channel = f'bench:channel:{index}'
+        received = threading.Event()
+        pubsub.subscribe(channel, lambda message: received.set())
+        while True:
+            # Wait until the subscription is live before timing anything.
+            received.clear()
+            pubsub.publish(channel, payload)
+            if received.wait(0.1):
+                break
+
+        def operation():
+            received.clear()
+            pubsub.publish(channel, payload)
+            received.wait(5)
+        return operation
+    return worker, pubsub.stop
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    'kv.set': kv_set,
+    'kv.get': kv_get,
+    'kv.get_many': kv_get_many,
+    'hash.set': hash_set,
+    'hash.get': hash_get,
+    'hash.get_many': hash_get_many,
+    'hash.get_all': hash_get_all,
+    'queue.set_get': queue_set_get,
+    'queue.get_many': queue_get_many,
+    'sorted_set.incr_top': sorted_set_add_top,
+    'stream.add': stream_add,
+    'stream.add_read_ack': stream_add_read_ack,
+    'pubsub.round_trip': pubsub_round_trip,
+}
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def run_scenario(scenario: Scenario, pool: redis.ConnectionPool, payload: Any, concurrency: int, ops: int) -> Dict[str, float]:
+    """Run ops calls on each of concurrency threads and return throughput and latency figures."""
+    worker_factory, cleanup = scenario(pool, payload)
+    try:
+        operations = [worker_factory(index) for index in range(concurrency)]
+        for operation in operations:
+            prepare = getattr(operation, 'prepare', None)
+            if prepare is not None:
+                prepare()
+            operation()
+        latencies: List[List[float]] = [[] for _ in operations]
+        barrier = threading.Barrier(concurrency + 1)
+
+        def run(index: int) -> None:
+            operation, timings = operations[index], latencies[index]
+            prepare = getattr(operation, 'prepare', None)
+            barrier.wait()
+            for _ in range(ops):
+                if prepare is not None:
+                    prepare()
+                started = time.perf_counter()
+                operation()
+                timings.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if any(getattr(operation, 'prepare', None) for operation in operations):
+            # Leave the untimed preparation out of the throughput.
+            elapsed = max(sum(timings) for timings in latencies)
+    finally:
+        cleanup()
+    merged = sorted(itertools.chain.from_iterable(latencies))
+    return {
+        'ops': len(merged),
+        'seconds': elapsed,
+        'ops_per_sec': len(merged) / elapsed if elapsed else 0.0,
+        'p50_us': percentile(merged, 0.50) * 1e6,
+        'p99_us': percentile(merged, 0.99) * 1e6,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(executable: str) -> Tuple[subprocess.Popen, str]:
+    """Start a throwaway redis-server without persistence and return it with its URL."""
+    port = free_port()
+    process = subprocess.Popen(
+        [executable, '--port', str(port), '--save', '', '--appendonly', 'no'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    url = f'redis://127.0.0.1:{port}/0'
+    client = redis.StrictRedis.from_url(url)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            client.ping()
+            return process, url
+        except redis.exceptions.ConnectionError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError(f'{executable} did not start')
+            time.sleep(0.05)
+
+
+def in_process_pool(max_connections: int) -> Tuple[redis.ConnectionPool, FakeRedisServer]:
+    """Connection pool of a FakeRedisServer started in this process."""
+    server = FakeRedisServer().start()
+    return redis.BlockingConnectionPool.from_url(server.url, max_connections=max_connections), server
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return a line for every result that got slower than threshold allows against the baseline."""
+    previous = {(r['scenario'], r['payload'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['payload'], result['concurrency']))
+        if before is None:
+            continue
+        label = f"{result['scenario']} {result['payload']} x{result['concurrency']}"
+        if result['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append(f"{label}: {before['ops_per_sec']:.0f} -> {result['ops_per_sec']:.0f} ops/s")
+        if result['p99_us'] > before['p99_us'] * (1 + threshold):
+            regressions.append(f"{label}: p99 {before['p99_us']:.0f} -> {result['p99_us']:.0f} us")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--url', help='benchmark an existing server, e.g. redis://localhost:6379/15 (it is written to)')
+    backend.add_argument('--server', nargs='?', const='redis-server', help='start this redis-server binary on a free port')
+    backend.add_argument('--in-process', action='store_true', help='use an in-process FakeRedisServer')
+    parser.add_argument('--only', help='comma-separated scenarios: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--payloads', default='small,medium,large', help='comma-separated payload sizes')
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated worker thread counts')
+    parser.add_argument('--ops', type=int, default=1000, help='calls per worker; a tenth of it for large payloads')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report to compare the results with')
+    parser.add_argument('--threshold', type=float, default=0.15, help='tolerated relative slowdown')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+    payloads = build_payloads()
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+
+    process = None
+    fake_server = None
+    if args.url:
+        pool, backend_name = redis.BlockingConnectionPool.from_url(args.url, max_connections=max(concurrency_levels) * 2 + 4), args.url
+    elif args.in_process or not (args.server or shutil.which('redis-server')):
+        pool, fake_server = in_process_pool(max(concurrency_levels) * 2 + 4)
+        backend_name = 'fake-redis-server'
+    else:
+        process, url = start_server(args.server or 'redis-server')
+        pool, backend_name = redis.BlockingConnectionPool.from_url(url, max_connections=max(concurrency_levels) * 2 + 4), 'redis-server'
+
+    results = []
+    try:
+        try:
+            server_version = redis.StrictRedis(connection_pool=pool).info('server').get('redis_version')
+        except redis.exceptions.ResponseError:
+            server_version = None
+        print(f"{'scenario':<20} {'payload':<8} {'threads':>7} {'ops/s':>10} {'p50 us':>9} {'p99 us':>9}")
+        for name in names:
+            for payload_name in args.payloads.split(','):
+                for concurrency in concurrency_levels:
+                    ops = max(args.ops // 10, 1) if payload_name == 'large' else args.ops
+                    result = run_scenario(SCENARIOS[name], pool, payloads[payload_name], concurrency, ops)
+                    result.update(scenario=name, payload=payload_name, concurrency=concurrency)
+                    results.append(result)
+                    print(
+                        f"{name:<20} {payload_name:<8} {concurrency:>7} {result['ops_per_sec']:>10.0f} "
+                        f"{result['p50_us']:>9.0f} {result['p99_us']:>9.0f}"
+                    )
+    finally:
+        pool.disconnect()
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if fake_server is not None:
+            fake_server.stop()
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'backend': backend_name,
+            'server_version': server_version,
+            'python': platform.python_version(),
+            'redis_py': redis.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'ops': args.ops,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions.')
+
+
+if __name__ == '__main__':
+    main()
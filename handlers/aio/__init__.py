@@ -0,0 +1,27 @@
+"""Asyncio versions of the handlers, sharing codecs and key names with the sync ones."""
+from handlers.aio.connection import AsyncConnectionRegistry, registry
+from handlers.aio.interface import AsyncIRedis
+from handlers.aio.hashset import RedisHashSet
+from handlers.aio.key_value import RedisKeyValue
+from handlers.aio.list import RedisList
+from handlers.aio.pubsub import RedisPubSub
+from handlers.aio.queue import RedisQueue
+from handlers.aio.set import RedisSet
+from handlers.aio.sorted_set import RedisSortedSet
+from handlers.aio.stack import RedisStack
+from handlers.aio.stream import RedisStream
+
+__all__ = [
+    'AsyncConnectionRegistry',
+    'AsyncIRedis',
+    'RedisHashSet',
+    'RedisKeyValue',
+    'RedisList',
+    'RedisPubSub',
+    'RedisQueue',
+    'RedisSet',
+    'RedisSortedSet',
+    'RedisStack',
+    'RedisStream',
+    'registry',
+]
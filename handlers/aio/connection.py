@@ -0,0 +1,146 @@
+import os
+import asyncio
+import threading
+import weakref
+import redis.asyncio
+from typing import Dict, MutableMapping, Optional
+from handlers.connection import ConnectionRegistry
+
+
+class AsyncConnectionRegistry(ConnectionRegistry):
+    """
+    Process-wide registry of asyncio connection pools, one per Redis server and event loop.
+
+    asyncio connections belong to the event loop that opened them, so pools
+    and cluster clients are kept per running loop and dropped once that loop
+    is closed. Clients created outside a running loop get a pool of their own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pools = weakref.WeakKeyDictionary()
+        self._clusters = weakref.WeakKeyDictionary()
+
+    def get_pool(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None
+    ) -> redis.asyncio.ConnectionPool:
+        """Return the pool the running event loop shares for the given server, creating it on first use."""
+        self._check_fork()
+        address = self._redirects.get((host, port), (host, port))
+        pools = self._loop_entries(self._pools)
+        if pools is None:
+            return self._create_pool(*address, db, password)
+        key = (host, port, db, password)
+        pool = pools.get(key)
+        if pool is None:
+            pool = pools[key] = self._create_pool(*address, db, password)
+        return pool
+
+    def get_client(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None
+    ) -> redis.asyncio.StrictRedis:
+        """Return an asyncio client bound to the shared pool for the given server."""
+        return redis.asyncio.StrictRedis(connection_pool=self.get_pool(host, port, db, password))
+
+    def get_cluster_client(self, host: str = 'localhost', port: int = 6379, password: str = None) -> redis.asyncio.RedisCluster:
+        """Return the asyncio Redis Cluster client the running event loop shares for the cluster a node belongs to."""
+        self._check_fork()
+        address = self._redirects.get((host, port), (host, port))
+        clusters = self._loop_entries(self._clusters)
+        if clusters is None:
+            return self._create_cluster(*address, password)
+        key = (host, port, password)
+        client = clusters.get(key)
+        if client is None:
+            client = clusters[key] = self._create_cluster(*address, password)
+        return client
+
+    async def reset(self) -> None:
+        """
+        Disconnect and forget every pool and cluster client of the running event loop.
+
+        Pools and clients of other loops are forgotten without being
+        disconnected, as their connections can only be closed from their own loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pools, self._pools = self._pools.get(loop, {}), weakref.WeakKeyDictionary()
+            clusters, self._clusters = self._clusters.get(loop, {}), weakref.WeakKeyDictionary()
+        for pool in pools.values():
+            await pool.disconnect()
+        for client in clusters.values():
+            await client.aclose()
+
+    def _loop_entries(self, by_loop: MutableMapping[asyncio.AbstractEventLoop, Dict]) -> Optional[Dict]:
+        # Returns None outside a running loop, where nothing can be shared safely.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        with self._lock:
+            for closed in [other for other in by_loop if other.is_closed()]:
+                del by_loop[closed]
+            return by_loop.setdefault(loop, {})
+
+    def _create_pool(self, host: str, port: int, db: int, password: Optional[str]) -> redis.asyncio.ConnectionPool:
+        options = dict(self._options)
+        blocking = options.pop('blocking')
+        timeout = options.pop('timeout')
+        if blocking:
+            return redis.asyncio.BlockingConnectionPool(
+                host=host, port=port, db=db, password=password, timeout=timeout, **options
+            )
+        return redis.asyncio.ConnectionPool(host=host, port=port, db=db, password=password, **options)
+
+    def _create_cluster(self, host: str, port: int, password: Optional[str]) -> redis.asyncio.RedisCluster:
+        options = dict(self._options)
+        options.pop('blocking')
+        options.pop('timeout')
+        return redis.asyncio.RedisCluster(host=host, port=port, password=password, **options)
+
+    def _after_fork(self) -> None:
+        self._pools = weakref.WeakKeyDictionary()
+        self._clusters = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __len__(self) -> int:
+        return sum(len(pools) for pools in list(self._pools.values()))
+
+    def __str__(self) -> str:
+        return f"AsyncConnectionRegistry(pools={len(self)}, loops={len(self._pools)})"
+
+
+registry = AsyncConnectionRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def get_connection(
+    host: str = 'localhost',
+    port: int = 6379,
+    db: int = 0,
+    password: str = None,
+    connection_pool: Optional[redis.asyncio.ConnectionPool] = None,
+    client: Optional[redis.asyncio.StrictRedis] = None
+) -> redis.asyncio.StrictRedis:
+    """
+    Resolve the asyncio client a handler should use.
+
+    An explicit client wins over an explicit pool, which wins over the shared
+    pool looked up in the registry from the connection parameters.
+    """
+    if client is not None:
+        return client
+    if connection_pool is not None:
+        return redis.asyncio.StrictRedis(connection_pool=connection_pool)
+    return registry.get_client(host, port, db, password)
@@ -0,0 +1,63 @@
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from handlers.aio.interface import AsyncIRedis
+
+
+class RedisHashSet(AsyncIRedis):
+    async def set(self, key: str, value: Any) -> None:
+        """Set a value in the hash set."""
+        await self._conn.hset(self._name, key, self._codec.dumps(value))
+
+    async def get(self, key: str) -> Any:
+        """Get a value from the hash set."""
+        byte_data = await self._conn.hget(self._name, key)
+        return self._codec.loads(byte_data) if byte_data else None
+
+    async def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """Set a field to value only if it still holds expected; None means missing. See the sync handler."""
+        missing = expected is None
+        expected = b'' if missing else self._codec.dumps(expected)
+        updated = await self._run_script(
+            'hash_compare_and_set', keys=[self._name], args=[key, int(missing), expected, self._codec.dumps(value)]
+        )
+        return bool(updated)
+
+    async def get_all(self) -> Dict[str, Any]:
+        """Retrieve all key-value pairs from the hash set."""
+        data = await self._conn.hgetall(self._name)
+        return {key.decode('utf-8'): self._codec.loads(value) for key, value in data.items()}
+
+    async def project(self, *keys: str) -> Tuple[Any, ...]:
+        """Get the values of the given fields with one HMGET, in order, with None for missing ones."""
+        if not keys:
+            return ()
+        data = await self._conn.hmget(self._name, keys)
+        return tuple(self._codec.loads(byte_data) if byte_data else None for byte_data in data)
+
+    async def iter_items(self, match: Optional[str] = None, count: int = 1000) -> AsyncIterator[Tuple[str, Any]]:
+        """Lazily yield (field, value) pairs with HSCAN instead of loading the whole hash."""
+        async for key, value in self._conn.hscan_iter(self._name, match=match, count=count):
+            yield key.decode('utf-8'), self._codec.loads(value)
+
+    async def iter_keys(self, match: Optional[str] = None, count: int = 1000) -> AsyncIterator[str]:
+        """Lazily yield the fields with HSCAN, without decoding their values."""
+        async for key, _ in self._conn.hscan_iter(self._name, match=match, count=count):
+            yield key.decode('utf-8')
+
+    async def size(self) -> int:
+        """Get the number of fields in the hash set."""
+        return await self._conn.hlen(self._name)
+
+    async def delete(self, key: str) -> None:
+        """Delete a key-value pair from the hash set."""
+        await self._conn.hdel(self._name, key)
+
+    async def clear(self) -> None:
+        """Clear the hash set."""
+        await self._conn.delete(self._name)
+
+    async def exists(self, key: str) -> bool:
+        """Check if a key exists in the hash set."""
+        return await self._conn.hexists(self._name, key)
+
+    def __str__(self) -> str:
+        return f"RedisHashSet(name={self._name})"
@@ -0,0 +1,73 @@
+import redis.asyncio
+from abc import ABCMeta, abstractmethod
+from typing import Any, Iterable, Optional
+from handlers.codec import Codec, DEFAULT_CODEC
+from handlers.aio.connection import get_connection
+from handlers.instrumentation import Instrumentation, instrument
+from handlers.interface import IRedis
+from handlers.scripts import AsyncScriptRegistry
+
+
+class AsyncIRedis(metaclass=ABCMeta):
+
+    def __init__(
+        self,
+        name: str,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.asyncio.ConnectionPool] = None,
+        client: Optional[redis.asyncio.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the asyncio Redis Connection.
+
+        No network I/O happens here; connections are opened on first use.
+
+        Args:
+            name (str): The name of the queue.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.asyncio.ConnectionPool, optional): An existing pool
+                to use instead of the shared one. Defaults to None.
+            client (redis.asyncio.StrictRedis, optional): An existing client to use as is,
+                which may be a redis.asyncio.RedisCluster. Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the one set with set_default_instrumentation().
+        """
+
+        self._name = name
+        self._codec = codec or DEFAULT_CODEC
+        self._conn = get_connection(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            connection_pool=connection_pool,
+            client=client
+        )
+        self._cluster = isinstance(self._conn, redis.asyncio.RedisCluster)
+        instrument(self, instrumentation)
+        self.scripts = AsyncScriptRegistry(self._conn)
+
+    async def _run_script(self, name: str, keys: Iterable[Any] = (), args: Iterable[Any] = ()) -> Any:
+        """Run a script of the registry on the handler's client."""
+        return await self.scripts(name, keys, args, client=self._conn)
+
+    _sub_key = IRedis._sub_key
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        """Retrieve the value associated with the given key."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Set the value for the given key, with an optional TTL."""
+        raise NotImplementedError
@@ -0,0 +1,107 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from handlers.aio.interface import AsyncIRedis
+from handlers.key_value import RedisKeyValue as SyncRedisKeyValue
+from handlers.utils import escape_pattern
+
+
+class RedisKeyValue(AsyncIRedis):
+    # Shared with the synchronous handler so both see the same keys.
+    _key_name = SyncRedisKeyValue._key_name
+
+    async def _scan_chunks(self, count: int) -> AsyncIterator[List[bytes]]:
+        """Yield the namespace's full key names in chunks of up to count keys."""
+        chunk = []
+        pattern = f'{escape_pattern(self._name)}:*'
+        async for key_name in self._conn.scan_iter(match=pattern, count=count):
+            chunk.append(key_name)
+            if len(chunk) >= count:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Set a key-value pair with an optional TTL."""
+        await self._conn.set(self._key_name(key), self._codec.dumps(value), ex=ttl or None)
+
+    async def set_if_absent(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Set a key only if it does not exist yet, with SET NX, and tell whether it was set."""
+        return bool(await self._conn.set(self._key_name(key), self._codec.dumps(value), ex=ttl or None, nx=True))
+
+    async def get_set(self, key: str, value: Any, ttl: Optional[int] = None) -> Any:
+        """Set a key and return its previous value, atomically with one script call."""
+        byte_data = await self._run_script(
+            'get_set_ttl', keys=[self._key_name(key)], args=[self._codec.dumps(value), int((ttl or 0) * 1000)]
+        )
+        return self._codec.loads(byte_data) if byte_data else None
+
+    async def get(self, key: str) -> Any:
+        """Get a value by key."""
+        key_name = self._key_name(key)
+        byte_data = await self._conn.get(key_name)
+        return self._codec.loads(byte_data) if byte_data else None
+
+    async def iter_keys(self, count: int = 1000) -> AsyncIterator[str]:
+        """
+        Iterate over the keys with SCAN without blocking the server.
+
+        Like SCAN itself, a key may be returned more than once.
+        """
+        prefix_length = len(self._name) + 1
+        async for chunk in self._scan_chunks(count):
+            for key_name in chunk:
+                yield key_name.decode('utf-8')[prefix_length:]
+
+    async def iter_items(self, count: int = 1000) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Iterate over the key-value pairs, fetching values with one MGET per chunk.
+
+        Args:
+            count (int, optional): SCAN COUNT hint and MGET chunk size. Defaults to 1000.
+        """
+        prefix_length = len(self._name) + 1
+        async for chunk in self._scan_chunks(count):
+            for key_name, byte_data in zip(chunk, await self._conn.mget(chunk)):
+                # The key may have expired or been deleted since it was scanned.
+                if byte_data is not None:
+                    yield key_name.decode('utf-8')[prefix_length:], self._codec.loads(byte_data)
+
+    async def get_all(self, count: int = 1000) -> Dict[str, Any]:
+        """Retrieve all key-value pairs."""
+        return {key: value async for key, value in self.iter_items(count)}
+
+    async def delete(self, key: str) -> None:
+        """Delete a key-value pair."""
+        key_name = self._key_name(key)
+        await self._conn.delete(key_name)
+
+    async def delete_if_equals(self, key: str, value: Any) -> bool:
+        """Delete a key only if it holds value, atomically with one script call, and tell whether it did."""
+        return bool(await self._run_script('compare_and_delete', keys=[self._key_name(key)], args=[self._codec.dumps(value)]))
+
+    async def clear(self, count: int = 1000, pipeline_size: int = 10) -> None:
+        """
+        Clear the key-value store.
+
+        Keys are found with SCAN and removed with UNLINK, so memory is reclaimed
+        in the background and the server never blocks on a large namespace.
+
+        Args:
+            count (int, optional): SCAN COUNT hint and keys per UNLINK. Defaults to 1000.
+            pipeline_size (int, optional): UNLINK commands sent per round trip. Defaults to 10.
+        """
+        pipeline = self._conn.pipeline(transaction=False)
+        async for chunk in self._scan_chunks(count):
+            pipeline.unlink(*chunk)
+            if len(pipeline) >= pipeline_size:
+                await pipeline.execute()
+        if len(pipeline):
+            await pipeline.execute()
+
+    async def exists(self, key: str) -> bool:
+        """Check if a key exists."""
+        key_name = self._key_name(key)
+        return await self._conn.exists(key_name)
+
+    def __str__(self) -> str:
+        return f"RedisKeyValue(name={self._name})"
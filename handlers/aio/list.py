@@ -0,0 +1,104 @@
+import redis
+from typing import Any, AsyncIterator, Iterable, List, Optional
+from handlers.aio.interface import AsyncIRedis
+from handlers.utils import is_unsupported_command
+
+
+class RedisList(AsyncIRedis):
+    _lpos_supported = True
+
+    async def set(self, value: Any) -> None:
+        """Append a value to the list."""
+        await self._conn.rpush(self._name, self._codec.dumps(value))
+
+    async def get(self, index: int) -> Any:
+        """Get a value by index."""
+        byte_data = await self._conn.lindex(self._name, index)
+        return self._codec.loads(byte_data) if byte_data else None
+
+    async def delete(self, value: Any) -> None:
+        """Remove a value from the list."""
+        await self._conn.lrem(self._name, 0, self._codec.dumps(value))
+
+    async def clear(self) -> None:
+        """Clear the list."""
+        await self._conn.delete(self._name)
+
+    async def get_all(self) -> List[Any]:
+        """Retrieve all values from the list."""
+        data = await self._conn.lrange(self._name, 0, -1)
+        return [self._codec.loads(value) for value in data]
+
+    async def exists(self) -> bool:
+        """Check if the list exists."""
+        return await self._conn.exists(self._name)
+
+    async def size(self) -> int:
+        """Get the size of the list."""
+        return await self._conn.llen(self._name)
+
+    async def get_range(self, start: int = 0, stop: Optional[int] = None) -> List[Any]:
+        """Retrieve the values from start up to, but not including, stop with one LRANGE."""
+        if stop == 0:
+            return []
+        data = await self._conn.lrange(self._name, start, -1 if stop is None else stop - 1)
+        return [self._codec.loads(value) for value in data]
+
+    async def iter(self, window: int = 1000) -> AsyncIterator[Any]:
+        """Lazily yield every value, fetching window values per LRANGE."""
+        start = 0
+        while True:
+            data = await self._conn.lrange(self._name, start, start + window - 1)
+            for value in data:
+                yield self._codec.loads(value)
+            if len(data) < window:
+                return
+            start += window
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self.iter()
+
+    async def _positions(self, value: Any, rank: int = 1, count: Optional[int] = None) -> Any:
+        element = self._codec.dumps(value)
+        if self._lpos_supported:
+            try:
+                return await self._conn.lpos(self._name, element, rank=rank, count=count)
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._lpos_supported = False
+        data = await self._conn.lrange(self._name, 0, -1)
+        positions = [index for index, item in enumerate(data) if item == element]
+        if rank < 0:
+            positions.reverse()
+        positions = positions[abs(rank) - 1:]
+        if count is None:
+            return positions[0] if positions else None
+        return positions if count == 0 else positions[:count]
+
+    async def index_of(self, value: Any, rank: int = 1) -> Optional[int]:
+        """Return the index of a value, searched for on the server with LPOS."""
+        return await self._positions(value, rank=rank)
+
+    async def contains(self, value: Any) -> bool:
+        """Check if the list contains a value."""
+        return await self.index_of(value) is not None
+
+    async def count(self, value: Any) -> int:
+        """Count occurrences of a value in the list with LPOS COUNT 0."""
+        if self._lpos_supported:
+            return len(await self._positions(value, count=0))
+        # Before Redis 6.0.6: count on the server with a script rather than pulling the list.
+        return await self._run_script('list_count', keys=[self._name], args=[self._codec.dumps(value)])
+
+    async def push_capped(self, values: Iterable[Any], max_length: int) -> int:
+        """Append values and trim the list to its newest max_length values. See the sync handler."""
+        if max_length <= 0:
+            raise ValueError('max_length must be positive')
+        values = [self._codec.dumps(value) for value in values][-max_length:]
+        if not values:
+            return await self.size()
+        return await self._run_script('push_capped', keys=[self._name], args=[max_length, *values])
+
+    def __str__(self) -> str:
+        return f"RedisList(name={self._name})"
@@ -0,0 +1,126 @@
+import asyncio
+import inspect
+import logging
+import redis.asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+from handlers.codec import Codec, DEFAULT_CODEC
+from handlers.aio.connection import get_connection
+from handlers.instrumentation import Instrumentation, instrument
+
+
+logger = logging.getLogger(__name__)
+
+class RedisPubSub:
+    def __init__(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.asyncio.ConnectionPool] = None,
+        client: Optional[redis.asyncio.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the asyncio Redis Pub/Sub handler.
+
+        Args:
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.asyncio.ConnectionPool, optional): An existing pool
+                to use instead of the shared one. Defaults to None.
+            client (redis.asyncio.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes published messages. Defaults to JSONCodec.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        self._conn = get_connection(host, port, db, password, connection_pool, client)
+        self._codec = codec or DEFAULT_CODEC
+        self._pubsub = None
+        self._callbacks: Dict[str, Callable[[Any], Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        instrument(self, instrumentation)
+
+    def _decode_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        pattern = message.get('pattern')
+        return {
+            'type': message['type'],
+            'channel': message['channel'].decode('utf-8'),
+            'pattern': pattern.decode('utf-8') if pattern else None,
+            'data': self._codec.loads(message['data']),
+        }
+
+    async def subscribe(self, channel: str, callback: Callable[[Any], Any]) -> None:
+        """
+        Subscribe to a channel.
+
+        The callback receives the decoded message and may be a plain function
+        or a coroutine function. All subscriptions share one listener task.
+        """
+        if self._pubsub is None:
+            self._pubsub = self._conn.pubsub()
+        self._callbacks[channel] = callback
+        await self._pubsub.subscribe(channel)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def unsubscribe(self, channel: str) -> None:
+        """Unsubscribe from a channel."""
+        self._callbacks.pop(channel, None)
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(channel)
+
+    async def _dispatch(self) -> None:
+        async for message in self._pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            callback = self._callbacks.get(message['channel'].decode('utf-8'))
+            if callback is None:
+                continue
+            # A failing callback must not end the task, and with it every subscription.
+            try:
+                result = callback(self._decode_message(message))
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception(f'{self}: callback for {message["channel"]!r} failed')
+
+    async def listen(self, *channels: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield decoded messages published to the given channels.
+
+        Each iterator uses its own connection, which is released when the
+        iteration stops.
+        """
+        pubsub = self._conn.pubsub()
+        await pubsub.subscribe(*channels)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    yield self._decode_message(message)
+        finally:
+            await pubsub.aclose()
+
+    async def publish(self, channel: str, message: Any) -> None:
+        """Publish a message to a channel."""
+        await self._conn.publish(channel, self._codec.dumps(message))
+
+    async def close(self) -> None:
+        """Stop the listener task and release its connection."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    def __str__(self) -> str:
+        return f"RedisPubSub()"
@@ -0,0 +1,36 @@
+from typing import Any, List
+from handlers.aio.interface import AsyncIRedis
+
+
+class RedisSet(AsyncIRedis):
+    async def set(self, value: Any) -> None:
+        """Add a value to the set."""
+        await self._conn.sadd(self._name, self._codec.dumps(value))
+
+    async def get(self) -> List[Any]:
+        """Retrieve all values from the set."""
+        data = await self._conn.smembers(self._name)
+        return [self._codec.loads(value) for value in data]
+
+    async def delete(self, value: Any) -> None:
+        """Remove a value from the set."""
+        await self._conn.srem(self._name, self._codec.dumps(value))
+
+    async def clear(self) -> None:
+        """Clear the set."""
+        await self._conn.delete(self._name)
+
+    async def exists(self, value: Any) -> bool:
+        """Check if a value exists in the set."""
+        return await self._conn.sismember(self._name, self._codec.dumps(value))
+
+    async def size(self) -> int:
+        """Get the size of the set."""
+        return await self._conn.scard(self._name)
+
+    async def is_empty(self) -> bool:
+        """Check if the set is empty."""
+        return await self.size() == 0
+
+    def __str__(self) -> str:
+        return f"RedisSet(name={self._name})"
@@ -0,0 +1,151 @@
+import redis
+from typing import Any, AsyncIterator, Iterable, List, Mapping, Optional, Tuple, Union
+from handlers.aio.interface import AsyncIRedis
+from handlers.sorted_set import RedisSortedSet as SyncRedisSortedSet
+from handlers.utils import chunked, is_unsupported_command
+
+
+class RedisSortedSet(AsyncIRedis):
+    _zrange_by_supported = True
+
+    _decode_range = SyncRedisSortedSet._decode_range
+
+    async def set(self, value: Any, score: float) -> None:
+        """Add a value with a score to the sorted set."""
+        await self._conn.zadd(self._name, {self._codec.dumps(value): float(score)})
+
+    async def add_many(
+        self,
+        items: Union[Iterable[Tuple[Any, float]], Mapping[Any, float]],
+        nx: bool = False,
+        xx: bool = False,
+        gt: bool = False,
+        lt: bool = False,
+        chunk_size: int = 1000
+    ) -> int:
+        """Add many values with one ZADD per chunk and return how many were new."""
+        if isinstance(items, Mapping):
+            items = items.items()
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(items, chunk_size):
+            mapping = {self._codec.dumps(value): float(score) for value, score in chunk}
+            pipeline.zadd(self._name, mapping, nx=nx, xx=xx, gt=gt, lt=lt)
+        return sum(await pipeline.execute())
+
+    async def incr(self, value: Any, amount: float = 1.0) -> float:
+        """Atomically add amount to the score of a value and return the new score."""
+        return await self._conn.zincrby(self._name, amount, self._codec.dumps(value))
+
+    async def get(self, value: Any) -> Any:
+        """Get the score of a value."""
+        return await self._conn.zscore(self._name, self._codec.dumps(value))
+
+    async def _range_by(
+        self,
+        by: str,
+        low: Any,
+        high: Any,
+        offset: Optional[int],
+        count: Optional[int],
+        with_scores: bool,
+        desc: bool
+    ) -> List[Any]:
+        if offset is None and count is not None:
+            offset = 0
+        if offset is not None and count is None:
+            count = -1
+        start, end = (high, low) if desc else (low, high)
+        if self._zrange_by_supported:
+            try:
+                return await self._conn.zrange(
+                    self._name, start, end, desc=desc, withscores=with_scores,
+                    byscore=by == 'score', bylex=by == 'lex', offset=offset, num=count
+                )
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err) and 'syntax error' not in str(err).lower():
+                    raise
+                self._zrange_by_supported = False
+        if by == 'lex':
+            command = self._conn.zrevrangebylex if desc else self._conn.zrangebylex
+            return await command(self._name, start, end, start=offset, num=count)
+        command = self._conn.zrevrangebyscore if desc else self._conn.zrangebyscore
+        return await command(self._name, start, end, start=offset, num=count, withscores=with_scores)
+
+    async def get_by_score(
+        self,
+        min: Union[float, str] = '-inf',
+        max: Union[float, str] = '+inf',
+        offset: Optional[int] = None,
+        count: Optional[int] = None,
+        with_scores: bool = False,
+        desc: bool = False
+    ) -> List[Any]:
+        """Retrieve values whose score is within a range, with ZRANGE BYSCORE."""
+        data = await self._range_by('score', min, max, offset, count, with_scores, desc)
+        return self._decode_range(data, with_scores)
+
+    async def get_by_lex(
+        self,
+        min: Any = None,
+        max: Any = None,
+        min_inclusive: bool = True,
+        max_inclusive: bool = True,
+        offset: Optional[int] = None,
+        count: Optional[int] = None,
+        desc: bool = False
+    ) -> List[Any]:
+        """Retrieve values within a range of their encoded bytes, with ZRANGE BYLEX."""
+        low = '-' if min is None else (b'[' if min_inclusive else b'(') + self._codec.dumps(min)
+        high = '+' if max is None else (b'[' if max_inclusive else b'(') + self._codec.dumps(max)
+        data = await self._range_by('lex', low, high, offset, count, False, desc)
+        return self._decode_range(data, False)
+
+    async def rank(self, value: Any, desc: bool = True) -> Optional[int]:
+        """Return the 0-based rank of a value, highest score first unless desc is False."""
+        element = self._codec.dumps(value)
+        return await (self._conn.zrevrank(self._name, element) if desc else self._conn.zrank(self._name, element))
+
+    async def top(self, k: int = 10, desc: bool = True) -> List[Tuple[int, Any, float]]:
+        """Return the first k entries as (rank, value, score)."""
+        if k <= 0:
+            return []
+        data = await self._conn.zrange(self._name, 0, k - 1, desc=desc, withscores=True)
+        return [(rank, self._codec.loads(value), score) for rank, (value, score) in enumerate(data)]
+
+    async def around(self, value: Any, radius: int = 5, desc: bool = True) -> List[Tuple[int, Any, float]]:
+        """Return the entries ranked up to radius places above and below a value."""
+        rank = await self.rank(value, desc=desc)
+        if rank is None:
+            return []
+        start = max(rank - radius, 0)
+        data = await self._conn.zrange(self._name, start, rank + radius, desc=desc, withscores=True)
+        return [(start + offset, self._codec.loads(member), score) for offset, (member, score) in enumerate(data)]
+
+    async def iter(self, match: Optional[str] = None, count: int = 1000) -> AsyncIterator[Tuple[Any, float]]:
+        """Lazily yield every (value, score) with ZSCAN, in no particular order."""
+        async for value, score in self._conn.zscan_iter(self._name, match=match, count=count):
+            yield self._codec.loads(value), score
+
+    async def size(self) -> int:
+        """Get the number of values in the sorted set."""
+        return await self._conn.zcard(self._name)
+
+    async def delete(self, value: Any) -> None:
+        """Remove a value from the sorted set."""
+        await self._conn.zrem(self._name, self._codec.dumps(value))
+
+    async def clear(self) -> None:
+        """Clear the sorted set."""
+        await self._conn.delete(self._name)
+
+    async def exists(self, value: Any) -> bool:
+        """Check if a value exists in the sorted set."""
+        return await self._conn.zscore(self._name, self._codec.dumps(value)) is not None
+
+    async def get_all(self) -> Any:
+        """Retrieve all values from the sorted set."""
+        data = await self._conn.zrange(self._name, 0, -1)
+        return [self._codec.loads(value) for value in data]
+
+    def __str__(self) -> str:
+        return f"RedisSortedSet(name={self._name})"
@@ -0,0 +1,91 @@
+import redis
+from typing import Any, List, Optional
+from handlers.aio.interface import AsyncIRedis
+from handlers.utils import is_unsupported_command
+
+
+class RedisStack(AsyncIRedis):
+    _pop_count_supported = True
+    _blmpop_supported = True
+
+    async def set(self, value: Any) -> None:
+        """Push a value onto the stack."""
+        await self._conn.rpush(self._name, self._codec.dumps(value))
+
+    async def get(self, block: Optional[float] = None) -> Any:
+        """
+        Pop a value from the stack.
+
+        Args:
+            block (float, optional): Wait up to this many seconds for a value with
+                BRPOP, or forever when 0. Defaults to None, which does not wait.
+        """
+        if block is None:
+            byte_data = await self._conn.rpop(self._name)
+        else:
+            popped = await self._conn.brpop([self._name], timeout=block)
+            byte_data = popped[1] if popped else None
+        return self._codec.loads(byte_data) if byte_data else None
+
+    async def get_many(self, count: int, block: Optional[float] = None) -> List[Any]:
+        """
+        Pop up to count values from the stack in a single round trip.
+
+        Args:
+            count (int): The maximum number of values to pop.
+            block (float, optional): When the stack is empty, wait up to this many
+                seconds for values with BLMPOP, or forever when 0. Defaults to None,
+                which does not wait.
+        """
+        if count <= 0:
+            return []
+        if block is not None:
+            return await self._blocking_pop_many(count, block)
+        return [self._codec.loads(value) for value in await self._pop_many(count)]
+
+    async def _pop_many(self, count: int) -> List[bytes]:
+        if count <= 0:
+            return []
+        if self._pop_count_supported:
+            try:
+                return await self._conn.rpop(self._name, count) or []
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._pop_count_supported = False
+        # Before Redis 6.2: pop atomically with a script.
+        return await self._run_script('pop_tail', keys=[self._name], args=[count])
+
+    async def _blocking_pop_many(self, count: int, block: float) -> List[Any]:
+        if self._blmpop_supported:
+            try:
+                popped = await self._conn.blmpop(block, 1, self._name, direction='RIGHT', count=count)
+                return [self._codec.loads(value) for value in popped[1]] if popped else []
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._blmpop_supported = False
+        popped = await self._conn.brpop([self._name], timeout=block)
+        if not popped:
+            return []
+        return [self._codec.loads(value) for value in [popped[1]] + await self._pop_many(count - 1)]
+
+    async def get_all(self) -> List[Any]:
+        """Retrieve all values from the stack."""
+        data = await self._conn.lrange(self._name, 0, -1)
+        return [self._codec.loads(value) for value in data]
+
+    async def clear(self) -> None:
+        """Clear the stack."""
+        await self._conn.delete(self._name)
+
+    async def size(self) -> int:
+        """Get the size of the stack."""
+        return await self._conn.llen(self._name)
+
+    async def is_empty(self) -> bool:
+        """Check if the stack is empty."""
+        return await self.size() == 0
+
+    def __str__(self) -> str:
+        return f"RedisStack(name={self._name})"
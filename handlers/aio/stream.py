@@ -0,0 +1,160 @@
+import redis
+import redis.asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, List, Mapping, Optional
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
+from handlers.aio.interface import AsyncIRedis
+from handlers.stream import RedisStream as SyncRedisStream
+from handlers.utils import chunked
+
+
+class RedisStream(AsyncIRedis):
+    def __init__(
+            self,
+            name: str,
+            group_name: str = '',
+            consumer_name: str = 'default',
+            host: str = 'localhost',
+            port: int = 6379,
+            db: int = 0,
+            password: str = None,
+            connection_pool: Optional[redis.asyncio.ConnectionPool] = None,
+            client: Optional[redis.asyncio.StrictRedis] = None,
+            codec: Optional[Codec] = None,
+            encode_values: bool = False,
+            maxlen: Optional[int] = None,
+            minid: Optional[str] = None,
+            approximate: bool = True,
+            instrumentation: Optional[Instrumentation] = None
+        ):
+        """
+        Initialize the asyncio Redis stream handler.
+
+        The consumer group is created lazily before the first stream operation.
+
+        Args:
+            name (str): The name of the stream.
+            group_name (str, optional): The consumer group name. Defaults to ''.
+            consumer_name (str, optional): The consumer name. Defaults to 'default'.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.asyncio.ConnectionPool, optional): An existing pool
+                to use instead of the shared one. Defaults to None.
+            client (redis.asyncio.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            encode_values (bool, optional): Encode every field value with the codec.
+                Defaults to False.
+            maxlen (int, optional): Trim the stream to about this many entries on every
+                write. Defaults to None.
+            minid (str, optional): Trim entries older than this ID on every write.
+                Defaults to None.
+            approximate (bool, optional): Trim with '~'. Defaults to True.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        if maxlen is not None and minid is not None:
+            raise ValueError('Only one of maxlen and minid can be given')
+        super().__init__(name, host, port, db, password, connection_pool, client, codec, instrumentation)
+        self.consumer_name = consumer_name
+        self.group_name = group_name
+        self._group_created = False
+        self._encode_values = encode_values
+        self._maxlen = maxlen
+        self._minid = minid
+        self._approximate = approximate
+
+    _encode = SyncRedisStream._encode
+    _decode = SyncRedisStream._decode
+    _xadd = SyncRedisStream._xadd
+
+    async def _create_consumer_group(self):
+        if self._group_created:
+            return
+        try:
+            await self._conn.xgroup_create(self._name, self.group_name, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP Consumer Group name already exists' not in str(e):
+                raise e
+        self._group_created = True
+
+    async def set(self, value: Any) -> None:
+        """Add a message to the stream."""
+        await self._create_consumer_group()
+        message_id = await self._xadd(self._conn, value)
+        return message_id
+
+    async def add_many(self, messages: Iterable[Mapping[str, Any]], chunk_size: int = 1000) -> List[Any]:
+        """Add many messages with one pipelined round trip per chunk and return their IDs."""
+        await self._create_consumer_group()
+        ids = []
+        for chunk in chunked(messages, chunk_size):
+            pipeline = self._conn.pipeline(transaction=False)
+            for value in chunk:
+                self._xadd(pipeline, value)
+            ids.extend(await pipeline.execute())
+        return ids
+
+    async def get(self, count=1, block=1000, auto_ack: bool = False) -> Any:
+        """
+        Retrieve messages from the stream.
+
+        Messages stay pending in the consumer group until they are acknowledged
+        with ack().
+
+        Args:
+            count (int, optional): The maximum number of messages. Defaults to 1.
+            block (int, optional): Milliseconds to wait for messages. Defaults to 1000.
+            auto_ack (bool, optional): Acknowledge every returned message right away
+                with a single XACK. Defaults to False.
+        """
+        await self._create_consumer_group()
+        messages = await self._conn.xreadgroup(
+            groupname=self.group_name,
+            consumername=self.consumer_name,
+            streams={self._name: '>'},
+            count=count,
+            block=block
+        )
+        data = {
+            'stream': self._name,
+            'datas': [{'id': message_id, 'data': self._decode(message)} for message_id, message in (messages[0][1] if messages else [])]
+        }
+        if auto_ack:
+            await self.ack(message['id'] for message in data['datas'])
+        return data
+
+    async def iter_messages(self, count: int = 10, block: int = 1000, auto_ack: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """Yield messages as they arrive, forever. Each item has 'id' and 'data'."""
+        while True:
+            data = await self.get(count=count, block=block, auto_ack=auto_ack)
+            for message in data['datas']:
+                yield message
+
+    def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        return self.iter_messages()
+
+    async def delete(self, id: str) -> None:
+        """Delete a message from the stream."""
+        await self._conn.xdel(self._name, id)
+
+    async def clear(self) -> None:
+        """Clear the stream."""
+        await self._conn.delete(self._name)
+        self._group_created = False
+
+    async def ack_message(self, id: str) -> None:
+        """Acknowledge a message."""
+        await self._conn.xack(self._name, self.group_name, id)
+
+    async def ack(self, ids: Iterable[str]) -> int:
+        """Acknowledge many messages with a single XACK and return how many were pending."""
+        ids = list(ids)
+        if not ids:
+            return 0
+        return await self._conn.xack(self._name, self.group_name, *ids)
+
+    def __str__(self) -> str:
+        return f"RedisStream(name={self._name})"
@@ -0,0 +1,275 @@
+import inspect
+import redis
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from handlers.instrumentation import InstrumentedCodec
+from handlers.scripts import _command_queue
+
+
+class BatchError(Exception):
+    """Raised when a handler call cannot be recorded or replayed in a batch."""
+
+
+def _connections_of(client) -> Any:
+    """The pool behind a client, or the node manager of a Redis Cluster client."""
+    if isinstance(client, redis.RedisCluster):
+        return client.nodes_manager
+    return client.connection_pool
+
+
+class _Pending:
+    """Stands in for every command reply while a call is being recorded."""
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __len__(self) -> int:
+        return 0
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(())
+
+    def items(self) -> Tuple:
+        return ()
+
+    def __repr__(self) -> str:
+        return '<pending>'
+
+
+_PENDING = _Pending()
+
+
+class _RecordingClient:
+    """Queues every command on the pipeline and answers with a placeholder."""
+
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._pipeline, name)
+        if not callable(attribute):
+            return attribute
+
+        def record(*args, **kwargs):
+            attribute(*args, **kwargs)
+            return _PENDING
+        return record
+
+
+class _ReplayClient:
+    """Answers every command with the next reply returned by the pipeline."""
+
+    def __init__(self, replies: List[Any]):
+        self._replies = iter(replies)
+        self.remaining = len(replies)
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        # Only commands are replayed; probes such as getattr(client, '_pipeline', client) must fail.
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def replay(*args, **kwargs):
+            if self.remaining == 0:
+                raise BatchError(f'{name} was not issued while the call was recorded')
+            self.remaining -= 1
+            reply = next(self._replies)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        return replay
+
+
+class _BatchedNearCache:
+    """
+    Stands in for a handler's near cache while the handler is batched.
+
+    Reads bypass the cache, so a call issues the same commands on both
+    runs, and written keys are evicted once, after their commands ran.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def get_or_load(self, key: str, field: Optional[str], load: Callable[[], Any], decode: Callable[[bytes], Any]) -> Any:
+        byte_data = load()
+        return decode(byte_data) if byte_data else None
+
+    def written(self, client, keys: Iterable[str]) -> None:
+        self._cache.written(client, keys, evict=not isinstance(client, _RecordingClient))
+
+    def cleared(self, client) -> None:
+        self._cache.cleared(client, evict=not isinstance(client, _RecordingClient))
+
+
+class Batch:
+    """
+    Records handler calls into one redis pipeline and replays them on flush.
+
+    Inside the context every public method of the batched handlers is run
+    twice: once while recording, with command replies replaced by an empty
+    placeholder, and once after the pipeline executed, with the real replies,
+    so the usual decoding code produces the result. This works for any
+    handler method whose commands do not depend on the replies of earlier
+    commands in the same call; other methods raise BatchError. Near cache
+    evictions and codec timings only happen on the second run, and batched
+    reads bypass the near cache.
+
+    Calls made inside the context return None. The decoded results are
+    available in call order from flush() and, once the context exits, from
+    the results attribute. A handler must not be used from another thread
+    while it is batched.
+
+    Example:
+        with Batch(hash_set, sorted_set, max_size=500) as batch:
+            for key, value in rows:
+                hash_set.set(key, value)
+                sorted_set.set(key, value['score'])
+        print(batch.results)
+    """
+
+    def __init__(self, *handlers, transaction: bool = False, max_size: int = 1000, raise_on_error: bool = True):
+        """
+        Initialize the batch.
+
+        Args:
+            *handlers: The handlers to batch. They must share a connection pool.
+            transaction (bool, optional): Wrap every flush in MULTI/EXEC. Defaults to False.
+            max_size (int, optional): Flush automatically once this many commands are
+                queued. Defaults to 1000.
+            raise_on_error (bool, optional): Raise the first error after a flush instead
+                of returning it in place of the result. Defaults to True.
+        """
+        if not handlers:
+            raise ValueError('Batch needs at least one handler')
+        pool = _connections_of(handlers[0]._conn)
+        for handler in handlers[1:]:
+            if _connections_of(handler._conn) is not pool:
+                raise ValueError(f'{handler} does not share a connection pool with {handlers[0]}')
+        self._handlers = handlers
+        self._client = handlers[0]._conn
+        self._transaction = transaction
+        self._max_size = max_size
+        self._raise_on_error = raise_on_error
+        self._pipeline = None
+        self._recorder: Optional[_RecordingClient] = None
+        self._calls: List[Tuple[Any, Callable[..., Any], tuple, dict, int]] = []
+        self._in_call = False
+        self.results: List[Any] = []
+
+    def __enter__(self) -> 'Batch':
+        self._pipeline = self._client.pipeline(transaction=self._transaction)
+        self._recorder = _RecordingClient(self._pipeline)
+        for handler in self._handlers:
+            if isinstance(handler._conn, (_RecordingClient, _ReplayClient)):
+                raise BatchError(f'{handler} is already batched')
+        self._originals = []
+        self._shadowed = []
+        self._near_caches = []
+        for handler in self._handlers:
+            self._originals.append(handler._conn)
+            handler._conn = self._recorder
+            near_cache = getattr(handler, '_near_cache', None)
+            self._near_caches.append(near_cache)
+            if near_cache is not None:
+                handler._near_cache = _BatchedNearCache(near_cache)
+            shadowed = {}
+            for name, function in inspect.getmembers(type(handler), inspect.isfunction):
+                if not name.startswith('_') and name != 'batch':
+                    # Instance attributes, e.g. instrumentation wrappers, come back on exit.
+                    if name in vars(handler):
+                        shadowed[name] = vars(handler)[name]
+                    setattr(handler, name, _BoundCall(self, handler, function))
+            self._shadowed.append(shadowed)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._calls = []
+            self._pipeline.reset()
+            for handler, conn, near_cache, shadowed in zip(self._handlers, self._originals, self._near_caches, self._shadowed):
+                handler._conn = conn
+                if near_cache is not None:
+                    handler._near_cache = near_cache
+                for name, value in list(vars(handler).items()):
+                    if isinstance(value, _BoundCall):
+                        delattr(handler, name)
+                vars(handler).update(shadowed)
+
+    def _record(self, handler, function: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        if self._in_call:
+            # A handler method calling another public method of its handler.
+            return function(handler, *args, **kwargs)
+        stack = _command_queue(self._pipeline)
+        queued = len(stack)
+        codec = handler._codec
+        if isinstance(codec, InstrumentedCodec):
+            # The replay encodes the same values again, and only that run is timed.
+            handler._codec = codec._codec
+        self._in_call = True
+        try:
+            function(handler, *args, **kwargs)
+        except Exception as err:
+            del stack[queued:]
+            raise BatchError(f'{type(handler).__name__}.{function.__name__} cannot be batched: {err}') from err
+        finally:
+            self._in_call = False
+            handler._codec = codec
+        self._calls.append((handler, function, args, kwargs, len(stack) - queued))
+        if len(stack) >= self._max_size:
+            self.flush()
+        return None
+
+    def flush(self) -> List[Any]:
+        """Execute the queued commands and return the decoded results of this flush."""
+        if not self._calls:
+            return []
+        calls, self._calls = self._calls, []
+        replies = iter(self._pipeline.execute(raise_on_error=False))
+        results = []
+        self._in_call = True
+        try:
+            for handler, function, args, kwargs, count in calls:
+                replay = _ReplayClient([next(replies) for _ in range(count)])
+                handler._conn = replay
+                try:
+                    result = function(handler, *args, **kwargs)
+                    if replay.remaining:
+                        raise BatchError(
+                            f'{type(handler).__name__}.{function.__name__} issued fewer commands '
+                            f'than while it was recorded'
+                        )
+                except Exception as err:
+                    result = err
+                results.append(result)
+        finally:
+            self._in_call = False
+            for handler in self._handlers:
+                handler._conn = self._recorder
+        self.results.extend(results)
+        if self._raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __str__(self) -> str:
+        return f"Batch(handlers={len(self._handlers)}, transaction={self._transaction})"
+
+
+class _BoundCall:
+    """Instance attribute that routes a handler method through its batch."""
+
+    __slots__ = ('_batch', '_handler', '_function')
+
+    def __init__(self, batch: Batch, handler, function: Callable[..., Any]):
+        self._batch = batch
+        self._handler = handler
+        self._function = function
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self._batch._record(self._handler, self._function, args, kwargs)
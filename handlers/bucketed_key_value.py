@@ -0,0 +1,447 @@
+import logging
+import zlib
+import redis
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
+from handlers.key_value import RedisKeyValue
+from handlers.utils import chunked, hash_tag, is_unsupported_command
+
+
+logger = logging.getLogger(__name__)
+
+# Server time in milliseconds, for the scripts that emulate field TTLs.
+_NOW = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+# KEYS: bucket, deadlines; ARGV: fields. Emulated TTLs only: drops the expired fields it finds.
+GET_SCRIPT = _NOW + """
+local values = redis.call('HMGET', KEYS[1], unpack(ARGV))
+local expired = {}
+for i = 1, #ARGV do
+    if values[i] then
+        local deadline = redis.call('ZSCORE', KEYS[2], ARGV[i])
+        if deadline and tonumber(deadline) <= now then
+            values[i] = false
+            expired[#expired + 1] = ARGV[i]
+        end
+    end
+end
+if #expired > 0 then
+    redis.call('HDEL', KEYS[1], unpack(expired))
+    redis.call('ZREM', KEYS[2], unpack(expired))
+end
+return values
+"""
+
+# KEYS: bucket, deadlines; ARGV: ttl in ms or 0, mode, 1 for HPEXPIRE else 0, field, value, ...
+# Mode 'set' returns nothing, 'nx' writes a single field only if it is missing and returns
+# whether it did, 'get' returns the previous value of a single field.
+SET_SCRIPT = _NOW + """
+local ttl, mode, native = tonumber(ARGV[1]), ARGV[2], ARGV[3] == '1'
+local previous = false
+if mode ~= 'set' then
+    previous = redis.call('HGET', KEYS[1], ARGV[4])
+    if previous and not native then
+        local deadline = redis.call('ZSCORE', KEYS[2], ARGV[4])
+        if deadline and tonumber(deadline) <= now then
+            previous = false
+        end
+    end
+    if mode == 'nx' and previous then
+        return 0
+    end
+end
+local fields = {}
+for i = 4, #ARGV, 2 do
+    fields[#fields + 1] = ARGV[i]
+end
+-- Overwriting a field clears its HPEXPIRE TTL.
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+if native then
+    if ttl > 0 then
+        redis.call('HPEXPIRE', KEYS[1], ttl, 'FIELDS', #fields, unpack(fields))
+    end
+elseif ttl > 0 then
+    for _, field in ipairs(fields) do
+        redis.call('ZADD', KEYS[2], now + ttl, field)
+    end
+else
+    redis.call('ZREM', KEYS[2], unpack(fields))
+end
+if mode == 'nx' then
+    return 1
+end
+return previous
+"""
+
+# KEYS: bucket, deadlines; ARGV: field, expected value. Deletes the field if it holds the value.
+DELETE_IF_EQUALS_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS: bucket, deadlines. Emulated TTLs only: deletes the expired fields and returns how many.
+PURGE_SCRIPT = _NOW + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for i = 1, #expired, 1000 do
+    redis.call('HDEL', KEYS[1], unpack(expired, i, math.min(i + 999, #expired)))
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+return #expired
+"""
+
+
+class BucketedKeyValue(RedisKeyValue):
+    """
+    Key-value store keeping its entries in a fixed number of small hashes.
+
+    Every top-level Redis key costs tens of bytes of overhead, which
+    dominates the memory of many small values. Here each key is hashed
+    with CRC32 into one of buckets hashes, named name#0 to name#N-1, so the
+    overhead is paid once per bucket. Redis keeps a hash in the compact
+    listpack encoding while it has at most hash-max-listpack-entries
+    fields (128 by default) of at most hash-max-listpack-value bytes (64
+    by default), so choose about one bucket per 100 expected keys. The
+    number of buckets is part of the layout: changing it needs a new
+    namespace and a migration.
+
+    The API is the one of RedisKeyValue. TTLs are per key: on Redis 7.4+
+    they are hash field TTLs set with HPEXPIRE. On older servers they are
+    emulated with a sorted set of deadlines next to each bucket: expired
+    entries are never returned and are deleted when read, and
+    purge_expired() deletes the ones nobody reads.
+
+    Example:
+        kv_store = BucketedKeyValue('sessions', buckets=100_000)
+        migrate_to_buckets(RedisKeyValue('sessions'), kv_store)
+    """
+
+    _hexpire_supported: Optional[bool] = None
+
+    def __init__(
+        self,
+        name: str,
+        buckets: int = 1024,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        native_ttl: Optional[bool] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the key-value store.
+
+        Args:
+            name (str): The namespace the bucket names start with.
+            buckets (int, optional): The number of hashes the keys are spread over.
+                Defaults to 1024.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            native_ttl (bool, optional): Whether the server supports hash field TTLs.
+                Defaults to None, which asks the server once.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        if buckets <= 0:
+            raise ValueError('buckets must be positive')
+        super().__init__(
+            name, host, port, db, password, connection_pool, client, codec, instrumentation=instrumentation
+        )
+        self._buckets = buckets
+        self.scripts.register('bucketed_key_value.get', GET_SCRIPT)
+        self.scripts.register('bucketed_key_value.set', SET_SCRIPT)
+        self.scripts.register('bucketed_key_value.purge', PURGE_SCRIPT)
+        self.scripts.register('bucketed_key_value.delete_if_equals', DELETE_IF_EQUALS_SCRIPT)
+        if native_ttl is not None:
+            self._hexpire_supported = native_ttl
+        else:
+            try:
+                self._conn.hpttl(self._bucket_key(0), '')
+                self._hexpire_supported = True
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._hexpire_supported = False
+                logger.info(f'{self}: the server has no hash field TTLs, emulating them')
+
+    def _bucket(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self._buckets
+
+    def _bucket_key(self, bucket: int) -> str:
+        # On Redis Cluster a bucket and its deadlines must share a slot.
+        name = f'{self._name}#{bucket}'
+        return hash_tag(name) if self._cluster else name
+
+    def _deadlines_key(self, bucket: int) -> str:
+        return f'{self._bucket_key(bucket)}:ttl'
+
+    def _group(self, keys: Iterable[str]) -> Dict[int, List[str]]:
+        """Group keys by bucket."""
+        groups = defaultdict(list)
+        for key in keys:
+            groups[self._bucket(key)].append(key)
+        return groups
+
+    def _write(self, client: Any, bucket: int, fields: List[Any], ttl_ms: int = 0, mode: str = 'set') -> Any:
+        """Write fields, a flat list of field and encoded value pairs, to a bucket with one script call."""
+        return self.scripts(
+            'bucketed_key_value.set',
+            keys=[self._bucket_key(bucket), self._deadlines_key(bucket)],
+            args=[ttl_ms, mode, int(self._hexpire_supported), *fields],
+            client=client
+        )
+
+    def _read(self, client: Any, bucket: int, keys: List[str]) -> Any:
+        """Read the encoded values of keys of one bucket, None for missing ones."""
+        if self._hexpire_supported:
+            return client.hmget(self._bucket_key(bucket), keys)
+        return self.scripts(
+            'bucketed_key_value.get', keys=[self._bucket_key(bucket), self._deadlines_key(bucket)], args=keys, client=client
+        )
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Set a key-value pair with an optional TTL."""
+        self._write(self._conn, self._bucket(key), [key, self._codec.dumps(value)], int((ttl or 0) * 1000))
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Set a key only if it does not exist yet, and tell whether it was set."""
+        written = self._write(self._conn, self._bucket(key), [key, self._codec.dumps(value)], int((ttl or 0) * 1000), 'nx')
+        return bool(written)
+
+    def get_set(self, key: str, value: Any, ttl: Optional[int] = None) -> Any:
+        """Set a key and return its previous value, atomically with one script call."""
+        byte_data = self._write(
+            self._conn, self._bucket(key), [key, self._codec.dumps(value)], int((ttl or 0) * 1000), 'get'
+        )
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def set_many(self, mapping: Mapping[str, Any], ttl: Optional[int] = None, chunk_size: int = 1000) -> None:
+        """
+        Set many key-value pairs with one script call per bucket and one round trip per chunk.
+
+        Args:
+            mapping (Mapping[str, Any]): The key-value pairs to set.
+            ttl (int, optional): Expiry in seconds applied to every key. Defaults to None.
+            chunk_size (int, optional): Keys per round trip. Defaults to 1000.
+        """
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(mapping.items(), chunk_size):
+            values = dict(chunk)
+            for bucket, keys in self._group(values).items():
+                fields = [item for key in keys for item in (key, self._codec.dumps(values[key]))]
+                self._write(pipeline, bucket, fields, int((ttl or 0) * 1000))
+            pipeline.execute()
+
+    def get(self, key: str) -> Any:
+        """Get a value by key."""
+        byte_data = self._read(self._conn, self._bucket(key), [key])[0]
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def get_many(self, keys: Iterable[str], chunk_size: int = 1000) -> Dict[str, Any]:
+        """
+        Get many values with one read per bucket and one round trip per chunk. Missing keys are left out.
+
+        Args:
+            keys (Iterable[str]): The keys to look up.
+            chunk_size (int, optional): Keys per round trip. Defaults to 1000.
+        """
+        data = {}
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(keys, chunk_size):
+            groups = list(self._group(chunk).values())
+            for keys_of_bucket in groups:
+                self._read(pipeline, self._bucket(keys_of_bucket[0]), keys_of_bucket)
+            for keys_of_bucket, values in zip(groups, pipeline.execute()):
+                for key, byte_data in zip(keys_of_bucket, values):
+                    if byte_data is not None:
+                        data[key] = self._codec.loads(byte_data)
+        return data
+
+    def _iter_buckets(self, count: int) -> Iterator[Dict[bytes, bytes]]:
+        """Yield the live fields of every bucket, reading count buckets per round trip."""
+        now = None
+        if not self._hexpire_supported:
+            seconds, microseconds = self._conn.time()
+            now = seconds * 1000 + microseconds // 1000
+        pipeline = self._conn.pipeline(transaction=False)
+        for buckets in chunked(range(self._buckets), count):
+            for bucket in buckets:
+                pipeline.hgetall(self._bucket_key(bucket))
+                if now is not None:
+                    pipeline.zrangebyscore(self._deadlines_key(bucket), '-inf', now)
+            replies = pipeline.execute()
+            if now is None:
+                yield from replies
+                continue
+            for fields, expired in zip(replies[::2], replies[1::2]):
+                for field in expired:
+                    fields.pop(field, None)
+                yield fields
+
+    def iter_keys(self, count: int = 10) -> Iterator[str]:
+        """
+        Iterate over the keys, reading count buckets per round trip.
+
+        Args:
+            count (int, optional): Buckets read per round trip. Defaults to 10.
+        """
+        for fields in self._iter_buckets(count):
+            for field in fields:
+                yield field.decode('utf-8')
+
+    def iter_items(self, count: int = 10) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over the key-value pairs, reading count buckets per round trip.
+
+        Args:
+            count (int, optional): Buckets read per round trip. Defaults to 10.
+        """
+        for fields in self._iter_buckets(count):
+            for field, byte_data in fields.items():
+                yield field.decode('utf-8'), self._codec.loads(byte_data)
+
+    def get_all(self, count: int = 10) -> Dict[str, Any]:
+        """Retrieve all key-value pairs."""
+        return dict(self.iter_items(count))
+
+    def delete(self, key: str) -> None:
+        """Delete a key-value pair."""
+        bucket = self._bucket(key)
+        self._conn.hdel(self._bucket_key(bucket), key)
+        if not self._hexpire_supported:
+            self._conn.zrem(self._deadlines_key(bucket), key)
+
+    def delete_if_equals(self, key: str, value: Any) -> bool:
+        """Delete a key only if it holds value, atomically with one script call, and tell whether it did."""
+        bucket = self._bucket(key)
+        return bool(self._run_script(
+            'bucketed_key_value.delete_if_equals',
+            keys=[self._bucket_key(bucket), self._deadlines_key(bucket)],
+            args=[key, self._codec.dumps(value)]
+        ))
+
+    def delete_many(self, keys: Iterable[str], chunk_size: int = 1000) -> int:
+        """Delete many keys with one HDEL per bucket and one round trip per chunk, and return how many existed."""
+        deleted = 0
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(keys, chunk_size):
+            for bucket, keys_of_bucket in self._group(chunk).items():
+                pipeline.hdel(self._bucket_key(bucket), *keys_of_bucket)
+                if not self._hexpire_supported:
+                    pipeline.zrem(self._deadlines_key(bucket), *keys_of_bucket)
+            replies = pipeline.execute()
+            deleted += sum(replies if self._hexpire_supported else replies[::2])
+        return deleted
+
+    def clear(self, count: int = 1000, pipeline_size: int = 10) -> None:
+        """
+        Clear the key-value store, removing every bucket with UNLINK.
+
+        Args:
+            count (int, optional): Buckets per round trip. Defaults to 1000.
+            pipeline_size (int, optional): Unused, kept for compatibility with
+                RedisKeyValue.clear(). Defaults to 10.
+        """
+        pipeline = self._conn.pipeline(transaction=False)
+        for buckets in chunked(range(self._buckets), count):
+            for bucket in buckets:
+                # One key per UNLINK, which cluster pipelines require.
+                pipeline.unlink(self._bucket_key(bucket))
+                pipeline.unlink(self._deadlines_key(bucket))
+            pipeline.execute()
+
+    def exists(self, key: str) -> bool:
+        """Check if a key exists."""
+        bucket = self._bucket(key)
+        if self._hexpire_supported:
+            return bool(self._conn.hexists(self._bucket_key(bucket), key))
+        return self._read(self._conn, bucket, [key])[0] is not None
+
+    def purge_expired(self, count: int = 100) -> int:
+        """
+        Delete the expired entries nobody has read, when TTLs are emulated, and return how many.
+
+        With hash field TTLs Redis deletes expired entries itself and this
+        returns 0. Otherwise call it periodically, e.g. from a scheduled job.
+
+        Args:
+            count (int, optional): Buckets purged per round trip. Defaults to 100.
+        """
+        if self._hexpire_supported:
+            return 0
+        purged = 0
+        pipeline = self._conn.pipeline(transaction=False)
+        for buckets in chunked(range(self._buckets), count):
+            for bucket in buckets:
+                self.scripts(
+                    'bucketed_key_value.purge', keys=[self._bucket_key(bucket), self._deadlines_key(bucket)], client=pipeline
+                )
+            purged += sum(pipeline.execute())
+        return purged
+
+    def __str__(self) -> str:
+        return f"BucketedKeyValue(name={self._name}, buckets={self._buckets})"
+
+
+def migrate_to_buckets(source: RedisKeyValue, target: BucketedKeyValue, count: int = 1000, delete: bool = False) -> int:
+    """
+    Copy every entry of a RedisKeyValue namespace into a BucketedKeyValue, with its remaining TTL.
+
+    Keys are read with SCAN, their values and TTLs with one pipeline per
+    count keys, and written with one script call per key and one pipeline
+    per chunk, so memory use stays flat however large the namespace is.
+    Values are copied encoded, so both handlers must use the same codec.
+    Run it while nothing writes to the source namespace; it may be run
+    again after an interruption.
+
+    Args:
+        source (RedisKeyValue): The namespace to copy.
+        target (BucketedKeyValue): Where to copy it. The two may share a name.
+        count (int, optional): SCAN COUNT hint and keys per round trip. Defaults to 1000.
+        delete (bool, optional): UNLINK each chunk of source keys once it is copied.
+            Defaults to False.
+
+    Returns:
+        int: The number of entries copied.
+    """
+    copied = 0
+    prefix_length = len(source._name) + 1
+    reader = source._conn.pipeline(transaction=False)
+    writer = target._conn.pipeline(transaction=False)
+    for key_names in source._scan_chunks(count):
+        for key_name in key_names:
+            reader.get(key_name)
+            reader.pttl(key_name)
+        replies = reader.execute()
+        for key_name, byte_data, ttl_ms in zip(key_names, replies[::2], replies[1::2]):
+            # The key may have expired or been deleted since it was scanned. Only -1
+            # means no TTL; a PTTL of 0 is a key expiring now, which a TTL of 0 would keep.
+            if byte_data is None or (ttl_ms != -1 and ttl_ms <= 0):
+                continue
+            key = key_name.decode('utf-8')[prefix_length:]
+            target._write(writer, target._bucket(key), [key, byte_data], max(ttl_ms, 0))
+            copied += 1
+        writer.execute()
+        if delete:
+            source._conn.unlink(*key_names)
+    logger.info(f'Copied {copied} entries from {source} to {target}')
+    return copied
@@ -0,0 +1,399 @@
+import time
+import math
+import uuid
+import random
+import asyncio
+import hashlib
+import inspect
+import logging
+import functools
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
+from handlers.aio.interface import AsyncIRedis
+from handlers.instrumentation import Instrumentation, get_default_instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# What a cached entry calls for when it is read.
+HIT, EARLY_REFRESH, STALE, MISS = 'hit', 'early_refresh', 'stale', 'miss'
+
+# Runs the background refreshes of stale entries of every cached function without an executor.
+_refresher: Optional[Executor] = None
+_refresher_lock = threading.Lock()
+
+
+def _default_refresher() -> Executor:
+    global _refresher
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                _refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+    return _refresher
+
+
+class CacheStats:
+    """Hit, miss and recomputation counters of one cached function."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Zero every counter."""
+        with self._lock:
+            self.hits = 0
+            self.negative_hits = 0
+            self.stale_hits = 0
+            self.misses = 0
+            self.early_refreshes = 0
+            self.lock_waits = 0
+            self.recomputations = 0
+            self.errors = 0
+            self.recompute_seconds = 0.0
+            self.max_recompute_seconds = 0.0
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def recomputed(self, seconds: float, error: bool) -> None:
+        with self._lock:
+            self.recomputations += 1
+            self.errors += error
+            self.recompute_seconds += seconds
+            self.max_recompute_seconds = max(self.max_recompute_seconds, seconds)
+
+    def hit_ratio(self) -> float:
+        """Return the share of calls answered from the cache, stale answers included."""
+        with self._lock:
+            served = self.hits + self.stale_hits
+            calls = served + self.misses + self.early_refreshes
+        return served / calls if calls else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return every counter, the hit ratio and the mean recomputation time."""
+        hit_ratio = self.hit_ratio()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'early_refreshes': self.early_refreshes,
+                'lock_waits': self.lock_waits,
+                'recomputations': self.recomputations,
+                'errors': self.errors,
+                'hit_ratio': hit_ratio,
+                'recompute_seconds': self.recompute_seconds,
+                'mean_recompute_seconds': self.recompute_seconds / self.recomputations if self.recomputations else 0.0,
+                'max_recompute_seconds': self.max_recompute_seconds,
+            }
+
+    def __str__(self) -> str:
+        return f"CacheStats(hits={self.hits}, misses={self.misses}, hit_ratio={self.hit_ratio():.2f})"
+
+
+class _Cache:
+    """The settings and state shared by the calls of one cached function."""
+
+    def __init__(
+        self,
+        function: Callable[..., Any],
+        kv: Any,
+        ttl: float,
+        key: Union[None, str, Callable[..., str]],
+        stale_ttl: float,
+        negative_ttl: Optional[float],
+        beta: float,
+        lock_timeout: float,
+        poll_interval: float,
+        executor: Optional[Executor],
+        instrumentation: Optional[Instrumentation]
+    ):
+        self.function = function
+        self.kv = kv
+        self.ttl = ttl
+        self.key = key
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.lock_ttl = max(1, math.ceil(lock_timeout))
+        self.poll_interval = poll_interval
+        self.executor = executor
+        self.instrumentation = instrumentation or get_default_instrumentation()
+        self.name = f'{function.__module__}.{function.__qualname__}'
+        self.stats = CacheStats()
+        # Background refreshes of async functions, referenced until they finish.
+        self.tasks: Set[asyncio.Task] = set()
+
+    def key_for(self, args: tuple, kwargs: dict) -> str:
+        if callable(self.key):
+            return str(self.key(*args, **kwargs))
+        if isinstance(self.key, str):
+            return self.key.format(*args, **kwargs)
+        digest = hashlib.sha1(repr((args, sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+        return f'{self.name}:{digest}'
+
+    def state(self, entry: Optional[List[Any]]) -> str:
+        """Tell what a cached entry, [value, recompute seconds, expiry time], calls for."""
+        if entry is None:
+            return MISS
+        _, delta, expires_at = entry
+        now = time.time()
+        if now >= expires_at:
+            return STALE if now < expires_at + self.stale_ttl else MISS
+        # XFetch: recompute early with a probability rising as expiry nears,
+        # sooner for values that take longer to recompute.
+        if self.beta and now - delta * self.beta * math.log(1.0 - random.random()) >= expires_at:
+            return EARLY_REFRESH
+        return HIT
+
+    def hit(self, entry: List[Any]) -> Any:
+        self.stats.count('hits')
+        if entry[0] is None:
+            self.stats.count('negative_hits')
+        return entry[0]
+
+    def entry(self, value: Any, seconds: float) -> Optional[Tuple[List[Any], int]]:
+        """Return the entry to store for a recomputed value and its TTL in Redis, or None to not cache it."""
+        ttl = self.ttl
+        if value is None:
+            if self.negative_ttl is None:
+                return None
+            ttl = self.negative_ttl
+        return [value, seconds, time.time() + ttl], math.ceil(ttl + self.stale_ttl)
+
+    def recomputed(self, seconds: float, error: bool) -> None:
+        self.stats.recomputed(seconds, error)
+        if self.instrumentation.enabled:
+            self.instrumentation.record_call('cached', self.name, seconds, error, 0)
+
+
+def _recompute(cache: _Cache, key: str, lock: Optional[str], token: Optional[str], args: tuple, kwargs: dict) -> Any:
+    try:
+        start = time.perf_counter()
+        try:
+            value = cache.function(*args, **kwargs)
+        except Exception:
+            cache.recomputed(time.perf_counter() - start, True)
+            raise
+        seconds = time.perf_counter() - start
+        cache.recomputed(seconds, False)
+        entry = cache.entry(value, seconds)
+        if entry is not None:
+            cache.kv.set(key, *entry)
+        return value
+    finally:
+        # Another caller may hold the lock if ours expired during the recomputation.
+        if lock is not None:
+            cache.kv.delete_if_equals(lock, token)
+
+
+def _refresh(cache: _Cache, key: str, lock: str, token: str, args: tuple, kwargs: dict) -> None:
+    try:
+        _recompute(cache, key, lock, token, args, kwargs)
+    except Exception:
+        logger.exception(f'Refreshing a stale entry of {cache.name} failed')
+
+
+def _call(cache: _Cache, args: tuple, kwargs: dict) -> Any:
+    kv = cache.kv
+    key = cache.key_for(args, kwargs)
+    entry = kv.get(key)
+    state = cache.state(entry)
+    if state == HIT:
+        return cache.hit(entry)
+    lock, token = f'{key}:lock', uuid.uuid4().hex
+    if state == EARLY_REFRESH:
+        if not kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            return cache.hit(entry)
+        cache.stats.count('early_refreshes')
+        return _recompute(cache, key, lock, token, args, kwargs)
+    if state == STALE:
+        cache.stats.count('stale_hits')
+        if kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            (cache.executor or _default_refresher()).submit(_refresh, cache, key, lock, token, args, kwargs)
+        return entry[0]
+    cache.stats.count('misses')
+    if kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+        return _recompute(cache, key, lock, token, args, kwargs)
+    # Another caller is recomputing the value: wait for it rather than stampede.
+    cache.stats.count('lock_waits')
+    deadline = time.monotonic() + cache.lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(cache.poll_interval)
+        entry = kv.get(key)
+        if entry is not None:
+            return entry[0]
+        # The lock is gone without an entry, e.g. the result was not cached or
+        # the function raised: take over instead of waiting out the deadline.
+        if kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            # The holder may have stored its entry just before releasing the lock.
+            entry = kv.get(key)
+            if entry is not None:
+                kv.delete_if_equals(lock, token)
+                return entry[0]
+            return _recompute(cache, key, lock, token, args, kwargs)
+    return _recompute(cache, key, None, None, args, kwargs)
+
+
+async def _recompute_async(cache: _Cache, key: str, lock: Optional[str], token: Optional[str], args: tuple, kwargs: dict) -> Any:
+    try:
+        start = time.perf_counter()
+        try:
+            value = await cache.function(*args, **kwargs)
+        except Exception:
+            cache.recomputed(time.perf_counter() - start, True)
+            raise
+        seconds = time.perf_counter() - start
+        cache.recomputed(seconds, False)
+        entry = cache.entry(value, seconds)
+        if entry is not None:
+            await cache.kv.set(key, *entry)
+        return value
+    finally:
+        if lock is not None:
+            await cache.kv.delete_if_equals(lock, token)
+
+
+async def _refresh_async(cache: _Cache, key: str, lock: str, token: str, args: tuple, kwargs: dict) -> None:
+    try:
+        await _recompute_async(cache, key, lock, token, args, kwargs)
+    except Exception:
+        logger.exception(f'Refreshing a stale entry of {cache.name} failed')
+
+
+async def _call_async(cache: _Cache, args: tuple, kwargs: dict) -> Any:
+    kv = cache.kv
+    key = cache.key_for(args, kwargs)
+    entry = await kv.get(key)
+    state = cache.state(entry)
+    if state == HIT:
+        return cache.hit(entry)
+    lock, token = f'{key}:lock', uuid.uuid4().hex
+    if state == EARLY_REFRESH:
+        if not await kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            return cache.hit(entry)
+        cache.stats.count('early_refreshes')
+        return await _recompute_async(cache, key, lock, token, args, kwargs)
+    if state == STALE:
+        cache.stats.count('stale_hits')
+        if await kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            task = asyncio.ensure_future(_refresh_async(cache, key, lock, token, args, kwargs))
+            cache.tasks.add(task)
+            task.add_done_callback(cache.tasks.discard)
+        return entry[0]
+    cache.stats.count('misses')
+    if await kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+        return await _recompute_async(cache, key, lock, token, args, kwargs)
+    cache.stats.count('lock_waits')
+    deadline = time.monotonic() + cache.lock_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(cache.poll_interval)
+        entry = await kv.get(key)
+        if entry is not None:
+            return entry[0]
+        if await kv.set_if_absent(lock, token, ttl=cache.lock_ttl):
+            entry = await kv.get(key)
+            if entry is not None:
+                await kv.delete_if_equals(lock, token)
+                return entry[0]
+            return await _recompute_async(cache, key, lock, token, args, kwargs)
+    return await _recompute_async(cache, key, None, None, args, kwargs)
+
+
+def cached(
+    kv: Any,
+    ttl: float,
+    key: Union[None, str, Callable[..., str]] = None,
+    stale_ttl: float = 0,
+    negative_ttl: Optional[float] = None,
+    beta: float = 1.0,
+    lock_timeout: float = 10.0,
+    poll_interval: float = 0.05,
+    executor: Optional[Executor] = None,
+    instrumentation: Optional[Instrumentation] = None
+) -> Callable[[F], F]:
+    """
+    Cache a function's results in a key-value store, recomputing each at most once at a time.
+
+    Works on functions and on async functions, which need an asyncio store
+    like handlers.aio.RedisKeyValue. Results are stored with the time they
+    took to compute and their expiry, so they must be serializable by the
+    store's codec.
+
+    - Single flight: on a miss, the caller that takes a short lock, SET NX
+      next to the key, recomputes; the others poll for its result for up
+      to lock_timeout seconds before computing it themselves. The lock is
+      released with a compare-and-delete script, so a caller whose lock
+      expired cannot release another caller's.
+    - Early refresh: with XFetch, each read recomputes a value before it
+      expires with a probability rising as expiry nears, so hot keys are
+      refreshed by one caller instead of expiring under load.
+    - Stale while revalidate: for stale_ttl seconds after expiry, callers
+      get the old value while one of them refreshes it in the background.
+    - Negative caching: None results are cached for negative_ttl seconds.
+
+    The decorated function gets cache_stats, a CacheStats with the hit ratio
+    and recomputation times, cache_key(*args, **kwargs) and
+    invalidate(*args, **kwargs), which deletes the cached result.
+
+    Args:
+        kv: The store, e.g. a RedisKeyValue, BucketedKeyValue or ShardedKeyValue.
+        ttl (float): Seconds a result stays fresh.
+        key (str or Callable, optional): Names the cached result of a call: a format
+            string filled with the call's arguments, like 'user:{0}', or a function
+            taking them. Defaults to the function's qualified name and a digest of
+            the arguments' repr().
+        stale_ttl (float, optional): Seconds an expired result may still be served
+            while it is refreshed. Defaults to 0.
+        negative_ttl (float, optional): Seconds None results stay fresh. Defaults to
+            None, which does not cache them.
+        beta (float, optional): XFetch eagerness; above 1 refreshes earlier, 0 never
+            refreshes early. Defaults to 1.0.
+        lock_timeout (float, optional): Seconds a recomputation may take before other
+            callers stop waiting for it. Defaults to 10.0.
+        poll_interval (float, optional): Seconds between checks for a result another
+            caller is computing. Defaults to 0.05.
+        executor (Executor, optional): Runs the background refreshes of functions.
+            Defaults to a thread pool shared by every cached function.
+        instrumentation (Instrumentation, optional): Receives every recomputation as a
+            call of handler 'cached'. Defaults to the default instrumentation.
+
+    Example:
+        @cached(RedisKeyValue('users'), ttl=300, key='user:{0}', stale_ttl=60, negative_ttl=30)
+        def load_user(user_id):
+            return db.fetch_user(user_id)
+    """
+    def decorate(function: F) -> F:
+        is_async = inspect.iscoroutinefunction(function)
+        if is_async != isinstance(kv, AsyncIRedis):
+            kind = 'an asyncio key-value store' if is_async else 'a synchronous key-value store'
+            raise TypeError(f'{function.__qualname__} needs {kind}, not {kv}')
+        cache = _Cache(function, kv, ttl, key, stale_ttl, negative_ttl, beta, lock_timeout, poll_interval, executor, instrumentation)
+
+        if is_async:
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                return await _call_async(cache, args, kwargs)
+
+            async def invalidate(*args, **kwargs) -> None:
+                await kv.delete(cache.key_for(args, kwargs))
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return _call(cache, args, kwargs)
+
+            def invalidate(*args, **kwargs) -> None:
+                kv.delete(cache.key_for(args, kwargs))
+
+        wrapper.cache_stats = cache.stats
+        wrapper.cache_key = lambda *args, **kwargs: cache.key_for(args, kwargs)
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorate
@@ -0,0 +1,196 @@
+import json
+import pickle
+import zlib
+from abc import ABCMeta, abstractmethod
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class Codec(metaclass=ABCMeta):
+    """Turns handler values into the bytes stored in Redis and back."""
+
+    name = 'codec'
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        """Serialize a value."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        """Deserialize a value."""
+        raise NotImplementedError
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class JSONCodec(Codec):
+    """Standard library JSON, byte-compatible with data written by older releases."""
+
+    name = 'json'
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class FastJSONCodec(Codec):
+    """
+    JSON through orjson or ujson when one is installed, the standard library otherwise.
+
+    The output is compact, so it is not byte-identical to JSONCodec. Handlers that
+    use the encoded value as an identity (sets, sorted sets, list removal) must
+    keep using the codec their data was written with.
+    """
+
+    name = 'fastjson'
+
+    def __init__(self):
+        if orjson is not None:
+            self._dumps, self._loads = orjson.dumps, orjson.loads
+        elif ujson is not None:
+            self._dumps = lambda value: ujson.dumps(value).encode('utf-8')
+            self._loads = ujson.loads
+        else:
+            self._dumps = lambda value: json.dumps(value, separators=(',', ':')).encode('utf-8')
+            self._loads = json.loads
+
+    def dumps(self, value: Any) -> bytes:
+        return self._dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return self._loads(data)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack encoding. Requires the msgpack package."""
+
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('MsgpackCodec requires the msgpack package: pip install msgpack')
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+class PickleCodec(Codec):
+    """
+    Pickle encoding for arbitrary Python objects.
+
+    Only use it when every writer to the Redis server is trusted, since loading
+    a pickle can execute arbitrary code.
+    """
+
+    name = 'pickle'
+
+    def __init__(self, protocol: int = pickle.HIGHEST_PROTOCOL):
+        self._protocol = protocol
+
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=self._protocol)
+
+    def loads(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+class CompressedCodec(Codec):
+    """
+    Wraps another codec and compresses payloads above a size threshold.
+
+    Every payload starts with a header byte naming the compression used, so
+    readers pick the right decompressor automatically and values written with
+    different thresholds or algorithms can be mixed freely.
+    """
+
+    RAW = 0x00
+    ZLIB = 0x01
+    LZ4 = 0x02
+
+    def __init__(self, codec: Codec = None, threshold: int = 1024, algorithm: str = 'zlib', level: int = 6):
+        """
+        Initialize the compressed codec.
+
+        Args:
+            codec (Codec, optional): The codec producing the payload. Defaults to JSONCodec.
+            threshold (int, optional): Minimum payload size in bytes worth compressing.
+                Defaults to 1024.
+            algorithm (str, optional): 'zlib' or 'lz4'. Defaults to 'zlib'.
+            level (int, optional): The zlib compression level. Defaults to 6.
+        """
+        if algorithm == 'lz4' and lz4_frame is None:
+            raise ImportError('lz4 compression requires the lz4 package: pip install lz4')
+        if algorithm not in ('zlib', 'lz4'):
+            raise ValueError(f'Unknown compression algorithm: {algorithm}')
+        self._codec = codec or JSONCodec()
+        self._threshold = threshold
+        self._algorithm = algorithm
+        self._level = level
+        self.name = f'{self._codec.name}+{algorithm}'
+
+    def dumps(self, value: Any) -> bytes:
+        payload = self._codec.dumps(value)
+        if len(payload) < self._threshold:
+            return bytes((self.RAW,)) + payload
+        if self._algorithm == 'lz4':
+            return bytes((self.LZ4,)) + lz4_frame.compress(payload)
+        return bytes((self.ZLIB,)) + zlib.compress(payload, self._level)
+
+    def loads(self, data: bytes) -> Any:
+        header, payload = data[0], data[1:]
+        if header == self.ZLIB:
+            payload = zlib.decompress(payload)
+        elif header == self.LZ4:
+            if lz4_frame is None:
+                raise ImportError('Reading lz4 payloads requires the lz4 package: pip install lz4')
+            payload = lz4_frame.decompress(payload)
+        elif header != self.RAW:
+            raise ValueError(f'Unknown compression header: {header:#04x}')
+        return self._codec.loads(payload)
+
+    def __str__(self) -> str:
+        return f"CompressedCodec(codec={self._codec}, threshold={self._threshold}, algorithm={self._algorithm})"
+
+
+CODECS: Dict[str, type] = {
+    JSONCodec.name: JSONCodec,
+    FastJSONCodec.name: FastJSONCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    PickleCodec.name: PickleCodec,
+}
+
+DEFAULT_CODEC = JSONCodec()
+
+
+def get_codec(name: str) -> Codec:
+    """Build a codec by name: 'json', 'fastjson', 'msgpack' or 'pickle'."""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f'Unknown codec: {name}') from None
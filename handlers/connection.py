@@ -0,0 +1,182 @@
+import os
+import threading
+import redis
+from typing import Any, Dict, Optional, Tuple
+
+
+PoolKey = Tuple[str, int, int, Optional[str]]
+
+
+class ConnectionRegistry:
+    """Process-wide registry handing out one connection pool per Redis server."""
+
+    def __init__(
+        self,
+        max_connections: int = 50,
+        timeout: Optional[float] = 20,
+        blocking: bool = True,
+        socket_keepalive: bool = True,
+        **connection_kwargs: Any
+    ):
+        """
+        Initialize the connection registry.
+
+        Args:
+            max_connections (int, optional): Maximum connections per pool. Defaults to 50.
+            timeout (float, optional): Seconds to wait for a free connection when the
+                pool is exhausted. Only used by blocking pools. Defaults to 20.
+            blocking (bool, optional): Wait for a free connection instead of raising
+                when the pool is exhausted. Defaults to True.
+            socket_keepalive (bool, optional): Enable TCP keepalive. Defaults to True.
+            **connection_kwargs: Extra keyword arguments passed to every connection.
+        """
+        self._pools: Dict[PoolKey, redis.ConnectionPool] = {}
+        self._clusters: Dict[Tuple[str, int, Optional[str]], redis.RedisCluster] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._options: Dict[str, Any] = {}
+        self._redirects: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self.configure(
+            max_connections=max_connections,
+            timeout=timeout,
+            blocking=blocking,
+            socket_keepalive=socket_keepalive,
+            **connection_kwargs
+        )
+
+    def configure(self, **options: Any) -> None:
+        """Update the pool options. Only pools created afterwards are affected."""
+        self._options.update(options)
+
+    def redirect(self, host: str, port: int, target: Optional[Tuple[str, int]]) -> None:
+        """
+        Connect pools created afterwards for host:port to another (host, port).
+
+        Used to point handlers at a test server without changing how they
+        are created. A target of None removes the redirect.
+        """
+        if target is None:
+            self._redirects.pop((host, port), None)
+        else:
+            self._redirects[(host, port)] = target
+
+    def get_pool(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None
+    ) -> redis.ConnectionPool:
+        """Return the shared pool for the given server, creating it on first use."""
+        self._check_fork()
+        key = (host, port, db, password)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    address = self._redirects.get((host, port), (host, port))
+                    pool = self._create_pool(*address, db, password)
+                    self._pools[key] = pool
+        return pool
+
+    def get_client(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None
+    ) -> redis.StrictRedis:
+        """Return a client bound to the shared pool for the given server."""
+        return redis.StrictRedis(connection_pool=self.get_pool(host, port, db, password))
+
+    def get_cluster_client(self, host: str = 'localhost', port: int = 6379, password: str = None) -> redis.RedisCluster:
+        """
+        Return the shared Redis Cluster client for the cluster a node belongs to.
+
+        The node is only used to discover the cluster; the client connects to
+        every primary it finds and routes each command to the node owning its
+        slot. The blocking and timeout options do not apply to clusters.
+        """
+        self._check_fork()
+        key = (host, port, password)
+        client = self._clusters.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clusters.get(key)
+                if client is None:
+                    address = self._redirects.get((host, port), (host, port))
+                    client = self._create_cluster(*address, password)
+                    self._clusters[key] = client
+        return client
+
+    def reset(self) -> None:
+        """Disconnect and forget every pool and cluster client owned by this process."""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+            clusters, self._clusters = self._clusters, {}
+        for pool in pools.values():
+            pool.disconnect()
+        for client in clusters.values():
+            client.close()
+
+    def _create_pool(self, host: str, port: int, db: int, password: Optional[str]) -> redis.ConnectionPool:
+        options = dict(self._options)
+        blocking = options.pop('blocking')
+        timeout = options.pop('timeout')
+        if blocking:
+            return redis.BlockingConnectionPool(
+                host=host, port=port, db=db, password=password, timeout=timeout, **options
+            )
+        return redis.ConnectionPool(host=host, port=port, db=db, password=password, **options)
+
+    def _create_cluster(self, host: str, port: int, password: Optional[str]) -> redis.RedisCluster:
+        options = dict(self._options)
+        options.pop('blocking')
+        options.pop('timeout')
+        return redis.RedisCluster(host=host, port=port, password=password, **options)
+
+    def _check_fork(self) -> None:
+        # Sockets inherited from the parent must never be reused or closed by a
+        # child, so a forked process simply drops the parent's pools.
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self) -> None:
+        self._pools = {}
+        self._clusters = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+    def __str__(self) -> str:
+        return f"ConnectionRegistry(pools={len(self._pools)})"
+
+
+registry = ConnectionRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def get_connection(
+    host: str = 'localhost',
+    port: int = 6379,
+    db: int = 0,
+    password: str = None,
+    connection_pool: Optional[redis.ConnectionPool] = None,
+    client: Optional[redis.StrictRedis] = None
+) -> redis.StrictRedis:
+    """
+    Resolve the client a handler should use.
+
+    An explicit client wins over an explicit pool, which wins over the shared
+    pool looked up in the registry from the connection parameters.
+    """
+    if client is not None:
+        return client
+    if connection_pool is not None:
+        return redis.StrictRedis(connection_pool=connection_pool)
+    return registry.get_client(host, port, db, password)
@@ -1,30 +1,176 @@
-import json
-from typing import Any, Dict
+import redis
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional, Tuple
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
 from handlers.interface import IRedis
+from handlers.near_cache import NearCache
+from handlers.utils import chunked
 
 
 class RedisHashSet(IRedis):
+    def __init__(
+        self,
+        name: str,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        near_cache: Optional[NearCache] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the hash set.
+
+        Args:
+            name (str): The name of the hash.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            near_cache (NearCache, optional): In-process cache in front of get().
+                Defaults to None.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        super().__init__(name, host, port, db, password, connection_pool, client, codec, instrumentation)
+        self._near_cache = near_cache
+        if near_cache is not None:
+            near_cache.bind(self._conn, prefix=name, name=name)
+
+    def _written(self) -> None:
+        # Invalidation works per Redis key, so any write evicts every cached field.
+        if self._near_cache is not None:
+            self._near_cache.written(self._conn, [self._name])
+
     def set(self, key: str, value: Any) -> None:
         """Set a value in the hash set."""
-        self._conn.hset(self._name, key, json.dumps(value))
+        self._conn.hset(self._name, key, self._codec.dumps(value))
+        self._written()
+
+    def set_many(self, mapping: Mapping[str, Any], ttl: Optional[int] = None, chunk_size: int = 1000) -> None:
+        """
+        Set many fields with one HSET per chunk.
+
+        Args:
+            mapping (Mapping[str, Any]): The field-value pairs to set.
+            ttl (int, optional): Expiry in seconds of the whole hash, set in the same
+                MULTI/EXEC as the fields of each chunk. Defaults to None.
+            chunk_size (int, optional): Fields per HSET. Defaults to 1000.
+        """
+        for chunk in chunked(mapping.items(), chunk_size):
+            pipeline = self._conn.pipeline(transaction=bool(ttl))
+            pipeline.hset(self._name, mapping={key: self._codec.dumps(value) for key, value in chunk})
+            if ttl:
+                pipeline.expire(self._name, ttl)
+            pipeline.execute()
+        self._written()
 
     def get(self, key: str) -> Any:
         """Get a value from the hash set."""
+        if self._near_cache is not None:
+            return self._near_cache.get_or_load(self._name, key, lambda: self._conn.hget(self._name, key), self._codec.loads)
         byte_data = self._conn.hget(self._name, key)
-        return json.loads(byte_data) if byte_data else None
-    
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def compare_and_set(self, key: str, expected: Any, value: Any) -> bool:
+        """
+        Set a field to value only if it still holds expected, atomically with one script call.
+
+        Values are compared encoded, so they must encode the same way every
+        time. An expected value of None means the field must be missing.
+        Returns whether the field was set.
+        """
+        missing = expected is None
+        expected = b'' if missing else self._codec.dumps(expected)
+        updated = self._run_script(
+            'hash_compare_and_set', keys=[self._name], args=[key, int(missing), expected, self._codec.dumps(value)]
+        )
+        if updated:
+            self._written()
+        return bool(updated)
+
+    def get_many(self, keys: Iterable[str], chunk_size: int = 1000) -> Dict[str, Any]:
+        """
+        Get many fields with one HMGET per chunk, all sent in one round trip. Missing fields are left out.
+
+        Args:
+            keys (Iterable[str]): The fields to look up.
+            chunk_size (int, optional): Fields per HMGET. Defaults to 1000.
+        """
+        chunks = list(chunked(keys, chunk_size))
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunks:
+            pipeline.hmget(self._name, chunk)
+        data = {}
+        for chunk, values in zip(chunks, pipeline.execute()):
+            for key, byte_data in zip(chunk, values):
+                if byte_data is not None:
+                    data[key] = self._codec.loads(byte_data)
+        return data
+
+    def project(self, *keys: str) -> Tuple[Any, ...]:
+        """Get the values of the given fields with one HMGET, in order, with None for missing ones."""
+        if not keys:
+            return ()
+        return tuple(self._codec.loads(byte_data) if byte_data else None for byte_data in self._conn.hmget(self._name, keys))
+
     def get_all(self) -> Dict[str, Any]:
         """Retrieve all key-value pairs from the hash set."""
         data = self._conn.hgetall(self._name)
-        return {key.decode('utf-8'): json.loads(value.decode('utf-8')) for key, value in data.items()}
+        return {key.decode('utf-8'): self._codec.loads(value) for key, value in data.items()}
+
+    def iter_items(self, match: Optional[str] = None, count: int = 1000) -> Iterator[Tuple[str, Any]]:
+        """
+        Lazily yield (field, value) pairs with HSCAN instead of loading the whole hash.
+
+        Args:
+            match (str, optional): Glob pattern the fields must match. Defaults to None.
+            count (int, optional): Fields fetched per HSCAN call. Defaults to 1000.
+        """
+        for key, value in self._conn.hscan_iter(self._name, match=match, count=count):
+            yield key.decode('utf-8'), self._codec.loads(value)
+
+    def iter_keys(self, match: Optional[str] = None, count: int = 1000) -> Iterator[str]:
+        """Lazily yield the fields with HSCAN, without decoding their values."""
+        for key, _ in self._conn.hscan_iter(self._name, match=match, count=count):
+            yield key.decode('utf-8')
 
-    def delete(self, key: str) -> None:
-        """Delete a key-value pair from the hash set."""
-        self._conn.hdel(self._name, key)
+    def view(self) -> 'RedisHashView':
+        """Return a dict-like view that reads and writes the hash field by field."""
+        return RedisHashView(self)
+
+    def size(self) -> int:
+        """Get the number of fields in the hash set."""
+        return self._conn.hlen(self._name)
+
+    def delete(self, key: str) -> bool:
+        """Delete a key-value pair from the hash set and tell whether it existed."""
+        deleted = self._conn.hdel(self._name, key)
+        self._written()
+        return bool(deleted)
+
+    def delete_many(self, keys: Iterable[str], chunk_size: int = 1000) -> int:
+        """Delete many fields with one HDEL per chunk and return how many existed."""
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(keys, chunk_size):
+            pipeline.hdel(self._name, *chunk)
+        deleted = sum(pipeline.execute())
+        self._written()
+        return deleted
 
     def clear(self) -> None:
         """Clear the hash set."""
-        return self._conn.delete(self._name)
+        self._conn.delete(self._name)
+        self._written()
 
     def exists(self, key: str) -> bool:
         """Check if a key exists in the hash set."""
@@ -32,4 +178,65 @@ class RedisHashSet(IRedis):
 
     def __str__(self) -> str:
         return f"RedisHashSet(name={self._name})"
-    
\ No newline at end of file
+
+
+class RedisHashView(MutableMapping):
+    """
+    A MutableMapping over a RedisHashSet that never loads the whole hash.
+
+    Lookups, membership and length are single HGET, HEXISTS and HLEN calls,
+    and iteration streams fields with HSCAN, decoding each value only when
+    it is reached.
+    """
+
+    def __init__(self, hash_set: RedisHashSet):
+        """
+        Initialize the view.
+
+        Args:
+            hash_set (RedisHashSet): The hash read and written through the view.
+        """
+        self._hash_set = hash_set
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._hash_set.get(key)
+        # A stored null decodes to None too, so only then is a second lookup needed.
+        if value is None and not self._hash_set.exists(key):
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._hash_set.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if not self._hash_set.delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and bool(self._hash_set.exists(key))
+
+    def __iter__(self) -> Iterator[str]:
+        return self._hash_set.iter_keys()
+
+    def __len__(self) -> int:
+        return self._hash_set.size()
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return self._hash_set.iter_items()
+
+    def values(self) -> Iterator[Any]:
+        return (value for _, value in self._hash_set.iter_items())
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Get many fields with HMGET. Missing fields are left out."""
+        return self._hash_set.get_many(keys)
+
+    def project(self, *keys: str) -> Tuple[Any, ...]:
+        """Get the values of the given fields with one HMGET, in order."""
+        return self._hash_set.project(*keys)
+
+    def clear(self) -> None:
+        self._hash_set.clear()
+
+    def __repr__(self) -> str:
+        return f"RedisHashView(name={self._hash_set._name})"
@@ -0,0 +1,489 @@
+import os
+import copy
+import time
+import inspect
+import logging
+import threading
+import functools
+from abc import ABCMeta, abstractmethod
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from handlers.codec import Codec
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Round trips made by the outermost handler call running in this context.
+_round_trips: ContextVar[Optional[List[int]]] = ContextVar('round_trips', default=None)
+
+
+class Instrumentation:
+    """
+    Receives timings from instrumented handlers. This base class discards them.
+
+    Handlers are only wrapped when enabled is true, so the default costs
+    nothing per call.
+    """
+
+    enabled = False
+
+    def record_call(self, handler: str, method: str, seconds: float, error: bool, round_trips: int) -> None:
+        """Record one public handler method call."""
+
+    def record_command(self, command: str, seconds: float, error: bool, commands: int = 1) -> None:
+        """Record one round trip: a command, or a pipeline of commands."""
+
+    def record_codec(self, operation: str, seconds: float, size: int) -> None:
+        """Record one dumps or loads of size encoded bytes."""
+
+
+NOOP = Instrumentation()
+_default: Instrumentation = NOOP
+
+
+def set_default_instrumentation(instrumentation: Optional[Instrumentation]) -> None:
+    """Use this instrumentation for every handler created afterwards without one."""
+    global _default
+    _default = instrumentation or NOOP
+
+
+def get_default_instrumentation() -> Instrumentation:
+    """Return the instrumentation used by handlers created without one."""
+    return _default
+
+
+class _Stat:
+    """Count, error count, latency histogram and totals of one series."""
+
+    __slots__ = ('count', 'errors', 'seconds', 'max_seconds', 'buckets', 'size', 'round_trips', 'commands')
+
+    def __init__(self, bucket_count: int):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (bucket_count + 1)
+        self.size = 0
+        self.round_trips = 0
+        self.commands = 0
+
+    def snapshot(self, bounds: Tuple[float, ...]) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(bounds + (float('inf'),), self.buckets):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds,
+            'mean_seconds': self.seconds / self.count if self.count else 0.0,
+            'buckets': buckets,
+            'bytes': self.size,
+            'round_trips': self.round_trips,
+            'commands': self.commands,
+        }
+
+
+class Metrics(Instrumentation):
+    """
+    Aggregates handler call, command and codec timings in memory.
+
+    Example:
+        metrics = Metrics(slow_threshold=0.05, exporters=[LoggingExporter()])
+        set_default_instrumentation(metrics)
+        metrics.start_exporting(interval=60)
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        slow_threshold: Optional[float] = None,
+        on_slow: Optional[Callable[[str, str, float], None]] = None,
+        exporters: Optional[List['Exporter']] = None
+    ):
+        """
+        Initialize the metrics.
+
+        Args:
+            buckets (Iterable[float], optional): Upper bounds of the latency buckets in
+                seconds. Defaults to DEFAULT_BUCKETS.
+            slow_threshold (float, optional): Log handler calls and commands taking at
+                least this many seconds. Defaults to None.
+            on_slow (Callable, optional): Called with (kind, name, seconds) for every
+                slow call, kind being 'call' or 'command'. Defaults to logging a warning.
+            exporters (List[Exporter], optional): Receive a snapshot on export().
+                Defaults to None.
+        """
+        self._bounds = tuple(sorted(buckets))
+        self._slow_threshold = slow_threshold
+        self._on_slow = on_slow or self._log_slow
+        self._exporters = list(exporters or [])
+        self._calls: Dict[Tuple[str, str], _Stat] = {}
+        self._commands: Dict[str, _Stat] = {}
+        self._codec: Dict[str, _Stat] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _observe(self, series: Dict[Any, _Stat], key: Any, seconds: float, error: bool) -> _Stat:
+        stat = series.get(key)
+        if stat is None:
+            stat = series[key] = _Stat(len(self._bounds))
+        stat.count += 1
+        stat.errors += error
+        stat.seconds += seconds
+        if seconds > stat.max_seconds:
+            stat.max_seconds = seconds
+        index = 0
+        for bound in self._bounds:
+            if seconds <= bound:
+                break
+            index += 1
+        stat.buckets[index] += 1
+        return stat
+
+    def record_call(self, handler: str, method: str, seconds: float, error: bool, round_trips: int) -> None:
+        with self._lock:
+            self._observe(self._calls, (handler, method), seconds, error).round_trips += round_trips
+        if self._slow_threshold is not None and seconds >= self._slow_threshold:
+            self._on_slow('call', f'{handler}.{method}', seconds)
+
+    def record_command(self, command: str, seconds: float, error: bool, commands: int = 1) -> None:
+        with self._lock:
+            self._observe(self._commands, command, seconds, error).commands += commands
+        if self._slow_threshold is not None and seconds >= self._slow_threshold:
+            self._on_slow('command', command, seconds)
+
+    def record_codec(self, operation: str, seconds: float, size: int) -> None:
+        with self._lock:
+            self._observe(self._codec, operation, seconds, False).size += size
+
+    @staticmethod
+    def _log_slow(kind: str, name: str, seconds: float) -> None:
+        logger.warning(f'Slow {kind} {name} took {seconds * 1000:.1f} ms')
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return every series as plain dicts.
+
+        'calls' is keyed by 'Handler.method', 'commands' by command name
+        ('PIPELINE' and 'MULTI' for pipelines, whose 'commands' field counts
+        the commands they carried) and 'codec' by 'dumps'/'loads'.
+        """
+        with self._lock:
+            return {
+                'calls': {f'{handler}.{method}': stat.snapshot(self._bounds) for (handler, method), stat in self._calls.items()},
+                'commands': {command: stat.snapshot(self._bounds) for command, stat in self._commands.items()},
+                'codec': {operation: stat.snapshot(self._bounds) for operation, stat in self._codec.items()},
+            }
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._calls.clear()
+            self._commands.clear()
+            self._codec.clear()
+
+    def export(self) -> None:
+        """Hand a snapshot to every exporter."""
+        snapshot = self.snapshot()
+        for exporter in self._exporters:
+            try:
+                exporter.export(snapshot)
+            except Exception as err:
+                logger.error(f'{exporter} failed: {err}')
+
+    def start_exporting(self, interval: float = 60.0) -> None:
+        """Call export() every interval seconds from a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.export()
+
+        self._thread = threading.Thread(target=run, name='metrics-exporter', daemon=True)
+        self._thread.start()
+
+    def stop_exporting(self) -> None:
+        """Stop the export thread started by start_exporting()."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def prometheus(self) -> str:
+        """Render the current snapshot in the Prometheus text exposition format."""
+        return render_prometheus(self.snapshot())
+
+    def __str__(self) -> str:
+        return f"Metrics(calls={len(self._calls)}, commands={len(self._commands)})"
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus(snapshot: Dict[str, Dict[str, Any]], prefix: str = 'redis_handler') -> str:
+    """Render a Metrics snapshot in the Prometheus text exposition format."""
+    lines = []
+
+    def histogram(metric: str, series: Iterable[Tuple[Dict[str, str], Dict[str, Any]]]) -> None:
+        lines.append(f'# TYPE {prefix}_{metric}_seconds histogram')
+        for labels, stat in series:
+            for bound, count in stat['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_{metric}_seconds_bucket{{{_labels(labels)},le="{le}"}} {count}')
+            lines.append(f'{prefix}_{metric}_seconds_sum{{{_labels(labels)}}} {stat["seconds"]}')
+            lines.append(f'{prefix}_{metric}_seconds_count{{{_labels(labels)}}} {stat["count"]}')
+
+    def counter(metric: str, field: str, series: Iterable[Tuple[Dict[str, str], Dict[str, Any]]]) -> None:
+        lines.append(f'# TYPE {prefix}_{metric} counter')
+        for labels, stat in series:
+            lines.append(f'{prefix}_{metric}{{{_labels(labels)}}} {stat[field]}')
+
+    calls = [(dict(zip(('handler', 'method'), name.split('.', 1))), stat) for name, stat in snapshot['calls'].items()]
+    commands = [({'command': name}, stat) for name, stat in snapshot['commands'].items()]
+    codec = [({'operation': name}, stat) for name, stat in snapshot['codec'].items()]
+    histogram('call', calls)
+    counter('call_errors_total', 'errors', calls)
+    counter('call_round_trips_total', 'round_trips', calls)
+    histogram('command', commands)
+    counter('command_errors_total', 'errors', commands)
+    histogram('codec', codec)
+    counter('codec_bytes_total', 'bytes', codec)
+    return '\n'.join(lines) + '\n'
+
+
+class Exporter(metaclass=ABCMeta):
+    """Receives Metrics snapshots."""
+
+    @abstractmethod
+    def export(self, snapshot: Dict[str, Dict[str, Any]]) -> None:
+        """Publish a snapshot."""
+        raise NotImplementedError
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class PrometheusExporter(Exporter):
+    """Writes the Prometheus text format to a file, e.g. for node_exporter's textfile collector."""
+
+    def __init__(self, path: str, prefix: str = 'redis_handler'):
+        """
+        Initialize the exporter.
+
+        Args:
+            path (str): The file written, atomically replaced on every export.
+            prefix (str, optional): Prefix of every metric name. Defaults to 'redis_handler'.
+        """
+        self._path = path
+        self._prefix = prefix
+
+    def export(self, snapshot: Dict[str, Dict[str, Any]]) -> None:
+        temporary = f'{self._path}.tmp'
+        with open(temporary, 'w') as file:
+            file.write(render_prometheus(snapshot, self._prefix))
+        os.replace(temporary, self._path)
+
+
+class LoggingExporter(Exporter):
+    """Logs one line per call and command series."""
+
+    def __init__(self, log: Optional[logging.Logger] = None, level: int = logging.INFO):
+        """
+        Initialize the exporter.
+
+        Args:
+            log (logging.Logger, optional): Where to log. Defaults to this module's logger.
+            level (int, optional): The log level. Defaults to logging.INFO.
+        """
+        self._log = log or logger
+        self._level = level
+
+    def export(self, snapshot: Dict[str, Dict[str, Any]]) -> None:
+        for kind in ('calls', 'commands'):
+            for name, stat in sorted(snapshot[kind].items()):
+                self._log.log(
+                    self._level,
+                    f"{name}: count={stat['count']} errors={stat['errors']} "
+                    f"mean={stat['mean_seconds'] * 1000:.2f}ms max={stat['max_seconds'] * 1000:.2f}ms"
+                )
+
+
+class CallbackExporter(Exporter):
+    """Passes every snapshot to a function."""
+
+    def __init__(self, callback: Callable[[Dict[str, Dict[str, Any]]], None]):
+        """
+        Initialize the exporter.
+
+        Args:
+            callback (Callable): Called with each snapshot.
+        """
+        self._callback = callback
+
+    def export(self, snapshot: Dict[str, Dict[str, Any]]) -> None:
+        self._callback(snapshot)
+
+
+class InstrumentedCodec(Codec):
+    """Times another codec and counts the bytes it produces and reads."""
+
+    def __init__(self, codec: Codec, instrumentation: Instrumentation):
+        self._codec = codec
+        self._instrumentation = instrumentation
+        self.name = codec.name
+
+    def dumps(self, value: Any) -> bytes:
+        started = time.perf_counter()
+        data = self._codec.dumps(value)
+        self._instrumentation.record_codec('dumps', time.perf_counter() - started, len(data))
+        return data
+
+    def loads(self, data: bytes) -> Any:
+        started = time.perf_counter()
+        value = self._codec.loads(data)
+        self._instrumentation.record_codec('loads', time.perf_counter() - started, len(data))
+        return value
+
+    def __str__(self) -> str:
+        return f"InstrumentedCodec({self._codec})"
+
+
+def _count_round_trip() -> None:
+    round_trips = _round_trips.get()
+    if round_trips is not None:
+        round_trips[0] += 1
+
+
+def _instrument_pipeline(pipeline: Any, instrumentation: Instrumentation) -> Any:
+    execute = pipeline.execute
+    command = 'MULTI' if getattr(pipeline, 'transaction', False) else 'PIPELINE'
+
+    if inspect.iscoroutinefunction(execute):
+        async def timed_execute(*args, **kwargs):
+            commands = len(pipeline)
+            started, error = time.perf_counter(), True
+            try:
+                result = await execute(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                _count_round_trip()
+                instrumentation.record_command(command, time.perf_counter() - started, error, commands)
+    else:
+        def timed_execute(*args, **kwargs):
+            commands = len(pipeline)
+            started, error = time.perf_counter(), True
+            try:
+                result = execute(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                _count_round_trip()
+                instrumentation.record_command(command, time.perf_counter() - started, error, commands)
+    pipeline.execute = timed_execute
+    return pipeline
+
+
+def instrument_client(client: Any, instrumentation: Instrumentation) -> Any:
+    """Return a copy of a sync or asyncio redis client that times every command and pipeline."""
+    client = copy.copy(client)
+    # The pool belongs to the original client; the copy must not close it when collected.
+    client.auto_close_connection_pool = False
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    if inspect.iscoroutinefunction(execute_command):
+        async def timed_command(*args, **options):
+            started, error = time.perf_counter(), True
+            try:
+                result = await execute_command(*args, **options)
+                error = False
+                return result
+            finally:
+                _count_round_trip()
+                instrumentation.record_command(str(args[0]).upper(), time.perf_counter() - started, error)
+    else:
+        def timed_command(*args, **options):
+            started, error = time.perf_counter(), True
+            try:
+                result = execute_command(*args, **options)
+                error = False
+                return result
+            finally:
+                _count_round_trip()
+                instrumentation.record_command(str(args[0]).upper(), time.perf_counter() - started, error)
+
+    client.execute_command = timed_command
+    client.pipeline = lambda *args, **kwargs: _instrument_pipeline(pipeline(*args, **kwargs), instrumentation)
+    return client
+
+
+def _timed_method(function: Callable[..., Any], handler: Any, instrumentation: Instrumentation) -> Callable[..., Any]:
+    handler_name, method = type(handler).__name__, function.__name__
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def timed(*args, **kwargs):
+            round_trips = _round_trips.get()
+            token = _round_trips.set([0]) if round_trips is None else None
+            started, error = time.perf_counter(), True
+            try:
+                result = await function(handler, *args, **kwargs)
+                error = False
+                return result
+            finally:
+                seconds = time.perf_counter() - started
+                count = _round_trips.get()[0]
+                if token is not None:
+                    _round_trips.reset(token)
+                instrumentation.record_call(handler_name, method, seconds, error, count if token is not None else 0)
+        return timed
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        round_trips = _round_trips.get()
+        token = _round_trips.set([0]) if round_trips is None else None
+        started, error = time.perf_counter(), True
+        try:
+            result = function(handler, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            count = _round_trips.get()[0]
+            if token is not None:
+                _round_trips.reset(token)
+            # Only the outermost call is charged for the round trips it caused.
+            instrumentation.record_call(handler_name, method, seconds, error, count if token is not None else 0)
+    return timed
+
+
+def instrument(handler: Any, instrumentation: Optional[Instrumentation] = None, skip: Iterable[str] = ('batch',)) -> None:
+    """
+    Time a handler's public methods, redis commands and codec.
+
+    Does nothing when the instrumentation is disabled. Generator methods
+    are not timed, since their work happens while they are consumed.
+    """
+    instrumentation = instrumentation or get_default_instrumentation()
+    if not instrumentation.enabled:
+        return
+    handler._conn = instrument_client(handler._conn, instrumentation)
+    handler._codec = InstrumentedCodec(handler._codec, instrumentation)
+    for name, function in inspect.getmembers(type(handler), inspect.isfunction):
+        if name.startswith('_') or name in skip:
+            continue
+        if inspect.isgeneratorfunction(function) or inspect.isasyncgenfunction(function):
+            continue
+        setattr(handler, name, _timed_method(function, handler, instrumentation))
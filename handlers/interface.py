@@ -2,7 +2,13 @@ import logging
 import redis
 from redis import exceptions
 from abc import ABCMeta, abstractmethod
-from typing import Any, Optional
+from typing import Any, Iterable, Optional
+from handlers.batch import Batch
+from handlers.codec import Codec, DEFAULT_CODEC
+from handlers.connection import get_connection
+from handlers.instrumentation import Instrumentation, instrument
+from handlers.scripts import ScriptRegistry
+from handlers.utils import hash_tag
 
 
 logger = logging.getLogger(__name__)
@@ -15,7 +21,11 @@ class IRedis(metaclass=ABCMeta):
         host: str = 'localhost', 
         port: int = 6379, 
         db: int = 0, 
-        password: str = None
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        instrumentation: Optional[Instrumentation] = None
     ):
         """
         Initialize the Redis Connection.
@@ -26,15 +36,26 @@ class IRedis(metaclass=ABCMeta):
             port (int, optional): The Redis server port. Defaults to 6379.
             db (int, optional): The Redis database number. Defaults to 0.
             password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is, which
+                may be a redis.RedisCluster. Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the one set with set_default_instrumentation(),
+                which is a no-op unless configured.
         """
 
         self._name = name
+        self._codec = codec or DEFAULT_CODEC
         try:
-            self._conn = redis.StrictRedis(
+            self._conn = get_connection(
                 host=host, 
                 port=port, 
                 db=db, 
-                password=password
+                password=password,
+                connection_pool=connection_pool,
+                client=client
             )
         except exceptions.ConnectionError as err:
             logger.error(f'Error connecting to Redis: {err}')
@@ -45,7 +66,24 @@ class IRedis(metaclass=ABCMeta):
         except exceptions.TimeoutError as err:
             logger.error(f'Timeout while connecting to Redis: {err}')
             raise
+        self._cluster = isinstance(self._conn, redis.RedisCluster)
+        instrument(self, instrumentation)
+        self.scripts = ScriptRegistry(self._conn)
 
+    def _run_script(self, name: str, keys: Iterable[Any] = (), args: Iterable[Any] = ()) -> Any:
+        """Run a script of the registry on the handler's current client, which a Batch may replace."""
+        return self.scripts(name, keys, args, client=self._conn)
+
+    def _sub_key(self, suffix: str) -> str:
+        """
+        Name a key the handler keeps next to its main one.
+
+        On Redis Cluster the name is hash-tagged so that the key lands in the
+        slot of the main key, which multi-key commands and scripts require.
+        """
+        if self._cluster:
+            return f'{hash_tag(self._name)}:{suffix}'
+        return f'{self._name}:{suffix}'
 
     @abstractmethod
     def get(self, key: str) -> Any:
@@ -56,4 +94,16 @@ class IRedis(metaclass=ABCMeta):
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set the value for the given key, with an optional TTL."""
         raise NotImplementedError
-    
\ No newline at end of file
+
+    def batch(self, transaction: bool = False, max_size: int = 1000, raise_on_error: bool = True) -> Batch:
+        """
+        Record calls made inside a with block into one pipeline.
+
+        Args:
+            transaction (bool, optional): Wrap every flush in MULTI/EXEC. Defaults to False.
+            max_size (int, optional): Flush automatically once this many commands are
+                queued. Defaults to 1000.
+            raise_on_error (bool, optional): Raise the first error after a flush instead
+                of returning it in place of the result. Defaults to True.
+        """
+        return Batch(self, transaction=transaction, max_size=max_size, raise_on_error=raise_on_error)
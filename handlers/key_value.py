@@ -1,40 +1,225 @@
-import json
-from typing import Any, Dict, Optional
+import redis
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
 from handlers.interface import IRedis
+from handlers.near_cache import NearCache
+from handlers.utils import chunked, escape_pattern
 
 
 class RedisKeyValue(IRedis):
+    def __init__(
+        self,
+        name: str,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        near_cache: Optional[NearCache] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the key-value store.
+
+        Args:
+            name (str): The namespace prepended to every key.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            near_cache (NearCache, optional): In-process cache in front of get().
+                Defaults to None.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        super().__init__(name, host, port, db, password, connection_pool, client, codec, instrumentation)
+        self._near_cache = near_cache
+        if near_cache is not None:
+            near_cache.bind(self._conn, prefix=f'{name}:', name=name)
+
     def _key_name(self, key: str) -> str:
         return f'{self._name}:{key}'
 
+    def _scan_chunks(self, count: int) -> Iterator[List[bytes]]:
+        """Yield the namespace's full key names in chunks of up to count keys."""
+        chunk = []
+        pattern = f'{escape_pattern(self._name)}:*'
+        for key_name in self._conn.scan_iter(match=pattern, count=count):
+            chunk.append(key_name)
+            if len(chunk) >= count:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set a key-value pair with an optional TTL."""
         key_name = self._key_name(key)
-        self._conn.set(key_name, json.dumps(value))
-        if ttl:
-            self._conn.expire(key_name, ttl)
+        self._conn.set(key_name, self._codec.dumps(value), ex=ttl or None)
+        if self._near_cache is not None:
+            self._near_cache.written(self._conn, [key_name])
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Set a key only if it does not exist yet, with SET NX, and tell whether it was set."""
+        key_name = self._key_name(key)
+        written = self._conn.set(key_name, self._codec.dumps(value), ex=ttl or None, nx=True)
+        if written and self._near_cache is not None:
+            self._near_cache.written(self._conn, [key_name])
+        return bool(written)
+
+    def get_set(self, key: str, value: Any, ttl: Optional[int] = None) -> Any:
+        """
+        Set a key and return its previous value, atomically with one script call.
+
+        Args:
+            key (str): The key.
+            value (Any): The new value.
+            ttl (float, optional): Expiry in seconds of the new value. Defaults to None,
+                which leaves the key without expiry.
+        """
+        key_name = self._key_name(key)
+        byte_data = self._run_script('get_set_ttl', keys=[key_name], args=[self._codec.dumps(value), int((ttl or 0) * 1000)])
+        if self._near_cache is not None:
+            self._near_cache.written(self._conn, [key_name])
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def set_many(self, mapping: Mapping[str, Any], ttl: Optional[int] = None, chunk_size: int = 1000) -> None:
+        """
+        Set many key-value pairs with one round trip per chunk.
+
+        Without a TTL each chunk is a single MSET. With a TTL each key gets its
+        own SET EX, so the value and its expiry are always written together.
+
+        Args:
+            mapping (Mapping[str, Any]): The key-value pairs to set.
+            ttl (int, optional): Expiry in seconds applied to every key. Defaults to None.
+            chunk_size (int, optional): Keys per round trip. Defaults to 1000.
+        """
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(mapping.items(), chunk_size):
+            if ttl:
+                for key, value in chunk:
+                    pipeline.set(self._key_name(key), self._codec.dumps(value), ex=ttl)
+            else:
+                pipeline.mset({self._key_name(key): self._codec.dumps(value) for key, value in chunk})
+            pipeline.execute()
+            if self._near_cache is not None:
+                self._near_cache.written(self._conn, [self._key_name(key) for key, _ in chunk])
 
     def get(self, key: str) -> Any:
         """Get a value by key."""
         key_name = self._key_name(key)
+        if self._near_cache is not None:
+            return self._near_cache.get_or_load(key_name, None, lambda: self._conn.get(key_name), self._codec.loads)
         byte_data = self._conn.get(key_name)
-        return json.loads(byte_data) if byte_data else None
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def get_many(self, keys: Iterable[str], chunk_size: int = 1000) -> Dict[str, Any]:
+        """
+        Get many values with one MGET per chunk, all sent in one round trip. Missing keys are left out.
 
-    def get_all(self) -> Dict[str, Any]:
+        Args:
+            keys (Iterable[str]): The keys to look up.
+            chunk_size (int, optional): Keys per MGET. Defaults to 1000.
+        """
+        chunks = list(chunked(keys, chunk_size))
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunks:
+            pipeline.mget([self._key_name(key) for key in chunk])
+        data = {}
+        for chunk, values in zip(chunks, pipeline.execute()):
+            for key, byte_data in zip(chunk, values):
+                if byte_data is not None:
+                    data[key] = self._codec.loads(byte_data)
+        return data
+
+    def iter_keys(self, count: int = 1000) -> Iterator[str]:
+        """
+        Iterate over the keys with SCAN without blocking the server.
+
+        Like SCAN itself, a key may be returned more than once.
+        """
+        prefix_length = len(self._name) + 1
+        for chunk in self._scan_chunks(count):
+            for key_name in chunk:
+                yield key_name.decode('utf-8')[prefix_length:]
+
+    def iter_items(self, count: int = 1000) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over the key-value pairs, fetching values with one MGET per chunk.
+
+        Args:
+            count (int, optional): SCAN COUNT hint and MGET chunk size. Defaults to 1000.
+        """
+        prefix_length = len(self._name) + 1
+        for chunk in self._scan_chunks(count):
+            for key_name, byte_data in zip(chunk, self._conn.mget(chunk)):
+                # The key may have expired or been deleted since it was scanned.
+                if byte_data is not None:
+                    yield key_name.decode('utf-8')[prefix_length:], self._codec.loads(byte_data)
+
+    def get_all(self, count: int = 1000) -> Dict[str, Any]:
         """Retrieve all key-value pairs."""
-        keys = self._conn.keys(f'{self._name}:*')
-        return {key.decode('utf-8').split(':')[-1]: self.get(key.decode('utf-8').split(':')[-1]) for key in keys}
+        return dict(self.iter_items(count))
 
     def delete(self, key: str) -> None:
         """Delete a key-value pair."""
         key_name = self._key_name(key)
         self._conn.delete(key_name)
+        if self._near_cache is not None:
+            self._near_cache.written(self._conn, [key_name])
+
+    def delete_if_equals(self, key: str, value: Any) -> bool:
+        """
+        Delete a key only if it holds value, atomically with one script call, and tell whether it did.
+
+        Values are compared encoded, so the codec must encode equal values the same way.
+        """
+        key_name = self._key_name(key)
+        deleted = self._run_script('compare_and_delete', keys=[key_name], args=[self._codec.dumps(value)])
+        if deleted and self._near_cache is not None:
+            self._near_cache.written(self._conn, [key_name])
+        return bool(deleted)
+
+    def delete_many(self, keys: Iterable[str], chunk_size: int = 1000) -> int:
+        """Delete many keys with one DELETE per chunk and return how many existed."""
+        key_names = [self._key_name(key) for key in keys]
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(key_names, chunk_size):
+            pipeline.delete(*chunk)
+        deleted = sum(pipeline.execute())
+        if self._near_cache is not None:
+            self._near_cache.written(self._conn, key_names)
+        return deleted
+
+    def clear(self, count: int = 1000, pipeline_size: int = 10) -> None:
+        """
+        Clear the key-value store.
+
+        Keys are found with SCAN and removed with UNLINK, so memory is reclaimed
+        in the background and the server never blocks on a large namespace.
 
-    def clear(self) -> None:
-        """Clear the key-value store."""
-        keys = self._conn.keys(f'{self._name}:*')
-        for key in keys:
-            self._conn.delete(key)
+        Args:
+            count (int, optional): SCAN COUNT hint and keys per UNLINK. Defaults to 1000.
+            pipeline_size (int, optional): UNLINK commands sent per round trip. Defaults to 10.
+        """
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in self._scan_chunks(count):
+            pipeline.unlink(*chunk)
+            if len(pipeline) >= pipeline_size:
+                pipeline.execute()
+        if len(pipeline):
+            pipeline.execute()
+        if self._near_cache is not None:
+            self._near_cache.cleared(self._conn)
 
     def exists(self, key: str) -> bool:
         """Check if a key exists."""
@@ -0,0 +1,120 @@
+import time
+import logging
+import threading
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import Future
+from typing import Any, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class LingerBuffer(metaclass=ABCMeta):
+    """
+    Collects items and writes them in batches from a background thread.
+
+    A batch is written once batch_size items are waiting or the oldest one
+    has waited linger seconds, whichever comes first, so a busy producer
+    pays one round trip per batch and a quiet one adds at most linger of
+    latency. Subclasses implement _write_batch, returning one result per
+    item; add() returns a Future of that result, or of the error the whole
+    batch failed with.
+    """
+
+    def __init__(self, linger: float = 0.005, batch_size: int = 500, max_buffered: int = 10000, name: str = 'linger-buffer'):
+        """
+        Initialize the buffer and start its flusher thread.
+
+        Args:
+            linger (float, optional): Seconds an item may wait for others to share
+                its round trip. Defaults to 0.005.
+            batch_size (int, optional): Items per write. Defaults to 500.
+            max_buffered (int, optional): add() blocks while this many items are
+                waiting. Defaults to 10000.
+            name (str, optional): Name of the flusher thread. Defaults to 'linger-buffer'.
+        """
+        self._linger = linger
+        self._batch_size = batch_size
+        self._max_buffered = max_buffered
+        self._buffer: List[Tuple[Any, Future]] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @abstractmethod
+    def _write_batch(self, items: List[Any]) -> List[Any]:
+        """Write a batch of items and return one result per item."""
+        raise NotImplementedError
+
+    def add(self, item: Any) -> Future:
+        """Queue an item and return a Future of its result."""
+        future = Future()
+        with self._lock:
+            while len(self._buffer) >= self._max_buffered and not self._closed:
+                self._lock.wait()
+            if self._closed:
+                raise RuntimeError(f'{self} is closed')
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append((item, future))
+            if len(self._buffer) >= self._batch_size:
+                self._lock.notify_all()
+        return future
+
+    def flush(self) -> None:
+        """Write everything queued so far and wait until it is written."""
+        with self._lock:
+            futures = [future for _, future in self._buffer]
+            self._oldest = 0
+            self._lock.notify_all()
+        for future in futures:
+            future.exception()
+
+    def close(self) -> None:
+        """Flush the buffer and stop the flusher thread."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if len(self._buffer) >= self._batch_size:
+                        break
+                    if self._buffer:
+                        remaining = self._oldest + self._linger - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._lock.wait(remaining)
+                    else:
+                        self._lock.wait()
+                if self._closed and not self._buffer:
+                    return
+                batch, self._buffer = self._buffer[:self._batch_size], self._buffer[self._batch_size:]
+                self._oldest = time.monotonic() if self._buffer else None
+                self._lock.notify_all()
+            self._write(batch)
+
+    def _write(self, batch: List[Tuple[Any, Future]]) -> None:
+        try:
+            results = self._write_batch([item for item, _ in batch])
+        except Exception as err:
+            logger.error(f'{self}: writing {len(batch)} items failed: {err}')
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def __enter__(self) -> 'LingerBuffer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
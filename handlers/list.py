@@ -1,21 +1,24 @@
-import json
-from typing import Any, List
+import redis
+from typing import Any, Iterable, Iterator, List, Optional, Union
 from handlers.interface import IRedis
+from handlers.utils import is_unsupported_command
 
 
 class RedisList(IRedis):
+    _lpos_supported = True
+
     def set(self, value: Any) -> None:
         """Append a value to the list."""
-        self._conn.rpush(self._name, json.dumps(value))
+        self._conn.rpush(self._name, self._codec.dumps(value))
 
     def get(self, index: int) -> Any:
         """Get a value by index."""
         byte_data = self._conn.lindex(self._name, index)
-        return json.loads(byte_data) if byte_data else None
-    
+        return self._codec.loads(byte_data) if byte_data else None
+
     def delete(self, value: Any) -> None:
         """Remove a value from the list."""
-        self._conn.lrem(self._name, 0, json.dumps(value))
+        self._conn.lrem(self._name, 0, self._codec.dumps(value))
 
     def clear(self) -> None:
         """Clear the list."""
@@ -24,7 +27,50 @@ class RedisList(IRedis):
     def get_all(self) -> List[Any]:
         """Retrieve all values from the list."""
         data = self._conn.lrange(self._name, 0, -1)
-        return [json.loads(value.decode('utf-8')) for value in data]
+        return [self._codec.loads(value) for value in data]
+
+    def get_range(self, start: int = 0, stop: Optional[int] = None) -> List[Any]:
+        """
+        Retrieve the values from start up to, but not including, stop with one LRANGE.
+
+        Indexes follow Python slicing, so negative ones count from the end.
+        """
+        if stop == 0:
+            return []
+        data = self._conn.lrange(self._name, start, -1 if stop is None else stop - 1)
+        return [self._codec.loads(value) for value in data]
+
+    def iter(self, window: int = 1000) -> Iterator[Any]:
+        """
+        Lazily yield every value, fetching window values per LRANGE.
+
+        Values pushed to or removed from the head of the list while iterating
+        shift the windows, so they may be skipped or seen twice.
+        """
+        start = 0
+        while True:
+            data = self._conn.lrange(self._name, start, start + window - 1)
+            for value in data:
+                yield self._codec.loads(value)
+            if len(data) < window:
+                return
+            start += window
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iter()
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            if index.step in (None, 1):
+                return self.get_range(index.start or 0, index.stop)
+            start, stop, step = index.indices(self.size())
+            if step > 0:
+                return self.get_range(start, stop)[::step] if start < stop else []
+            return self.get_range(stop + 1, start + 1)[::step] if stop < start else []
+        byte_data = self._conn.lindex(self._name, index)
+        if byte_data is None:
+            raise IndexError(f'{self} index out of range')
+        return self._codec.loads(byte_data)
 
     def exists(self) -> bool:
         """Check if the list exists."""
@@ -33,15 +79,65 @@ class RedisList(IRedis):
     def size(self) -> int:
         """Get the size of the list."""
         return self._conn.llen(self._name)
-        
+
+    def _positions(self, value: Any, rank: int = 1, count: Optional[int] = None) -> Any:
+        # LPOS compares encoded bytes, so values must encode the same way every time.
+        element = self._codec.dumps(value)
+        if self._lpos_supported:
+            try:
+                return self._conn.lpos(self._name, element, rank=rank, count=count)
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._lpos_supported = False
+        # Before Redis 6.0.6: compare the encoded values on the client instead.
+        data = self._conn.lrange(self._name, 0, -1)
+        positions = [index for index, item in enumerate(data) if item == element]
+        if rank < 0:
+            positions.reverse()
+        positions = positions[abs(rank) - 1:]
+        if count is None:
+            return positions[0] if positions else None
+        return positions if count == 0 else positions[:count]
+
+    def index_of(self, value: Any, rank: int = 1) -> Optional[int]:
+        """
+        Return the index of a value, searched for on the server with LPOS.
+
+        Args:
+            value (Any): The value to find.
+            rank (int, optional): Which match to return; 2 is the second one, and
+                negative ranks search from the tail. Defaults to 1.
+        """
+        return self._positions(value, rank=rank)
+
     def contains(self, value: Any) -> bool:
         """Check if the list contains a value."""
-        return self.count(value) > 0
-    
+        return self.index_of(value) is not None
+
     def count(self, value: Any) -> int:
-        """Count occurrences of a value in the list."""
-        elements = self.get_all()
-        return elements.count(value)
+        """Count occurrences of a value in the list with LPOS COUNT 0."""
+        if self._lpos_supported:
+            return len(self._positions(value, count=0))
+        # Before Redis 6.0.6: count on the server with a script rather than pulling the list.
+        return self._run_script('list_count', keys=[self._name], args=[self._codec.dumps(value)])
+
+    def push_capped(self, values: Iterable[Any], max_length: int) -> int:
+        """
+        Append values and trim the list to its newest max_length values, atomically with one script call.
+
+        Returns the list's length afterwards.
+
+        Raises:
+            ValueError: If max_length is not positive.
+        """
+        if max_length <= 0:
+            raise ValueError('max_length must be positive')
+        # Older values would be trimmed right away, so they are not sent.
+        values = [self._codec.dumps(value) for value in values][-max_length:]
+        if not values:
+            return self.size()
+        return self._run_script('push_capped', keys=[self._name], args=[max_length, *values])
 
     def __str__(self) -> str:
-        return f"RedisList(name={self._name})"
\ No newline at end of file
+        return f"RedisList(name={self._name})"
@@ -0,0 +1,283 @@
+import json
+import time
+import logging
+import threading
+import redis
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = '__redis__:invalidate'
+
+
+class NearCache:
+    """
+    In-process LRU cache in front of a handler's reads.
+
+    Entries are bounded by count and by the size of their encoded values, and
+    may also expire after a TTL. Stale entries are evicted in one of two ways:
+
+    * 'tracking': Redis client-side caching in broadcast mode. The server
+      pushes the name of every modified key under the handler's prefix to a
+      dedicated connection, so writes from any client are seen.
+    * 'pubsub': handlers using a near cache publish the keys they modify on a
+      channel every cache listens to. Writes from clients that do not use a
+      near cache are not seen; use this mode only when tracking is unavailable.
+
+    Every write made through the owning handler also evicts locally at once.
+    A cache must only be used by one handler, and cached values are shared
+    between callers, so they must not be mutated.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: Optional[float] = None,
+        invalidation: str = 'tracking',
+        channel: Optional[str] = None,
+        reconnect_delay: float = 1.0
+    ):
+        """
+        Initialize the near cache.
+
+        Args:
+            max_entries (int, optional): Maximum cached values. Defaults to 10000.
+            max_bytes (int, optional): Maximum total size of the cached encoded values.
+                Defaults to 64 MiB.
+            ttl (float, optional): Seconds after which an entry is refetched even without
+                an invalidation. Defaults to None.
+            invalidation (str, optional): 'tracking', 'pubsub' or 'none'. Defaults to 'tracking'.
+            channel (str, optional): The channel used by the pubsub mode. Defaults to
+                '__nearcache__:<handler name>'.
+            reconnect_delay (float, optional): Seconds to wait before reconnecting a
+                dropped invalidation connection. Defaults to 1.0.
+        """
+        if invalidation not in ('tracking', 'pubsub', 'none'):
+            raise ValueError(f'Unknown invalidation mode: {invalidation}')
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._invalidation = invalidation
+        self._channel = channel
+        self._reconnect_delay = reconnect_delay
+        self._entries: 'OrderedDict[Tuple[str, Optional[str]], Tuple[Any, int, Optional[float]]]' = OrderedDict()
+        self._fields: Dict[str, Set[Optional[str]]] = {}
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._connections = []
+        # The connection holding CLIENT TRACKING, whose loss ends the invalidations.
+        self._tracker: Optional[redis.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bind(self, client: redis.StrictRedis, prefix: str, name: str) -> None:
+        """Start listening for invalidations of keys starting with prefix."""
+        if self._invalidation == 'none' or self._thread is not None:
+            return
+        self._client = client
+        self._prefix = prefix
+        if self._channel is None:
+            self._channel = f'__nearcache__:{name}'
+        connection = self._connect()
+        self._thread = threading.Thread(target=self._listen, args=(connection,), name=f'near-cache-{name}', daemon=True)
+        self._thread.start()
+
+    def get_or_load(self, key: str, field: Optional[str], load: Callable[[], Any], decode: Callable[[bytes], Any]) -> Any:
+        """Return the cached value, or load, cache and return it."""
+        cache_key = (key, field)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return value
+                self._remove(cache_key)
+            self.misses += 1
+            generation = self._generation
+        byte_data = load()
+        if not isinstance(byte_data, (bytes, str)):
+            return decode(byte_data) if byte_data else None
+        value = decode(byte_data)
+        with self._lock:
+            # Anything invalidated while the value was in flight may be stale.
+            if generation == self._generation:
+                self._store(cache_key, value, len(byte_data))
+        return value
+
+    def written(self, client: redis.StrictRedis, keys: Iterable[str], evict: bool = True) -> None:
+        """
+        Evict keys written by the owning handler and tell the other caches.
+
+        With evict False only the other caches are told, which a Batch does
+        while recording a call whose commands have not run yet.
+        """
+        keys = list(keys)
+        if evict:
+            self.invalidate(keys)
+        if self._invalidation == 'pubsub' and keys:
+            client.publish(self._channel, json.dumps(keys))
+
+    def cleared(self, client: redis.StrictRedis, evict: bool = True) -> None:
+        """Drop every entry after the owning handler cleared its data and tell the other caches."""
+        if evict:
+            self.invalidate()
+        if self._invalidation == 'pubsub':
+            client.publish(self._channel, b'')
+
+    def invalidate(self, keys: Optional[Iterable[str]] = None) -> None:
+        """Evict every cached field of the given keys, or everything when keys is None."""
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._fields.clear()
+                self._bytes = 0
+                return
+            for key in keys:
+                for field in list(self._fields.get(key, ())):
+                    self._remove((key, field))
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit, miss, eviction and invalidation counters and the current size."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def close(self) -> None:
+        """Stop listening for invalidations and drop every entry."""
+        self._stop.set()
+        self._tracker = None
+        for connection in list(self._connections):
+            connection.disconnect()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.invalidate()
+
+    def _store(self, cache_key: Tuple[str, Optional[str]], value: Any, size: int) -> None:
+        if size > self._max_bytes:
+            return
+        if cache_key in self._entries:
+            self._remove(cache_key)
+        expires_at = time.monotonic() + self._ttl if self._ttl else None
+        self._entries[cache_key] = (value, size, expires_at)
+        self._fields.setdefault(cache_key[0], set()).add(cache_key[1])
+        self._bytes += size
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, cache_key: Tuple[str, Optional[str]]) -> None:
+        _, size, _ = self._entries.pop(cache_key)
+        self._bytes -= size
+        fields = self._fields[cache_key[0]]
+        fields.discard(cache_key[1])
+        if not fields:
+            del self._fields[cache_key[0]]
+
+    def _new_connection(self) -> redis.Connection:
+        pool = self._client.connection_pool
+        # Invalidations are read as plain RESP2 replies: with RESP3, the default
+        # of redis-py 8, they arrive as push messages read_response() skips.
+        kwargs = dict(pool.connection_kwargs, protocol=2)
+        if 'maint_notifications_config' in kwargs:
+            # Maintenance notifications need RESP3.
+            kwargs['maint_notifications_config'] = None
+        connection = pool.connection_class(**kwargs)
+        connection.connect()
+        self._connections.append(connection)
+        return connection
+
+    def _connect(self) -> redis.Connection:
+        """Open the connection the invalidation messages arrive on."""
+        for connection in self._connections:
+            connection.disconnect()
+        self._connections = []
+        self._tracker = None
+        listener = self._new_connection()
+        if self._invalidation == 'tracking':
+            listener.send_command('CLIENT', 'ID')
+            client_id = listener.read_response()
+            # Tracking lives on its own connection, which must stay open for
+            # as long as notifications are wanted.
+            tracker = self._new_connection()
+            tracker.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id, 'BCAST', 'PREFIX', self._prefix)
+            tracker.read_response()
+            self._tracker = tracker
+            listener.send_command('SUBSCRIBE', INVALIDATION_CHANNEL)
+        else:
+            listener.send_command('SUBSCRIBE', self._channel)
+        listener.read_response()
+        return listener
+
+    def _listen(self, connection: redis.Connection) -> None:
+        while not self._stop.is_set():
+            try:
+                if connection.can_read(timeout=1.0):
+                    self._handle(connection.read_response())
+                self._check_tracker()
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError, ValueError) as err:
+                # ValueError: close() disconnected the socket in the middle of a read.
+                if self._stop.is_set():
+                    return
+                logger.warning(f'Near cache lost an invalidation connection: {err}')
+                # Invalidations may have been missed while disconnected.
+                self.invalidate()
+                while not self._stop.wait(self._reconnect_delay):
+                    try:
+                        connection = self._connect()
+                        # Drop what was read between the loss and the new subscription.
+                        self.invalidate()
+                        break
+                    except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError) as err:
+                        logger.warning(f'Near cache could not reconnect: {err}')
+
+    def _check_tracker(self) -> None:
+        """Raise ConnectionError if the tracking connection closed or its redirection broke."""
+        tracker = self._tracker
+        if tracker is None or self._stop.is_set() or not tracker.can_read(timeout=0):
+            return
+        # The tracker sends no command once tracking is on, so anything it receives
+        # means tracking stopped: a tracking-redir-broken push, or an error.
+        try:
+            message = tracker.read_response()
+        except redis.exceptions.ResponseError as err:
+            message = err
+        raise redis.exceptions.ConnectionError(f'client tracking stopped: {message!r}')
+
+    def _handle(self, message: Any) -> None:
+        if not isinstance(message, list) or len(message) != 3 or message[0] != b'message':
+            return
+        data = message[2]
+        if not data:
+            # FLUSHALL/FLUSHDB, or a whole namespace cleared through a handler.
+            self.invalidate()
+        elif self._invalidation == 'tracking':
+            self.invalidate([key.decode('utf-8') for key in data])
+        else:
+            self.invalidate(json.loads(data))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __str__(self) -> str:
+        return f"NearCache(entries={len(self._entries)}, invalidation={self._invalidation})"
+
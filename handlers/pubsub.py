@@ -1,10 +1,54 @@
-import json
+import time
+import asyncio
+import logging
+import threading
 import redis
-from typing import Any, Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from handlers.codec import Codec, DEFAULT_CODEC
+from handlers.connection import get_connection
+from handlers.instrumentation import Instrumentation, get_default_instrumentation, instrument
+from handlers.linger import LingerBuffer
+from handlers.utils import chunked
+
+
+logger = logging.getLogger(__name__)
+
+# Confirmation message type -> (subscription kind, whether it is now subscribed)
+_CONFIRMATIONS = {
+    'subscribe': ('channel', True),
+    'unsubscribe': ('channel', False),
+    'psubscribe': ('pattern', True),
+    'punsubscribe': ('pattern', False),
+}
 
 
 class RedisPubSub:
-    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, password: str = None):
+    """
+    Publishes messages and dispatches subscriptions on one connection.
+
+    Every channel and pattern subscription shares a single dispatcher thread
+    that blocks on the socket until a message arrives. Messages are decoded
+    once and handed to the callback on an executor, so a slow callback does
+    not hold up delivery to the others.
+
+    subscribe() and psubscribe() return once the dispatcher has read the
+    server's confirmation, so a message published afterwards, from any
+    connection, is delivered.
+    """
+
+    def __init__(
+        self,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        executor: Optional[Executor] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
         """
         Initialize the Redis Pub/Sub handler.
 
@@ -13,18 +57,303 @@ class RedisPubSub:
             port (int, optional): The Redis server port. Defaults to 6379.
             db (int, optional): The Redis database number. Defaults to 0.
             password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes published messages. Defaults to JSONCodec.
+            executor (Executor, optional): Runs the callbacks. It is not shut down by
+                stop(). Defaults to a single worker thread, which keeps callbacks in
+                the order their messages arrived.
+            instrumentation (Instrumentation, optional): Receives call, command, codec
+                and callback timings. Defaults to the default instrumentation.
         """
-        self._conn = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        self._conn = get_connection(host, port, db, password, connection_pool, client)
+        self._codec = codec or DEFAULT_CODEC
         self._pubsub = self._conn.pubsub()
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._channels: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._patterns: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._listeners: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._lock = threading.Lock()
+        # ('channel' or 'pattern', name) pairs the server confirmed, updated by the dispatcher.
+        self._confirmed: Set[Tuple[str, str]] = set()
+        self._confirmation = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._instrumentation = instrumentation or get_default_instrumentation()
+        instrument(self, self._instrumentation)
+
+    def _decode_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        pattern = message.get('pattern')
+        return {
+            'type': message['type'],
+            'channel': message['channel'].decode('utf-8'),
+            'pattern': pattern.decode('utf-8') if pattern else None,
+            'data': self._codec.loads(message['data']),
+        }
+
+    def subscribe(self, channel: str, callback: Callable[[Dict[str, Any]], Any]) -> None:
+        """
+        Subscribe to a channel, replacing any earlier callback for it.
+
+        The callback receives the decoded message: a dict with 'type',
+        'channel', 'pattern' and 'data'.
+        """
+        with self._lock:
+            if channel not in self._channels and channel not in self._listeners:
+                self._pubsub.subscribe(channel)
+            self._channels[channel] = callback
+            self._start()
+        self._wait_confirmed([('channel', channel)])
+
+    def unsubscribe(self, channel: str) -> None:
+        """Unsubscribe from a channel. Iterators returned by listen() keep receiving it."""
+        with self._lock:
+            if self._channels.pop(channel, None) is not None and channel not in self._listeners:
+                self._forget([('channel', channel)])
+                self._pubsub.unsubscribe(channel)
+
+    def psubscribe(self, pattern: str, callback: Callable[[Dict[str, Any]], Any]) -> None:
+        """Subscribe to every channel matching a glob-style pattern."""
+        with self._lock:
+            if pattern not in self._patterns:
+                self._pubsub.psubscribe(pattern)
+            self._patterns[pattern] = callback
+            self._start()
+        self._wait_confirmed([('pattern', pattern)])
 
-    def subscribe(self, channel: str, callback: Callable[[Any], None]) -> None:
-        """Subscribe to a channel."""
-        self._pubsub.subscribe(**{channel: callback})
-        self._pubsub.run_in_thread(sleep_time=0.001)
+    def punsubscribe(self, pattern: str) -> None:
+        """Unsubscribe from a pattern."""
+        with self._lock:
+            if self._patterns.pop(pattern, None) is not None:
+                self._forget([('pattern', pattern)])
+                self._pubsub.punsubscribe(pattern)
+
+    def _wait_confirmed(self, subscriptions: List[Tuple[str, str]], timeout: float = 10.0) -> None:
+        """Block until the dispatcher has read the server's confirmation of every subscription."""
+        with self._confirmation:
+            if not self._confirmation.wait_for(lambda: self._confirmed.issuperset(subscriptions), timeout):
+                # redis-py subscribes again once it reconnects.
+                logger.warning(f'{self}: no confirmation of {subscriptions} after {timeout} seconds')
+
+    def _forget(self, subscriptions: Iterable[Tuple[str, str]]) -> None:
+        with self._confirmation:
+            self._confirmed.difference_update(subscriptions)
+
+    async def listen(self, *channels: str, max_queued: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield decoded messages published to the given channels, for asyncio code.
+
+        Messages come from the shared dispatcher and are handed to the event
+        loop as they arrive, without going through the callback executor.
+        When more than max_queued messages are waiting to be consumed, new
+        ones are dropped with a warning rather than stalling the dispatcher.
+
+        Example:
+            async for message in pubsub.listen('events'):
+                ...
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(max_queued)
+
+        def put(message: Dict[str, Any]) -> None:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning(f'{self}: listener is {max_queued} messages behind, dropping one on {message["channel"]}')
+
+        def deliver(message: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(put, message)
+
+        with self._lock:
+            for channel in channels:
+                if channel not in self._channels and channel not in self._listeners:
+                    self._pubsub.subscribe(channel)
+                self._listeners.setdefault(channel, []).append(deliver)
+            self._start()
+        await loop.run_in_executor(None, self._wait_confirmed, [('channel', channel) for channel in channels])
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._lock:
+                for channel in channels:
+                    listeners = self._listeners.get(channel, [])
+                    if deliver in listeners:
+                        listeners.remove(deliver)
+                    if not listeners:
+                        self._listeners.pop(channel, None)
+                        if channel not in self._channels and self._thread is not None:
+                            self._forget([('channel', channel)])
+                            self._pubsub.unsubscribe(channel)
 
     def publish(self, channel: str, message: Any) -> None:
         """Publish a message to a channel."""
-        self._conn.publish(channel, json.dumps(message))
+        self._conn.publish(channel, self._codec.dumps(message))
+
+    def publish_many(self, messages: Iterable[Tuple[str, Any]], chunk_size: int = 1000) -> int:
+        """
+        Publish many (channel, message) pairs with one pipelined round trip per chunk.
+
+        Returns the total number of subscribers that received them.
+        """
+        received = 0
+        for chunk in chunked(messages, chunk_size):
+            pipeline = self._conn.pipeline(transaction=False)
+            for channel, message in chunk:
+                pipeline.publish(channel, self._codec.dumps(message))
+            received += sum(pipeline.execute())
+        return received
+
+    def publisher(self, linger: float = 0.005, batch_size: int = 500, max_buffered: int = 10000) -> 'PubSubPublisher':
+        """Return a publisher that coalesces messages into publish_many() batches."""
+        return PubSubPublisher(self, linger, batch_size, max_buffered)
+
+    def stop(self, timeout: Optional[float] = 5) -> None:
+        """
+        Drop every subscription and stop the dispatcher.
+
+        Callbacks already handed to the default executor are run before it
+        returns. Subscribing again starts a new dispatcher.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._stop.set()
+            self._channels.clear()
+            self._patterns.clear()
+            self._listeners.clear()
+        with self._confirmation:
+            self._confirmed.clear()
+        # The replies wake the dispatcher up at once.
+        try:
+            self._pubsub.unsubscribe()
+            self._pubsub.punsubscribe()
+        except redis.exceptions.ConnectionError:
+            pass
+        thread.join(timeout)
+        self._pubsub.reset()
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pubsub-callback')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._dispatch, name='pubsub-dispatcher', daemon=True)
+        self._thread.start()
+
+    def _dispatch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                # Blocks on the socket; the timeout only bounds how late stop() is noticed when idle.
+                message = self._pubsub.get_message(timeout=1.0)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as err:
+                if self._stop.is_set():
+                    return
+                # redis-py reconnects and resubscribes on the next read.
+                logger.warning(f'{self}: connection lost: {err}')
+                with self._confirmation:
+                    self._confirmed.clear()
+                self._stop.wait(1.0)
+                continue
+            if message is not None and message['type'] in _CONFIRMATIONS:
+                self._confirm(message)
+                continue
+            if message is None or message['type'] not in ('message', 'pmessage'):
+                continue
+            listeners = ()
+            if message['type'] == 'message':
+                channel = message['channel'].decode('utf-8')
+                callback = self._channels.get(channel)
+                listeners = tuple(self._listeners.get(channel, ()))
+            else:
+                callback = self._patterns.get(message['pattern'].decode('utf-8'))
+            if callback is None and not listeners:
+                continue
+            try:
+                decoded = self._decode_message(message)
+            except Exception as err:
+                logger.error(f'{self}: cannot decode a message on {message["channel"]!r}: {err}')
+                continue
+            if callback is not None:
+                self._executor.submit(self._run_callback, callback, decoded)
+            for deliver in listeners:
+                try:
+                    deliver(decoded)
+                except RuntimeError:
+                    # The listener's event loop is closed.
+                    pass
+
+    def _confirm(self, message: Dict[str, Any]) -> None:
+        kind, subscribed = _CONFIRMATIONS[message['type']]
+        subscription = (kind, message['channel'].decode('utf-8'))
+        with self._confirmation:
+            if subscribed:
+                self._confirmed.add(subscription)
+            else:
+                self._confirmed.discard(subscription)
+            self._confirmation.notify_all()
+
+    def _run_callback(self, callback: Callable[[Dict[str, Any]], Any], message: Dict[str, Any]) -> None:
+        started, error = time.perf_counter(), True
+        try:
+            callback(message)
+            error = False
+        except Exception as err:
+            logger.error(f'{self}: callback for {message["channel"]} failed: {err}')
+        finally:
+            if self._instrumentation.enabled:
+                self._instrumentation.record_call(type(self).__name__, 'callback', time.perf_counter() - started, error, 0)
+
+    def __str__(self) -> str:
+        return f"RedisPubSub()"
+
+
+class PubSubPublisher(LingerBuffer):
+    """
+    Coalesces publish() calls into pipelined batches.
+
+    A batch is sent once batch_size messages are waiting or the oldest one
+    has waited linger seconds. publish() returns a Future of the number of
+    subscribers that received the message.
+
+    Example:
+        with pubsub.publisher(linger=0.002) as publisher:
+            for event in events:
+                publisher.publish('events', event)
+    """
+
+    def __init__(self, pubsub: RedisPubSub, linger: float = 0.005, batch_size: int = 500, max_buffered: int = 10000):
+        """
+        Initialize the publisher and start its flusher thread.
+
+        Args:
+            pubsub (RedisPubSub): The handler whose connection and codec are used.
+            linger (float, optional): Seconds a message may wait for others to share
+                its round trip. Defaults to 0.005.
+            batch_size (int, optional): Messages per pipeline. Defaults to 500.
+            max_buffered (int, optional): publish() blocks while this many messages
+                are waiting. Defaults to 10000.
+        """
+        self._pubsub = pubsub
+        super().__init__(linger, batch_size, max_buffered, name='pubsub-publisher')
+
+    def publish(self, channel: str, message: Any) -> Future:
+        """Queue a message and return a Future of its receiver count."""
+        return self.add((channel, message))
+
+    def _write_batch(self, items: List[Tuple[str, Any]]) -> List[int]:
+        pipeline = self._pubsub._conn.pipeline(transaction=False)
+        for channel, message in items:
+            pipeline.publish(channel, self._pubsub._codec.dumps(message))
+        return pipeline.execute()
 
     def __str__(self) -> str:
-        return f"RedisPubSub()"
\ No newline at end of file
+        return f"PubSubPublisher(linger={self._linger}, batch_size={self._batch_size}, buffered={len(self)})"
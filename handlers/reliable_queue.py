@@ -0,0 +1,358 @@
+import os
+import uuid
+import socket
+import logging
+import threading
+import redis
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Iterable, List, NamedTuple, Optional, Tuple, Union
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
+from handlers.queue import RedisQueue
+from handlers.utils import escape_pattern
+
+
+logger = logging.getLogger(__name__)
+
+ID_LENGTH = 32
+
+# KEYS: queue, processing, deadlines, owners, deliveries
+# ARGV: count, visibility timeout in ms, optional item already moved by BLMOVE
+RECEIVE_SCRIPT = """
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000) + tonumber(ARGV[2])
+local received = {}
+local function claim(item)
+    local id = string.sub(item, 1, 32)
+    redis.call('ZADD', KEYS[3], deadline, item)
+    redis.call('HSET', KEYS[4], id, KEYS[2])
+    received[#received + 1] = item
+    received[#received + 1] = redis.call('HINCRBY', KEYS[5], id, 1)
+end
+if ARGV[3] then
+    claim(ARGV[3])
+end
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not item then
+        break
+    end
+    claim(item)
+end
+return received
+"""
+
+# KEYS: processing, deadlines, owners, deliveries
+# ARGV: the acknowledged items
+ACK_SCRIPT = """
+local acked = 0
+for _, item in ipairs(ARGV) do
+    if redis.call('LREM', KEYS[1], 1, item) > 0 then
+        local id = string.sub(item, 1, 32)
+        redis.call('ZREM', KEYS[2], item)
+        redis.call('HDEL', KEYS[3], id)
+        redis.call('HDEL', KEYS[4], id)
+        acked = acked + 1
+    end
+end
+return acked
+"""
+
+# KEYS: deadlines, owners
+# ARGV: limit
+EXPIRED_OWNERS_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now_ms, 'LIMIT', 0, tonumber(ARGV[1]))
+local seen, owners = {}, {}
+for _, item in ipairs(expired) do
+    local owner = redis.call('HGET', KEYS[2], string.sub(item, 1, 32)) or ''
+    if not seen[owner] then
+        seen[owner] = true
+        owners[#owners + 1] = owner
+    end
+end
+return owners
+"""
+
+# KEYS: queue, deadlines, owners, deliveries, dead letters, and the processing
+# list whose expired items to reap, or none for the items without an owner
+# ARGV: limit, max deliveries (0 disables dead-lettering)
+REAP_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now_ms, 'LIMIT', 0, tonumber(ARGV[1]))
+local max_deliveries = tonumber(ARGV[2])
+local processing = KEYS[6] or false
+local requeued, dead = 0, 0
+for _, item in ipairs(expired) do
+    local id = string.sub(item, 1, 32)
+    if redis.call('HGET', KEYS[3], id) == processing then
+        if processing then
+            redis.call('LREM', processing, 1, item)
+        end
+        redis.call('ZREM', KEYS[2], item)
+        redis.call('HDEL', KEYS[3], id)
+        local deliveries = tonumber(redis.call('HGET', KEYS[4], id) or '0')
+        if max_deliveries > 0 and deliveries >= max_deliveries then
+            redis.call('HDEL', KEYS[4], id)
+            redis.call('RPUSH', KEYS[5], item)
+            dead = dead + 1
+        else
+            redis.call('LPUSH', KEYS[1], item)
+            requeued = requeued + 1
+        end
+    end
+end
+return {requeued, dead}
+"""
+
+# KEYS: processing, queue, deadlines, owners
+REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = #items, 1, -1 do
+    local item = items[i]
+    redis.call('ZREM', KEYS[3], item)
+    redis.call('HDEL', KEYS[4], string.sub(item, 1, 32))
+    redis.call('LPUSH', KEYS[2], item)
+end
+redis.call('DEL', KEYS[1])
+return #items
+"""
+
+
+class QueueMessage(NamedTuple):
+    id: str
+    value: Any
+    deliveries: int
+
+
+class RedisReliableQueue(RedisQueue):
+    """
+    A queue whose items survive consumer crashes.
+
+    get() atomically moves items into a per-consumer processing list with
+    LMOVE/BLMOVE and records a visibility deadline. Items stay there until
+    they are acknowledged with ack(). reap() puts items whose deadline
+    passed back at the head of the queue, or on the dead-letter list once
+    they were delivered max_deliveries times. Receiving and acknowledging
+    are each a single Lua script call, whatever the batch size; reaping
+    takes one more call per consumer holding expired items, as a script may
+    only touch the processing lists it is given.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        consumer_name: Optional[str] = None,
+        visibility_timeout: float = 30,
+        max_deliveries: int = 5,
+        host: str = 'localhost',
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        connection_pool: Optional[redis.ConnectionPool] = None,
+        client: Optional[redis.StrictRedis] = None,
+        codec: Optional[Codec] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the reliable queue.
+
+        Args:
+            name (str): The name of the queue.
+            consumer_name (str, optional): Names this consumer's processing list.
+                Defaults to '<hostname>:<pid>'.
+            visibility_timeout (float, optional): Seconds an item may stay unacknowledged
+                before reap() hands it to another consumer. Defaults to 30.
+            max_deliveries (int, optional): Deliveries after which an expired item is
+                dead-lettered instead of requeued. 0 never dead-letters. Defaults to 5.
+            host (str, optional): The Redis server host. Defaults to 'localhost'.
+            port (int, optional): The Redis server port. Defaults to 6379.
+            db (int, optional): The Redis database number. Defaults to 0.
+            password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
+        """
+        super().__init__(name, host, port, db, password, connection_pool, client, codec, instrumentation)
+        self.consumer_name = consumer_name or f'{socket.gethostname()}:{os.getpid()}'
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self._processing = self._processing_key(self.consumer_name)
+        self._deadlines = self._sub_key('deadlines')
+        self._owners = self._sub_key('owners')
+        self._deliveries = self._sub_key('deliveries')
+        self._dead = self._sub_key('dead')
+        self.scripts.register('reliable_queue.receive', RECEIVE_SCRIPT)
+        self.scripts.register('reliable_queue.ack', ACK_SCRIPT)
+        self.scripts.register('reliable_queue.expired_owners', EXPIRED_OWNERS_SCRIPT)
+        self.scripts.register('reliable_queue.reap', REAP_SCRIPT)
+        self.scripts.register('reliable_queue.requeue', REQUEUE_SCRIPT)
+        # id -> (item, local expiry) for messages this consumer received.
+        self._in_flight: 'OrderedDict[str, Tuple[bytes, float]]' = OrderedDict()
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_stop = threading.Event()
+
+    def _processing_key(self, consumer_name: str) -> str:
+        return self._sub_key(f'processing:{consumer_name}')
+
+    def _encode(self, value: Any) -> Tuple[str, bytes]:
+        id = uuid.uuid4().hex
+        return id, id.encode('ascii') + self._codec.dumps(value)
+
+    def set(self, value: Any) -> str:
+        """Push a value onto the queue and return its message id."""
+        id, item = self._encode(value)
+        self._conn.rpush(self._name, item)
+        return id
+
+    def set_many(self, values: Iterable[Any]) -> List[str]:
+        """Push many values with a single RPUSH and return their message ids."""
+        encoded = [self._encode(value) for value in values]
+        if encoded:
+            self._conn.rpush(self._name, *[item for _, item in encoded])
+        return [id for id, _ in encoded]
+
+    def get(self, block: Optional[float] = None) -> Optional[QueueMessage]:
+        """
+        Receive one message, or None when the queue is empty.
+
+        Args:
+            block (float, optional): Wait up to this many seconds for a message with
+                BLMOVE, or forever when 0. Defaults to None, which does not wait.
+        """
+        messages = self.get_many(1, block=block)
+        return messages[0] if messages else None
+
+    def get_many(self, count: int, block: Optional[float] = None) -> List[QueueMessage]:
+        """
+        Receive up to count messages in a single round trip.
+
+        Args:
+            count (int): The maximum number of messages to receive.
+            block (float, optional): When the queue is empty, wait up to this many
+                seconds for a message with BLMOVE, or forever when 0. Defaults to None,
+                which does not wait.
+        """
+        if count <= 0:
+            return []
+        keys = [self._name, self._processing, self._deadlines, self._owners, self._deliveries]
+        args = [count, int(self.visibility_timeout * 1000)]
+        if block is not None:
+            item = self._conn.blmove(self._name, self._processing, block, 'LEFT', 'RIGHT')
+            if item is None:
+                return []
+            # A crash before the script runs leaves the item in the processing
+            # list without a deadline; requeue_processing() recovers it.
+            args = [count - 1, args[1], item]
+        received = self._run_script('reliable_queue.receive', keys=keys, args=args)
+        return self._track(received)
+
+    def _track(self, received: List[Any]) -> List[QueueMessage]:
+        now = monotonic()
+        # Keep ids around for one extra visibility period so late acks still resolve.
+        expires_at = now + 2 * self.visibility_timeout
+        while self._in_flight:
+            id, (_, expiry) = next(iter(self._in_flight.items()))
+            if expiry > now:
+                break
+            del self._in_flight[id]
+        messages = []
+        for item, deliveries in zip(received[::2], received[1::2]):
+            id = item[:ID_LENGTH].decode('ascii')
+            self._in_flight[id] = (item, expires_at)
+            messages.append(QueueMessage(id, self._codec.loads(item[ID_LENGTH:]), int(deliveries)))
+        return messages
+
+    def ack(self, ids: Iterable[Union[str, QueueMessage]]) -> int:
+        """
+        Acknowledge messages received by this consumer with a single script call.
+
+        Returns how many were still owned by this consumer; a message whose
+        visibility timeout expired and that was reaped is not acknowledged.
+        """
+        items = []
+        for id in ids:
+            entry = self._in_flight.pop(id.id if isinstance(id, QueueMessage) else id, None)
+            if entry is not None:
+                items.append(entry[0])
+        if not items:
+            return 0
+        return self._run_script('reliable_queue.ack', keys=[self._processing, self._deadlines, self._owners, self._deliveries], args=items)
+
+    def reap(self, limit: int = 1000) -> Tuple[int, int]:
+        """
+        Requeue or dead-letter up to limit messages whose visibility timeout expired.
+
+        Returns the number of requeued and dead-lettered messages.
+        """
+        keys = [self._name, self._deadlines, self._owners, self._deliveries, self._dead]
+        owners = self._run_script('reliable_queue.expired_owners', keys=[self._deadlines, self._owners], args=[limit])
+        requeued = dead = 0
+        for owner in owners:
+            # Each consumer's processing list is reaped by its own call, which declares it.
+            counts = self._run_script('reliable_queue.reap', keys=keys + ([owner] if owner else []), args=[limit, self.max_deliveries])
+            requeued += counts[0]
+            dead += counts[1]
+        if requeued or dead:
+            logger.info(f'{self}: requeued {requeued} and dead-lettered {dead} expired messages')
+        return requeued, dead
+
+    def start_reaper(self, interval: float = 1.0) -> None:
+        """Run reap() every interval seconds on a background thread."""
+        if self._reaper is not None:
+            return
+        self._reaper_stop.clear()
+
+        def run():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    self.reap()
+                except redis.exceptions.RedisError as err:
+                    logger.error(f'{self}: reaper failed: {err}')
+
+        self._reaper = threading.Thread(target=run, name=f'reaper-{self._name}', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self) -> None:
+        """Stop the background reaper."""
+        if self._reaper is None:
+            return
+        self._reaper_stop.set()
+        self._reaper.join()
+        self._reaper = None
+
+    def requeue_processing(self, consumer_name: Optional[str] = None) -> int:
+        """Move every message held by a consumer, this one by default, back to the queue."""
+        processing = self._processing_key(consumer_name or self.consumer_name)
+        return self._run_script('reliable_queue.requeue', keys=[processing, self._name, self._deadlines, self._owners])
+
+    def get_all(self) -> List[Any]:
+        """Retrieve all values waiting in the queue."""
+        data = self._conn.lrange(self._name, 0, -1)
+        return [self._codec.loads(item[ID_LENGTH:]) for item in data]
+
+    def dead_letters(self) -> List[Any]:
+        """Retrieve all dead-lettered values."""
+        data = self._conn.lrange(self._dead, 0, -1)
+        return [self._codec.loads(item[ID_LENGTH:]) for item in data]
+
+    def in_flight(self) -> int:
+        """Get the number of received but unacknowledged messages across consumers."""
+        return self._conn.zcard(self._deadlines)
+
+    def clear(self) -> None:
+        """Clear the queue with its processing lists, bookkeeping and dead letters."""
+        keys = [self._name, self._deadlines, self._owners, self._deliveries, self._dead]
+        keys.extend(self._conn.scan_iter(match=escape_pattern(self._sub_key('processing:')) + '*'))
+        self._conn.delete(*keys)
+        self._in_flight.clear()
+
+    def __str__(self) -> str:
+        return f"RedisReliableQueue(name={self._name}, consumer={self.consumer_name})"
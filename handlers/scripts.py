@@ -0,0 +1,241 @@
+import hashlib
+import weakref
+import redis
+import redis.asyncio
+import redis.asyncio.cluster
+import redis.cluster
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+
+# Atomic operations the handlers build on. KEYS and ARGV are listed above each script.
+BUILTIN_SCRIPTS: Dict[str, str] = {
+    # KEYS: list; ARGV: count. LPOP with a count needs Redis 6.2.
+    'pop_head': """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+end
+return items
+""",
+    # KEYS: list; ARGV: count. RPOP with a count needs Redis 6.2.
+    'pop_tail': """
+local items = redis.call('LRANGE', KEYS[1], -tonumber(ARGV[1]), -1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], 0, -#items - 1)
+end
+local popped = {}
+for i = #items, 1, -1 do
+    popped[#popped + 1] = items[i]
+end
+return popped
+""",
+    # KEYS: source list, destination list; ARGV: count
+    'pop_push': """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    for i = 1, #items, 1000 do
+        redis.call('RPUSH', KEYS[2], unpack(items, i, math.min(i + 999, #items)))
+    end
+end
+return items
+""",
+    # KEYS: key; ARGV: value, ttl in ms or 0 for none
+    'get_set_ttl': """
+local previous = redis.call('GET', KEYS[1])
+if tonumber(ARGV[2]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return previous
+""",
+    # KEYS: key; ARGV: expected value
+    'compare_and_delete': """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""",
+    # KEYS: hash; ARGV: field, 1 if the field must be missing else 0, expected value, new value
+    'hash_compare_and_set': """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if ARGV[2] == '1' then
+    if current then
+        return 0
+    end
+elseif current ~= ARGV[3] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[4])
+return 1
+""",
+    # KEYS: list; ARGV: max length (positive), values
+    'push_capped': """
+for i = 2, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+return redis.call('LLEN', KEYS[1])
+""",
+    # KEYS: list; ARGV: value
+    'list_count': """
+local count = 0
+for _, item in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    if item == ARGV[1] then
+        count = count + 1
+    end
+end
+return count
+""",
+}
+
+
+class LuaScript(NamedTuple):
+    name: str
+    source: str
+    sha: str
+
+
+def _command_queue(client: Any) -> Optional[List[Any]]:
+    """
+    The list of commands a pipeline has queued, or None when the client runs commands at once.
+
+    Pipelines start a new list every time they execute, so the list also
+    identifies the round of commands a call is queued in.
+    """
+    # A Batch queues calls through a wrapper of its pipeline.
+    client = getattr(client, '_pipeline', client)
+    if isinstance(client, (redis.client.Pipeline, redis.asyncio.client.Pipeline)):
+        return client.command_stack
+    if isinstance(client, (redis.cluster.ClusterPipeline, redis.asyncio.cluster.ClusterPipeline)):
+        return client._execution_strategy._command_queue
+    return None
+
+
+class ScriptRegistry:
+    """
+    Named Lua scripts run with EVALSHA.
+
+    Scripts are sent to the server once and called by SHA afterwards. When
+    the server answers NOSCRIPT, because it restarted or its script cache
+    was flushed, the script is loaded again and the call retried. Every
+    registry starts with the built-in scripts.
+
+    A call queued on a pipeline, or recorded by a Batch, only fails with
+    NOSCRIPT once it executes, too late to load the script. So the first
+    time a script is queued in every round of a pipeline, i.e. between two
+    executions, the registry asks SCRIPT EXISTS through its own client and
+    loads the script when the server lost it.
+
+    Example:
+        queue.scripts.register('push_twice', "redis.call('RPUSH', KEYS[1], ARGV[1], ARGV[1])")
+        queue.scripts('push_twice', keys=[queue_name], args=['x'])
+    """
+
+    def __init__(self, client: Any, scripts: Optional[Mapping[str, str]] = None):
+        """
+        Initialize the registry.
+
+        Args:
+            client (redis.StrictRedis): Loads the scripts and runs calls made without
+                an explicit client.
+            scripts (Mapping[str, str], optional): Scripts to register besides the
+                built-in ones, by name. Defaults to None.
+        """
+        self._client = client
+        self._scripts: Dict[str, LuaScript] = {}
+        # pipeline -> (its command list when checked, the SHAs checked for that round)
+        self._checked: 'weakref.WeakKeyDictionary[Any, Tuple[List[Any], Set[str]]]' = weakref.WeakKeyDictionary()
+        for name, source in {**BUILTIN_SCRIPTS, **(scripts or {})}.items():
+            self.register(name, source)
+
+    def register(self, name: str, source: str) -> str:
+        """Register a script under a name, replacing any script of that name, and return its SHA."""
+        sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        self._scripts[name] = LuaScript(name, source, sha)
+        return sha
+
+    def get(self, name: str) -> LuaScript:
+        """Return a registered script."""
+        try:
+            return self._scripts[name]
+        except KeyError:
+            raise KeyError(f'no script named {name!r}') from None
+
+    def load(self, *names: str) -> None:
+        """Send scripts to the server now, every registered one when no names are given."""
+        for name in names or list(self._scripts):
+            self._client.script_load(self.get(name).source)
+
+    def _unchecked(self, script: LuaScript, client: Any, queue: List[Any]) -> bool:
+        """Tell whether a script still has to be checked before it is queued in this round of a pipeline."""
+        pipeline = getattr(client, '_pipeline', client)
+        checked_queue, checked = self._checked.get(pipeline, (None, set()))
+        if checked_queue is not queue:
+            checked = set()
+            self._checked[pipeline] = (queue, checked)
+        if script.sha in checked:
+            return False
+        checked.add(script.sha)
+        return True
+
+    def __call__(self, name: str, keys: Iterable[Any] = (), args: Iterable[Any] = (), client: Any = None) -> Any:
+        """
+        Run a script and return its reply.
+
+        Args:
+            name (str): The script's name.
+            keys (Iterable, optional): The keys it reads or writes. Defaults to none.
+            args (Iterable, optional): Its other arguments. Defaults to none.
+            client (optional): Runs the call instead of the registry's client, e.g. a
+                pipeline. Defaults to None.
+        """
+        script = self.get(name)
+        keys = list(keys)
+        client = self._client if client is None else client
+        queue = _command_queue(client)
+        if queue is not None:
+            if self._unchecked(script, client, queue) and not self._client.script_exists(script.sha)[0]:
+                self.load(name)
+            # Cluster pipelines refuse evalsha() but queue EVALSHA like any other command.
+            return client.execute_command('EVALSHA', script.sha, len(keys), *keys, *args)
+        try:
+            return client.evalsha(script.sha, len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            client.script_load(script.source)
+            return client.evalsha(script.sha, len(keys), *keys, *args)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._scripts
+
+    def __len__(self) -> int:
+        return len(self._scripts)
+
+    def __str__(self) -> str:
+        return f"ScriptRegistry(scripts={len(self._scripts)})"
+
+
+class AsyncScriptRegistry(ScriptRegistry):
+    """ScriptRegistry for asyncio clients."""
+
+    async def load(self, *names: str) -> None:
+        """Send scripts to the server now, every registered one when no names are given."""
+        for name in names or list(self._scripts):
+            await self._client.script_load(self.get(name).source)
+
+    async def __call__(self, name: str, keys: Iterable[Any] = (), args: Iterable[Any] = (), client: Any = None) -> Any:
+        """Run a script and return its reply. See ScriptRegistry.__call__()."""
+        script = self.get(name)
+        keys = list(keys)
+        client = self._client if client is None else client
+        queue = _command_queue(client)
+        if queue is not None:
+            if self._unchecked(script, client, queue) and not (await self._client.script_exists(script.sha))[0]:
+                await self.load(name)
+            return client.execute_command('EVALSHA', script.sha, len(keys), *keys, *args)
+        try:
+            return await client.evalsha(script.sha, len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            await client.script_load(script.source)
+            return await client.evalsha(script.sha, len(keys), *keys, *args)
@@ -1,4 +1,3 @@
-import json
 from typing import Any, List
 from handlers.interface import IRedis
 
@@ -6,16 +5,16 @@ from handlers.interface import IRedis
 class RedisSet(IRedis):
     def set(self, value: Any) -> None:
         """Add a value to the set."""
-        self._conn.sadd(self._name, json.dumps(value))
+        self._conn.sadd(self._name, self._codec.dumps(value))
 
     def get(self,) -> List[Any]:
         """Retrieve all values from the set."""
         data = self._conn.smembers(self._name)
-        return [json.loads(value.decode('utf-8')) for value in data]
+        return [self._codec.loads(value) for value in data]
 
     def delete(self, value: Any) -> None:
         """Remove a value from the set."""
-        self._conn.srem(self._name, json.dumps(value))
+        self._conn.srem(self._name, self._codec.dumps(value))
 
     def clear(self) -> None:
         """Clear the set."""
@@ -23,7 +22,7 @@ class RedisSet(IRedis):
 
     def exists(self, value: Any) -> bool:
         """Check if a value exists in the set."""
-        return self._conn.sismember(self._name, json.dumps(value))
+        return self._conn.sismember(self._name, self._codec.dumps(value))
     
     def size(self) -> int:
         """Get the size of the set."""
@@ -0,0 +1,369 @@
+import bisect
+import hashlib
+import logging
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, TypeVar, Union
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
+from handlers.key_value import RedisKeyValue
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class HashRing:
+    """
+    Consistent hash ring assigning keys to nodes.
+
+    Every node is placed on the ring as many virtual nodes, replicas times
+    its weight, so keys spread evenly and adding or removing a node only
+    moves the keys of its share of the ring. Positions come from MD5, so
+    every process maps a key to the same node.
+    """
+
+    def __init__(self, nodes: Union[Iterable[str], Mapping[str, int]] = (), replicas: int = 160):
+        """
+        Initialize the ring.
+
+        Args:
+            nodes (Iterable[str] or Mapping[str, int], optional): The node names, or
+                node names mapped to integer weights. Defaults to no nodes.
+            replicas (int, optional): Virtual nodes per unit of weight. Defaults to 160.
+        """
+        if replicas <= 0:
+            raise ValueError('replicas must be positive')
+        self.replicas = replicas
+        self._weights: Dict[str, int] = {}
+        self._positions: List[int] = []
+        self._owners: List[str] = []
+        self._lock = threading.Lock()
+        weights = nodes.items() if isinstance(nodes, Mapping) else ((node, 1) for node in nodes)
+        for node, weight in weights:
+            self.add_node(node, weight)
+
+    @staticmethod
+    def _position(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def _rebuild(self) -> None:
+        ring = sorted(
+            (self._position(f'{node}#{index}'), node)
+            for node, weight in self._weights.items()
+            for index in range(self.replicas * weight)
+        )
+        # Swap both lists at once so concurrent lookups see a consistent ring.
+        self._positions, self._owners = [position for position, _ in ring], [node for _, node in ring]
+
+    def add_node(self, node: str, weight: int = 1) -> None:
+        """Add a node holding a share of the keys proportional to its weight."""
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+        with self._lock:
+            if node in self._weights:
+                raise ValueError(f'{node} is already on the ring')
+            self._weights[node] = weight
+            self._rebuild()
+
+    def remove_node(self, node: str) -> None:
+        """Remove a node; its keys go to the nodes that follow it on the ring."""
+        with self._lock:
+            if self._weights.pop(node, None) is None:
+                raise KeyError(node)
+            self._rebuild()
+
+    def get_node(self, key: str) -> str:
+        """Return the node a key belongs to."""
+        positions, owners = self._positions, self._owners
+        if not positions:
+            raise LookupError('the ring has no nodes')
+        index = bisect.bisect(positions, self._position(key))
+        return owners[index % len(owners)]
+
+    def group(self, keys: Iterable[T], key: Callable[[T], str] = str) -> Dict[str, List[T]]:
+        """Split items by the node their key belongs to, keeping their order."""
+        groups: Dict[str, List[T]] = {}
+        for item in keys:
+            groups.setdefault(self.get_node(key(item)), []).append(item)
+        return groups
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._weights)
+
+    def __contains__(self, node: object) -> bool:
+        return node in self._weights
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def __str__(self) -> str:
+        return f"HashRing(nodes={len(self._weights)}, replicas={self.replicas})"
+
+
+def routing_key(key: str) -> str:
+    """
+    Return the part of a key that decides its shard.
+
+    Like Redis Cluster, only the hash tag is used when the key has one, so
+    'user:{42}:profile' and 'user:{42}:settings' always share a shard.
+    """
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class ShardedKeyValue:
+    """
+    A RedisKeyValue spread over several Redis servers.
+
+    Keys are assigned to servers with a HashRing, so adding or removing a
+    server only moves the keys of its share of the ring. Single-key calls
+    go to one server; bulk calls are split per server and the parts run in
+    parallel on an executor. Keys with a hash tag, e.g. 'cart:{42}:items',
+    are placed by the tag only.
+
+    Example:
+        sessions = ShardedKeyValue('sessions', ['redis-a:6379', 'redis-b:6379', 'redis-c:6379'])
+        sessions.set_many({'u1': {...}, 'u2': {...}}, ttl=3600)
+        sessions.get_many(['u1', 'u2'])
+    """
+
+    def __init__(
+        self,
+        name: str,
+        nodes: Union[Iterable[str], Mapping[str, int]],
+        replicas: int = 160,
+        db: int = 0,
+        password: str = None,
+        codec: Optional[Codec] = None,
+        executor: Optional[Executor] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        """
+        Initialize the sharded key-value store.
+
+        Args:
+            name (str): The namespace prepended to every key.
+            nodes (Iterable[str] or Mapping[str, int]): The servers as 'host:port',
+                or mapped to integer weights. The names place the servers on the ring,
+                so every process must use the same ones.
+            replicas (int, optional): Virtual nodes per unit of weight. Defaults to 160.
+            db (int, optional): The Redis database number on every server. Defaults to 0.
+            password (str, optional): The Redis password of every server. Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            executor (Executor, optional): Runs the per-server parts of bulk calls. It is
+                not shut down by close(). Defaults to a thread pool created on first use.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings of every shard. Defaults to the default instrumentation.
+        """
+        self._name = name
+        self._db = db
+        self._password = password
+        self._codec = codec
+        self._instrumentation = instrumentation
+        self._ring = HashRing(nodes, replicas)
+        self._shards: Dict[str, RedisKeyValue] = {node: self._open(node) for node in self._ring.nodes}
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._lock = threading.Lock()
+
+    def _open(self, node: str) -> RedisKeyValue:
+        host, _, port = node.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"{node!r} is not a 'host:port' address")
+        return RedisKeyValue(
+            self._name, host=host, port=int(port), db=self._db, password=self._password,
+            codec=self._codec, instrumentation=self._instrumentation
+        )
+
+    def _shard(self, key: str) -> RedisKeyValue:
+        return self._shards[self._ring.get_node(routing_key(key))]
+
+    def _run(self, function: Callable[[RedisKeyValue, T], Any], parts: Mapping[str, T]) -> List[Any]:
+        """Call function(shard, part) for every shard's part, in parallel when there are several."""
+        if len(parts) <= 1:
+            return [function(self._shards[node], part) for node, part in parts.items()]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self._shards), thread_name_prefix=f'shards-{self._name}')
+            executor = self._executor
+        futures = [executor.submit(function, self._shards[node], part) for node, part in parts.items()]
+        return [future.result() for future in futures]
+
+    def _resize_executor(self) -> None:
+        """Drop the executor this store created, so the next bulk call gets one thread per server again."""
+        with self._lock:
+            if not self._owns_executor or self._executor is None:
+                return
+            executor, self._executor = self._executor, None
+        # Calls already submitted still run.
+        executor.shutdown(wait=False)
+
+    def shard_for(self, key: str) -> str:
+        """Return the 'host:port' of the server holding a key."""
+        return self._ring.get_node(routing_key(key))
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Set a key-value pair with an optional TTL."""
+        self._shard(key).set(key, value, ttl)
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Set a key only if it does not exist yet, and tell whether it was set."""
+        return self._shard(key).set_if_absent(key, value, ttl)
+
+    def get_set(self, key: str, value: Any, ttl: Optional[int] = None) -> Any:
+        """Set a key and return its previous value, atomically."""
+        return self._shard(key).get_set(key, value, ttl)
+
+    def set_many(self, mapping: Mapping[str, Any], ttl: Optional[int] = None, chunk_size: int = 1000) -> None:
+        """Set many key-value pairs, writing to every server in parallel."""
+        parts = {
+            node: dict(items)
+            for node, items in self._ring.group(mapping.items(), key=lambda item: routing_key(item[0])).items()
+        }
+        self._run(lambda shard, part: shard.set_many(part, ttl, chunk_size), parts)
+
+    def get(self, key: str) -> Any:
+        """Get a value by key."""
+        return self._shard(key).get(key)
+
+    def get_many(self, keys: Iterable[str], chunk_size: int = 1000) -> Dict[str, Any]:
+        """Get many values, reading from every server in parallel. Missing keys are left out."""
+        data = {}
+        for part in self._run(lambda shard, part: shard.get_many(part, chunk_size), self._ring.group(keys, key=routing_key)):
+            data.update(part)
+        return data
+
+    def iter_keys(self, count: int = 1000) -> Iterator[str]:
+        """Iterate over the keys of every server, one server after the other."""
+        for shard in list(self._shards.values()):
+            yield from shard.iter_keys(count)
+
+    def iter_items(self, count: int = 1000) -> Iterator[Tuple[str, Any]]:
+        """Iterate over the key-value pairs of every server, one server after the other."""
+        for shard in list(self._shards.values()):
+            yield from shard.iter_items(count)
+
+    def get_all(self, count: int = 1000) -> Dict[str, Any]:
+        """Retrieve all key-value pairs, reading from every server in parallel."""
+        data = {}
+        for part in self._run(lambda shard, _: shard.get_all(count), dict.fromkeys(self._shards)):
+            data.update(part)
+        return data
+
+    def delete(self, key: str) -> None:
+        """Delete a key-value pair."""
+        self._shard(key).delete(key)
+
+    def delete_if_equals(self, key: str, value: Any) -> bool:
+        """Delete a key only if it holds value, atomically, and tell whether it did."""
+        return self._shard(key).delete_if_equals(key, value)
+
+    def delete_many(self, keys: Iterable[str], chunk_size: int = 1000) -> int:
+        """Delete many keys on every server in parallel and return how many existed."""
+        return sum(self._run(lambda shard, part: shard.delete_many(part, chunk_size), self._ring.group(keys, key=routing_key)))
+
+    def exists(self, key: str) -> bool:
+        """Check if a key exists."""
+        return self._shard(key).exists(key)
+
+    def clear(self, count: int = 1000) -> None:
+        """Clear the namespace on every server in parallel."""
+        self._run(lambda shard, _: shard.clear(count), dict.fromkeys(self._shards))
+
+    def add_node(self, node: str, weight: int = 1, migrate: bool = True) -> int:
+        """
+        Add a server to the ring.
+
+        With migrate, the keys that now belong to the new server are moved
+        to it. Moving is not atomic: writes to those keys while it runs may
+        be lost, so add servers while writes are paused.
+
+        Returns the number of moved keys.
+        """
+        if node in self._ring:
+            raise ValueError(f'{node} is already on the ring')
+        # Register the shard first, so lookups never find a node without one.
+        self._shards[node] = self._open(node)
+        self._ring.add_node(node, weight)
+        self._resize_executor()
+        if not migrate:
+            return 0
+        others = {name: None for name in self._shards if name != node}
+        return sum(self._run(lambda source, _: self._migrate(source), others))
+
+    def remove_node(self, node: str, migrate: bool = True) -> int:
+        """
+        Remove a server from the ring.
+
+        With migrate, its keys are first moved to the servers that now own
+        them, with the same caveat as add_node().
+
+        Returns the number of moved keys.
+        """
+        if node not in self._ring:
+            raise KeyError(node)
+        if len(self._ring) == 1:
+            raise ValueError('cannot remove the last server')
+        self._ring.remove_node(node)
+        shard = self._shards.pop(node)
+        self._resize_executor()
+        return self._migrate(shard) if migrate else 0
+
+    def rebalance(self, count: int = 1000) -> int:
+        """Move every key stored on a server that does not own it, e.g. after add_node(migrate=False)."""
+        return sum(self._run(lambda source, _: self._migrate(source, count), dict.fromkeys(self._shards)))
+
+    def _migrate(self, source: RedisKeyValue, count: int = 1000) -> int:
+        """
+        Move the keys of source that belong to another server, keeping their TTLs.
+
+        Keys are copied with DUMP and RESTORE, so keys of any type move, not
+        only the strings the store writes itself.
+        """
+        prefix_length = len(self._name) + 1
+        moved = 0
+        for chunk in source._scan_chunks(count):
+            targets = self._ring.group(chunk, key=lambda key_name: routing_key(key_name.decode('utf-8')[prefix_length:]))
+            targets = {node: key_names for node, key_names in targets.items() if self._shards[node] is not source}
+            for node, key_names in targets.items():
+                pipeline = source._conn.pipeline(transaction=False)
+                for key_name in key_names:
+                    pipeline.dump(key_name)
+                    pipeline.pttl(key_name)
+                replies = pipeline.execute()
+                pipeline = self._shards[node]._conn.pipeline(transaction=False)
+                for key_name, payload, ttl in zip(key_names, replies[::2], replies[1::2]):
+                    # The key expired or was deleted since it was scanned, or is expiring now;
+                    # only a PTTL of -1 means it has no TTL.
+                    if payload is not None and (ttl > 0 or ttl == -1):
+                        pipeline.restore(key_name, max(ttl, 0), payload, replace=True)
+                moved += len(pipeline.execute())
+                source._conn.delete(*key_names)
+        if moved:
+            logger.info(f'{self}: moved {moved} keys to the servers that own them')
+        return moved
+
+    def close(self) -> None:
+        """Shut down the executor this store created."""
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self) -> 'ShardedKeyValue':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def __str__(self) -> str:
+        return f"ShardedKeyValue(name={self._name}, nodes={len(self._shards)})"
@@ -1,26 +1,181 @@
-import json
-from typing import Any, List
+import redis
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 from handlers.interface import IRedis
+from handlers.utils import chunked, is_unsupported_command
 
 
 class RedisSortedSet(IRedis):
+    _zrange_by_supported = True
+
     def set(self, value: Any, score: float) -> None:
         """Add a value with a score to the sorted set."""
-        self._conn.zadd(self._name, {json.dumps(value): float(score)})
+        self._conn.zadd(self._name, {self._codec.dumps(value): float(score)})
+
+    def add_many(
+        self,
+        items: Union[Iterable[Tuple[Any, float]], Mapping[Any, float]],
+        nx: bool = False,
+        xx: bool = False,
+        gt: bool = False,
+        lt: bool = False,
+        chunk_size: int = 1000
+    ) -> int:
+        """
+        Add many values with one ZADD per chunk and return how many were new.
+
+        Args:
+            items (Iterable[Tuple[Any, float]] or Mapping): (value, score) pairs, or a
+                mapping for hashable values.
+            nx (bool, optional): Only add new values, never update scores. Defaults to False.
+            xx (bool, optional): Only update existing values. Defaults to False.
+            gt (bool, optional): Only update a score when the new one is greater,
+                as for a high score. Defaults to False.
+            lt (bool, optional): Only update a score when the new one is lower.
+                Defaults to False.
+            chunk_size (int, optional): Values per ZADD. Defaults to 1000.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+        pipeline = self._conn.pipeline(transaction=False)
+        for chunk in chunked(items, chunk_size):
+            mapping = {self._codec.dumps(value): float(score) for value, score in chunk}
+            pipeline.zadd(self._name, mapping, nx=nx, xx=xx, gt=gt, lt=lt)
+        return sum(pipeline.execute())
+
+    def incr(self, value: Any, amount: float = 1.0) -> float:
+        """Atomically add amount to the score of a value, adding it if missing, and return the new score."""
+        return self._conn.zincrby(self._name, amount, self._codec.dumps(value))
 
     def get(self, value: Any) -> Any:
         """Get the score of a value."""
-        score = self._conn.zscore(self._name, json.dumps(value))
+        score = self._conn.zscore(self._name, self._codec.dumps(value))
         return score
-    
-    def get_by_score(self, start: int = 0, end: int = -1) -> List[Any]:
-        """Retrieve values within a score range."""
-        data = self._conn.zrange(self._name, start, end)
-        return [json.loads(value.decode('utf-8')) for value in data]
-    
+
+    def _decode_range(self, data: List[Any], with_scores: bool) -> List[Any]:
+        if with_scores:
+            return [(self._codec.loads(value), score) for value, score in data]
+        return [self._codec.loads(value) for value in data]
+
+    def _range_by(
+        self,
+        by: str,
+        low: Any,
+        high: Any,
+        offset: Optional[int],
+        count: Optional[int],
+        with_scores: bool,
+        desc: bool
+    ) -> List[Any]:
+        if offset is None and count is not None:
+            offset = 0
+        if offset is not None and count is None:
+            count = -1
+        # With REV the range is given from high to low.
+        start, end = (high, low) if desc else (low, high)
+        if self._zrange_by_supported:
+            try:
+                return self._conn.zrange(
+                    self._name, start, end, desc=desc, withscores=with_scores,
+                    byscore=by == 'score', bylex=by == 'lex', offset=offset, num=count
+                )
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err) and 'syntax error' not in str(err).lower():
+                    raise
+                self._zrange_by_supported = False
+        # Before Redis 6.2: the dedicated range commands.
+        if by == 'lex':
+            command = self._conn.zrevrangebylex if desc else self._conn.zrangebylex
+            return command(self._name, start, end, start=offset, num=count)
+        command = self._conn.zrevrangebyscore if desc else self._conn.zrangebyscore
+        return command(self._name, start, end, start=offset, num=count, withscores=with_scores)
+
+    def get_by_score(
+        self,
+        min: Union[float, str] = '-inf',
+        max: Union[float, str] = '+inf',
+        offset: Optional[int] = None,
+        count: Optional[int] = None,
+        with_scores: bool = False,
+        desc: bool = False
+    ) -> List[Any]:
+        """
+        Retrieve values whose score is within a range, with ZRANGE BYSCORE.
+
+        Args:
+            min (float or str, optional): The lowest score. Prefix it with '(' to
+                exclude it. Defaults to '-inf'.
+            max (float or str, optional): The highest score. Defaults to '+inf'.
+            offset (int, optional): Matches to skip, for pagination. Defaults to None.
+            count (int, optional): The maximum number of values. Defaults to None.
+            with_scores (bool, optional): Return (value, score) pairs. Defaults to False.
+            desc (bool, optional): Highest scores first. Defaults to False.
+        """
+        data = self._range_by('score', min, max, offset, count, with_scores, desc)
+        return self._decode_range(data, with_scores)
+
+    def get_by_lex(
+        self,
+        min: Any = None,
+        max: Any = None,
+        min_inclusive: bool = True,
+        max_inclusive: bool = True,
+        offset: Optional[int] = None,
+        count: Optional[int] = None,
+        desc: bool = False
+    ) -> List[Any]:
+        """
+        Retrieve values within a range of their encoded bytes, with ZRANGE BYLEX.
+
+        Only meaningful when every value has the same score. The bounds are
+        values and are encoded with the codec; None leaves that end open.
+        """
+        low = '-' if min is None else (b'[' if min_inclusive else b'(') + self._codec.dumps(min)
+        high = '+' if max is None else (b'[' if max_inclusive else b'(') + self._codec.dumps(max)
+        data = self._range_by('lex', low, high, offset, count, False, desc)
+        return self._decode_range(data, False)
+
+    def rank(self, value: Any, desc: bool = True) -> Optional[int]:
+        """Return the 0-based rank of a value, highest score first unless desc is False."""
+        element = self._codec.dumps(value)
+        return self._conn.zrevrank(self._name, element) if desc else self._conn.zrank(self._name, element)
+
+    def top(self, k: int = 10, desc: bool = True) -> List[Tuple[int, Any, float]]:
+        """Return the first k entries as (rank, value, score), highest score first unless desc is False."""
+        if k <= 0:
+            return []
+        data = self._conn.zrange(self._name, 0, k - 1, desc=desc, withscores=True)
+        return [(rank, self._codec.loads(value), score) for rank, (value, score) in enumerate(data)]
+
+    def around(self, value: Any, radius: int = 5, desc: bool = True) -> List[Tuple[int, Any, float]]:
+        """
+        Return the entries ranked up to radius places above and below a value.
+
+        Entries are (rank, value, score), highest score first unless desc
+        is False. Empty when the value is not in the set.
+        """
+        rank = self.rank(value, desc=desc)
+        if rank is None:
+            return []
+        start = max(rank - radius, 0)
+        data = self._conn.zrange(self._name, start, rank + radius, desc=desc, withscores=True)
+        return [(start + offset, self._codec.loads(member), score) for offset, (member, score) in enumerate(data)]
+
+    def iter(self, match: Optional[str] = None, count: int = 1000) -> Iterator[Tuple[Any, float]]:
+        """
+        Lazily yield every (value, score) with ZSCAN, in no particular order.
+
+        match is a glob pattern applied to the encoded values.
+        """
+        for value, score in self._conn.zscan_iter(self._name, match=match, count=count):
+            yield self._codec.loads(value), score
+
+    def size(self) -> int:
+        """Get the number of values in the sorted set."""
+        return self._conn.zcard(self._name)
+
     def delete(self, value: Any) -> None:
         """Remove a value from the sorted set."""
-        self._conn.zrem(self._name, json.dumps(value))
+        self._conn.zrem(self._name, self._codec.dumps(value))
 
     def clear(self) -> None:
         """Clear the sorted set."""
@@ -28,12 +183,12 @@ class RedisSortedSet(IRedis):
 
     def exists(self, value: Any) -> bool:
         """Check if a value exists in the sorted set."""
-        return self._conn.zscore(self._name, json.dumps(value)) is not None
-    
+        return self._conn.zscore(self._name, self._codec.dumps(value)) is not None
+
     def get_all(self) -> Any:
         """Retrieve all values from the sorted set."""
         data = self._conn.zrange(self._name, 0, -1)
-        return [json.loads(value.decode('utf-8')) for value in data]
-    
+        return [self._codec.loads(value) for value in data]
+
     def __str__(self) -> str:
-        return f"RedisSortedSet(name={self._name})"
\ No newline at end of file
+        return f"RedisSortedSet(name={self._name})"
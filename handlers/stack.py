@@ -1,38 +1,85 @@
-import json
-from typing import Any, List
+import redis
+from typing import Any, List, Optional
 from .interface import IRedis
+from .utils import is_unsupported_command
 
 
 class RedisStack(IRedis):
+    _pop_count_supported = True
+    _blmpop_supported = True
+
     def set(self, value: Any) -> None:
         """Push a value onto the stack."""
-        self._conn.rpush(self._name, json.dumps(value))
+        self._conn.rpush(self._name, self._codec.dumps(value))
 
-    def get(self) -> Any:
-        """Pop a value from the stack."""
-        byte_data = self._conn.rpop(self._name)
-        return json.loads(byte_data) if byte_data else None
+    def get(self, block: Optional[float] = None) -> Any:
+        """
+        Pop a value from the stack.
 
-    def get_many(self, count: int) -> List[Any]:
-        """Pop multiple values from the stack."""
-        data = []
-        for _ in range(count):
+        Args:
+            block (float, optional): Wait up to this many seconds for a value with
+                BRPOP, or forever when 0. Defaults to None, which does not wait.
+        """
+        if block is None:
             byte_data = self._conn.rpop(self._name)
-            if byte_data:
-                data.append(json.loads(byte_data))
-            else:
-                break
-        return data
+        else:
+            popped = self._conn.brpop([self._name], timeout=block)
+            byte_data = popped[1] if popped else None
+        return self._codec.loads(byte_data) if byte_data else None
+
+    def get_many(self, count: int, block: Optional[float] = None) -> List[Any]:
+        """
+        Pop up to count values from the stack in a single round trip.
+
+        Args:
+            count (int): The maximum number of values to pop.
+            block (float, optional): When the stack is empty, wait up to this many
+                seconds for values with BLMPOP, or forever when 0. Defaults to None,
+                which does not wait.
+        """
+        if count <= 0:
+            return []
+        if block is not None:
+            return self._blocking_pop_many(count, block)
+        return [self._codec.loads(value) for value in self._pop_many(count)]
+
+    def _pop_many(self, count: int) -> List[bytes]:
+        if count <= 0:
+            return []
+        if self._pop_count_supported:
+            try:
+                return self._conn.rpop(self._name, count) or []
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._pop_count_supported = False
+        # Before Redis 6.2: pop atomically with a script.
+        return self._run_script('pop_tail', keys=[self._name], args=[count])
+
+    def _blocking_pop_many(self, count: int, block: float) -> List[Any]:
+        if self._blmpop_supported:
+            try:
+                popped = self._conn.blmpop(block, 1, self._name, direction='RIGHT', count=count)
+                return [self._codec.loads(value) for value in popped[1]] if popped else []
+            except redis.exceptions.ResponseError as err:
+                if not is_unsupported_command(err):
+                    raise
+                self._blmpop_supported = False
+        # Before Redis 7: wait for the first value, then take what else is there.
+        popped = self._conn.brpop([self._name], timeout=block)
+        if not popped:
+            return []
+        return [self._codec.loads(value) for value in [popped[1]] + self._pop_many(count - 1)]
 
     def get_all(self) -> List[Any]:
         """Retrieve all values from the stack."""
         data = self._conn.lrange(self._name, 0, -1)
-        return [json.loads(value.decode('utf-8')) for value in data]
-    
+        return [self._codec.loads(value) for value in data]
+
     def clear(self) -> None:
         """Clear the stack."""
         self._conn.delete(self._name)
-    
+
     def size(self) -> int:
         """Get the size of the stack."""
         return self._conn.llen(self._name)
@@ -42,4 +89,4 @@ class RedisStack(IRedis):
         return self.size() == 0
 
     def __str__(self) -> str:
-        return f"RedisStack(name={self._name})"
\ No newline at end of file
+        return f"RedisStack(name={self._name})"
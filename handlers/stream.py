@@ -1,6 +1,13 @@
+import logging
 import redis
-from typing import Any
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+from handlers.codec import Codec
+from handlers.instrumentation import Instrumentation
 from handlers.interface import IRedis
+from handlers.utils import chunked
+
+
+logger = logging.getLogger(__name__)
 
 
 class RedisStream(IRedis):
@@ -12,7 +19,15 @@ class RedisStream(IRedis):
             host: str = 'localhost', 
             port: int = 6379, 
             db: int = 0, 
-            password: str = None
+            password: str = None,
+            connection_pool: Optional[redis.ConnectionPool] = None,
+            client: Optional[redis.StrictRedis] = None,
+            codec: Optional[Codec] = None,
+            encode_values: bool = False,
+            maxlen: Optional[int] = None,
+            minid: Optional[str] = None,
+            approximate: bool = True,
+            instrumentation: Optional[Instrumentation] = None
         ):
         """
         Initialize the Redis stream handler.
@@ -25,10 +40,33 @@ class RedisStream(IRedis):
             port (int, optional): The Redis server port. Defaults to 6379.
             db (int, optional): The Redis database number. Defaults to 0.
             password (str, optional): The Redis password. Defaults to None.
+            connection_pool (redis.ConnectionPool, optional): An existing pool to use
+                instead of the shared one. Defaults to None.
+            client (redis.StrictRedis, optional): An existing client to use as is.
+                Defaults to None.
+            codec (Codec, optional): Serializes stored values. Defaults to JSONCodec.
+            encode_values (bool, optional): Encode every field value with the codec on
+                write and decode it on read, so nested values survive. Fields of
+                messages read back are then str. Defaults to False, which stores
+                values as given, as earlier versions did.
+            maxlen (int, optional): Trim the stream to about this many entries on every
+                write. Defaults to None.
+            minid (str, optional): Trim entries older than this ID on every write.
+                Defaults to None.
+            approximate (bool, optional): Trim with '~', letting Redis drop whole
+                macro nodes only, which is much cheaper. Defaults to True.
+            instrumentation (Instrumentation, optional): Receives call, command and codec
+                timings. Defaults to the default instrumentation.
         """
-        super().__init__(name, host, port, db, password)
+        if maxlen is not None and minid is not None:
+            raise ValueError('Only one of maxlen and minid can be given')
+        super().__init__(name, host, port, db, password, connection_pool, client, codec, instrumentation)
         self.consumer_name = consumer_name
         self.group_name = group_name
+        self._encode_values = encode_values
+        self._maxlen = maxlen
+        self._minid = minid
+        self._approximate = approximate
         self._create_consumer_group()
     
     def _create_consumer_group(self):
@@ -40,13 +78,65 @@ class RedisStream(IRedis):
             else:
                 raise e
         
+    def _encode(self, value: Mapping[str, Any]) -> Mapping[str, Any]:
+        if not self._encode_values:
+            return value
+        return {field: self._codec.dumps(field_value) for field, field_value in value.items()}
+
+    def _decode(self, message: Optional[Dict[bytes, bytes]]) -> Any:
+        if not self._encode_values or message is None:
+            return message
+        return {field.decode('utf-8'): self._codec.loads(field_value) for field, field_value in message.items()}
+
+    def _xadd(self, client: redis.StrictRedis, value: Mapping[str, Any]) -> Any:
+        return client.xadd(
+            self._name,
+            self._encode(value),
+            maxlen=self._maxlen,
+            minid=self._minid,
+            approximate=self._approximate
+        )
+
     def set(self, value: Any) -> None:
         """Add a message to the stream."""
-        message_id = self._conn.xadd(self._name, value)
+        message_id = self._xadd(self._conn, value)
         return message_id
-    
-    def get(self, count=1, block=1000) -> Any:
-        """Retrieve messages from the stream."""
+
+    def add_many(self, messages: Iterable[Mapping[str, Any]], chunk_size: int = 1000) -> List[Any]:
+        """
+        Add many messages with one pipelined round trip per chunk and return their IDs.
+
+        Args:
+            messages (Iterable[Mapping[str, Any]]): The messages, in order.
+            chunk_size (int, optional): XADDs per pipeline. Defaults to 1000.
+        """
+        ids = []
+        for chunk in chunked(messages, chunk_size):
+            pipeline = self._conn.pipeline(transaction=False)
+            for value in chunk:
+                self._xadd(pipeline, value)
+            ids.extend(pipeline.execute())
+        return ids
+
+    def _format(self, messages: List[Any]) -> Dict[str, Any]:
+        return {
+            'stream': self._name,
+            'datas': [{'id': message_id, 'data': self._decode(message)} for message_id, message in messages]
+        }
+
+    def get(self, count=1, block=1000, auto_ack: bool = False) -> Any:
+        """
+        Retrieve messages from the stream.
+
+        Messages stay pending in the consumer group until they are acknowledged
+        with ack(), so a consumer that dies mid-batch leaves them for recover().
+
+        Args:
+            count (int, optional): The maximum number of messages. Defaults to 1.
+            block (int, optional): Milliseconds to wait for messages. Defaults to 1000.
+            auto_ack (bool, optional): Acknowledge every returned message right away
+                with a single XACK. Defaults to False.
+        """
         messages = self._conn.xreadgroup(
             groupname=self.group_name,
             consumername=self.consumer_name,
@@ -54,20 +144,68 @@ class RedisStream(IRedis):
             count=count,
             block=block
         )
-        data = {
-            'stream': self._name,
-            'datas': []
-        }
-        if messages:
-            messages = messages[0][1]
-            for message_id, message in messages:
-                data['datas'].append({
-                    'id': message_id,
-                    'data': message
-                })
-                self.ack_message(message_id)
+        data = self._format(messages[0][1] if messages else [])
+        if auto_ack:
+            self.ack(message['id'] for message in data['datas'])
         return data
 
+    def consume(self, callback: Callable[[Dict[str, Any]], None], count: int = 10, block: int = 1000) -> int:
+        """
+        Read a batch of messages, pass each one to callback and acknowledge the ones it handled.
+
+        Messages whose callback raised stay pending for a later recover().
+        The successful ones are acknowledged together with a single XACK.
+        Returns the number of acknowledged messages.
+        """
+        handled = []
+        for message in self.get(count=count, block=block)['datas']:
+            try:
+                callback(message)
+            except Exception as err:
+                logger.error(f'{self}: message {message["id"]} failed: {err}')
+            else:
+                handled.append(message['id'])
+        return self.ack(handled)
+
+    def recover(self, min_idle_time: int, count: int = 100) -> Dict[str, Any]:
+        """
+        Claim messages other consumers left pending for at least min_idle_time milliseconds.
+
+        Uses XAUTOCLAIM, so the whole pending list is scanned server-side in
+        pages. The claimed messages are returned like get() returns new ones
+        and must be acknowledged the same way.
+        """
+        claimed = []
+        start_id = '0-0'
+        while len(claimed) < count:
+            response = self._conn.xautoclaim(
+                self._name,
+                self.group_name,
+                self.consumer_name,
+                min_idle_time,
+                start_id=start_id,
+                count=count - len(claimed)
+            )
+            start_id, messages = response[0], response[1]
+            # Entries deleted from the stream while pending come back empty.
+            claimed.extend(message for message in messages if message[1] is not None)
+            if start_id in (b'0-0', '0-0'):
+                break
+        return self._format(claimed)
+
+    def pending(self) -> Dict[str, Any]:
+        """Summarize the group's pending messages: total, ID range and count per consumer."""
+        summary = self._conn.xpending(self._name, self.group_name)
+        return {
+            'pending': summary['pending'],
+            'min': summary['min'],
+            'max': summary['max'],
+            'consumers': {
+                consumer['name'].decode('utf-8'): consumer['pending']
+                for consumer in summary['consumers']
+            }
+        }
+
     def delete(self, id: str) -> None:
         """Delete a message from the stream."""
         self._conn.xdel(self._name, id)
@@ -80,5 +218,12 @@ class RedisStream(IRedis):
         """Acknowledge a message."""
         self._conn.xack(self._name, self.group_name, id)
 
+    def ack(self, ids: Iterable[str]) -> int:
+        """Acknowledge many messages with a single XACK and return how many were pending."""
+        ids = list(ids)
+        if not ids:
+            return 0
+        return self._conn.xack(self._name, self.group_name, *ids)
+
     def __str__(self) -> str:
         return f"RedisStream(name={self._name})"
@@ -0,0 +1,262 @@
+import time
+import logging
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+from handlers.stream import RedisStream
+
+
+logger = logging.getLogger(__name__)
+
+
+class StreamConsumer:
+    """
+    Runs a handler over a RedisStream consumer group with a pool of workers.
+
+    A fetcher thread keeps up to prefetch messages in flight, reading them
+    with XREADGROUP COUNT n so a burst costs one round trip, and hands each
+    one to the executor. Messages whose handler returned are acknowledged
+    in batches by an acker thread; messages whose handler raised stay
+    pending and can be recovered later. When prefetch messages are in
+    flight the fetcher stops reading, which is the backpressure. Messages
+    claimed from idle consumers are skipped while this consumer still holds
+    them, handled or not, until they are acknowledged, so a slow handler
+    does not get its own message twice.
+
+    Example:
+        consumer = StreamConsumer(stream, handle_order, workers=8)
+        consumer.start()
+        ...
+        consumer.stop()
+    """
+
+    def __init__(
+        self,
+        stream: RedisStream,
+        handler: Callable[[Dict[str, Any]], Any],
+        workers: int = 4,
+        executor: Union[str, Executor] = 'thread',
+        prefetch: int = 100,
+        batch_size: int = 50,
+        block: int = 1000,
+        ack_batch_size: int = 100,
+        ack_interval: float = 0.1,
+        reclaim_idle_time: Optional[int] = None
+    ):
+        """
+        Initialize the consumer runner.
+
+        Args:
+            stream (RedisStream): The stream and consumer group to read.
+            handler (Callable): Called with each message ({'id', 'data'}). It must be
+                picklable when a process pool is used.
+            workers (int, optional): Worker threads or processes. Defaults to 4.
+            executor (str or Executor, optional): 'thread', 'process' or an existing
+                executor, which is then not shut down by stop(). Defaults to 'thread'.
+            prefetch (int, optional): Maximum messages read but not yet handled.
+                Defaults to 100.
+            batch_size (int, optional): Maximum COUNT of one XREADGROUP. Defaults to 50.
+            block (int, optional): Milliseconds one XREADGROUP waits for messages.
+                Defaults to 1000.
+            ack_batch_size (int, optional): Acknowledge as soon as this many messages
+                are done. Defaults to 100.
+            ack_interval (float, optional): Seconds after which finished messages are
+                acknowledged even if the batch is not full. Defaults to 0.1.
+            reclaim_idle_time (int, optional): When set, messages other consumers left
+                pending for this many milliseconds are claimed whenever the stream
+                has nothing new. Defaults to None.
+        """
+        self._stream = stream
+        self._handler = handler
+        self._workers = workers
+        if isinstance(executor, Executor):
+            self._executor, self._owns_executor = executor, False
+        elif executor == 'thread':
+            self._executor, self._owns_executor = ThreadPoolExecutor(max_workers=workers), True
+        elif executor == 'process':
+            self._executor, self._owns_executor = ProcessPoolExecutor(max_workers=workers), True
+        else:
+            raise ValueError(f'Unknown executor: {executor}')
+        self._prefetch = prefetch
+        self._batch_size = batch_size
+        self._block = block
+        self._ack_batch_size = ack_batch_size
+        self._ack_interval = ack_interval
+        self._reclaim_idle_time = reclaim_idle_time
+
+        self._lock = threading.Condition()
+        self._in_flight: Dict[Any, Future] = {}
+        # Ids read and neither acknowledged nor failed yet.
+        self._held: Set[Any] = set()
+        # Keeps an acknowledgement from landing between a claim and the check of held ids.
+        self._claiming = threading.Lock()
+        self._to_ack: List[Any] = []
+        self._running = False
+        self._drained = threading.Event()
+        self._fetcher: Optional[threading.Thread] = None
+        self._acker: Optional[threading.Thread] = None
+
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.acked = 0
+        self._started_at: Optional[float] = None
+        self._last_sample = (time.monotonic(), 0)
+
+    def start(self) -> None:
+        """Start fetching and handling messages in the background."""
+        if self._running:
+            return
+        self._running = True
+        self._drained.clear()
+        self._started_at = time.monotonic()
+        self._last_sample = (self._started_at, self.processed)
+        name = self._stream.consumer_name
+        self._fetcher = threading.Thread(target=self._fetch_loop, name=f'stream-fetcher-{name}', daemon=True)
+        self._acker = threading.Thread(target=self._ack_loop, name=f'stream-acker-{name}', daemon=True)
+        self._fetcher.start()
+        self._acker.start()
+
+    def run(self) -> None:
+        """Start and block until stop() is called from another thread or Ctrl-C."""
+        self.start()
+        try:
+            while self._running:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, timeout: Optional[float] = 30) -> None:
+        """
+        Stop fetching, let in-flight messages finish and acknowledge them.
+
+        Messages still running after timeout seconds are left pending, so
+        they are redelivered by a later recover() rather than lost.
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._fetcher.join()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f'{self}: stopping with {len(self._in_flight)} messages still running')
+                    break
+                self._lock.wait(remaining)
+        self._drained.set()
+        self._acker.join()
+        self._flush_acks()
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    def _fetch_loop(self) -> None:
+        while self._running:
+            with self._lock:
+                while self._running and len(self._in_flight) >= self._prefetch:
+                    self._lock.wait(0.1)
+                free = self._prefetch - len(self._in_flight)
+            if not self._running:
+                return
+            try:
+                messages = self._read(min(self._batch_size, free))
+            except Exception as err:
+                logger.error(f'{self}: reading the stream failed: {err}')
+                time.sleep(self._block / 1000)
+                continue
+            with self._lock:
+                self._held.update(message['id'] for message in messages)
+                self.received += len(messages)
+                futures = [(message['id'], self._executor.submit(self._handler, message)) for message in messages]
+                self._in_flight.update(futures)
+            for id, future in futures:
+                future.add_done_callback(lambda future, id=id: self._done(id, future))
+
+    def _read(self, count: int) -> List[Dict[str, Any]]:
+        messages = self._stream.get(count=count, block=self._block)['datas']
+        if messages or self._reclaim_idle_time is None:
+            return messages
+        with self._claiming:
+            messages = self._stream.recover(self._reclaim_idle_time, count=count)['datas']
+            with self._lock:
+                # A handler running longer than reclaim_idle_time leaves its message idle.
+                return [message for message in messages if message['id'] not in self._held]
+
+    def _done(self, id: Any, future: Future) -> None:
+        error = future.exception()
+        with self._lock:
+            self._in_flight.pop(id, None)
+            if error is None:
+                self.processed += 1
+                self._to_ack.append(id)
+            else:
+                self._held.discard(id)
+                self.failed += 1
+                logger.error(f'{self}: message {id} failed: {error}')
+            self._lock.notify_all()
+
+    def _ack_loop(self) -> None:
+        while not self._drained.is_set():
+            with self._lock:
+                if len(self._to_ack) < self._ack_batch_size:
+                    self._lock.wait(self._ack_interval)
+            self._flush_acks()
+
+    def _flush_acks(self) -> None:
+        with self._lock:
+            ids, self._to_ack = self._to_ack, []
+        if not ids:
+            return
+        with self._claiming:
+            try:
+                acked = self._stream.ack(ids)
+            except Exception as err:
+                logger.error(f'{self}: acknowledging {len(ids)} messages failed: {err}')
+                with self._lock:
+                    self._to_ack.extend(ids)
+                return
+            with self._lock:
+                self._held.difference_update(ids)
+                self.acked += acked
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Return throughput and lag figures for this consumer.
+
+        'rate' is messages handled per second since the previous call and
+        'utilization' the share of workers running a handler right now;
+        'in_flight' also counts messages read but still queued for a worker. 'lag' is the
+        number of entries not yet delivered to the group (Redis 7+) and
+        'pending' the group's delivered but unacknowledged entries.
+        """
+        now = time.monotonic()
+        with self._lock:
+            processed, in_flight = self.processed, len(self._in_flight)
+            running = sum(1 for future in self._in_flight.values() if future.running())
+            metrics = {
+                'consumer': self._stream.consumer_name,
+                'received': self.received,
+                'processed': processed,
+                'failed': self.failed,
+                'acked': self.acked,
+                'in_flight': in_flight,
+            }
+        last_time, last_processed = self._last_sample
+        self._last_sample = (now, processed)
+        elapsed = now - self._started_at if self._started_at else 0
+        metrics['rate'] = (processed - last_processed) / (now - last_time) if now > last_time else 0.0
+        metrics['average_rate'] = processed / elapsed if elapsed else 0.0
+        metrics['utilization'] = min(running, self._workers) / self._workers
+        metrics['lag'] = metrics['pending'] = None
+        for group in self._stream._conn.xinfo_groups(self._stream._name):
+            group_name = group['name']
+            if isinstance(group_name, bytes):
+                group_name = group_name.decode('utf-8')
+            if group_name == self._stream.group_name:
+                metrics['lag'] = group.get('lag')
+                metrics['pending'] = group.get('pending')
+        return metrics
+
+    def __str__(self) -> str:
+        return f"StreamConsumer(stream={self._stream._name}, consumer={self._stream.consumer_name})"
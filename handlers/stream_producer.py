@@ -0,0 +1,48 @@
+from concurrent.futures import Future
+from typing import Any, List, Mapping
+from handlers.linger import LingerBuffer
+from handlers.stream import RedisStream
+
+
+class StreamProducer(LingerBuffer):
+    """
+    Buffers messages for a RedisStream and writes them in pipelined batches.
+
+    send() returns a Future that resolves to the message ID.
+
+    Example:
+        with StreamProducer(stream, linger=0.005) as producer:
+            for event in events:
+                producer.send(event)
+    """
+
+    def __init__(
+        self,
+        stream: RedisStream,
+        linger: float = 0.005,
+        batch_size: int = 500,
+        max_buffered: int = 10000
+    ):
+        """
+        Initialize the producer and start its flusher thread.
+
+        Args:
+            stream (RedisStream): The stream written to. Its codec and trimming apply.
+            linger (float, optional): Seconds a message may wait for others to share
+                its round trip. Defaults to 0.005.
+            batch_size (int, optional): Messages per pipeline. Defaults to 500.
+            max_buffered (int, optional): send() blocks while this many messages are
+                waiting. Defaults to 10000.
+        """
+        self._stream = stream
+        super().__init__(linger, batch_size, max_buffered, name=f'stream-producer-{stream._name}')
+
+    def send(self, value: Mapping[str, Any]) -> Future:
+        """Queue a message and return a Future of its ID."""
+        return self.add(value)
+
+    def _write_batch(self, items: List[Mapping[str, Any]]) -> List[Any]:
+        return self._stream.add_many(items, chunk_size=len(items))
+
+    def __str__(self) -> str:
+        return f"StreamProducer(stream={self._stream._name})"
@@ -0,0 +1,3414 @@
+import re
+import time
+import bisect
+import socket
+import hashlib
+import pickle
+import logging
+import functools
+import itertools
+import threading
+import socketserver
+import uuid
+import redis
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from redis.crc import key_slot
+
+try:
+    import lupa
+except ImportError:
+    lupa = None
+
+
+logger = logging.getLogger(__name__)
+
+REDIS_VERSION = '7.4.0'
+
+MAX_ID = (2 ** 64 - 1, 2 ** 64 - 1)
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+SYNTAX_ERROR = 'ERR syntax error'
+NOT_INTEGER = 'ERR value is not an integer or out of range'
+NOT_FLOAT = 'ERR value is not a valid float'
+INVALID_STREAM_ID = 'ERR Invalid stream ID specified as stream command argument'
+
+# Commands a client may send while it is subscribed to channels or patterns.
+SUBSCRIBED_COMMANDS = {b'SUBSCRIBE', b'UNSUBSCRIBE', b'PSUBSCRIBE', b'PUNSUBSCRIBE', b'PING', b'QUIT', b'RESET'}
+
+# Commands whose arguments name channels rather than keys.
+PUBSUB_COMMANDS = {b'PUBLISH', b'SUBSCRIBE', b'UNSUBSCRIBE', b'PSUBSCRIBE', b'PUNSUBSCRIBE', b'PUBSUB'}
+
+CLUSTER_SLOTS = 16384
+
+# Commands that are never queued by MULTI.
+TRANSACTION_COMMANDS = {b'MULTI', b'EXEC', b'DISCARD', b'WATCH', b'UNWATCH'}
+
+# Commands Lua scripts may not call.
+SCRIPT_FORBIDDEN_COMMANDS = SUBSCRIBED_COMMANDS | TRANSACTION_COMMANDS | {b'EVAL', b'EVALSHA', b'SCRIPT'}
+
+
+class FakeClock:
+    """
+    Time source of a FakeRedisServer that tests can move forward.
+
+    It follows the system clock plus an offset, so expiry, TIME and stream
+    IDs behave as usual until advance() jumps ahead. Blocking commands
+    still wait in real time.
+    """
+
+    def __init__(self):
+        self._offset = 0.0
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        """Return the current time in seconds since the epoch."""
+        return time.time() + self._offset
+
+    def time_ms(self) -> int:
+        """Return the current time in milliseconds since the epoch."""
+        return int(self.time() * 1000)
+
+    def advance(self, seconds: float) -> None:
+        """Move the clock forward, expiring keys whose time has come."""
+        with self._lock:
+            self._offset += seconds
+
+    def __str__(self) -> str:
+        return f"FakeClock(offset={self._offset})"
+
+
+class _Status(bytes):
+    """A simple string reply, such as OK."""
+
+
+class _CommandError(Exception):
+    """An error reply. The message starts with the error code, e.g. ERR."""
+
+
+class _Replies(list):
+    """Several replies to one command, as sent by SUBSCRIBE."""
+
+
+class _Map(list):
+    """(key, value) pairs: a map in RESP3, a flat array in RESP2."""
+
+
+class _Pairs(list):
+    """(member, score) pairs: nested arrays in RESP3, a flat array in RESP2."""
+
+
+class _Set(list):
+    """A set in RESP3, an array in RESP2."""
+
+
+class _Push(list):
+    """An out-of-band message: a push in RESP3, an array in RESP2."""
+
+
+def _map(*items: Any) -> _Map:
+    return _Map(zip(items[::2], items[1::2]))
+
+
+NIL_ARRAY = object()
+OK = _Status(b'OK')
+QUEUED = _Status(b'QUEUED')
+
+
+def _format_float(value: float) -> bytes:
+    if value == float('inf'):
+        return b'inf'
+    if value == float('-inf'):
+        return b'-inf'
+    if value == int(value) and abs(value) < 1e17:
+        return b'%d' % int(value)
+    return repr(value).encode()
+
+
+def _encode(reply: Any, out: List[bytes], resp3: bool) -> None:
+    if reply is None or reply is NIL_ARRAY:
+        out.append(b'_\r\n' if resp3 else b'$-1\r\n' if reply is None else b'*-1\r\n')
+    elif isinstance(reply, _Status):
+        out.append(b'+%s\r\n' % reply)
+    elif isinstance(reply, _CommandError):
+        out.append(b'-%s\r\n' % str(reply).replace('\r', ' ').replace('\n', ' ').encode())
+    elif isinstance(reply, int):
+        out.append(b':%d\r\n' % reply)
+    elif isinstance(reply, float):
+        data = _format_float(reply)
+        out.append(b',%s\r\n' % data if resp3 else b'$%d\r\n%s\r\n' % (len(data), data))
+    elif isinstance(reply, str):
+        data = reply.encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    elif isinstance(reply, bytes):
+        out.append(b'$%d\r\n%s\r\n' % (len(reply), reply))
+    elif isinstance(reply, _Map):
+        out.append(b'%%%d\r\n' % len(reply) if resp3 else b'*%d\r\n' % (len(reply) * 2))
+        for key, value in reply:
+            _encode(key, out, resp3)
+            _encode(value, out, resp3)
+    elif isinstance(reply, _Pairs):
+        out.append(b'*%d\r\n' % (len(reply) if resp3 else len(reply) * 2))
+        for member, score in reply:
+            if resp3:
+                out.append(b'*2\r\n')
+            _encode(member, out, resp3)
+            _encode(score, out, resp3)
+    else:
+        kind = b'*'
+        if resp3 and isinstance(reply, _Set):
+            kind = b'~'
+        elif resp3 and isinstance(reply, _Push):
+            kind = b'>'
+        out.append(b'%s%d\r\n' % (kind, len(reply)))
+        for item in reply:
+            _encode(item, out, resp3)
+
+
+def _read_command(rfile) -> Optional[List[bytes]]:
+    line = rfile.readline()
+    if not line:
+        return None
+    if line[:1] != b'*':
+        # An inline command, as typed into telnet.
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = rfile.readline()
+        if header[:1] != b'$':
+            raise ValueError(f'expected a bulk string, got {header!r}')
+        length = int(header[1:])
+        data = rfile.read(length + 2)
+        if len(data) < length + 2:
+            return None
+        args.append(data[:-2])
+    return args
+
+
+def _int(value: bytes) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise _CommandError(NOT_INTEGER)
+
+
+def _float(value: bytes, message: str = NOT_FLOAT) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise _CommandError(message)
+    if number != number:
+        raise _CommandError(message)
+    return number
+
+
+def _timeout(value: bytes) -> float:
+    seconds = _float(value, 'ERR timeout is not a float or out of range')
+    if seconds < 0:
+        raise _CommandError('ERR timeout is negative')
+    return seconds
+
+
+@functools.lru_cache(maxsize=256)
+def _glob(pattern: bytes) -> 're.Pattern':
+    """Compile a Redis glob pattern: *, ?, [abc], [^a-z] and backslash escapes."""
+    out, i, n = [], 0, len(pattern)
+    while i < n:
+        char = pattern[i:i + 1]
+        i += 1
+        if char == b'*':
+            out.append(b'.*')
+        elif char == b'?':
+            out.append(b'.')
+        elif char == b'\\' and i < n:
+            out.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif char == b'[':
+            j, negate, members = i, False, []
+            if pattern[j:j + 1] == b'^':
+                negate, j = True, j + 1
+            while j < n and pattern[j:j + 1] != b']':
+                if pattern[j:j + 1] == b'\\' and j + 1 < n:
+                    members.append(re.escape(pattern[j + 1:j + 2]))
+                    j += 2
+                elif pattern[j + 1:j + 2] == b'-' and j + 2 < n and pattern[j + 2:j + 3] != b']':
+                    low, high = sorted((pattern[j:j + 1], pattern[j + 2:j + 3]))
+                    members.append(re.escape(low) + b'-' + re.escape(high))
+                    j += 3
+                else:
+                    members.append(re.escape(pattern[j:j + 1]))
+                    j += 1
+            if j >= n:
+                out.append(re.escape(b'['))
+                continue
+            out.append(b'[' + (b'^' if negate else b'') + b''.join(members) + b']')
+            i = j + 1
+        else:
+            out.append(re.escape(char))
+    return re.compile(b''.join(out) + b'\\Z', re.DOTALL)
+
+
+def _matches(pattern: Optional[bytes], value: bytes) -> bool:
+    return pattern is None or _glob(pattern).match(value) is not None
+
+
+def _parse_id(value: bytes, missing_sequence: int = 0) -> Tuple[int, int]:
+    try:
+        if b'-' in value:
+            ms, sequence = value.split(b'-', 1)
+            return int(ms), int(sequence)
+        return int(value), missing_sequence
+    except ValueError:
+        raise _CommandError(INVALID_STREAM_ID)
+
+
+def _format_id(stream_id: Tuple[int, int]) -> bytes:
+    return b'%d-%d' % stream_id
+
+
+def _range_start(value: bytes) -> Tuple[int, int]:
+    """Parse the lower bound of an XRANGE: -, an ID, or an exclusive (ID."""
+    if value == b'-':
+        return 0, 0
+    if value == b'+':
+        return MAX_ID
+    if value[:1] == b'(':
+        ms, sequence = _parse_id(value[1:])
+        if (ms, sequence) == MAX_ID:
+            raise _CommandError('ERR invalid start ID for the interval')
+        return (ms, sequence + 1) if sequence < MAX_ID[1] else (ms + 1, 0)
+    return _parse_id(value)
+
+
+def _range_end(value: bytes) -> Tuple[int, int]:
+    """Parse the upper bound of an XRANGE: +, an ID, or an exclusive (ID."""
+    if value == b'+':
+        return MAX_ID
+    if value == b'-':
+        return 0, 0
+    if value[:1] == b'(':
+        ms, sequence = _parse_id(value[1:], MAX_ID[1])
+        if (ms, sequence) == (0, 0):
+            raise _CommandError('ERR invalid end ID for the interval')
+        return (ms, sequence - 1) if sequence > 0 else (ms - 1, MAX_ID[1])
+    return _parse_id(value, MAX_ID[1])
+
+
+def _score_bound(value: bytes) -> Tuple[float, bool]:
+    """Parse a ZRANGEBYSCORE bound into (score, exclusive)."""
+    message = 'ERR min or max is not a float'
+    if value[:1] == b'(':
+        return _float(value[1:], message), True
+    return _float(value, message), False
+
+
+def _lex_bound(value: bytes) -> Tuple[Optional[bytes], bool]:
+    """Parse a ZRANGEBYLEX bound into (member, exclusive); None is an open end."""
+    if value in (b'-', b'+'):
+        return None, False
+    if value[:1] in (b'[', b'('):
+        return value[1:], value[:1] == b'('
+    raise _CommandError('ERR min or max not valid string range item')
+
+
+class _SortedSet:
+    """Members with their scores, ordered by (score, member) on demand."""
+
+    __slots__ = ('scores', '_ordered')
+
+    def __init__(self):
+        self.scores: Dict[bytes, float] = {}
+        self._ordered: Optional[List[Tuple[float, bytes]]] = None
+
+    def add(self, member: bytes, score: float) -> None:
+        self.scores[member] = score
+        self._ordered = None
+
+    def remove(self, member: bytes) -> bool:
+        if self.scores.pop(member, None) is None:
+            return False
+        self._ordered = None
+        return True
+
+    def ordered(self) -> List[Tuple[float, bytes]]:
+        if self._ordered is None:
+            self._ordered = sorted((score, member) for member, score in self.scores.items())
+        return self._ordered
+
+    def rank(self, member: bytes) -> Optional[int]:
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.ordered(), (score, member))
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+
+class _Group:
+    """A stream consumer group with its pending entries list."""
+
+    __slots__ = ('last_id', 'pending', 'consumers')
+
+    def __init__(self, last_id: Tuple[int, int]):
+        self.last_id = last_id
+        # ID -> [consumer, last delivery time in ms, delivery count]
+        self.pending: Dict[Tuple[int, int], List[Any]] = {}
+        # Consumer name -> last time it was seen, in ms
+        self.consumers: Dict[bytes, int] = {}
+
+    def sorted_pending(self) -> List[Tuple[Tuple[int, int], List[Any]]]:
+        return sorted(self.pending.items())
+
+
+class _Stream:
+    """Stream entries ordered by ID, and the consumer groups reading them."""
+
+    __slots__ = ('ids', 'entries', 'last_id', 'max_deleted_id', 'entries_added', 'groups')
+
+    def __init__(self):
+        self.ids: List[Tuple[int, int]] = []
+        self.entries: Dict[Tuple[int, int], List[bytes]] = {}
+        self.last_id = (0, 0)
+        self.max_deleted_id = (0, 0)
+        self.entries_added = 0
+        self.groups: Dict[bytes, _Group] = {}
+
+    def next_id(self, now_ms: int) -> Tuple[int, int]:
+        if now_ms > self.last_id[0]:
+            return now_ms, 0
+        return self.last_id[0], self.last_id[1] + 1
+
+    def add(self, stream_id: Tuple[int, int], fields: List[bytes]) -> None:
+        self.ids.append(stream_id)
+        self.entries[stream_id] = fields
+        self.last_id = stream_id
+        self.entries_added += 1
+
+    def range(self, start: Tuple[int, int], end: Tuple[int, int], count: Optional[int] = None, reverse: bool = False) -> List[Tuple[Tuple[int, int], List[bytes]]]:
+        low = bisect.bisect_left(self.ids, start)
+        high = bisect.bisect_right(self.ids, end)
+        ids = self.ids[low:high]
+        if reverse:
+            ids.reverse()
+        if count is not None:
+            ids = ids[:count]
+        return [(stream_id, self.entries[stream_id]) for stream_id in ids]
+
+    def after(self, stream_id: Tuple[int, int], count: Optional[int] = None) -> List[Tuple[Tuple[int, int], List[bytes]]]:
+        low = bisect.bisect_right(self.ids, stream_id)
+        ids = self.ids[low:] if count is None else self.ids[low:low + count]
+        return [(entry_id, self.entries[entry_id]) for entry_id in ids]
+
+    def delete(self, stream_id: Tuple[int, int]) -> bool:
+        if self.entries.pop(stream_id, None) is None:
+            return False
+        del self.ids[bisect.bisect_left(self.ids, stream_id)]
+        self.max_deleted_id = max(self.max_deleted_id, stream_id)
+        return True
+
+    def trim(self, maxlen: Optional[int] = None, minid: Optional[Tuple[int, int]] = None) -> int:
+        if maxlen is not None:
+            cut = max(len(self.ids) - maxlen, 0)
+        else:
+            cut = bisect.bisect_left(self.ids, minid)
+        for stream_id in self.ids[:cut]:
+            del self.entries[stream_id]
+        if cut:
+            self.max_deleted_id = max(self.max_deleted_id, self.ids[cut - 1])
+            del self.ids[:cut]
+        return cut
+
+    def lag(self, group: _Group) -> int:
+        return len(self.ids) - bisect.bisect_right(self.ids, group.last_id)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class _HyperLogLog:
+    """
+    The distinct elements added to a HyperLogLog.
+
+    Counts are exact rather than estimated, and unlike on Redis the value
+    cannot be read with GET.
+    """
+
+    __slots__ = ('elements',)
+
+    def __init__(self):
+        self.elements: Set[bytes] = set()
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+
+# What TYPE reports for every kind of value.
+TYPE_NAMES = {
+    bytes: b'string', deque: b'list', dict: b'hash', set: b'set', _SortedSet: b'zset', _Stream: b'stream',
+    _HyperLogLog: b'string',
+}
+
+
+class _Database:
+    """The keyspace of one database number, with lazy expiry."""
+
+    def __init__(self, server: 'FakeRedisServer', index: int):
+        self.server = server
+        self.index = index
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, int] = {}
+        # Deadlines of hash fields set with HEXPIRE and friends, by key and field.
+        self.field_expires: Dict[bytes, Dict[bytes, int]] = {}
+        self.versions: Dict[bytes, int] = {}
+
+    def get(self, key: bytes, kind: Optional[type] = None) -> Any:
+        value = self.data.get(key)
+        if value is None:
+            return None
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= self.server.clock.time_ms():
+            self.delete(key)
+            return None
+        if kind is not None and type(value) is not kind:
+            raise _CommandError(WRONGTYPE)
+        return value
+
+    def get_or_create(self, key: bytes, kind: type) -> Any:
+        value = self.get(key, kind)
+        if value is None:
+            value = self.data[key] = kind()
+        return value
+
+    def set(self, key: bytes, value: Any, keep_ttl: bool = False) -> None:
+        self.data[key] = value
+        if not keep_ttl:
+            self.expires.pop(key, None)
+        self.field_expires.pop(key, None)
+        self.touch(key)
+
+    def delete(self, key: bytes) -> bool:
+        if self.data.pop(key, None) is None:
+            return False
+        self.expires.pop(key, None)
+        self.field_expires.pop(key, None)
+        self.touch(key)
+        return True
+
+    def exists(self, key: bytes) -> bool:
+        return self.get(key) is not None
+
+    def touch(self, key: bytes) -> None:
+        """Record a change to a key, for WATCH, blocked clients and client-side caching."""
+        self.versions[key] = next(self.server._versions)
+        self.server._dirty = True
+        self.server._invalidate(key)
+
+    def changed(self, key: bytes) -> None:
+        """Record a change to a collection, deleting it once empty."""
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, _Stream) and len(value) == 0:
+            self.delete(key)
+        else:
+            self.touch(key)
+
+    def keys(self) -> List[bytes]:
+        return [key for key in list(self.data) if self.get(key) is not None]
+
+    def flush(self) -> None:
+        for key in list(self.data):
+            self.versions[key] = next(self.server._versions)
+        self.data.clear()
+        self.expires.clear()
+        self.field_expires.clear()
+
+
+class _Client:
+    """The state of one client connection."""
+
+    def __init__(self, client_id: int, connection: socket.socket):
+        self.id = client_id
+        self.connection = connection
+        self.name: Optional[bytes] = None
+        self.db = 0
+        self.channels: Set[bytes] = set()
+        self.patterns: Set[bytes] = set()
+        self.multi: Optional[List[List[bytes]]] = None
+        self.multi_failed = False
+        self.watched: Dict[Tuple[int, bytes], int] = {}
+        self.tracking: Optional[Tuple[Optional[int], List[bytes]]] = None
+        self.no_block = False
+        self.resp3 = False
+        self._write_lock = threading.Lock()
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+    def close(self) -> None:
+        """Close the connection, as CLIENT KILL does."""
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send(self, reply: Any) -> None:
+        out: List[bytes] = []
+        if isinstance(reply, _Replies):
+            for item in reply:
+                _encode(item, out, self.resp3)
+        else:
+            _encode(reply, out, self.resp3)
+        try:
+            with self._write_lock:
+                self.connection.sendall(b''.join(out))
+        except OSError:
+            pass
+
+
+class _Command:
+    __slots__ = ('function', 'arity', 'keys')
+
+    def __init__(self, function: Callable[..., Any], arity: int, keys: Any):
+        self.function = function
+        self.arity = arity
+        self.keys = keys
+
+
+_COMMANDS: Dict[bytes, _Command] = {}
+
+
+def _command(name: str, arity: int, keys: Any = (1, 1, 1)) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Register a command implementation.
+
+    The arity counts the command name, like Redis does: a positive arity
+    is exact, a negative one is a minimum. keys gives the first and last
+    key positions and the step between keys, a negative last position
+    counting from the end, as COMMAND reports them. It is None for
+    commands without keys and a function returning the key positions for
+    commands whose keys move, e.g. after a numkeys argument.
+    """
+    def register(function: Callable[..., Any]) -> Callable[..., Any]:
+        _COMMANDS[name.encode()] = _Command(function, arity, keys)
+        return function
+    return register
+
+
+def _numkeys_at(index: int) -> Callable[[List[bytes]], List[int]]:
+    """Key positions of commands giving a key count at index, followed by the keys."""
+    def positions(args: List[bytes]) -> List[int]:
+        count = _int(args[index]) if len(args) > index else 0
+        return list(range(index + 1, min(index + 1 + count, len(args))))
+    return positions
+
+
+def _stream_keys(args: List[bytes]) -> List[int]:
+    """Key positions of XREAD and XREADGROUP: the first half of what follows STREAMS."""
+    for index, arg in enumerate(args):
+        if arg.upper() == b'STREAMS':
+            count = (len(args) - index - 1) // 2
+            return list(range(index + 1, index + 1 + count))
+    return []
+
+
+def _command_keys(args: List[bytes]) -> List[bytes]:
+    """Return the keys a command reads or writes."""
+    command = _COMMANDS.get(args[0].upper())
+    if command is None or command.keys is None:
+        return []
+    if callable(command.keys):
+        return [args[index] for index in command.keys(args)]
+    first, last, step = command.keys
+    if last < 0:
+        last += len(args)
+    return args[first:last + 1:step]
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self) -> None:
+        super().setup()
+        # Pipelined replies go out one write each; do not let Nagle hold them back.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self) -> None:
+        fake = self.server.fake
+        client = fake._connect(self.request)
+        try:
+            while True:
+                args = _read_command(self.rfile)
+                if args is None:
+                    return
+                if not args:
+                    continue
+                client.send(fake._execute(client, args))
+                if args[0].upper() == b'QUIT':
+                    return
+        except (OSError, ValueError):
+            pass
+        finally:
+            fake._disconnect(client)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRedisServer:
+    """
+    An in-process stand-in for a Redis server, for tests.
+
+    It speaks RESP2 and RESP3 (HELLO 3) on a local TCP port, so sync and asyncio redis-py
+    clients, pipelines, transactions and pub/sub work unchanged. It covers
+    the commands the handlers use: strings, hashes, lists with the blocking
+    pops, sets, sorted sets, streams with consumer groups, pub/sub,
+    MULTI/EXEC/WATCH, client-side caching through CLIENT TRACKING with
+    REDIRECT and, when the lupa package is installed, Lua scripts.
+
+    With cluster=True it poses as a one-node Redis Cluster owning every
+    slot: redis.RedisCluster clients connect to it, and commands and
+    scripts whose keys span several slots fail with CROSSSLOT, as they
+    would on a real cluster.
+
+    Expiry, TIME and stream IDs follow a FakeClock, so tests can expire
+    keys instantly with clock.advance(). Commands run one at a time, like
+    on a real server; data lives in memory only.
+
+    Example:
+        with FakeRedisServer() as server:
+            server.install()
+            kv_store = RedisKeyValue('sessions')
+            kv_store.set('id', 'data', ttl=60)
+            server.clock.advance(61)
+            assert kv_store.get('id') is None
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        clock: Optional[FakeClock] = None,
+        databases: int = 16,
+        cluster: bool = False
+    ):
+        """
+        Initialize the server. It listens once started.
+
+        Args:
+            host (str, optional): The address to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): The port to listen on, 0 for a free one. Defaults to 0.
+            clock (FakeClock, optional): The time source. Defaults to a new FakeClock.
+            databases (int, optional): The number of databases. Defaults to 16.
+            cluster (bool, optional): Act as a one-node Redis Cluster. Defaults to False.
+        """
+        self.clock = clock or FakeClock()
+        self.cluster = cluster
+        self._node_id = uuid.uuid4().hex + uuid.uuid4().hex[:8]
+        self._script_slot: Optional[int] = None
+        self._address = (host, port)
+        self._databases = [_Database(self, index) for index in range(databases)]
+        self._cond = threading.Condition(threading.RLock())
+        self._clients: Dict[int, _Client] = {}
+        self._client_ids = itertools.count(1)
+        self._versions = itertools.count(1)
+        self._cursors: 'OrderedDict[int, bytes]' = OrderedDict()
+        self._cursor_ids = itertools.count(1)
+        self._dirty = False
+        self._closed = False
+        self._scripts: Dict[str, Any] = {}
+        self._lua = None
+        self._script_client: Optional[_Client] = None
+        self._server: Optional[_TCPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._installed: List[Tuple[Any, str, int]] = []
+        self._started = time.monotonic()
+
+    def start(self) -> 'FakeRedisServer':
+        """Start listening and return the server."""
+        if self._server is not None:
+            return self
+        self._closed = False
+        self._server = _TCPServer(self._address, _RequestHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), name='fake-redis-server', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop listening, drop every client and undo install()."""
+        self.uninstall()
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        with self._cond:
+            self._closed = True
+            clients = list(self._clients.values())
+            self._cond.notify_all()
+        for client in clients:
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        """The redis:// URL of database 0."""
+        return f'redis://{self.host}:{self.port}/0'
+
+    @property
+    def scripting(self) -> bool:
+        """Whether EVAL and EVALSHA are available, which needs the lupa package."""
+        return lupa is not None
+
+    def client(self, db: int = 0, **kwargs: Any) -> redis.StrictRedis:
+        """Return a new client connected to this server."""
+        return redis.StrictRedis(host=self.host, port=self.port, db=db, **kwargs)
+
+    def install(self, host: str = 'localhost', port: int = 6379) -> None:
+        """
+        Point the shared sync and asyncio connection registries at this server.
+
+        Handlers created afterwards for host:port, the default address, use
+        this server without any other change. Pools the registries already
+        hold for that address are dropped.
+        """
+        from handlers.connection import registry
+        from handlers.aio.connection import registry as aio_registry
+        for shared in (registry, aio_registry):
+            shared.redirect(host, port, (self.host, self.port))
+            self._installed.append((shared, host, port))
+        registry.reset()
+
+    def uninstall(self) -> None:
+        """Undo install()."""
+        from handlers.connection import registry
+        installed, self._installed = self._installed, []
+        for shared, host, port in installed:
+            shared.redirect(host, port, None)
+        if installed:
+            registry.reset()
+
+    def flushall(self) -> None:
+        """Delete every key of every database."""
+        with self._cond:
+            for database in self._databases:
+                database.flush()
+            self._invalidate(None)
+
+    def _connect(self, connection: socket.socket) -> _Client:
+        with self._cond:
+            client = _Client(next(self._client_ids), connection)
+            self._clients[client.id] = client
+            return client
+
+    def _disconnect(self, client: _Client) -> None:
+        with self._cond:
+            self._clients.pop(client.id, None)
+
+    def _db(self, client: _Client) -> _Database:
+        return self._databases[client.db]
+
+    def _execute(self, client: _Client, args: List[bytes]) -> Any:
+        name = args[0].upper()
+        if client.multi is not None and name not in TRANSACTION_COMMANDS:
+            error = self._check(client, name, args)
+            if error is not None:
+                client.multi_failed = True
+                return error
+            client.multi.append(args)
+            return QUEUED
+        with self._cond:
+            reply = self._call(client, name, args)
+            if self._dirty:
+                self._dirty = False
+                self._cond.notify_all()
+            return reply
+
+    def _check(self, client: _Client, name: bytes, args: List[bytes]) -> Optional[_CommandError]:
+        command = _COMMANDS.get(name)
+        if command is None:
+            beginning = ' '.join(f"'{arg.decode('utf-8', 'replace')}'" for arg in args[1:4])
+            return _CommandError(f"ERR unknown command '{args[0].decode('utf-8', 'replace')}', with args beginning with: {beginning}")
+        if (command.arity > 0 and len(args) != command.arity) or len(args) < -command.arity:
+            return _CommandError(f"ERR wrong number of arguments for '{name.decode().lower()}' command")
+        if self.cluster:
+            slots = {key_slot(key) for key in _command_keys(args)}
+            if len(slots) > 1:
+                return _CommandError("CROSSSLOT Keys in request don't hash to the same slot")
+            if self._script_slot is not None and slots - {self._script_slot}:
+                return _CommandError('ERR Script attempted to access keys that do not hash to the same slot')
+        if client.subscriptions and not client.resp3 and name not in SUBSCRIBED_COMMANDS:
+            return _CommandError(
+                f"ERR Can't execute '{name.decode().lower()}': only (P|S)SUBSCRIBE / "
+                f"(P|S)UNSUBSCRIBE / PING / QUIT / RESET are allowed in this context"
+            )
+        return None
+
+    def _call(self, client: _Client, name: bytes, args: List[bytes]) -> Any:
+        error = self._check(client, name, args)
+        if error is not None:
+            return error
+        try:
+            return _COMMANDS[name].function(self, client, *args[1:])
+        except _CommandError as err:
+            return err
+
+    def _block(self, client: _Client, timeout: float, attempt: Callable[[], Any]) -> Any:
+        """
+        Retry attempt until it returns something other than None.
+
+        Gives up after timeout seconds, 0 meaning never. Inside MULTI and
+        scripts nothing blocks and attempt runs once.
+        """
+        result = attempt()
+        if result is not None or client.no_block:
+            return result
+        deadline = None if timeout == 0 else time.monotonic() + timeout
+        while not self._closed:
+            remaining = 1.0 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._cond.wait(remaining)
+            if client.id not in self._clients:
+                return None
+            result = attempt()
+            if result is not None:
+                return result
+        return None
+
+    def _publish(self, channel: bytes, message: bytes) -> int:
+        receivers = 0
+        for client in list(self._clients.values()):
+            if channel in client.channels:
+                client.send(_Push([b'message', channel, message]))
+                receivers += 1
+            for pattern in client.patterns:
+                if _matches(pattern, channel):
+                    client.send(_Push([b'pmessage', pattern, channel, message]))
+                    receivers += 1
+        return receivers
+
+    def _invalidate(self, key: Optional[bytes]) -> None:
+        """Tell tracking clients a key changed; None means everything was flushed."""
+        for client in list(self._clients.values()):
+            if client.tracking is None:
+                continue
+            redirect, prefixes = client.tracking
+            if key is not None and prefixes and not any(key.startswith(prefix) for prefix in prefixes):
+                continue
+            target = self._clients.get(redirect) if redirect else client
+            if target is None:
+                # Like Redis, only RESP3 clients hear that their redirection client is gone.
+                if client.resp3:
+                    client.send(_Push([b'tracking-redir-broken', redirect]))
+                continue
+            keys = None if key is None else [key]
+            if target.resp3:
+                target.send(_Push([b'invalidate', keys]))
+            elif b'__redis__:invalidate' in target.channels:
+                target.send(_Push([b'message', b'__redis__:invalidate', keys]))
+
+    def _script_runtime(self):
+        if lupa is None:
+            raise _CommandError('ERR scripting needs the lupa package: pip install lupa')
+        if self._lua is None:
+            self._lua = lupa.LuaRuntime(encoding=None, register_eval=False)
+            self._lua.execute(b'unpack = unpack or table.unpack')
+            self._lua.globals()[b'_redis_call'] = self._script_call
+            self._lua.execute(b"""
+                redis = {LOG_DEBUG = 0, LOG_VERBOSE = 1, LOG_NOTICE = 2, LOG_WARNING = 3}
+                function redis.call(...)
+                    local reply = _redis_call(...)
+                    if type(reply) == 'table' and reply.err then
+                        error(reply, 0)
+                    end
+                    return reply
+                end
+                function redis.pcall(...)
+                    return _redis_call(...)
+                end
+                function redis.error_reply(message) return {err = message} end
+                function redis.status_reply(message) return {ok = message} end
+                function redis.log(level, message) end
+                function redis.setresp(version) end
+                function redis.set_repl(mode) end
+                function redis.replicate_commands() return true end
+            """)
+            self._lua_load = self._lua.eval(b'function(source) return load(source, "@user_script") end')
+            self._lua_run = self._lua.eval(b'function(f) return pcall(f) end')
+        return self._lua
+
+    def _script_call(self, *args: Any) -> Any:
+        lua = self._lua
+        if not args:
+            return lua.table_from({b'err': b'ERR Please specify at least one argument for this redis lib call'})
+        command = []
+        for arg in args:
+            if isinstance(arg, bytes):
+                command.append(arg)
+            elif isinstance(arg, (int, float)) and not isinstance(arg, bool):
+                command.append(_format_float(arg) if isinstance(arg, float) else b'%d' % arg)
+            else:
+                return lua.table_from({b'err': b'ERR Lua redis lib command arguments must be strings or integers'})
+        name = command[0].upper()
+        if name in SCRIPT_FORBIDDEN_COMMANDS:
+            reply = _CommandError('ERR This Redis command is not allowed from script')
+        else:
+            reply = self._call(self._script_client, name, command)
+        return self._to_lua(reply)
+
+    def _to_lua(self, reply: Any) -> Any:
+        lua = self._lua
+        if reply is None or reply is NIL_ARRAY:
+            return False
+        if isinstance(reply, _Status):
+            return lua.table_from({b'ok': bytes(reply)})
+        if isinstance(reply, _CommandError):
+            return lua.table_from({b'err': str(reply).encode()})
+        if isinstance(reply, float):
+            return _format_float(reply)
+        if isinstance(reply, (_Map, _Pairs)):
+            # Scripts see RESP2 replies.
+            reply = [item for pair in reply for item in pair]
+        if isinstance(reply, str):
+            return reply.encode()
+        if isinstance(reply, (int, bytes)):
+            return reply
+        return lua.table_from([self._to_lua(item) for item in reply])
+
+    def _from_lua(self, value: Any) -> Any:
+        if value is None or value is False:
+            return None
+        if value is True:
+            return 1
+        if isinstance(value, float):
+            return int(value)
+        if isinstance(value, (int, bytes)):
+            return value
+        if lupa.lua_type(value) != 'table':
+            return None
+        if value[b'err'] is not None:
+            return _CommandError(value[b'err'].decode('utf-8', 'replace'))
+        if value[b'ok'] is not None:
+            return _Status(value[b'ok'])
+        items, index = [], 1
+        while value[index] is not None:
+            items.append(self._from_lua(value[index]))
+            index += 1
+        return items
+
+    def _run_script(self, client: _Client, sha: str, numkeys: bytes, args: Tuple[bytes, ...]) -> Any:
+        count = _int(numkeys)
+        if count < 0:
+            raise _CommandError("ERR Number of keys can't be negative")
+        if count > len(args):
+            raise _CommandError("ERR Number of keys can't be greater than number of args")
+        lua = self._script_runtime()
+        function = self._scripts.get(sha)
+        if function is None:
+            raise _CommandError('NOSCRIPT No matching script. Please use EVAL.')
+        lua.globals()[b'KEYS'] = lua.table_from(args[:count])
+        lua.globals()[b'ARGV'] = lua.table_from(args[count:])
+        if self.cluster and count:
+            # EVAL itself checked that the declared keys share a slot.
+            self._script_slot = key_slot(args[0])
+        self._script_client, client.no_block = client, True
+        try:
+            ok, result = self._lua_run(function)
+        finally:
+            client.no_block = False
+            self._script_slot = None
+        if ok:
+            return self._from_lua(result)
+        if lupa.lua_type(result) == 'table' and result[b'err'] is not None:
+            raise _CommandError(f"{result[b'err'].decode('utf-8', 'replace')} script: {sha}")
+        message = result.decode('utf-8', 'replace') if isinstance(result, bytes) else str(result)
+        raise _CommandError(f'ERR {message} script: {sha}')
+
+    def _load_script(self, source: bytes) -> str:
+        sha = hashlib.sha1(source).hexdigest()
+        if sha not in self._scripts:
+            self._script_runtime()
+            function, error = self._lua_load(source), None
+            if isinstance(function, tuple):
+                function, error = function
+            if function is None:
+                raise _CommandError(f"ERR Error compiling script (new function): {error.decode('utf-8', 'replace')}")
+            self._scripts[sha] = function
+        return sha
+
+    def __enter__(self) -> 'FakeRedisServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def __str__(self) -> str:
+        address = f'{self.host}:{self.port}' if self._server is not None else 'stopped'
+        return f"FakeRedisServer({address})"
+
+
+# Connection, server and keyspace commands
+
+@_command('PING', -1, None)
+def _ping(server, client, *args):
+    if len(args) > 1:
+        raise _CommandError("ERR wrong number of arguments for 'ping' command")
+    if client.subscriptions and not client.resp3:
+        return [b'pong', args[0] if args else b'']
+    return args[0] if args else _Status(b'PONG')
+
+
+@_command('ECHO', 2, None)
+def _echo(server, client, message):
+    return message
+
+
+@_command('QUIT', 1, None)
+def _quit(server, client):
+    return OK
+
+
+@_command('RESET', 1, None)
+def _reset(server, client):
+    client.db, client.multi, client.watched, client.tracking = 0, None, {}, None
+    client.channels.clear()
+    client.patterns.clear()
+    return _Status(b'RESET')
+
+
+@_command('SELECT', 2, None)
+def _select(server, client, index):
+    index = _int(index)
+    if server.cluster and index != 0:
+        raise _CommandError('ERR SELECT is not allowed in cluster mode')
+    if not 0 <= index < len(server._databases):
+        raise _CommandError('ERR DB index is out of range')
+    client.db = index
+    return OK
+
+
+@_command('HELLO', -1, None)
+def _hello(server, client, *args):
+    if args:
+        if args[0] not in (b'2', b'3'):
+            raise _CommandError('NOPROTO unsupported protocol version')
+        if len(args) > 1:
+            raise _CommandError('ERR the fake server does not support AUTH or SETNAME in HELLO')
+        client.resp3 = args[0] == b'3'
+    return _map(
+        b'server', b'redis', b'version', REDIS_VERSION.encode(), b'proto', 3 if client.resp3 else 2,
+        b'id', client.id, b'mode', b'standalone', b'role', b'master', b'modules', [],
+    )
+
+
+@_command('CLIENT', -2, None)
+def _client(server, client, subcommand, *args):
+    subcommand = subcommand.upper()
+    if subcommand == b'ID':
+        return client.id
+    if subcommand == b'SETNAME' and len(args) == 1:
+        client.name = args[0] or None
+        return OK
+    if subcommand == b'GETNAME':
+        return client.name
+    if subcommand in (b'SETINFO', b'NO-EVICT', b'NO-TOUCH'):
+        return OK
+    if subcommand == b'TRACKING' and args:
+        return _client_tracking(server, client, *args)
+    if subcommand == b'KILL' and len(args) == 2 and args[0].upper() == b'ID':
+        target = server._clients.get(_int(args[1]))
+        if target is None:
+            return 0
+        target.close()
+        return 1
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try CLIENT HELP.")
+
+
+def _client_tracking(server, client, switch, *options):
+    # Default tracking mode is handled like BCAST: clients are told about
+    # every change, not only about keys they read, which is always safe.
+    if switch.upper() == b'OFF':
+        client.tracking = None
+        return OK
+    if switch.upper() != b'ON':
+        raise _CommandError(SYNTAX_ERROR)
+    redirect, prefixes, index = None, [], 0
+    while index < len(options):
+        option = options[index].upper()
+        if option == b'REDIRECT' and index + 1 < len(options):
+            redirect = _int(options[index + 1])
+            if redirect not in server._clients:
+                raise _CommandError('ERR The client ID you want redirect to does not exist')
+            index += 2
+        elif option == b'PREFIX' and index + 1 < len(options):
+            prefixes.append(options[index + 1])
+            index += 2
+        elif option in (b'BCAST', b'OPTIN', b'OPTOUT', b'NOLOOP'):
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    client.tracking = (redirect, prefixes)
+    return OK
+
+
+@_command('INFO', -1, None)
+def _info(server, client, *sections):
+    lines = [
+        '# Server', f'redis_version:{REDIS_VERSION}', f"redis_mode:{'cluster' if server.cluster else 'standalone'}", 'os:fake',
+        f'tcp_port:{server.port}', f'uptime_in_seconds:{int(time.monotonic() - server._started)}',
+        '', '# Clients', f'connected_clients:{len(server._clients)}',
+        '', '# Memory', 'used_memory:0', '', '# Cluster', f'cluster_enabled:{int(server.cluster)}', '', '# Keyspace',
+    ]
+    for database in server._databases:
+        keys = database.keys()
+        if keys:
+            expires = sum(1 for key in keys if key in database.expires)
+            lines.append(f'db{database.index}:keys={len(keys)},expires={expires},avg_ttl=0')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+@_command('CONFIG', -2, None)
+def _config(server, client, subcommand, *args):
+    if subcommand.upper() == b'GET':
+        return _Map()
+    if subcommand.upper() in (b'SET', b'RESETSTAT'):
+        return OK
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try CONFIG HELP.")
+
+
+@_command('TIME', 1, None)
+def _time(server, client):
+    now = server.clock.time()
+    return [b'%d' % int(now), b'%d' % int((now % 1) * 1000000)]
+
+
+@_command('COMMAND', -1, None)
+def _command_info(server, client, *args):
+    subcommand = args[0].upper() if args else None
+    if subcommand == b'COUNT':
+        return len(_COMMANDS)
+    if subcommand == b'GETKEYS':
+        if len(args) < 2 or args[1].upper() not in _COMMANDS:
+            raise _CommandError('ERR Invalid command specified')
+        keys = _command_keys(list(args[1:]))
+        if not keys:
+            raise _CommandError('ERR The command has no key arguments')
+        return keys
+    if subcommand == b'DOCS':
+        return _Map()
+    if subcommand == b'INFO':
+        names = [name.upper() for name in args[1:]]
+    elif subcommand is None:
+        names = list(_COMMANDS)
+    else:
+        raise _CommandError(f"ERR unknown subcommand '{args[0].decode('utf-8', 'replace')}'. Try COMMAND HELP.")
+    replies = []
+    for name in names:
+        command = _COMMANDS.get(name)
+        if command is None:
+            replies.append(NIL_ARRAY)
+            continue
+        flags = []
+        if callable(command.keys):
+            flags.append(b'movablekeys')
+            first, last, step = 0, 0, 0
+        else:
+            first, last, step = command.keys or (0, 0, 0)
+        if name in PUBSUB_COMMANDS:
+            flags.append(b'pubsub')
+        replies.append([name.lower(), command.arity, _Set(flags), first, last, step, _Set(), [], [], []])
+    return replies
+
+
+@_command('CLUSTER', -2, None)
+def _cluster(server, client, subcommand, *args):
+    if not server.cluster:
+        raise _CommandError('ERR This instance has cluster support disabled')
+    subcommand = subcommand.upper()
+    if subcommand == b'SLOTS':
+        return [[0, CLUSTER_SLOTS - 1, [server.host.encode(), server.port, server._node_id.encode()]]]
+    if subcommand == b'KEYSLOT' and len(args) == 1:
+        return key_slot(args[0])
+    if subcommand == b'MYID':
+        return server._node_id.encode()
+    if subcommand == b'INFO':
+        return (
+            f'cluster_state:ok\r\ncluster_slots_assigned:{CLUSTER_SLOTS}\r\ncluster_slots_ok:{CLUSTER_SLOTS}\r\n'
+            f'cluster_known_nodes:1\r\ncluster_size:1\r\n'
+        )
+    if subcommand == b'NODES':
+        return (
+            f'{server._node_id} {server.host}:{server.port}@{server.port + 10000} '
+            f'myself,master - 0 0 1 connected 0-{CLUSTER_SLOTS - 1}\n'
+        )
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try CLUSTER HELP.")
+
+
+@_command('DBSIZE', 1, None)
+def _dbsize(server, client):
+    return len(server._db(client).keys())
+
+
+@_command('FLUSHDB', -1, None)
+def _flushdb(server, client, *mode):
+    server._db(client).flush()
+    server._invalidate(None)
+    return OK
+
+
+@_command('FLUSHALL', -1, None)
+def _flushall(server, client, *mode):
+    for database in server._databases:
+        database.flush()
+    server._invalidate(None)
+    return OK
+
+
+@_command('DEL', -2, (1, -1, 1))
+def _del(server, client, *keys):
+    database = server._db(client)
+    return sum(database.get(key) is not None and database.delete(key) for key in keys)
+
+
+_command('UNLINK', -2, (1, -1, 1))(_del)
+
+
+@_command('EXISTS', -2, (1, -1, 1))
+def _exists(server, client, *keys):
+    database = server._db(client)
+    return sum(database.exists(key) for key in keys)
+
+
+@_command('TYPE', 2)
+def _type(server, client, key):
+    value = server._db(client).get(key)
+    return _Status(b'none' if value is None else TYPE_NAMES[type(value)])
+
+
+def _expire(server, client, key, deadline_ms, options):
+    database = server._db(client)
+    if database.get(key) is None:
+        return 0
+    options = {option.upper() for option in options}
+    if not options <= {b'NX', b'XX', b'GT', b'LT'}:
+        raise _CommandError(f"ERR Unsupported option {b' '.join(options).decode('utf-8', 'replace')}")
+    if b'NX' in options and (b'XX' in options or b'GT' in options or b'LT' in options):
+        raise _CommandError('ERR NX and XX, GT or LT options at the same time are not compatible')
+    current = database.expires.get(key)
+    if (b'NX' in options and current is not None) or (b'XX' in options and current is None):
+        return 0
+    # A key without a TTL counts as expiring at infinity.
+    if b'GT' in options and (current is None or deadline_ms <= current):
+        return 0
+    if b'LT' in options and current is not None and deadline_ms >= current:
+        return 0
+    if deadline_ms <= server.clock.time_ms():
+        database.delete(key)
+        return 1
+    database.expires[key] = deadline_ms
+    database.touch(key)
+    return 1
+
+
+@_command('EXPIRE', -3)
+def _expire_seconds(server, client, key, seconds, *options):
+    return _expire(server, client, key, server.clock.time_ms() + _int(seconds) * 1000, options)
+
+
+@_command('PEXPIRE', -3)
+def _pexpire(server, client, key, milliseconds, *options):
+    return _expire(server, client, key, server.clock.time_ms() + _int(milliseconds), options)
+
+
+@_command('EXPIREAT', -3)
+def _expireat(server, client, key, timestamp, *options):
+    return _expire(server, client, key, _int(timestamp) * 1000, options)
+
+
+@_command('PEXPIREAT', -3)
+def _pexpireat(server, client, key, timestamp, *options):
+    return _expire(server, client, key, _int(timestamp), options)
+
+
+def _remaining_ms(server, client, key) -> int:
+    database = server._db(client)
+    if database.get(key) is None:
+        return -2
+    deadline = database.expires.get(key)
+    return -1 if deadline is None else max(deadline - server.clock.time_ms(), 0)
+
+
+@_command('TTL', 2)
+def _ttl(server, client, key):
+    remaining = _remaining_ms(server, client, key)
+    return remaining if remaining < 0 else (remaining + 500) // 1000
+
+
+@_command('PTTL', 2)
+def _pttl(server, client, key):
+    return _remaining_ms(server, client, key)
+
+
+@_command('PERSIST', 2)
+def _persist(server, client, key):
+    database = server._db(client)
+    if database.get(key) is None or database.expires.pop(key, None) is None:
+        return 0
+    database.touch(key)
+    return 1
+
+
+@_command('KEYS', 2, None)
+def _keys(server, client, pattern):
+    return [key for key in server._db(client).keys() if _matches(pattern, key)]
+
+
+def _scan_options(options) -> Tuple[Optional[bytes], int, Dict[bytes, Any]]:
+    match, count, extra, index = None, 10, {}, 0
+    while index < len(options):
+        option = options[index].upper()
+        if option == b'MATCH' and index + 1 < len(options):
+            match = options[index + 1]
+            index += 2
+        elif option == b'COUNT' and index + 1 < len(options):
+            count = _int(options[index + 1])
+            if count < 1:
+                raise _CommandError(SYNTAX_ERROR)
+            index += 2
+        elif option == b'TYPE' and index + 1 < len(options):
+            extra[b'TYPE'] = options[index + 1].lower()
+            index += 2
+        elif option == b'NOVALUES':
+            extra[b'NOVALUES'] = True
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    return match, count, extra
+
+
+def _scan_page(server, items: List[bytes], cursor: bytes, count: int, small: int = 128) -> Tuple[bytes, List[bytes]]:
+    """
+    Return one SCAN page of sorted names and the cursor of the next one.
+
+    A cursor remembers the last name returned, so names present for the
+    whole iteration are returned exactly once, whatever else changes.
+    """
+    number = _int(cursor)
+    if number < 0:
+        raise _CommandError('ERR invalid cursor')
+    if number == 0:
+        # Like Redis with small encodings, small collections come back whole.
+        if len(items) <= small:
+            return b'0', items
+        start = 0
+    elif number in server._cursors:
+        start = bisect.bisect_right(items, server._cursors[number])
+    else:
+        return b'0', []
+    page = items[start:start + count]
+    if start + count >= len(items):
+        return b'0', page
+    number = next(server._cursor_ids)
+    server._cursors[number] = page[-1]
+    while len(server._cursors) > 10000:
+        server._cursors.popitem(last=False)
+    return b'%d' % number, page
+
+
+@_command('SCAN', -2, None)
+def _scan(server, client, cursor, *options):
+    match, count, extra = _scan_options(options)
+    database = server._db(client)
+    cursor, keys = _scan_page(server, sorted(database.keys()), cursor, count, small=0)
+    kind = extra.get(b'TYPE')
+    keys = [
+        key for key in keys
+        if _matches(match, key) and (kind is None or TYPE_NAMES[type(database.data[key])] == kind)
+    ]
+    return [cursor, keys]
+
+
+@_command('RENAME', 3, (1, 2, 1))
+def _rename(server, client, source, destination):
+    database = server._db(client)
+    value = database.get(source)
+    if value is None:
+        raise _CommandError('ERR no such key')
+    deadline = database.expires.get(source)
+    field_deadlines = database.field_expires.get(source)
+    database.delete(source)
+    database.set(destination, value)
+    if deadline is not None:
+        database.expires[destination] = deadline
+    if field_deadlines:
+        database.field_expires[destination] = field_deadlines
+    return OK
+
+
+# An opaque payload, like the RDB encoding Redis uses: the value and its hash field deadlines.
+DUMP_PREFIX = b'fakeredis-dump:1:'
+
+
+@_command('DUMP', 2)
+def _dump(server, client, key):
+    database = server._db(client)
+    value = database.get(key)
+    if value is None:
+        return None
+    return DUMP_PREFIX + pickle.dumps((value, database.field_expires.get(key)))
+
+
+@_command('RESTORE', -4)
+def _restore(server, client, key, ttl, payload, *options):
+    replace = absolute = False
+    index = 0
+    while index < len(options):
+        option = options[index].upper()
+        if option == b'REPLACE':
+            replace = True
+        elif option == b'ABSTTL':
+            absolute = True
+        elif option in (b'IDLETIME', b'FREQ') and index + 1 < len(options):
+            # Eviction hints, meaningless without eviction.
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+        index += 1
+    ttl = _int(ttl)
+    if ttl < 0:
+        raise _CommandError('ERR Invalid TTL value, must be >= 0')
+    if not payload.startswith(DUMP_PREFIX):
+        raise _CommandError('ERR DUMP payload version or checksum are wrong')
+    value, field_deadlines = pickle.loads(payload[len(DUMP_PREFIX):])
+    database = server._db(client)
+    if database.exists(key) and not replace:
+        raise _CommandError('BUSYKEY Target key name already exists.')
+    deadline = (ttl if absolute else server.clock.time_ms() + ttl) if ttl else None
+    if deadline is not None and deadline <= server.clock.time_ms():
+        database.delete(key)
+        return OK
+    database.set(key, value)
+    if deadline is not None:
+        database.expires[key] = deadline
+    if field_deadlines:
+        database.field_expires[key] = field_deadlines
+    return OK
+
+
+# Strings
+
+def _string(server, client, key) -> Optional[bytes]:
+    return server._db(client).get(key, bytes)
+
+
+@_command('GET', 2)
+def _get(server, client, key):
+    return _string(server, client, key)
+
+
+@_command('SET', -3)
+def _set(server, client, key, value, *options):
+    condition, get, keep_ttl, deadline, index = None, False, False, None, 0
+    now = server.clock.time_ms()
+    while index < len(options):
+        option = options[index].upper()
+        if option in (b'NX', b'XX') and condition in (None, option):
+            condition = option
+            index += 1
+        elif option == b'GET':
+            get = True
+            index += 1
+        elif option == b'KEEPTTL' and deadline is None:
+            keep_ttl = True
+            index += 1
+        elif option in (b'EX', b'PX', b'EXAT', b'PXAT') and index + 1 < len(options) and deadline is None and not keep_ttl:
+            amount = _int(options[index + 1])
+            if amount <= 0:
+                raise _CommandError("ERR invalid expire time in 'set' command")
+            deadline = {
+                b'EX': now + amount * 1000, b'PX': now + amount,
+                b'EXAT': amount * 1000, b'PXAT': amount,
+            }[option]
+            index += 2
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    database = server._db(client)
+    old = database.get(key, bytes) if get else database.get(key)
+    if (condition == b'NX' and old is not None) or (condition == b'XX' and old is None):
+        return old if get else None
+    database.set(key, value, keep_ttl=keep_ttl)
+    if deadline is not None:
+        database.expires[key] = deadline
+    return old if get else OK
+
+
+@_command('SETNX', 3)
+def _setnx(server, client, key, value):
+    return int(_set(server, client, key, value, b'NX') is not None)
+
+
+@_command('SETEX', 4)
+def _setex(server, client, key, seconds, value):
+    return _set(server, client, key, value, b'EX', seconds)
+
+
+@_command('PSETEX', 4)
+def _psetex(server, client, key, milliseconds, value):
+    return _set(server, client, key, value, b'PX', milliseconds)
+
+
+@_command('GETSET', 3)
+def _getset(server, client, key, value):
+    return _set(server, client, key, value, b'GET')
+
+
+@_command('GETDEL', 2)
+def _getdel(server, client, key):
+    value = _string(server, client, key)
+    if value is not None:
+        server._db(client).delete(key)
+    return value
+
+
+@_command('MGET', -2, (1, -1, 1))
+def _mget(server, client, *keys):
+    database = server._db(client)
+    values = []
+    for key in keys:
+        value = database.get(key)
+        values.append(value if type(value) is bytes else None)
+    return values
+
+
+@_command('MSET', -3, (1, -1, 2))
+def _mset(server, client, *pairs):
+    if len(pairs) % 2:
+        raise _CommandError("ERR wrong number of arguments for 'mset' command")
+    database = server._db(client)
+    for index in range(0, len(pairs), 2):
+        database.set(pairs[index], pairs[index + 1])
+    return OK
+
+
+@_command('MSETNX', -3, (1, -1, 2))
+def _msetnx(server, client, *pairs):
+    if len(pairs) % 2:
+        raise _CommandError("ERR wrong number of arguments for 'msetnx' command")
+    database = server._db(client)
+    if any(database.exists(pairs[index]) for index in range(0, len(pairs), 2)):
+        return 0
+    _mset(server, client, *pairs)
+    return 1
+
+
+def _incr(server, client, key, amount: int) -> int:
+    database = server._db(client)
+    value = database.get(key, bytes)
+    try:
+        number = int(value) + amount if value is not None else amount
+    except ValueError:
+        raise _CommandError(NOT_INTEGER)
+    if not -2 ** 63 <= number < 2 ** 63:
+        raise _CommandError('ERR increment or decrement would overflow')
+    database.set(key, b'%d' % number, keep_ttl=True)
+    return number
+
+
+@_command('INCR', 2)
+def _incr1(server, client, key):
+    return _incr(server, client, key, 1)
+
+
+@_command('DECR', 2)
+def _decr1(server, client, key):
+    return _incr(server, client, key, -1)
+
+
+@_command('INCRBY', 3)
+def _incrby(server, client, key, amount):
+    return _incr(server, client, key, _int(amount))
+
+
+@_command('DECRBY', 3)
+def _decrby(server, client, key, amount):
+    return _incr(server, client, key, -_int(amount))
+
+
+@_command('INCRBYFLOAT', 3)
+def _incrbyfloat(server, client, key, amount):
+    database = server._db(client)
+    value = database.get(key, bytes)
+    number = (_float(value) if value is not None else 0.0) + _float(amount)
+    data = _format_float(number)
+    database.set(key, data, keep_ttl=True)
+    return data
+
+
+@_command('APPEND', 3)
+def _append(server, client, key, value):
+    database = server._db(client)
+    data = (database.get(key, bytes) or b'') + value
+    database.set(key, data, keep_ttl=True)
+    return len(data)
+
+
+@_command('STRLEN', 2)
+def _strlen(server, client, key):
+    return len(_string(server, client, key) or b'')
+
+
+# Bitmaps
+
+BIT_OFFSET_ERROR = 'ERR bit offset is not an integer or out of range'
+
+
+def _bit_offset(value: bytes, width: int = 1) -> int:
+    """Parse a bit offset, which BITFIELD also accepts as #N, meaning N times the field width."""
+    try:
+        offset = int(value[1:]) * width if value[:1] == b'#' else int(value)
+    except ValueError:
+        raise _CommandError(BIT_OFFSET_ERROR)
+    if not 0 <= offset < 2 ** 32:
+        raise _CommandError(BIT_OFFSET_ERROR)
+    return offset
+
+
+def _read_bits(data: bytearray, offset: int, width: int, signed: bool) -> int:
+    value = 0
+    for position in range(offset, offset + width):
+        byte = data[position >> 3] if position >> 3 < len(data) else 0
+        value = (value << 1) | ((byte >> (7 - (position & 7))) & 1)
+    if signed and value >> (width - 1):
+        value -= 1 << width
+    return value
+
+
+def _write_bits(data: bytearray, offset: int, width: int, value: int) -> None:
+    end = (offset + width + 7) >> 3
+    if len(data) < end:
+        data.extend(bytes(end - len(data)))
+    for index, position in enumerate(range(offset, offset + width)):
+        mask = 1 << (7 - (position & 7))
+        if (value >> (width - 1 - index)) & 1:
+            data[position >> 3] |= mask
+        else:
+            data[position >> 3] &= ~mask
+
+
+@_command('SETBIT', 4)
+def _setbit(server, client, key, offset, bit):
+    offset = _bit_offset(offset)
+    if bit not in (b'0', b'1'):
+        raise _CommandError('ERR bit is not an integer or out of range')
+    database = server._db(client)
+    data = bytearray(database.get(key, bytes) or b'')
+    previous = _read_bits(data, offset, 1, False)
+    _write_bits(data, offset, 1, int(bit))
+    database.set(key, bytes(data), keep_ttl=True)
+    return previous
+
+
+@_command('GETBIT', 3)
+def _getbit(server, client, key, offset):
+    return _read_bits(bytearray(_string(server, client, key) or b''), _bit_offset(offset), 1, False)
+
+
+@_command('BITCOUNT', -2)
+def _bitcount(server, client, key, *args):
+    data = _string(server, client, key) or b''
+    if not args:
+        return sum(bin(byte).count('1') for byte in data)
+    if len(args) not in (2, 3) or (len(args) == 3 and args[2].upper() not in (b'BYTE', b'BIT')):
+        raise _CommandError(SYNTAX_ERROR)
+    bits = [(byte >> (7 - index)) & 1 for byte in data for index in range(8)]
+    size = len(bits) if len(args) == 3 and args[2].upper() == b'BIT' else len(data)
+    start, end = _int(args[0]), _int(args[1])
+    start, end = max(start + size if start < 0 else start, 0), min(end + size if end < 0 else end, size - 1)
+    if start > end:
+        return 0
+    if size == len(bits):
+        return sum(bits[start:end + 1])
+    return sum(bin(byte).count('1') for byte in data[start:end + 1])
+
+
+def _bitfield_type(value: bytes) -> Tuple[bool, int]:
+    """Parse a BITFIELD type like i16 or u8 into (signed, width)."""
+    signed = value[:1].lower() == b'i'
+    try:
+        width = int(value[1:])
+    except ValueError:
+        width = 0
+    if value[:1].lower() not in (b'i', b'u') or not 1 <= width <= (64 if signed else 63):
+        raise _CommandError('ERR Invalid bitfield type. Use something like i16 u8. Note that u64 is not supported but i64 is.')
+    return signed, width
+
+
+def _bitfield_ops(server, client, key, args: Tuple[bytes, ...], read_only: bool) -> List[Optional[int]]:
+    database = server._db(client)
+    data = bytearray(database.get(key, bytes) or b'')
+    overflow, written, reply, index = b'WRAP', False, [], 0
+    while index < len(args):
+        operation = args[index].upper()
+        if operation == b'OVERFLOW' and not read_only and index + 1 < len(args):
+            overflow = args[index + 1].upper()
+            if overflow not in (b'WRAP', b'SAT', b'FAIL'):
+                raise _CommandError('ERR Invalid OVERFLOW type specified')
+            index += 2
+            continue
+        arity = 3 if operation == b'GET' else 4
+        if operation not in (b'GET', b'SET', b'INCRBY') or index + arity > len(args):
+            raise _CommandError(SYNTAX_ERROR)
+        if read_only and operation != b'GET':
+            raise _CommandError('ERR BITFIELD_RO only supports the GET subcommand')
+        signed, width = _bitfield_type(args[index + 1])
+        offset = _bit_offset(args[index + 2], width)
+        current = _read_bits(data, offset, width, signed)
+        if operation == b'GET':
+            reply.append(current)
+        else:
+            value = _int(args[index + 3])
+            value = current + value if operation == b'INCRBY' else value
+            low, high = (-(1 << (width - 1)), (1 << (width - 1)) - 1) if signed else (0, (1 << width) - 1)
+            if low <= value <= high or overflow == b'WRAP':
+                value = (value - low) % (1 << width) + low
+            elif overflow == b'SAT':
+                value = min(max(value, low), high)
+            else:
+                reply.append(None)
+                index += arity
+                continue
+            _write_bits(data, offset, width, value & ((1 << width) - 1))
+            written = True
+            reply.append(current if operation == b'SET' else value)
+        index += arity
+    if written:
+        database.set(key, bytes(data), keep_ttl=True)
+    return reply
+
+
+@_command('BITFIELD', -2)
+def _bitfield(server, client, key, *args):
+    return _bitfield_ops(server, client, key, args, read_only=False)
+
+
+@_command('BITFIELD_RO', -2)
+def _bitfield_ro(server, client, key, *args):
+    return _bitfield_ops(server, client, key, args, read_only=True)
+
+
+# HyperLogLogs
+
+def _hyperloglog(server, client, key) -> Optional[_HyperLogLog]:
+    value = server._db(client).get(key)
+    if value is not None and not isinstance(value, _HyperLogLog):
+        raise _CommandError('WRONGTYPE Key is not a valid HyperLogLog string value.')
+    return value
+
+
+@_command('PFADD', -2)
+def _pfadd(server, client, key, *elements):
+    database = server._db(client)
+    hyperloglog = _hyperloglog(server, client, key)
+    created = hyperloglog is None
+    if created:
+        hyperloglog = database.data[key] = _HyperLogLog()
+    size = len(hyperloglog)
+    hyperloglog.elements.update(elements)
+    if created or len(hyperloglog) != size:
+        database.touch(key)
+        return 1
+    return 0
+
+
+@_command('PFCOUNT', -2, (1, -1, 1))
+def _pfcount(server, client, *keys):
+    elements = set()
+    for key in keys:
+        elements.update(getattr(_hyperloglog(server, client, key), 'elements', ()))
+    return len(elements)
+
+
+@_command('PFMERGE', -2, (1, -1, 1))
+def _pfmerge(server, client, destination, *sources):
+    elements = set()
+    for key in (destination, *sources):
+        elements.update(getattr(_hyperloglog(server, client, key), 'elements', ()))
+    database = server._db(client)
+    hyperloglog = _hyperloglog(server, client, destination)
+    if hyperloglog is None:
+        hyperloglog = database.data[destination] = _HyperLogLog()
+    hyperloglog.elements = elements
+    database.touch(destination)
+    return OK
+
+
+# Hashes
+
+def _hash(server, client, key) -> Optional[dict]:
+    database = server._db(client)
+    fields = database.get(key, dict)
+    deadlines = database.field_expires.get(key)
+    if fields is None or not deadlines:
+        return fields
+    # Fields expire lazily, like keys.
+    now = server.clock.time_ms()
+    expired = [field for field, deadline in deadlines.items() if deadline <= now]
+    if not expired:
+        return fields
+    for field in expired:
+        del deadlines[field]
+        fields.pop(field, None)
+    database.changed(key)
+    return database.get(key, dict)
+
+
+@_command('HSET', -4)
+def _hset(server, client, key, *pairs):
+    if len(pairs) % 2:
+        raise _CommandError("ERR wrong number of arguments for 'hset' command")
+    database = server._db(client)
+    _hash(server, client, key)
+    fields = database.get_or_create(key, dict)
+    deadlines = database.field_expires.get(key, {})
+    added = 0
+    for index in range(0, len(pairs), 2):
+        added += pairs[index] not in fields
+        fields[pairs[index]] = pairs[index + 1]
+        # Overwriting a field clears its TTL.
+        deadlines.pop(pairs[index], None)
+    database.changed(key)
+    return added
+
+
+@_command('HMSET', -4)
+def _hmset(server, client, key, *pairs):
+    _hset(server, client, key, *pairs)
+    return OK
+
+
+@_command('HSETNX', 4)
+def _hsetnx(server, client, key, field, value):
+    fields = _hash(server, client, key)
+    if fields is not None and field in fields:
+        return 0
+    return _hset(server, client, key, field, value)
+
+
+@_command('HGET', 3)
+def _hget(server, client, key, field):
+    return (_hash(server, client, key) or {}).get(field)
+
+
+@_command('HMGET', -3)
+def _hmget(server, client, key, *fields):
+    values = _hash(server, client, key) or {}
+    return [values.get(field) for field in fields]
+
+
+@_command('HGETALL', 2)
+def _hgetall(server, client, key):
+    return _Map((_hash(server, client, key) or {}).items())
+
+
+@_command('HKEYS', 2)
+def _hkeys(server, client, key):
+    return list(_hash(server, client, key) or {})
+
+
+@_command('HVALS', 2)
+def _hvals(server, client, key):
+    return list((_hash(server, client, key) or {}).values())
+
+
+@_command('HDEL', -3)
+def _hdel(server, client, key, *fields):
+    values = _hash(server, client, key)
+    if values is None:
+        return 0
+    deleted = sum(values.pop(field, None) is not None for field in fields)
+    deadlines = server._db(client).field_expires.get(key, {})
+    for field in fields:
+        deadlines.pop(field, None)
+    if deleted:
+        server._db(client).changed(key)
+    return deleted
+
+
+@_command('HEXISTS', 3)
+def _hexists(server, client, key, field):
+    return int(field in (_hash(server, client, key) or {}))
+
+
+@_command('HLEN', 2)
+def _hlen(server, client, key):
+    return len(_hash(server, client, key) or {})
+
+
+@_command('HSTRLEN', 3)
+def _hstrlen(server, client, key, field):
+    return len((_hash(server, client, key) or {}).get(field, b''))
+
+
+@_command('HINCRBY', 4)
+def _hincrby(server, client, key, field, amount):
+    current = (_hash(server, client, key) or {}).get(field, b'0')
+    try:
+        number = int(current) + _int(amount)
+    except ValueError:
+        raise _CommandError('ERR hash value is not an integer')
+    _hset(server, client, key, field, b'%d' % number)
+    return number
+
+
+@_command('HINCRBYFLOAT', 4)
+def _hincrbyfloat(server, client, key, field, amount):
+    current = (_hash(server, client, key) or {}).get(field, b'0')
+    data = _format_float(_float(current, 'ERR hash value is not a float') + _float(amount))
+    _hset(server, client, key, field, data)
+    return data
+
+
+@_command('HSCAN', -3)
+def _hscan(server, client, key, cursor, *options):
+    match, count, extra = _scan_options(options)
+    fields = _hash(server, client, key) or {}
+    cursor, page = _scan_page(server, sorted(fields), cursor, count)
+    reply = []
+    for field in page:
+        if _matches(match, field):
+            reply.append(field)
+            if not extra.get(b'NOVALUES'):
+                reply.append(fields[field])
+    return [cursor, reply]
+
+
+def _hash_fields_argument(args: Tuple[bytes, ...]) -> Tuple[Tuple[bytes, ...], List[bytes]]:
+    """Split the arguments of the hash field TTL commands into the options and the FIELDS list."""
+    for index, arg in enumerate(args):
+        if arg.upper() == b'FIELDS':
+            if index + 1 >= len(args):
+                break
+            count = _int(args[index + 1])
+            fields = list(args[index + 2:])
+            if count <= 0 or count != len(fields):
+                raise _CommandError('ERR The `numfields` parameter must match the number of arguments')
+            return args[:index], fields
+    raise _CommandError('ERR Mandatory argument FIELDS is missing or not at the right position')
+
+
+def _hash_field_expire(server, client, key, deadline_ms: int, args: Tuple[bytes, ...]) -> List[int]:
+    options, fields = _hash_fields_argument(args)
+    if len(options) > 1 or (options and options[0].upper() not in (b'NX', b'XX', b'GT', b'LT')):
+        raise _CommandError(SYNTAX_ERROR)
+    condition = options[0].upper() if options else None
+    database = server._db(client)
+    values = _hash(server, client, key)
+    if values is None:
+        return [-2] * len(fields)
+    deadlines = database.field_expires.setdefault(key, {})
+    reply = []
+    for field in fields:
+        if field not in values:
+            reply.append(-2)
+            continue
+        current = deadlines.get(field)
+        # A field without a TTL counts as expiring at infinity.
+        if (
+            (condition == b'NX' and current is not None)
+            or (condition == b'XX' and current is None)
+            or (condition == b'GT' and (current is None or deadline_ms <= current))
+            or (condition == b'LT' and current is not None and deadline_ms >= current)
+        ):
+            reply.append(0)
+        elif deadline_ms <= server.clock.time_ms():
+            del values[field]
+            deadlines.pop(field, None)
+            reply.append(2)
+        else:
+            deadlines[field] = deadline_ms
+            reply.append(1)
+    if 1 in reply or 2 in reply:
+        database.changed(key)
+    return reply
+
+
+@_command('HEXPIRE', -6)
+def _hexpire(server, client, key, seconds, *args):
+    return _hash_field_expire(server, client, key, server.clock.time_ms() + _int(seconds) * 1000, args)
+
+
+@_command('HPEXPIRE', -6)
+def _hpexpire(server, client, key, milliseconds, *args):
+    return _hash_field_expire(server, client, key, server.clock.time_ms() + _int(milliseconds), args)
+
+
+@_command('HEXPIREAT', -6)
+def _hexpireat(server, client, key, timestamp, *args):
+    return _hash_field_expire(server, client, key, _int(timestamp) * 1000, args)
+
+
+@_command('HPEXPIREAT', -6)
+def _hpexpireat(server, client, key, timestamp, *args):
+    return _hash_field_expire(server, client, key, _int(timestamp), args)
+
+
+def _hash_field_deadlines(server, client, key, args: Tuple[bytes, ...]) -> List[int]:
+    """The deadline of each field, -2 for a missing one and -1 for one without a TTL."""
+    options, fields = _hash_fields_argument(args)
+    if options:
+        raise _CommandError(SYNTAX_ERROR)
+    values = _hash(server, client, key) or {}
+    deadlines = server._db(client).field_expires.get(key, {})
+    return [-2 if field not in values else deadlines.get(field, -1) for field in fields]
+
+
+@_command('HPERSIST', -5)
+def _hpersist(server, client, key, *args):
+    reply = []
+    for deadline, field in zip(_hash_field_deadlines(server, client, key, args), args[2:]):
+        if deadline < 0:
+            reply.append(deadline)
+        else:
+            del server._db(client).field_expires[key][field]
+            reply.append(1)
+    if 1 in reply:
+        server._db(client).touch(key)
+    return reply
+
+
+@_command('HTTL', -5)
+def _httl(server, client, key, *args):
+    now = server.clock.time_ms()
+    return [
+        deadline if deadline < 0 else (max(deadline - now, 0) + 500) // 1000
+        for deadline in _hash_field_deadlines(server, client, key, args)
+    ]
+
+
+@_command('HPTTL', -5)
+def _hpttl(server, client, key, *args):
+    now = server.clock.time_ms()
+    return [deadline if deadline < 0 else max(deadline - now, 0) for deadline in _hash_field_deadlines(server, client, key, args)]
+
+
+@_command('HEXPIRETIME', -5)
+def _hexpiretime(server, client, key, *args):
+    return [deadline if deadline < 0 else deadline // 1000 for deadline in _hash_field_deadlines(server, client, key, args)]
+
+
+@_command('HPEXPIRETIME', -5)
+def _hpexpiretime(server, client, key, *args):
+    return _hash_field_deadlines(server, client, key, args)
+
+
+# Lists
+
+def _list(server, client, key) -> Optional[deque]:
+    return server._db(client).get(key, deque)
+
+
+def _push(server, client, key, values, left: bool, only_existing: bool = False) -> int:
+    database = server._db(client)
+    if only_existing and _list(server, client, key) is None:
+        return 0
+    items = database.get_or_create(key, deque)
+    if left:
+        items.extendleft(values)
+    else:
+        items.extend(values)
+    database.changed(key)
+    return len(items)
+
+
+@_command('LPUSH', -3)
+def _lpush(server, client, key, *values):
+    return _push(server, client, key, values, left=True)
+
+
+@_command('RPUSH', -3)
+def _rpush(server, client, key, *values):
+    return _push(server, client, key, values, left=False)
+
+
+@_command('LPUSHX', -3)
+def _lpushx(server, client, key, *values):
+    return _push(server, client, key, values, left=True, only_existing=True)
+
+
+@_command('RPUSHX', -3)
+def _rpushx(server, client, key, *values):
+    return _push(server, client, key, values, left=False, only_existing=True)
+
+
+def _pop(server, client, key, left: bool, count: Optional[int] = None) -> Optional[List[bytes]]:
+    items = _list(server, client, key)
+    if items is None:
+        return None
+    popped = []
+    for _ in range(1 if count is None else min(count, len(items))):
+        popped.append(items.popleft() if left else items.pop())
+    server._db(client).changed(key)
+    return popped
+
+
+def _pop_command(server, client, key, count, left: bool):
+    if count:
+        amount = _int(count[0])
+        if amount < 0:
+            raise _CommandError('ERR value is out of range, must be positive')
+        popped = _pop(server, client, key, left, amount)
+        return NIL_ARRAY if popped is None else popped
+    popped = _pop(server, client, key, left)
+    return None if popped is None else popped[0]
+
+
+@_command('LPOP', -2)
+def _lpop(server, client, key, *count):
+    return _pop_command(server, client, key, count, left=True)
+
+
+@_command('RPOP', -2)
+def _rpop(server, client, key, *count):
+    return _pop_command(server, client, key, count, left=False)
+
+
+@_command('LLEN', 2)
+def _llen(server, client, key):
+    return len(_list(server, client, key) or ())
+
+
+def _normalize_range(start: int, stop: int, size: int) -> Tuple[int, int]:
+    """Turn inclusive, possibly negative indices into a Python slice."""
+    if start < 0:
+        start = max(size + start, 0)
+    if stop < 0:
+        stop = size + stop
+    return start, min(stop, size - 1) + 1
+
+
+@_command('LRANGE', 4)
+def _lrange(server, client, key, start, stop):
+    items = _list(server, client, key) or deque()
+    start, stop = _normalize_range(_int(start), _int(stop), len(items))
+    if start >= stop:
+        return []
+    return list(itertools.islice(items, start, stop))
+
+
+@_command('LINDEX', 3)
+def _lindex(server, client, key, index):
+    items = _list(server, client, key) or deque()
+    index = _int(index)
+    if index < 0:
+        index += len(items)
+    return items[index] if 0 <= index < len(items) else None
+
+
+@_command('LSET', 4)
+def _lset(server, client, key, index, value):
+    items = _list(server, client, key)
+    if items is None:
+        raise _CommandError('ERR no such key')
+    index = _int(index)
+    if index < 0:
+        index += len(items)
+    if not 0 <= index < len(items):
+        raise _CommandError('ERR index out of range')
+    items[index] = value
+    server._db(client).changed(key)
+    return OK
+
+
+@_command('LREM', 4)
+def _lrem(server, client, key, count, value):
+    items = _list(server, client, key)
+    count = _int(count)
+    if items is None:
+        return 0
+    values = list(items)
+    order = range(len(values) - 1, -1, -1) if count < 0 else range(len(values))
+    removed = set()
+    for index in order:
+        if values[index] == value:
+            removed.add(index)
+            if len(removed) == abs(count):
+                break
+    if removed:
+        items.clear()
+        items.extend(item for index, item in enumerate(values) if index not in removed)
+        server._db(client).changed(key)
+    return len(removed)
+
+
+@_command('LTRIM', 4)
+def _ltrim(server, client, key, start, stop):
+    items = _list(server, client, key)
+    if items is None:
+        return OK
+    start, stop = _normalize_range(_int(start), _int(stop), len(items))
+    kept = list(itertools.islice(items, start, stop)) if start < stop else []
+    items.clear()
+    items.extend(kept)
+    server._db(client).changed(key)
+    return OK
+
+
+@_command('LINSERT', 5)
+def _linsert(server, client, key, where, pivot, value):
+    where = where.upper()
+    if where not in (b'BEFORE', b'AFTER'):
+        raise _CommandError(SYNTAX_ERROR)
+    items = _list(server, client, key)
+    if items is None:
+        return 0
+    for index, item in enumerate(items):
+        if item == pivot:
+            items.insert(index if where == b'BEFORE' else index + 1, value)
+            server._db(client).changed(key)
+            return len(items)
+    return -1
+
+
+@_command('LPOS', -3)
+def _lpos(server, client, key, element, *options):
+    rank, count, maxlen, index = 1, None, 0, 0
+    while index < len(options):
+        option = options[index].upper()
+        if index + 1 >= len(options):
+            raise _CommandError(SYNTAX_ERROR)
+        value = _int(options[index + 1])
+        if option == b'RANK':
+            if value == 0:
+                raise _CommandError(
+                    "ERR RANK can't be zero: use 1 to start from the first match, "
+                    "2 from the second ... or use negative to start from the end of the list"
+                )
+            rank = value
+        elif option == b'COUNT':
+            if value < 0:
+                raise _CommandError("ERR COUNT can't be negative")
+            count = value
+        elif option == b'MAXLEN':
+            if value < 0:
+                raise _CommandError("ERR MAXLEN can't be negative")
+            maxlen = value
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+        index += 2
+    items = list(_list(server, client, key) or ())
+    positions = range(len(items)) if rank > 0 else range(len(items) - 1, -1, -1)
+    if maxlen:
+        positions = positions[:maxlen]
+    skip, matches = abs(rank) - 1, []
+    for position in positions:
+        if items[position] != element:
+            continue
+        if skip:
+            skip -= 1
+            continue
+        matches.append(position)
+        if count is None or len(matches) == count:
+            break
+    if count is None:
+        return matches[0] if matches else None
+    return matches
+
+
+def _move(server, client, source, destination, where_from: bytes, where_to: bytes) -> Optional[bytes]:
+    if where_from.upper() not in (b'LEFT', b'RIGHT') or where_to.upper() not in (b'LEFT', b'RIGHT'):
+        raise _CommandError(SYNTAX_ERROR)
+    _list(server, client, destination)
+    popped = _pop(server, client, source, where_from.upper() == b'LEFT')
+    if popped is None:
+        return None
+    _push(server, client, destination, popped, left=where_to.upper() == b'LEFT')
+    return popped[0]
+
+
+@_command('LMOVE', 5, (1, 2, 1))
+def _lmove(server, client, source, destination, where_from, where_to):
+    return _move(server, client, source, destination, where_from, where_to)
+
+
+@_command('RPOPLPUSH', 3, (1, 2, 1))
+def _rpoplpush(server, client, source, destination):
+    return _move(server, client, source, destination, b'RIGHT', b'LEFT')
+
+
+@_command('BLMOVE', 6, (1, 2, 1))
+def _blmove(server, client, source, destination, where_from, where_to, timeout):
+    timeout = _timeout(timeout)
+    return server._block(client, timeout, lambda: _move(server, client, source, destination, where_from, where_to))
+
+
+@_command('BRPOPLPUSH', 4, (1, 2, 1))
+def _brpoplpush(server, client, source, destination, timeout):
+    timeout = _timeout(timeout)
+    return server._block(client, timeout, lambda: _move(server, client, source, destination, b'RIGHT', b'LEFT'))
+
+
+def _blocking_pop(server, client, keys, timeout, left: bool):
+    timeout = _timeout(timeout)
+
+    def attempt():
+        for key in keys:
+            popped = _pop(server, client, key, left)
+            if popped is not None:
+                return [key, popped[0]]
+        return None
+    reply = server._block(client, timeout, attempt)
+    return NIL_ARRAY if reply is None else reply
+
+
+@_command('BLPOP', -3, (1, -2, 1))
+def _blpop(server, client, *args):
+    return _blocking_pop(server, client, args[:-1], args[-1], left=True)
+
+
+@_command('BRPOP', -3, (1, -2, 1))
+def _brpop(server, client, *args):
+    return _blocking_pop(server, client, args[:-1], args[-1], left=False)
+
+
+def _multi_pop(server, client, args, timeout: Optional[float]):
+    numkeys = _int(args[0])
+    if numkeys <= 0:
+        raise _CommandError('ERR numkeys should be greater than 0')
+    if len(args) < numkeys + 2:
+        raise _CommandError(SYNTAX_ERROR)
+    keys, where, options = args[1:numkeys + 1], args[numkeys + 1].upper(), args[numkeys + 2:]
+    if where not in (b'LEFT', b'RIGHT'):
+        raise _CommandError(SYNTAX_ERROR)
+    count = 1
+    if options:
+        if len(options) != 2 or options[0].upper() != b'COUNT':
+            raise _CommandError(SYNTAX_ERROR)
+        count = _int(options[1])
+        if count <= 0:
+            raise _CommandError('ERR count should be greater than 0')
+
+    def attempt():
+        for key in keys:
+            popped = _pop(server, client, key, where == b'LEFT', count)
+            if popped is not None:
+                return [key, popped]
+        return None
+    reply = attempt() if timeout is None else server._block(client, timeout, attempt)
+    return NIL_ARRAY if reply is None else reply
+
+
+@_command('LMPOP', -4, _numkeys_at(1))
+def _lmpop(server, client, *args):
+    return _multi_pop(server, client, args, None)
+
+
+@_command('BLMPOP', -5, _numkeys_at(2))
+def _blmpop(server, client, timeout, *args):
+    return _multi_pop(server, client, args, _timeout(timeout))
+
+
+# Sets
+
+def _set_members(server, client, key) -> Optional[set]:
+    return server._db(client).get(key, set)
+
+
+@_command('SADD', -3)
+def _sadd(server, client, key, *members):
+    database = server._db(client)
+    values = database.get_or_create(key, set)
+    size = len(values)
+    values.update(members)
+    database.changed(key)
+    return len(values) - size
+
+
+@_command('SREM', -3)
+def _srem(server, client, key, *members):
+    values = _set_members(server, client, key)
+    if values is None:
+        return 0
+    size = len(values)
+    values.difference_update(members)
+    if len(values) != size:
+        server._db(client).changed(key)
+    return size - len(values)
+
+
+@_command('SMEMBERS', 2)
+def _smembers(server, client, key):
+    return _Set(sorted(_set_members(server, client, key) or ()))
+
+
+@_command('SISMEMBER', 3)
+def _sismember(server, client, key, member):
+    return int(member in (_set_members(server, client, key) or ()))
+
+
+@_command('SMISMEMBER', -3)
+def _smismember(server, client, key, *members):
+    values = _set_members(server, client, key) or set()
+    return [int(member in values) for member in members]
+
+
+@_command('SCARD', 2)
+def _scard(server, client, key):
+    return len(_set_members(server, client, key) or ())
+
+
+@_command('SPOP', -2)
+def _spop(server, client, key, *count):
+    values = _set_members(server, client, key)
+    amount = _int(count[0]) if count else 1
+    if values is None:
+        return [] if count else None
+    popped = [values.pop() for _ in range(min(amount, len(values)))]
+    server._db(client).changed(key)
+    return popped if count else popped[0]
+
+
+@_command('SRANDMEMBER', -2)
+def _srandmember(server, client, key, *count):
+    values = sorted(_set_members(server, client, key) or ())
+    if not count:
+        return values[0] if values else None
+    return values[:_int(count[0])]
+
+
+@_command('SMOVE', 4, (1, 2, 1))
+def _smove(server, client, source, destination, member):
+    values = _set_members(server, client, source)
+    _set_members(server, client, destination)
+    if values is None or member not in values:
+        return 0
+    _srem(server, client, source, member)
+    _sadd(server, client, destination, member)
+    return 1
+
+
+def _combine(server, client, keys, operation) -> set:
+    result = set(_set_members(server, client, keys[0]) or ())
+    for key in keys[1:]:
+        result = operation(result, _set_members(server, client, key) or set())
+    return result
+
+
+@_command('SINTER', -2, (1, -1, 1))
+def _sinter(server, client, *keys):
+    return _Set(sorted(_combine(server, client, keys, set.intersection)))
+
+
+@_command('SUNION', -2, (1, -1, 1))
+def _sunion(server, client, *keys):
+    return _Set(sorted(_combine(server, client, keys, set.union)))
+
+
+@_command('SDIFF', -2, (1, -1, 1))
+def _sdiff(server, client, *keys):
+    return _Set(sorted(_combine(server, client, keys, set.difference)))
+
+
+@_command('SSCAN', -3)
+def _sscan(server, client, key, cursor, *options):
+    match, count, _ = _scan_options(options)
+    cursor, page = _scan_page(server, sorted(_set_members(server, client, key) or ()), cursor, count)
+    return [cursor, [member for member in page if _matches(match, member)]]
+
+
+# Sorted sets
+
+def _zset(server, client, key) -> Optional[_SortedSet]:
+    return server._db(client).get(key, _SortedSet)
+
+
+@_command('ZADD', -4)
+def _zadd(server, client, key, *args):
+    flags, index = set(), 0
+    while index < len(args) and args[index].upper() in (b'NX', b'XX', b'GT', b'LT', b'CH', b'INCR'):
+        flags.add(args[index].upper())
+        index += 1
+    pairs = args[index:]
+    if not pairs or len(pairs) % 2:
+        raise _CommandError(SYNTAX_ERROR)
+    if {b'NX', b'XX'} <= flags:
+        raise _CommandError('ERR XX and NX options at the same time are not compatible')
+    if ({b'GT', b'LT'} <= flags) or (b'NX' in flags and flags & {b'GT', b'LT'}):
+        raise _CommandError('ERR GT, LT, and/or NX options at the same time are not compatible')
+    if b'INCR' in flags and len(pairs) != 2:
+        raise _CommandError('ERR INCR option supports a single increment-element pair')
+    scores = [_float(pairs[index]) for index in range(0, len(pairs), 2)]
+    database = server._db(client)
+    zset = database.get_or_create(key, _SortedSet)
+    added = changed = 0
+    result = None
+    for score, member in zip(scores, pairs[1::2]):
+        current = zset.scores.get(member)
+        if (b'NX' in flags and current is not None) or (b'XX' in flags and current is None):
+            continue
+        if b'INCR' in flags:
+            score += current or 0.0
+        if current is not None and ((b'GT' in flags and score <= current) or (b'LT' in flags and score >= current)):
+            continue
+        if current is None:
+            added += 1
+        elif current != score:
+            changed += 1
+        zset.add(member, score)
+        result = score
+    database.changed(key)
+    if b'INCR' in flags:
+        return result
+    return added + changed if b'CH' in flags else added
+
+
+@_command('ZINCRBY', 4)
+def _zincrby(server, client, key, amount, member):
+    return _zadd(server, client, key, b'INCR', amount, member)
+
+
+@_command('ZSCORE', 3)
+def _zscore(server, client, key, member):
+    zset = _zset(server, client, key)
+    return None if zset is None else zset.scores.get(member)
+
+
+@_command('ZMSCORE', -3)
+def _zmscore(server, client, key, *members):
+    scores = (_zset(server, client, key) or _SortedSet()).scores
+    return [scores.get(member) for member in members]
+
+
+@_command('ZREM', -3)
+def _zrem(server, client, key, *members):
+    zset = _zset(server, client, key)
+    if zset is None:
+        return 0
+    removed = sum(zset.remove(member) for member in members)
+    if removed:
+        server._db(client).changed(key)
+    return removed
+
+
+@_command('ZCARD', 2)
+def _zcard(server, client, key):
+    return len(_zset(server, client, key) or ())
+
+
+def _in_score_range(score: float, low: Tuple[float, bool], high: Tuple[float, bool]) -> bool:
+    above = score > low[0] if low[1] else score >= low[0]
+    below = score < high[0] if high[1] else score <= high[0]
+    return above and below
+
+
+def _in_lex_range(member: bytes, low: Tuple[Optional[bytes], bool], high: Tuple[Optional[bytes], bool], low_raw: bytes, high_raw: bytes) -> bool:
+    if low_raw == b'+' or high_raw == b'-':
+        return False
+    above = low[0] is None or (member > low[0] if low[1] else member >= low[0])
+    below = high[0] is None or (member < high[0] if high[1] else member <= high[0])
+    return above and below
+
+
+@_command('ZCOUNT', 4)
+def _zcount(server, client, key, low, high):
+    low, high = _score_bound(low), _score_bound(high)
+    ordered = (_zset(server, client, key) or _SortedSet()).ordered()
+    return sum(_in_score_range(score, low, high) for score, _ in ordered)
+
+
+@_command('ZLEXCOUNT', 4)
+def _zlexcount(server, client, key, low, high):
+    bounds = _lex_bound(low), _lex_bound(high)
+    ordered = (_zset(server, client, key) or _SortedSet()).ordered()
+    return sum(_in_lex_range(member, *bounds, low, high) for _, member in ordered)
+
+
+def _zrank(server, client, key, member, options, reverse: bool):
+    zset = _zset(server, client, key)
+    with_score = bool(options) and options[0].upper() == b'WITHSCORE'
+    if options and (len(options) > 1 or not with_score):
+        raise _CommandError(SYNTAX_ERROR)
+    rank = None if zset is None else zset.rank(member)
+    if rank is None:
+        return NIL_ARRAY if with_score else None
+    if reverse:
+        rank = len(zset) - 1 - rank
+    return [rank, zset.scores[member]] if with_score else rank
+
+
+@_command('ZRANK', -3)
+def _zrank_ascending(server, client, key, member, *options):
+    return _zrank(server, client, key, member, options, reverse=False)
+
+
+@_command('ZREVRANK', -3)
+def _zrevrank(server, client, key, member, *options):
+    return _zrank(server, client, key, member, options, reverse=True)
+
+
+def _zrange_reply(items: List[Tuple[float, bytes]], with_scores: bool) -> List[Any]:
+    if with_scores:
+        return _Pairs((member, score) for score, member in items)
+    return [member for _, member in items]
+
+
+def _zrange_generic(server, client, key, start, stop, by: bytes, reverse: bool, offset: int, count: int) -> List[Tuple[float, bytes]]:
+    """Select sorted set entries; for REV the bounds come from high to low, as in ZRANGE."""
+    ordered = (_zset(server, client, key) or _SortedSet()).ordered()
+    if by == b'RANK':
+        items = ordered[::-1] if reverse else ordered
+        first, last = _normalize_range(_int(start), _int(stop), len(items))
+        return items[first:last] if first < last else []
+    low, high = (stop, start) if reverse else (start, stop)
+    if by == b'SCORE':
+        low_bound, high_bound = _score_bound(low), _score_bound(high)
+        items = [item for item in ordered if _in_score_range(item[0], low_bound, high_bound)]
+    else:
+        bounds = _lex_bound(low), _lex_bound(high)
+        items = [item for item in ordered if _in_lex_range(item[1], *bounds, low, high)]
+    if reverse:
+        items.reverse()
+    if offset < 0:
+        return []
+    items = items[offset:]
+    return items if count < 0 else items[:count]
+
+
+def _zrange_options(options, allowed: Set[bytes]) -> Dict[bytes, Any]:
+    parsed, index = {}, 0
+    while index < len(options):
+        option = options[index].upper()
+        if option not in allowed:
+            raise _CommandError(SYNTAX_ERROR)
+        if option == b'LIMIT':
+            if index + 2 >= len(options):
+                raise _CommandError(SYNTAX_ERROR)
+            parsed[option] = (_int(options[index + 1]), _int(options[index + 2]))
+            index += 3
+        else:
+            parsed[option] = True
+            index += 1
+    return parsed
+
+
+@_command('ZRANGE', -4)
+def _zrange(server, client, key, start, stop, *options):
+    parsed = _zrange_options(options, {b'BYSCORE', b'BYLEX', b'REV', b'LIMIT', b'WITHSCORES'})
+    if b'BYSCORE' in parsed and b'BYLEX' in parsed:
+        raise _CommandError(SYNTAX_ERROR)
+    by = b'SCORE' if b'BYSCORE' in parsed else b'LEX' if b'BYLEX' in parsed else b'RANK'
+    if b'LIMIT' in parsed and by == b'RANK':
+        raise _CommandError('ERR syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX')
+    if b'WITHSCORES' in parsed and by == b'LEX':
+        raise _CommandError('ERR syntax error, WITHSCORES not supported in combination with BYLEX')
+    offset, count = parsed.get(b'LIMIT', (0, -1))
+    items = _zrange_generic(server, client, key, start, stop, by, b'REV' in parsed, offset, count)
+    return _zrange_reply(items, b'WITHSCORES' in parsed)
+
+
+@_command('ZREVRANGE', -4)
+def _zrevrange(server, client, key, start, stop, *options):
+    parsed = _zrange_options(options, {b'WITHSCORES'})
+    items = _zrange_generic(server, client, key, start, stop, b'RANK', True, 0, -1)
+    return _zrange_reply(items, b'WITHSCORES' in parsed)
+
+
+def _zrange_by(server, client, key, low, high, options, by: bytes, reverse: bool):
+    allowed = {b'LIMIT', b'WITHSCORES'} if by == b'SCORE' else {b'LIMIT'}
+    parsed = _zrange_options(options, allowed)
+    offset, count = parsed.get(b'LIMIT', (0, -1))
+    # ZREVRANGEBY* take the bounds from high to low, like ZRANGE REV.
+    items = _zrange_generic(server, client, key, low, high, by, reverse, offset, count)
+    return _zrange_reply(items, b'WITHSCORES' in parsed)
+
+
+@_command('ZRANGEBYSCORE', -4)
+def _zrangebyscore(server, client, key, low, high, *options):
+    return _zrange_by(server, client, key, low, high, options, b'SCORE', False)
+
+
+@_command('ZREVRANGEBYSCORE', -4)
+def _zrevrangebyscore(server, client, key, high, low, *options):
+    return _zrange_by(server, client, key, high, low, options, b'SCORE', True)
+
+
+@_command('ZRANGEBYLEX', -4)
+def _zrangebylex(server, client, key, low, high, *options):
+    return _zrange_by(server, client, key, low, high, options, b'LEX', False)
+
+
+@_command('ZREVRANGEBYLEX', -4)
+def _zrevrangebylex(server, client, key, high, low, *options):
+    return _zrange_by(server, client, key, high, low, options, b'LEX', True)
+
+
+def _zremove(server, client, key, items) -> int:
+    zset = _zset(server, client, key)
+    for _, member in items:
+        zset.remove(member)
+    if items:
+        server._db(client).changed(key)
+    return len(items)
+
+
+@_command('ZREMRANGEBYSCORE', 4)
+def _zremrangebyscore(server, client, key, low, high):
+    return _zremove(server, client, key, _zrange_generic(server, client, key, low, high, b'SCORE', False, 0, -1))
+
+
+@_command('ZREMRANGEBYRANK', 4)
+def _zremrangebyrank(server, client, key, start, stop):
+    return _zremove(server, client, key, _zrange_generic(server, client, key, start, stop, b'RANK', False, 0, -1))
+
+
+def _zpop(server, client, key, count, reverse: bool):
+    amount = _int(count[0]) if count else 1
+    if amount < 0:
+        raise _CommandError('ERR value is out of range, must be positive')
+    items = _zrange_generic(server, client, key, b'0', b'%d' % (amount - 1), b'RANK', reverse, 0, -1) if amount else []
+    _zremove(server, client, key, items)
+    if not count:
+        return [value for score, member in items for value in (member, score)]
+    return _zrange_reply(items, True)
+
+
+@_command('ZPOPMIN', -2)
+def _zpopmin(server, client, key, *count):
+    return _zpop(server, client, key, count, reverse=False)
+
+
+@_command('ZPOPMAX', -2)
+def _zpopmax(server, client, key, *count):
+    return _zpop(server, client, key, count, reverse=True)
+
+
+@_command('ZSCAN', -3)
+def _zscan(server, client, key, cursor, *options):
+    match, count, _ = _scan_options(options)
+    zset = _zset(server, client, key) or _SortedSet()
+    cursor, page = _scan_page(server, sorted(zset.scores), cursor, count)
+    return [cursor, [value for member in page if _matches(match, member) for value in (member, _format_float(zset.scores[member]))]]
+
+
+# Streams
+
+def _stream(server, client, key) -> Optional[_Stream]:
+    return server._db(client).get(key, _Stream)
+
+
+def _entries_reply(entries) -> List[Any]:
+    return [[_format_id(stream_id), fields] for stream_id, fields in entries]
+
+
+def _trim_options(options, index: int) -> Tuple[Dict[str, Any], int]:
+    """Parse MAXLEN|MINID [=|~] threshold [LIMIT count] starting at index."""
+    strategy = options[index].upper()
+    index += 1
+    if index < len(options) and options[index] in (b'=', b'~'):
+        index += 1
+    if index >= len(options):
+        raise _CommandError(SYNTAX_ERROR)
+    if strategy == b'MAXLEN':
+        maxlen = _int(options[index])
+        if maxlen < 0:
+            raise _CommandError('ERR The MAXLEN argument must be >= 0.')
+        trim = {'maxlen': maxlen}
+    else:
+        trim = {'minid': _parse_id(options[index])}
+    index += 1
+    if index + 1 < len(options) and options[index].upper() == b'LIMIT':
+        # Exact trimming never leaves more entries than asked, so LIMIT is moot.
+        _int(options[index + 1])
+        index += 2
+    return trim, index
+
+
+@_command('XADD', -5)
+def _xadd(server, client, key, *args):
+    no_create, trim, index = False, None, 0
+    while index < len(args):
+        option = args[index].upper()
+        if option == b'NOMKSTREAM':
+            no_create = True
+            index += 1
+        elif option in (b'MAXLEN', b'MINID'):
+            trim, index = _trim_options(args, index)
+        else:
+            break
+    if index >= len(args):
+        raise _CommandError(SYNTAX_ERROR)
+    requested, fields = args[index], list(args[index + 1:])
+    if not fields or len(fields) % 2:
+        raise _CommandError("ERR wrong number of arguments for 'xadd' command")
+    database = server._db(client)
+    stream = database.get(key, _Stream)
+    if stream is None:
+        if no_create:
+            return None
+        stream = _Stream()
+    now = server.clock.time_ms()
+    if requested == b'*':
+        stream_id = stream.next_id(now)
+    elif requested.endswith(b'-*'):
+        ms = _parse_id(requested[:-2])[0]
+        stream_id = (ms, stream.last_id[1] + 1) if ms == stream.last_id[0] else (ms, 0)
+    else:
+        stream_id = _parse_id(requested)
+    if stream_id == (0, 0):
+        raise _CommandError('ERR The ID specified in XADD must be greater than 0-0')
+    if stream_id <= stream.last_id:
+        raise _CommandError('ERR The ID specified in XADD is equal or smaller than the target stream top item')
+    if database.get(key) is None:
+        database.data[key] = stream
+    stream.add(stream_id, fields)
+    if trim is not None:
+        stream.trim(**trim)
+    database.changed(key)
+    return _format_id(stream_id)
+
+
+@_command('XTRIM', -4)
+def _xtrim(server, client, key, *options):
+    if options[0].upper() not in (b'MAXLEN', b'MINID'):
+        raise _CommandError(SYNTAX_ERROR)
+    trim, index = _trim_options(options, 0)
+    if index != len(options):
+        raise _CommandError(SYNTAX_ERROR)
+    stream = _stream(server, client, key)
+    if stream is None:
+        return 0
+    trimmed = stream.trim(**trim)
+    if trimmed:
+        server._db(client).changed(key)
+    return trimmed
+
+
+@_command('XDEL', -3)
+def _xdel(server, client, key, *ids):
+    stream = _stream(server, client, key)
+    parsed = [_parse_id(stream_id) for stream_id in ids]
+    if stream is None:
+        return 0
+    deleted = sum(stream.delete(stream_id) for stream_id in parsed)
+    if deleted:
+        server._db(client).changed(key)
+    return deleted
+
+
+@_command('XLEN', 2)
+def _xlen(server, client, key):
+    return len(_stream(server, client, key) or ())
+
+
+def _count_option(options) -> Optional[int]:
+    if not options:
+        return None
+    if len(options) != 2 or options[0].upper() != b'COUNT':
+        raise _CommandError(SYNTAX_ERROR)
+    count = _int(options[1])
+    return max(count, 0)
+
+
+@_command('XRANGE', -4)
+def _xrange(server, client, key, start, end, *options):
+    count = _count_option(options)
+    stream = _stream(server, client, key) or _Stream()
+    return _entries_reply(stream.range(_range_start(start), _range_end(end), count))
+
+
+@_command('XREVRANGE', -4)
+def _xrevrange(server, client, key, end, start, *options):
+    count = _count_option(options)
+    stream = _stream(server, client, key) or _Stream()
+    return _entries_reply(stream.range(_range_start(start), _range_end(end), count, reverse=True))
+
+
+def _read_options(args, group: bool) -> Tuple[Dict[bytes, Any], List[bytes], List[bytes]]:
+    options, index = {}, 0
+    while index < len(args):
+        option = args[index].upper()
+        if option == b'STREAMS':
+            rest = args[index + 1:]
+            if not rest or len(rest) % 2:
+                raise _CommandError(
+                    "ERR Unbalanced 'xreadgroup' list of streams: for each stream key an ID or '>' must be specified."
+                    if group else
+                    "ERR Unbalanced 'xread' list of streams: for each stream key an ID or '$' must be specified."
+                )
+            half = len(rest) // 2
+            return options, list(rest[:half]), list(rest[half:])
+        if option == b'COUNT' and index + 1 < len(args):
+            options[b'COUNT'] = max(_int(args[index + 1]), 0) or None
+            index += 2
+        elif option == b'BLOCK' and index + 1 < len(args):
+            block = _int(args[index + 1])
+            if block < 0:
+                raise _CommandError('ERR timeout is negative')
+            options[b'BLOCK'] = block
+            index += 2
+        elif option == b'GROUP' and group and index + 2 < len(args):
+            options[b'GROUP'] = (args[index + 1], args[index + 2])
+            index += 3
+        elif option == b'NOACK' and group:
+            options[b'NOACK'] = True
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    raise _CommandError(SYNTAX_ERROR)
+
+
+@_command('XREAD', -4, _stream_keys)
+def _xread(server, client, *args):
+    options, keys, ids = _read_options(args, group=False)
+    starts = []
+    for key, stream_id in zip(keys, ids):
+        stream = _stream(server, client, key)
+        if stream_id == b'$':
+            starts.append(stream.last_id if stream is not None else (0, 0))
+        else:
+            starts.append(_parse_id(stream_id))
+    count = options.get(b'COUNT')
+
+    def attempt():
+        reply = []
+        for key, start in zip(keys, starts):
+            stream = _stream(server, client, key)
+            entries = stream.after(start, count) if stream is not None else []
+            if entries:
+                reply.append((key, _entries_reply(entries)))
+        return _Map(reply) if reply else None
+    if b'BLOCK' in options:
+        reply = server._block(client, options[b'BLOCK'] / 1000, attempt)
+    else:
+        reply = attempt()
+    return NIL_ARRAY if reply is None else reply
+
+
+def _group(server, client, key, name, command: str) -> Tuple[_Stream, _Group]:
+    stream = _stream(server, client, key)
+    group = stream.groups.get(name) if stream is not None else None
+    if group is None:
+        key_name, group_name = key.decode('utf-8', 'replace'), name.decode('utf-8', 'replace')
+        raise _CommandError(f"NOGROUP No such key '{key_name}' or consumer group '{group_name}'{command}")
+    return stream, group
+
+
+@_command('XREADGROUP', -7, _stream_keys)
+def _xreadgroup(server, client, *args):
+    options, keys, ids = _read_options(args, group=True)
+    if b'GROUP' not in options:
+        raise _CommandError('ERR Missing GROUP option for XREADGROUP')
+    name, consumer = options[b'GROUP']
+    count, no_ack = options.get(b'COUNT'), options.get(b'NOACK', False)
+    for key in keys:
+        _group(server, client, key, name, ' in XREADGROUP with GROUP option')
+    history = any(stream_id != b'>' for stream_id in ids)
+    parsed = [None if stream_id == b'>' else _parse_id(stream_id) for stream_id in ids]
+
+    def attempt():
+        now, reply = server.clock.time_ms(), []
+        for key, start in zip(keys, parsed):
+            stream, group = _group(server, client, key, name, ' in XREADGROUP with GROUP option')
+            group.consumers[consumer] = now
+            if start is None:
+                entries = stream.after(group.last_id, count)
+                if not entries:
+                    continue
+                group.last_id = entries[-1][0]
+                if not no_ack:
+                    for stream_id, _ in entries:
+                        group.pending[stream_id] = [consumer, now, 1]
+                server._dirty = True
+                reply.append((key, _entries_reply(entries)))
+            else:
+                entries = []
+                for stream_id, pending in group.sorted_pending():
+                    if pending[0] != consumer or stream_id <= start:
+                        continue
+                    pending[1], pending[2] = now, pending[2] + 1
+                    entries.append([_format_id(stream_id), stream.entries.get(stream_id)])
+                    if count is not None and len(entries) == count:
+                        break
+                reply.append((key, entries))
+        return _Map(reply) if reply else None
+    if b'BLOCK' in options and not history:
+        reply = server._block(client, options[b'BLOCK'] / 1000, attempt)
+    else:
+        reply = attempt()
+    return NIL_ARRAY if reply is None else reply
+
+
+@_command('XACK', -4)
+def _xack(server, client, key, name, *ids):
+    parsed = [_parse_id(stream_id) for stream_id in ids]
+    stream = _stream(server, client, key)
+    group = stream.groups.get(name) if stream is not None else None
+    if group is None:
+        return 0
+    acked = sum(group.pending.pop(stream_id, None) is not None for stream_id in parsed)
+    return acked
+
+
+@_command('XGROUP', -2, (2, 2, 1))
+def _xgroup(server, client, subcommand, *args):
+    subcommand = subcommand.upper()
+    if subcommand == b'CREATE' and len(args) >= 3:
+        key, name, start = args[:3]
+        options = {option.upper() for option in args[3:] if option.upper() == b'MKSTREAM'}
+        database = server._db(client)
+        stream = database.get(key, _Stream)
+        if stream is None:
+            if b'MKSTREAM' not in options:
+                raise _CommandError(
+                    'ERR The XGROUP subcommand requires the key to exist. Note that for CREATE '
+                    'you may want to use the MKSTREAM option to create an empty stream automatically.'
+                )
+            stream = database.data[key] = _Stream()
+        if name in stream.groups:
+            raise _CommandError('BUSYGROUP Consumer Group name already exists')
+        stream.groups[name] = _Group(stream.last_id if start == b'$' else _parse_id(start))
+        database.touch(key)
+        return OK
+    if subcommand == b'DESTROY' and len(args) == 2:
+        stream = _stream(server, client, args[0])
+        if stream is None:
+            raise _CommandError('ERR The XGROUP subcommand requires the key to exist.')
+        return int(stream.groups.pop(args[1], None) is not None)
+    if subcommand == b'CREATECONSUMER' and len(args) == 3:
+        _, group = _group(server, client, args[0], args[1], ' for CREATECONSUMER')
+        if args[2] in group.consumers:
+            return 0
+        group.consumers[args[2]] = server.clock.time_ms()
+        return 1
+    if subcommand == b'DELCONSUMER' and len(args) == 3:
+        _, group = _group(server, client, args[0], args[1], ' for DELCONSUMER')
+        owned = [stream_id for stream_id, pending in group.pending.items() if pending[0] == args[2]]
+        for stream_id in owned:
+            del group.pending[stream_id]
+        group.consumers.pop(args[2], None)
+        return len(owned)
+    if subcommand == b'SETID' and len(args) >= 3:
+        stream, group = _group(server, client, args[0], args[1], ' for SETID')
+        group.last_id = stream.last_id if args[2] == b'$' else _parse_id(args[2])
+        return OK
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try XGROUP HELP.")
+
+
+@_command('XPENDING', -3)
+def _xpending(server, client, key, name, *args):
+    stream, group = _group(server, client, key, name, '')
+    pending = group.sorted_pending()
+    if not args:
+        if not pending:
+            return [0, None, None, NIL_ARRAY]
+        owners: Dict[bytes, int] = {}
+        for _, (consumer, _, _) in pending:
+            owners[consumer] = owners.get(consumer, 0) + 1
+        return [
+            len(pending), _format_id(pending[0][0]), _format_id(pending[-1][0]),
+            [[consumer, b'%d' % count] for consumer, count in sorted(owners.items())],
+        ]
+    min_idle, args = 0, list(args)
+    if args[0].upper() == b'IDLE':
+        if len(args) < 2:
+            raise _CommandError(SYNTAX_ERROR)
+        min_idle, args = _int(args[1]), args[2:]
+    if len(args) not in (3, 4):
+        raise _CommandError(SYNTAX_ERROR)
+    start, end, count = _range_start(args[0]), _range_end(args[1]), _int(args[2])
+    consumer = args[3] if len(args) == 4 else None
+    now, reply = server.clock.time_ms(), []
+    for stream_id, (owner, delivered, deliveries) in pending:
+        if len(reply) >= count:
+            break
+        if not start <= stream_id <= end or (consumer is not None and owner != consumer):
+            continue
+        if now - delivered < min_idle:
+            continue
+        reply.append([_format_id(stream_id), owner, now - delivered, deliveries])
+    return reply
+
+
+@_command('XAUTOCLAIM', -6)
+def _xautoclaim(server, client, key, name, consumer, min_idle, start, *options):
+    min_idle, start = _int(min_idle), _range_start(start)
+    count, just_id, index = 100, False, 0
+    while index < len(options):
+        option = options[index].upper()
+        if option == b'COUNT' and index + 1 < len(options):
+            count = _int(options[index + 1])
+            if count < 1:
+                raise _CommandError('ERR COUNT must be > 0')
+            index += 2
+        elif option == b'JUSTID':
+            just_id = True
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    stream, group = _group(server, client, key, name, '')
+    now, claimed, deleted, cursor = server.clock.time_ms(), [], [], (0, 0)
+    candidates = [item for item in group.sorted_pending() if item[0] >= start]
+    for stream_id, pending in candidates:
+        if len(claimed) + len(deleted) >= count:
+            cursor = stream_id
+            break
+        if now - pending[1] < min_idle:
+            continue
+        if stream_id not in stream.entries:
+            del group.pending[stream_id]
+            deleted.append(_format_id(stream_id))
+            continue
+        pending[0], pending[1] = consumer, now
+        if not just_id:
+            pending[2] += 1
+        claimed.append(stream_id)
+    group.consumers.setdefault(consumer, now)
+    if just_id:
+        entries = [_format_id(stream_id) for stream_id in claimed]
+    else:
+        entries = _entries_reply((stream_id, stream.entries[stream_id]) for stream_id in claimed)
+    return [_format_id(cursor), entries, deleted]
+
+
+@_command('XCLAIM', -6)
+def _xclaim(server, client, key, name, consumer, min_idle, *args):
+    min_idle, ids, index = _int(min_idle), [], 0
+    while index < len(args) and args[index].upper() not in (b'IDLE', b'TIME', b'RETRYCOUNT', b'FORCE', b'JUSTID', b'LASTID'):
+        ids.append(_parse_id(args[index]))
+        index += 1
+    now = server.clock.time_ms()
+    delivered, retry_count, force, just_id = now, None, False, False
+    while index < len(args):
+        option = args[index].upper()
+        if option in (b'IDLE', b'TIME', b'RETRYCOUNT', b'LASTID') and index + 1 < len(args):
+            if option == b'IDLE':
+                delivered = now - _int(args[index + 1])
+            elif option == b'TIME':
+                delivered = _int(args[index + 1])
+            elif option == b'RETRYCOUNT':
+                retry_count = _int(args[index + 1])
+            index += 2
+        elif option in (b'FORCE', b'JUSTID'):
+            force, just_id = force or option == b'FORCE', just_id or option == b'JUSTID'
+            index += 1
+        else:
+            raise _CommandError(SYNTAX_ERROR)
+    stream, group = _group(server, client, key, name, '')
+    claimed = []
+    for stream_id in ids:
+        pending = group.pending.get(stream_id)
+        if pending is None:
+            if not force or stream_id not in stream.entries:
+                continue
+            pending = group.pending[stream_id] = [consumer, now, 0]
+        elif stream_id not in stream.entries:
+            del group.pending[stream_id]
+            continue
+        elif now - pending[1] < min_idle:
+            continue
+        pending[0], pending[1] = consumer, delivered
+        if retry_count is not None:
+            pending[2] = retry_count
+        elif not just_id:
+            pending[2] += 1
+        claimed.append(stream_id)
+    group.consumers.setdefault(consumer, now)
+    if just_id:
+        return [_format_id(stream_id) for stream_id in claimed]
+    return _entries_reply((stream_id, stream.entries[stream_id]) for stream_id in claimed)
+
+
+@_command('XINFO', -3, (2, 2, 1))
+def _xinfo(server, client, subcommand, key, *args):
+    subcommand = subcommand.upper()
+    stream = _stream(server, client, key)
+    if stream is None:
+        raise _CommandError('ERR no such key')
+    if subcommand == b'GROUPS':
+        reply = []
+        for name, group in stream.groups.items():
+            lag = stream.lag(group)
+            reply.append(_map(
+                b'name', name, b'consumers', len(group.consumers), b'pending', len(group.pending),
+                b'last-delivered-id', _format_id(group.last_id),
+                b'entries-read', stream.entries_added - lag, b'lag', lag,
+            ))
+        return reply
+    if subcommand == b'CONSUMERS' and len(args) == 1:
+        _, group = _group(server, client, key, args[0], '')
+        now, reply = server.clock.time_ms(), []
+        for name, seen in group.consumers.items():
+            owned = sum(1 for pending in group.pending.values() if pending[0] == name)
+            reply.append(_map(b'name', name, b'pending', owned, b'idle', now - seen, b'inactive', now - seen))
+        return reply
+    if subcommand == b'STREAM':
+        first = stream.range((0, 0), MAX_ID, 1)
+        last = stream.range((0, 0), MAX_ID, 1, reverse=True)
+        return _map(
+            b'length', len(stream), b'radix-tree-keys', 1, b'radix-tree-nodes', 2,
+            b'last-generated-id', _format_id(stream.last_id),
+            b'max-deleted-entry-id', _format_id(stream.max_deleted_id),
+            b'entries-added', stream.entries_added,
+            b'recorded-first-entry-id', _format_id(first[0][0]) if first else b'0-0',
+            b'groups', len(stream.groups),
+            b'first-entry', _entries_reply(first)[0] if first else None,
+            b'last-entry', _entries_reply(last)[0] if last else None,
+        )
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try XINFO HELP.")
+
+
+# Pub/sub
+
+@_command('PUBLISH', 3, None)
+def _publish(server, client, channel, message):
+    return server._publish(channel, message)
+
+
+def _subscribe(client, targets: Set[bytes], kind: bytes, names) -> _Replies:
+    replies = _Replies()
+    for name in names:
+        targets.add(name)
+        replies.append(_Push([kind, name, client.subscriptions]))
+    return replies
+
+
+def _unsubscribe(client, targets: Set[bytes], kind: bytes, names) -> _Replies:
+    replies = _Replies()
+    for name in names or sorted(targets):
+        targets.discard(name)
+        replies.append(_Push([kind, name, client.subscriptions]))
+    if not replies:
+        replies.append(_Push([kind, None, client.subscriptions]))
+    return replies
+
+
+@_command('SUBSCRIBE', -2, None)
+def _subscribe_channels(server, client, *channels):
+    return _subscribe(client, client.channels, b'subscribe', channels)
+
+
+@_command('PSUBSCRIBE', -2, None)
+def _subscribe_patterns(server, client, *patterns):
+    return _subscribe(client, client.patterns, b'psubscribe', patterns)
+
+
+@_command('UNSUBSCRIBE', -1, None)
+def _unsubscribe_channels(server, client, *channels):
+    return _unsubscribe(client, client.channels, b'unsubscribe', channels)
+
+
+@_command('PUNSUBSCRIBE', -1, None)
+def _unsubscribe_patterns(server, client, *patterns):
+    return _unsubscribe(client, client.patterns, b'punsubscribe', patterns)
+
+
+@_command('PUBSUB', -2, None)
+def _pubsub(server, client, subcommand, *args):
+    subcommand = subcommand.upper()
+    clients = list(server._clients.values())
+    if subcommand == b'CHANNELS':
+        pattern = args[0] if args else None
+        return sorted({channel for other in clients for channel in other.channels if _matches(pattern, channel)})
+    if subcommand == b'NUMSUB':
+        return [item for channel in args for item in (channel, sum(channel in other.channels for other in clients))]
+    if subcommand == b'NUMPAT':
+        return sum(len(other.patterns) for other in clients)
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try PUBSUB HELP.")
+
+
+# Transactions
+
+@_command('MULTI', 1, None)
+def _multi(server, client):
+    if client.multi is not None:
+        raise _CommandError('ERR MULTI calls can not be nested')
+    client.multi, client.multi_failed = [], False
+    return OK
+
+
+@_command('DISCARD', 1, None)
+def _discard(server, client):
+    if client.multi is None:
+        raise _CommandError('ERR DISCARD without MULTI')
+    client.multi, client.watched = None, {}
+    return OK
+
+
+@_command('EXEC', 1, None)
+def _exec(server, client):
+    if client.multi is None:
+        raise _CommandError('ERR EXEC without MULTI')
+    queued, failed, watched = client.multi, client.multi_failed, client.watched
+    client.multi, client.watched = None, {}
+    if failed:
+        raise _CommandError('EXECABORT Transaction discarded because of previous errors.')
+    for (index, key), version in watched.items():
+        database = server._databases[index]
+        database.get(key)
+        if database.versions.get(key, 0) != version:
+            return NIL_ARRAY
+    client.no_block = True
+    try:
+        return [server._call(client, args[0].upper(), args) for args in queued]
+    finally:
+        client.no_block = False
+
+
+@_command('WATCH', -2, (1, -1, 1))
+def _watch(server, client, *keys):
+    if client.multi is not None:
+        raise _CommandError('ERR WATCH inside MULTI is not allowed')
+    database = server._db(client)
+    for key in keys:
+        database.get(key)
+        client.watched[(database.index, key)] = database.versions.get(key, 0)
+    return OK
+
+
+@_command('UNWATCH', 1, None)
+def _unwatch(server, client):
+    client.watched = {}
+    return OK
+
+
+# Scripting
+
+@_command('EVAL', -3, _numkeys_at(2))
+def _eval(server, client, source, numkeys, *args):
+    return server._run_script(client, server._load_script(source), numkeys, args)
+
+
+@_command('EVALSHA', -3, _numkeys_at(2))
+def _evalsha(server, client, sha, numkeys, *args):
+    return server._run_script(client, sha.decode('utf-8', 'replace').lower(), numkeys, args)
+
+
+_command('EVAL_RO', -3)(_eval)
+_command('EVALSHA_RO', -3)(_evalsha)
+
+
+@_command('SCRIPT', -2, None)
+def _script(server, client, subcommand, *args):
+    subcommand = subcommand.upper()
+    if subcommand == b'LOAD' and len(args) == 1:
+        return server._load_script(args[0]).encode()
+    if subcommand == b'EXISTS' and args:
+        return [int(sha.decode('utf-8', 'replace').lower() in server._scripts) for sha in args]
+    if subcommand == b'FLUSH':
+        server._scripts.clear()
+        return OK
+    raise _CommandError(f"ERR unknown subcommand '{subcommand.decode('utf-8', 'replace')}'. Try SCRIPT HELP.")
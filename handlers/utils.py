@@ -0,0 +1,46 @@
+import re
+import redis
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+
+T = TypeVar('T')
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_unsupported_command(err: redis.exceptions.ResponseError) -> bool:
+    """Tell whether the server rejected a command, or a form of it, that it does not know."""
+    message = str(err).lower()
+    return 'unknown command' in message or 'wrong number of arguments' in message
+
+
+def escape_pattern(value: str) -> str:
+    """Escape glob characters so a string matches itself in SCAN MATCH patterns."""
+    return re.sub(r'([*?\[\]\\])', r'\\\1', value)
+
+
+def hash_tag(name: str) -> str:
+    """
+    Return a prefix for keys that must live in the same Redis Cluster slot as name.
+
+    Keys starting with '{name}' hash like the key name itself, so a handler
+    can keep its main key unchanged and still put its other keys next to it.
+    A name that already holds a hash tag is returned as is.
+    """
+    start = name.find('{')
+    if start != -1:
+        end = name.find('}', start + 1)
+        if end > start + 1:
+            return name
+    if '{' in name or '}' in name:
+        raise ValueError(f'{name!r} has braces but no hash tag, so no other key can share its slot')
+    return f'{{{name}}}'
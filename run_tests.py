@@ -1,6 +1,15 @@
+import os
+import sys
+import hashlib
 import json
+import time
+import threading
+import asyncio
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+import redis
 from handlers.queue import RedisQueue
+from handlers.reliable_queue import RedisReliableQueue
 from handlers.stack import RedisStack
 from handlers.hashset import RedisHashSet
 from handlers.key_value import RedisKeyValue
@@ -8,9 +17,51 @@ from handlers.list import RedisList
 from handlers.set import RedisSet
 from handlers.sorted_set import RedisSortedSet
 from handlers.stream import RedisStream
+from handlers.stream_consumer import StreamConsumer
+from handlers.stream_producer import StreamProducer
 from handlers.pubsub import RedisPubSub
+from handlers.connection import ConnectionRegistry, registry
+from handlers import aio
+from handlers.batch import Batch, BatchError, _ReplayClient
+from handlers.near_cache import NearCache
+from handlers.instrumentation import CallbackExporter, Metrics
+from handlers.testing import FakeRedisServer
+from handlers.bloom_filter import RedisBloomFilter
+from handlers.hyperloglog import RedisHyperLogLog
+from handlers.bucketed_key_value import BucketedKeyValue, migrate_to_buckets
+from handlers.cache import cached
+from handlers.scripts import BUILTIN_SCRIPTS
+from handlers.sharding import HashRing, ShardedKeyValue
+from handlers.utils import hash_tag
+from handlers.codec import CompressedCodec, FastJSONCodec, JSONCodec, PickleCodec, get_codec
 
 
+# The tests run against an in-process FakeRedisServer, one per process.
+# Set REDIS_LIVE=1 to use the Redis server on localhost:6379 instead.
+SERVER = None
+
+
+def setUpModule():
+    global SERVER
+    if os.environ.get('REDIS_LIVE') != '1':
+        SERVER = FakeRedisServer().start()
+        SERVER.install()
+
+
+def tearDownModule():
+    global SERVER
+    if SERVER is not None:
+        SERVER.stop()
+        SERVER = None
+
+
+def advance(seconds):
+    """Let time pass on the server: instantly on the fake server, by sleeping on a live one."""
+    if SERVER is None:
+        time.sleep(seconds)
+    else:
+        SERVER.clock.advance(seconds)
+
 
 class TestRedisQueue(unittest.TestCase):
     @classmethod
@@ -40,6 +91,48 @@ class TestRedisQueue(unittest.TestCase):
         self.queue.clear()
         self.assertTrue(self.queue.is_empty())
 
+    def test_get_many_in_order(self):
+        self.queue.clear()
+        for n in range(5):
+            self.queue.set(n)
+        self.assertEqual(self.queue.get_many(3), [0, 1, 2])
+        self.assertEqual(self.queue.get_many(10), [3, 4])
+        self.assertEqual(self.queue.get_many(10), [])
+
+    def test_get_many_script_fallback(self):
+        queue = RedisQueue('test_queue')
+        queue._pop_count_supported = False
+        queue.clear()
+        for n in range(5):
+            queue.set(n)
+        self.assertEqual(queue.get_many(3), [0, 1, 2])
+        self.assertEqual(queue.size(), 2)
+        queue.clear()
+
+    def test_transfer(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        destination = RedisQueue('test_queue_destination')
+        destination.clear()
+        self.queue.clear()
+        for n in range(5):
+            self.queue.set(n)
+        self.assertEqual(self.queue.transfer(destination, count=3), [0, 1, 2])
+        self.assertEqual(self.queue.transfer('test_queue_destination', count=10), [3, 4])
+        self.assertEqual(self.queue.transfer(destination), [])
+        self.assertEqual(destination.get_all(), [0, 1, 2, 3, 4])
+        destination.clear()
+
+    def test_blocking_get(self):
+        self.queue.clear()
+        self.assertIsNone(self.queue.get(block=0.1))
+        self.assertEqual(self.queue.get_many(5, block=0.1), [])
+        self.queue.set(self.first_data)
+        self.queue.set(self.last_data)
+        self.assertEqual(self.queue.get_many(5, block=1), [self.first_data, self.last_data])
+        self.queue.set(self.first_data)
+        self.assertEqual(self.queue.get(block=1), self.first_data)
+
     def test_clear(self):
         self.queue.set(self.first_data)
         self.queue.set(self.last_data)
@@ -50,7 +143,76 @@ class TestRedisQueue(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.queue.clear()
-        
+
+
+
+class TestRedisReliableQueue(unittest.TestCase):
+    def setUp(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.queue = RedisReliableQueue('test_reliable_queue', consumer_name='worker1', max_deliveries=2)
+        self.queue.clear()
+
+    def tearDown(self):
+        self.queue.clear()
+
+    def test_receive_and_ack(self):
+        ids = self.queue.set_many([{'n': 1}, {'n': 2}, {'n': 3}])
+        messages = self.queue.get_many(2)
+        self.assertEqual([message.id for message in messages], ids[:2])
+        self.assertEqual([message.value for message in messages], [{'n': 1}, {'n': 2}])
+        self.assertEqual([message.deliveries for message in messages], [1, 1])
+        self.assertEqual(self.queue.size(), 1)
+        self.assertEqual(self.queue.in_flight(), 2)
+        self.assertEqual(self.queue.ack([messages[0].id, messages[1]]), 2)
+        self.assertEqual(self.queue.in_flight(), 0)
+        self.assertEqual(self.queue.get_all(), [{'n': 3}])
+
+    def test_blocking_get(self):
+        self.assertIsNone(self.queue.get(block=0.1))
+        self.queue.set({'n': 1})
+        self.queue.set({'n': 2})
+        messages = self.queue.get_many(5, block=1)
+        self.assertEqual([message.value for message in messages], [{'n': 1}, {'n': 2}])
+        self.assertEqual(self.queue.in_flight(), 2)
+
+    def test_expired_messages_are_requeued_then_dead_lettered(self):
+        self.queue.visibility_timeout = 0.05
+        self.queue.set({'n': 1})
+        first = self.queue.get()
+        advance(0.1)
+        self.assertEqual(self.queue.reap(), (1, 0))
+        # The original consumer lost the message and can no longer ack it.
+        self.assertEqual(self.queue.ack([first.id]), 0)
+
+        other = RedisReliableQueue('test_reliable_queue', consumer_name='worker2', visibility_timeout=0.05)
+        second = other.get()
+        self.assertEqual((second.id, second.deliveries), (first.id, 2))
+        advance(0.1)
+        self.assertEqual(self.queue.reap(), (0, 1))
+        self.assertEqual(self.queue.dead_letters(), [{'n': 1}])
+        self.assertEqual(self.queue.in_flight(), 0)
+
+    def test_reap_several_consumers(self):
+        self.queue.visibility_timeout = 0.05
+        other = RedisReliableQueue('test_reliable_queue', consumer_name='worker2', visibility_timeout=0.05)
+        self.queue.set_many([1, 2, 3])
+        self.queue.get()
+        other.get_many(2)
+        advance(0.1)
+        self.assertEqual(self.queue.reap(), (3, 0))
+        self.assertEqual(sorted(self.queue.get_all()), [1, 2, 3])
+        self.assertEqual(self.queue._conn.llen(self.queue._processing), 0)
+        self.assertEqual(self.queue._conn.llen(other._processing), 0)
+        self.assertEqual(self.queue.in_flight(), 0)
+
+    def test_requeue_processing(self):
+        self.queue.set_many([1, 2, 3])
+        self.queue.get_many(2)
+        self.assertEqual(self.queue.requeue_processing(), 2)
+        self.assertEqual(self.queue.get_all(), [1, 2, 3])
+        self.assertEqual(self.queue.in_flight(), 0)
+
 
 class TestRedisStack(unittest.TestCase):
     @classmethod
@@ -80,6 +242,17 @@ class TestRedisStack(unittest.TestCase):
         self.stack.clear()
         self.assertTrue(self.stack.is_empty())
 
+    def test_get_many_last_in_first_out(self):
+        for stack in (self.stack, RedisStack('test_stack')):
+            stack.clear()
+            if stack is not self.stack:
+                stack._pop_count_supported = False
+            for n in range(5):
+                stack.set(n)
+            self.assertEqual(stack.get_many(3), [4, 3, 2])
+            self.assertEqual(stack.get_many(10, block=1), [1, 0])
+            self.assertIsNone(stack.get(block=0.1))
+
     def test_clear(self):
         self.stack.set(self.first_data)
         self.stack.set(self.last_data)
@@ -130,6 +303,61 @@ class TestRedisHashSetHandler(unittest.TestCase):
         self.hash_set.delete(self.test_key)
         self.assertFalse(self.hash_set.exists(self.test_key))
 
+    def test_bulk_operations(self):
+        self.hash_set.clear()
+        self.hash_set.set_many({f'key{n}': {'n': n} for n in range(10)}, chunk_size=4)
+        self.assertEqual(self.hash_set.get_many(['key0', 'key5', 'missing'], chunk_size=2), {
+            'key0': {'n': 0},
+            'key5': {'n': 5}
+        })
+        self.assertEqual(self.hash_set.delete_many(['key0', 'key5', 'missing']), 2)
+        self.assertEqual(len(self.hash_set.get_all()), 8)
+
+        self.hash_set.set_many({'key': 1}, ttl=100)
+        self.assertTrue(0 < self.hash_set._conn.ttl('test_hash_set') <= 100)
+        self.hash_set._conn.persist('test_hash_set')
+
+    def test_scan_iteration_and_projection(self):
+        self.hash_set.clear()
+        self.hash_set.set_many({f'user:{n}': n for n in range(20)})
+        self.hash_set.set('other', 'x')
+        self.assertEqual(dict(self.hash_set.iter_items(count=5)), self.hash_set.get_all())
+        self.assertEqual(sorted(self.hash_set.iter_keys(match='user:1*')), sorted(['user:1'] + [f'user:{n}' for n in range(10, 20)]))
+        self.assertEqual(self.hash_set.project('user:3', 'missing', 'other'), (3, None, 'x'))
+        self.assertEqual(self.hash_set.size(), 21)
+
+    def test_mapping_view(self):
+        self.hash_set.clear()
+        view = self.hash_set.view()
+        view['a'] = {'data': 1}
+        view['none'] = None
+        self.assertEqual(view['a'], {'data': 1})
+        self.assertIsNone(view['none'])
+        self.assertIn('none', view)
+        self.assertNotIn('missing', view)
+        self.assertEqual(view.get('missing', 'default'), 'default')
+        with self.assertRaises(KeyError):
+            view['missing']
+        self.assertEqual(len(view), 2)
+        self.assertEqual(dict(view.items()), {'a': {'data': 1}, 'none': None})
+        view.update({'b': 2})
+        del view['none']
+        with self.assertRaises(KeyError):
+            del view['none']
+        self.assertEqual(sorted(view), ['a', 'b'])
+        self.assertEqual(view.project('b', 'a'), (2, {'data': 1}))
+
+    def test_compare_and_set(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.hash_set.delete('counter')
+        self.assertTrue(self.hash_set.compare_and_set('counter', None, {'n': 1}))
+        self.assertFalse(self.hash_set.compare_and_set('counter', None, {'n': 1}))
+        self.assertFalse(self.hash_set.compare_and_set('counter', {'n': 0}, {'n': 2}))
+        self.assertTrue(self.hash_set.compare_and_set('counter', {'n': 1}, {'n': 2}))
+        self.assertEqual(self.hash_set.get('counter'), {'n': 2})
+        self.hash_set.delete('counter')
+
     def test_clear(self):
         self.hash_set.set(self.test_key, {'data': 'value'})
         self.assertTrue(self.hash_set.exists(self.test_key))
@@ -185,11 +413,75 @@ class TestRedisKeyValueHandler(unittest.TestCase):
         self.kv_store.clear()
         self.assertFalse(self.kv_store.exists(self.test_key))
 
+    def test_get_all_keeps_colons_in_keys(self):
+        self.kv_store.clear()
+        self.kv_store.set('user:1', {'data': 'value1'})
+        self.kv_store.set('user:1:profile', {'data': 'value2'})
+        self.assertEqual(self.kv_store.get_all(), {
+            'user:1': {'data': 'value1'},
+            'user:1:profile': {'data': 'value2'}
+        })
+
+    def test_iter_items_in_chunks(self):
+        self.kv_store.clear()
+        for n in range(25):
+            self.kv_store.set(f'key{n}', n)
+        other_store = RedisKeyValue('test_kv_store_other')
+        other_store.set('key0', 'other')
+        items = dict(self.kv_store.iter_items(count=4))
+        self.assertEqual(items, {f'key{n}': n for n in range(25)})
+        self.assertEqual(sorted(self.kv_store.iter_keys(count=4)), sorted(items))
+
+        self.kv_store.clear(count=4, pipeline_size=2)
+        self.assertEqual(self.kv_store.get_all(), {})
+        self.assertEqual(other_store.get('key0'), 'other')
+        other_store.clear()
+
+    def test_bulk_operations(self):
+        self.kv_store.clear()
+        mapping = {f'key{n}': {'n': n} for n in range(10)}
+        self.kv_store.set_many(mapping, chunk_size=3)
+        self.assertEqual(self.kv_store.get_many(['key1', 'key9', 'missing'], chunk_size=2), {
+            'key1': {'n': 1},
+            'key9': {'n': 9}
+        })
+        self.assertEqual(self.kv_store.delete_many(['key1', 'key2', 'missing'], chunk_size=2), 2)
+        self.assertFalse(self.kv_store.exists('key1'))
+
+        self.kv_store.set_many({'expiring': 1}, ttl=100)
+        self.assertTrue(0 < self.kv_store._conn.ttl(self.kv_store._key_name('expiring')) <= 100)
+
+    def test_set_if_absent(self):
+        self.kv_store.delete('absent')
+        self.assertTrue(self.kv_store.set_if_absent('absent', 1, ttl=100))
+        self.assertFalse(self.kv_store.set_if_absent('absent', 2))
+        self.assertEqual(self.kv_store.get('absent'), 1)
+        self.assertTrue(0 < self.kv_store._conn.ttl(self.kv_store._key_name('absent')) <= 100)
+
+    def test_get_set(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.kv_store.delete('swapped')
+        self.assertIsNone(self.kv_store.get_set('swapped', {'n': 1}))
+        self.assertEqual(self.kv_store.get_set('swapped', {'n': 2}, ttl=1), {'n': 1})
+        self.assertEqual(self.kv_store.get('swapped'), {'n': 2})
+        advance(2)
+        self.assertFalse(self.kv_store.exists('swapped'))
+
+    def test_delete_if_equals(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.kv_store.set('lock', 'token')
+        self.assertFalse(self.kv_store.delete_if_equals('lock', 'other'))
+        self.assertEqual(self.kv_store.get('lock'), 'token')
+        self.assertTrue(self.kv_store.delete_if_equals('lock', 'token'))
+        self.assertFalse(self.kv_store.exists('lock'))
+        self.assertFalse(self.kv_store.delete_if_equals('lock', 'token'))
+
     def test_set_with_ttl(self):
         self.kv_store.set(self.test_key, self.test_value, ttl=1)
         self.assertTrue(self.kv_store.exists(self.test_key))
-        import time
-        time.sleep(2)
+        advance(2)
         self.assertFalse(self.kv_store.exists(self.test_key))
 
     @classmethod
@@ -197,6 +489,91 @@ class TestRedisKeyValueHandler(unittest.TestCase):
         cls.kv_store.clear()
 
 
+class TestBucketedKeyValue(unittest.TestCase):
+    def setUp(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        # Hash field TTLs need Redis 7.4; the emulation works everywhere.
+        self.stores = [BucketedKeyValue('test_bucketed_kv', buckets=8, native_ttl=False)]
+        try:
+            self.stores.append(BucketedKeyValue('test_bucketed_kv', buckets=8))
+        except redis.exceptions.ResponseError:
+            pass
+        self.stores[0].clear()
+
+    def tearDown(self):
+        self.stores[0].clear()
+
+    def test_set_get_and_delete(self):
+        for kv_store in self.stores:
+            with self.subTest(kv_store=kv_store, native_ttl=kv_store._hexpire_supported):
+                for n in range(50):
+                    kv_store.set(f'key{n}', {'n': n})
+                self.assertEqual(kv_store.get('key7'), {'n': 7})
+                self.assertIsNone(kv_store.get('missing'))
+                self.assertTrue(kv_store.exists('key7'))
+                kv_store.delete('key7')
+                self.assertFalse(kv_store.exists('key7'))
+                self.assertEqual(kv_store.get_all(count=3), {f'key{n}': {'n': n} for n in range(50) if n != 7})
+                self.assertEqual(len(list(kv_store.iter_keys())), 49)
+                self.assertLessEqual(len(kv_store._conn.keys('test_bucketed_kv#*')), 8)
+                kv_store.clear()
+                self.assertEqual(kv_store._conn.keys('test_bucketed_kv#*'), [])
+
+    def test_bulk_operations(self):
+        for kv_store in self.stores:
+            with self.subTest(native_ttl=kv_store._hexpire_supported):
+                kv_store.set_many({f'key{n}': n for n in range(20)}, chunk_size=7)
+                self.assertEqual(kv_store.get_many(['key1', 'key19', 'missing'], chunk_size=2), {'key1': 1, 'key19': 19})
+                self.assertEqual(kv_store.delete_many(['key1', 'key2', 'missing'], chunk_size=2), 2)
+                self.assertEqual(len(kv_store.get_all()), 18)
+                kv_store.clear()
+
+    def test_atomic_operations(self):
+        for kv_store in self.stores:
+            with self.subTest(native_ttl=kv_store._hexpire_supported):
+                self.assertTrue(kv_store.set_if_absent('key', 1))
+                self.assertFalse(kv_store.set_if_absent('key', 2))
+                self.assertEqual(kv_store.get_set('key', 3), 1)
+                self.assertEqual(kv_store.get('key'), 3)
+                self.assertFalse(kv_store.delete_if_equals('key', 1))
+                self.assertTrue(kv_store.delete_if_equals('key', 3))
+                self.assertFalse(kv_store.exists('key'))
+                kv_store.clear()
+
+    def test_ttl(self):
+        for kv_store in self.stores:
+            with self.subTest(native_ttl=kv_store._hexpire_supported):
+                kv_store.set('short', 1, ttl=1)
+                kv_store.set_many({'also_short': 2}, ttl=1)
+                kv_store.set('long', 3, ttl=100)
+                kv_store.set('forever', 4)
+                kv_store.set('reset', 5, ttl=1)
+                kv_store.set('reset', 6)
+                kv_store.set('unread', 7, ttl=1)
+                self.assertEqual(kv_store.get('short'), 1)
+                advance(2)
+                self.assertIsNone(kv_store.get('short'))
+                self.assertFalse(kv_store.exists('also_short'))
+                self.assertEqual(kv_store.get_all(), {'long': 3, 'forever': 4, 'reset': 6})
+                self.assertTrue(kv_store.set_if_absent('short', 8))
+                self.assertEqual(kv_store.purge_expired(), 0 if kv_store._hexpire_supported else 1)
+                kv_store.clear()
+
+    def test_migration(self):
+        source = RedisKeyValue('test_bucketed_kv')
+        source.clear()
+        source.set_many({f'key{n}': n for n in range(30)})
+        source.set('expiring', 'soon', ttl=100)
+        target = self.stores[-1]
+        self.assertEqual(migrate_to_buckets(source, target, count=7, delete=True), 31)
+        self.assertEqual(source.get_all(), {})
+        self.assertEqual(target.get_all(), {**{f'key{n}': n for n in range(30)}, 'expiring': 'soon'})
+        advance(101)
+        self.assertIsNone(target.get('expiring'))
+        self.assertEqual(len(target.get_all()), 30)
+
+
 class TestRedisList(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -225,6 +602,56 @@ class TestRedisList(unittest.TestCase):
         self.assertIsNone(self.list_instance.get(0))
         self.assertEqual(self.list_instance.size(), 0)
 
+    def test_server_side_search(self):
+        for value in ['a', 'b', 'a', 'c', 'a']:
+            self.list_instance.set(value)
+        self.assertEqual(self.list_instance.count('a'), 3)
+        self.assertEqual(self.list_instance.count('z'), 0)
+        self.assertTrue(self.list_instance.contains('c'))
+        self.assertFalse(self.list_instance.contains('z'))
+        self.assertEqual(self.list_instance.index_of('a'), 0)
+        self.assertEqual(self.list_instance.index_of('a', rank=2), 2)
+        self.assertEqual(self.list_instance.index_of('a', rank=-1), 4)
+        self.assertIsNone(self.list_instance.index_of('z'))
+
+    def test_search_fallback_without_lpos(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        for value in ['a', 'b', 'a']:
+            self.list_instance.set(value)
+        self.list_instance._lpos_supported = False
+        try:
+            self.assertEqual(self.list_instance.count('a'), 2)
+            self.assertEqual(self.list_instance.index_of('a', rank=-1), 2)
+            self.assertIsNone(self.list_instance.index_of('z'))
+        finally:
+            del self.list_instance._lpos_supported
+
+    def test_push_capped(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.assertEqual(self.list_instance.push_capped([1, 2, 3], max_length=5), 3)
+        self.assertEqual(self.list_instance.push_capped([4, 5, 6, 7], max_length=5), 5)
+        self.assertEqual(self.list_instance.get_all(), [3, 4, 5, 6, 7])
+        self.assertEqual(self.list_instance.push_capped([], max_length=5), 5)
+        with self.assertRaises(ValueError):
+            self.list_instance.push_capped([8], max_length=0)
+        self.assertEqual(self.list_instance.push_capped(range(10000), max_length=20000), 10005)
+        self.assertEqual(self.list_instance.push_capped(range(30000), max_length=3), 3)
+        self.assertEqual(self.list_instance.get_all(), [29997, 29998, 29999])
+
+    def test_iteration_and_slicing(self):
+        for n in range(10):
+            self.list_instance.set(n)
+        self.assertEqual(list(self.list_instance.iter(window=3)), list(range(10)))
+        values = list(range(10))
+        for index in (slice(2, 5), slice(None, -3), slice(-4, None), slice(0, 0), slice(5, 2), slice(None, None, 3), slice(8, 1, -2), slice(None, None, -1)):
+            with self.subTest(index=index):
+                self.assertEqual(self.list_instance[index], values[index])
+        self.assertEqual(self.list_instance[-1], 9)
+        with self.assertRaises(IndexError):
+            self.list_instance[10]
+
 
 class TestRedisSet(unittest.TestCase):
     @classmethod
@@ -254,6 +681,76 @@ class TestRedisSet(unittest.TestCase):
         self.assertEqual(self.set_instance.size(), 0)
 
 
+class TestRedisBloomFilter(unittest.TestCase):
+    def setUp(self):
+        self.bloom = RedisBloomFilter('test_bloom', capacity=100, error_rate=0.01)
+        self.bloom.clear()
+
+    def tearDown(self):
+        self.bloom.clear()
+
+    def test_add_and_contains(self):
+        self.assertFalse(self.bloom.get({'id': 1}))
+        self.assertTrue(self.bloom.set({'id': 1}))
+        self.assertFalse(self.bloom.set({'id': 1}))
+        self.assertTrue(self.bloom.exists({'id': 1}))
+        self.assertEqual(self.bloom.add_many([{'id': n} for n in range(50)] * 2, chunk_size=7), 49)
+        self.assertEqual(self.bloom.contains_many([{'id': n} for n in range(50)]), [True] * 50)
+        self.assertEqual(self.bloom.size(), 50)
+
+    def test_scales_past_capacity(self):
+        self.assertEqual(self.bloom.add_many([f'id{n}' for n in range(1000)]), 1000)
+        self.assertGreater(self.bloom._layer_count, 1)
+        self.assertEqual(self.bloom.size(), 1000)
+        self.assertTrue(all(self.bloom.contains_many([f'id{n}' for n in range(1000)])))
+        false_positives = sum(self.bloom.contains_many([f'other{n}' for n in range(1000)]))
+        self.assertLess(false_positives, 1000 * 0.01 * 3)
+        self.assertLess(self.bloom.bits(), 1000 * 32)
+
+    def test_layers_added_by_other_clients(self):
+        other = RedisBloomFilter('test_bloom', capacity=100, error_rate=0.01)
+        self.assertFalse(self.bloom.get('first'))
+        other.add_many([f'id{n}' for n in range(300)])
+        self.assertTrue(all(self.bloom.contains_many([f'id{n}' for n in range(300)])))
+        with self.assertRaises(ValueError):
+            RedisBloomFilter('test_bloom', capacity=1000).get('first')
+
+    def test_fallback_without_bitfield_ro(self):
+        self.bloom._bitfield_ro_supported = False
+        self.bloom.add_many(['a', 'b'])
+        self.assertEqual(self.bloom.contains_many(['a', 'b']), [True, True])
+
+    def test_invalid_parameters(self):
+        for parameters in ({'capacity': 0}, {'error_rate': 1}, {'growth': 0}):
+            with self.subTest(**parameters):
+                with self.assertRaises(ValueError):
+                    RedisBloomFilter('test_bloom', **parameters)
+
+
+class TestRedisHyperLogLog(unittest.TestCase):
+    def setUp(self):
+        self.counter = RedisHyperLogLog('test_hll')
+        self.other = RedisHyperLogLog('test_hll_other')
+        self.counter.clear()
+        self.other.clear()
+
+    def tearDown(self):
+        self.counter.clear()
+        self.other.clear()
+
+    def test_count_and_merge(self):
+        self.assertTrue(self.counter.is_empty())
+        self.assertTrue(self.counter.set({'id': 1}))
+        self.assertFalse(self.counter.set({'id': 1}))
+        self.assertTrue(self.counter.add_many([{'id': n} for n in range(1000)], chunk_size=300))
+        self.assertFalse(self.counter.add_many([]))
+        self.assertAlmostEqual(self.counter.get(), 1000, delta=30)
+        self.other.add_many([{'id': n} for n in range(500, 1500)])
+        self.assertAlmostEqual(self.counter.count_union(self.other), 1500, delta=45)
+        self.counter.merge('test_hll_other')
+        self.assertAlmostEqual(self.counter.size(), 1500, delta=45)
+
+
 class TestRedisSortedSet(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -278,12 +775,206 @@ class TestRedisSortedSet(unittest.TestCase):
         self.sorted_set_instance.delete(value)
         self.assertIsNone(self.sorted_set_instance.get(value))
 
+    def test_score_and_lex_ranges(self):
+        self.sorted_set_instance.add_many([({'name': name}, score) for name, score in [('a', 5), ('b', 1), ('c', 3), ('d', 10)]])
+        names = lambda values: [value['name'] for value in values]
+        self.assertEqual(names(self.sorted_set_instance.get_by_score(2, 8)), ['c', 'a'])
+        self.assertEqual(names(self.sorted_set_instance.get_by_score('(3', '+inf')), ['a', 'd'])
+        self.assertEqual(names(self.sorted_set_instance.get_by_score(desc=True, offset=1, count=2)), ['a', 'c'])
+        self.assertEqual(self.sorted_set_instance.get_by_score(0, 3, with_scores=True), [({'name': 'b'}, 1.0), ({'name': 'c'}, 3.0)])
+
+        lex = RedisSortedSet('test_sorted_set_lex')
+        lex.clear()
+        lex.add_many({word: 0 for word in ['apple', 'banana', 'cherry', 'date']})
+        self.assertEqual(lex.get_by_lex('banana', 'cherry'), ['banana', 'cherry'])
+        self.assertEqual(lex.get_by_lex(min='banana', min_inclusive=False, count=1), ['cherry'])
+        self.assertEqual(lex.get_by_lex(desc=True, count=2), ['date', 'cherry'])
+        lex.clear()
+
+    def test_range_fallback_before_zrange_by(self):
+        self.sorted_set_instance.add_many({'a': 1, 'b': 2, 'c': 3})
+        self.sorted_set_instance._zrange_by_supported = False
+        try:
+            self.assertEqual(self.sorted_set_instance.get_by_score(2, '+inf', with_scores=True), [('b', 2.0), ('c', 3.0)])
+            self.assertEqual(self.sorted_set_instance.get_by_score(desc=True, count=1), ['c'])
+        finally:
+            del self.sorted_set_instance._zrange_by_supported
+
+    def test_leaderboard(self):
+        self.assertEqual(self.sorted_set_instance.add_many({f'player{n}': n * 10 for n in range(10)}), 10)
+        self.assertEqual(self.sorted_set_instance.add_many({'player1': 5, 'player2': 50, 'new': 1}, gt=True), 1)
+        self.assertEqual(self.sorted_set_instance.get('player1'), 10.0)
+        self.assertEqual(self.sorted_set_instance.get('player2'), 50.0)
+        self.assertEqual(self.sorted_set_instance.add_many({'player3': 0, 'other': 0}, xx=True), 0)
+        self.assertEqual(self.sorted_set_instance.get('player3'), 0.0)
+        self.assertEqual(self.sorted_set_instance.incr('player0', 100), 100.0)
+        self.assertEqual(self.sorted_set_instance.top(3), [(0, 'player0', 100.0), (1, 'player9', 90.0), (2, 'player8', 80.0)])
+        self.assertEqual(self.sorted_set_instance.top(0), [])
+        self.assertEqual(self.sorted_set_instance.top(-1), [])
+        self.assertEqual(self.sorted_set_instance.rank('player9'), 1)
+        self.assertEqual(self.sorted_set_instance.rank('player9', desc=False), 9)
+        self.assertEqual([rank for rank, _, _ in self.sorted_set_instance.around('player8', radius=2)], [0, 1, 2, 3, 4])
+        self.assertEqual(self.sorted_set_instance.around('missing'), [])
+        self.assertEqual(sorted(self.sorted_set_instance.iter(count=3)), sorted(self.sorted_set_instance.get_by_score(with_scores=True)))
+        self.assertEqual(self.sorted_set_instance.size(), 11)
+
+
+class TestRedisStream(unittest.TestCase):
+    def setUp(self):
+        self.stream = RedisStream('test_stream', group_name='test_group', consumer_name='consumer1')
+        self.stream.clear()
+        self.stream._create_consumer_group()
+
+    def tearDown(self):
+        self.stream.clear()
+
+    def test_get_leaves_messages_pending_until_ack(self):
+        ids = [self.stream.set({'n': str(n)}) for n in range(3)]
+        data = self.stream.get(count=10, block=100)
+        self.assertEqual([message['id'] for message in data['datas']], ids)
+        self.assertEqual(data['datas'][0]['data'], {b'n': b'0'})
+        self.assertEqual(self.stream.pending()['pending'], 3)
+        self.assertEqual(self.stream.ack(ids), 3)
+        self.assertEqual(self.stream.pending(), {'pending': 0, 'min': None, 'max': None, 'consumers': {}})
+
+    def test_auto_ack(self):
+        self.stream.set({'n': '1'})
+        self.assertEqual(len(self.stream.get(count=10, block=100, auto_ack=True)['datas']), 1)
+        self.assertEqual(self.stream.pending()['pending'], 0)
+
+    def test_consume_acks_only_handled_messages(self):
+        for n in range(4):
+            self.stream.set({'n': str(n)})
+
+        def callback(message):
+            if message['data'][b'n'] == b'2':
+                raise ValueError('cannot handle')
+
+        self.assertEqual(self.stream.consume(callback, count=10, block=100), 3)
+        self.assertEqual(self.stream.pending()['consumers'], {'consumer1': 1})
+
+    def test_recover_stale_messages(self):
+        ids = [self.stream.set({'n': str(n)}) for n in range(3)]
+        self.stream.get(count=10, block=100)
+        other = RedisStream('test_stream', group_name='test_group', consumer_name='consumer2')
+        self.assertEqual(other.recover(min_idle_time=60000)['datas'], [])
+        recovered = other.recover(min_idle_time=0, count=2)
+        self.assertEqual([message['id'] for message in recovered['datas']], ids[:2])
+        self.assertEqual(other.pending()['consumers'], {'consumer1': 1, 'consumer2': 2})
+
+    def test_add_many_encodes_values(self):
+        stream = RedisStream('test_stream', group_name='test_group', consumer_name='consumer1', encode_values=True)
+        ids = stream.add_many([{'n': n, 'tags': ['a', 'b']} for n in range(3)])
+        self.assertEqual(len(ids), 3)
+        data = stream.get(count=10, block=100, auto_ack=True)
+        self.assertEqual([message['id'] for message in data['datas']], ids)
+        self.assertEqual(data['datas'][2]['data'], {'n': 2, 'tags': ['a', 'b']})
+
+    def test_maxlen_trims_on_write(self):
+        stream = RedisStream('test_stream', group_name='test_group', maxlen=5, approximate=False)
+        stream.add_many({'n': str(n)} for n in range(20))
+        stream.set({'n': '20'})
+        self.assertEqual(self.stream._conn.xlen('test_stream'), 5)
+        self.assertRaises(ValueError, RedisStream, 'test_stream', group_name='test_group', maxlen=5, minid='0-1')
+
+    def test_producer_batches_until_linger(self):
+        with StreamProducer(self.stream, linger=0.05, batch_size=100) as producer:
+            futures = [producer.send({'n': str(n)}) for n in range(10)]
+            self.assertEqual(len(producer), 10)
+            producer.flush()
+            ids = [future.result(timeout=1) for future in futures]
+            late = producer.send({'n': '10'})
+        self.assertTrue(late.done())
+        data = self.stream.get(count=20, block=100)
+        self.assertEqual([message['id'] for message in data['datas']], ids + [late.result()])
+
+
+class TestStreamConsumer(unittest.TestCase):
+    def setUp(self):
+        self.stream = RedisStream('test_stream', group_name='test_group', consumer_name='consumer1')
+        self.stream.clear()
+        self.stream._create_consumer_group()
+
+    def tearDown(self):
+        self.stream.clear()
+
+    def test_handles_and_acks_in_batches(self):
+        for n in range(20):
+            self.stream.set({'n': str(n)})
+        handled = []
+
+        def handler(message):
+            if message['data'][b'n'] == b'7':
+                raise ValueError('cannot handle')
+            handled.append(int(message['data'][b'n']))
+
+        consumer = StreamConsumer(self.stream, handler, workers=4, prefetch=8, batch_size=5, block=50)
+        consumer.start()
+        deadline = time.time() + 5
+        while consumer.processed + consumer.failed < 20 and time.time() < deadline:
+            time.sleep(0.01)
+        consumer.stop()
+        self.assertEqual(sorted(handled), [n for n in range(20) if n != 7])
+        metrics = consumer.metrics()
+        self.assertEqual((metrics['received'], metrics['processed'], metrics['failed'], metrics['acked']), (20, 19, 1, 19))
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(self.stream.pending()['pending'], 1)
+
+    def test_prefetch_bounds_messages_in_flight(self):
+        for n in range(10):
+            self.stream.set({'n': str(n)})
+        release = threading.Event()
+        consumer = StreamConsumer(self.stream, lambda message: release.wait(5), workers=2, prefetch=3, block=50)
+        consumer.start()
+        deadline = time.time() + 5
+        while consumer.received < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(consumer.metrics()['in_flight'], 3)
+        self.assertEqual(consumer.received, 3)
+        release.set()
+        deadline = time.time() + 5
+        while consumer.processed < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        consumer.stop()
+        self.assertEqual(consumer.acked, 10)
+
+    def test_reclaim_skips_messages_still_running(self):
+        self.stream.set({'n': '1'})
+        handled = []
+        release = threading.Event()
+
+        def handler(message):
+            handled.append(message['id'])
+            release.wait(5)
+
+        executor = ThreadPoolExecutor(1)
+        consumer = StreamConsumer(self.stream, handler, workers=4, executor=executor, block=10, reclaim_idle_time=20)
+        consumer.start()
+        time.sleep(0.3)
+        self.stream.set({'n': '2'})
+        deadline = time.time() + 5
+        while consumer.received < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        metrics = consumer.metrics()
+        self.assertEqual((metrics['received'], metrics['in_flight'], metrics['utilization']), (2, 2, 0.25))
+        release.set()
+        consumer.stop()
+        executor.shutdown()
+        self.assertEqual(len(handled), 2)
+        self.assertEqual(len(set(handled)), 2)
+        self.assertEqual(consumer.acked, 2)
+
 
 class TestRedisPubSub(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.pubsub_instance = RedisPubSub()
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.pubsub_instance.stop()
+
     def setUp(self):
         pass  # No need to clear or reset anything for Pub/Sub
 
@@ -295,16 +986,1109 @@ class TestRedisPubSub(unittest.TestCase):
 
         def callback(msg):
             nonlocal received_message
-            received_message = json.loads(msg['data'])
+            received_message = msg['data']
 
         self.pubsub_instance.subscribe(channel, callback)
+        # subscribe() returns once the server confirmed the subscription.
+        self.assertEqual(self.pubsub_instance._conn.pubsub_numsub(channel), [(channel.encode(), 1)])
         self.pubsub_instance.publish(channel, message)
 
         # Wait for message to be received
-        self.pubsub_instance._conn.execute_command('DEBUG', 'SLEEP', '1')
+        self.wait_for(lambda: received_message == message)
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_patterns_and_runtime_unsubscribe(self):
+        pubsub = RedisPubSub()
+        received = []
+        pubsub.subscribe('test_channel_a', received.append)
+        pubsub.psubscribe('test_pattern_*', received.append)
+        self.assertEqual(pubsub._conn.pubsub_numpat(), 1)
+        pubsub.publish('test_channel_a', 1)
+        pubsub.publish('test_pattern_x', 2)
+        self.wait_for(lambda: len(received) == 2)
+        self.assertEqual(received[0], {'type': 'message', 'channel': 'test_channel_a', 'pattern': None, 'data': 1})
+        self.assertEqual(received[1]['pattern'], 'test_pattern_*')
+
+        pubsub.unsubscribe('test_channel_a')
+        pubsub.punsubscribe('test_pattern_*')
+        pubsub.subscribe('test_channel_b', received.append)
+        pubsub.publish('test_channel_a', 3)
+        pubsub.publish('test_pattern_x', 4)
+        pubsub.publish('test_channel_b', 5)
+        self.wait_for(lambda: len(received) == 3)
+        self.assertEqual(received[2]['data'], 5)
+        self.assertEqual(len([thread for thread in threading.enumerate() if thread.name == 'pubsub-dispatcher']), 1)
+        pubsub.stop()
+        self.assertIsNone(pubsub._thread)
+
+    def test_slow_callback_does_not_stall_other_channels(self):
+        release = threading.Event()
+        received = []
+        pubsub = RedisPubSub(executor=ThreadPoolExecutor(max_workers=2))
+        pubsub.subscribe('test_slow_channel', lambda msg: release.wait(5))
+        pubsub.subscribe('test_fast_channel', received.append)
+        pubsub.publish('test_slow_channel', 'slow')
+        pubsub.publish('test_fast_channel', 'fast')
+        self.wait_for(lambda: len(received) == 1)
+        release.set()
+        pubsub.stop()
+
+    def test_publish_many_and_coalescing_publisher(self):
+        pubsub = RedisPubSub()
+        received = []
+        pubsub.subscribe('test_batch_channel', received.append)
+        self.assertEqual(pubsub.publish_many([('test_batch_channel', n) for n in range(3)]), 3)
+        with pubsub.publisher(linger=0.05, batch_size=100) as publisher:
+            futures = [publisher.publish('test_batch_channel', n) for n in range(3, 6)]
+            self.assertEqual(len(publisher), 3)
+            self.assertEqual(str(publisher), 'PubSubPublisher(linger=0.05, batch_size=100, buffered=3)')
+        self.assertEqual([future.result() for future in futures], [1, 1, 1])
+        self.wait_for(lambda: len(received) >= 6)
+        self.assertEqual([message['data'] for message in received][-6:], [0, 1, 2, 3, 4, 5])
+        pubsub.stop()
+
+    def test_async_listen(self):
+        pubsub = RedisPubSub()
+
+        async def consume():
+            messages = pubsub.listen('test_async_channel')
+            receiver = asyncio.ensure_future(messages.__anext__())
+            while not receiver.done():
+                pubsub.publish('test_async_channel', {'message': 'Hello'})
+                await asyncio.sleep(0.01)
+            await messages.aclose()
+            return receiver.result()
+
+        message = asyncio.run(consume())
+        self.assertEqual(message['data'], {'message': 'Hello'})
+        self.assertEqual(pubsub._listeners, {})
+        pubsub.stop()
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    def test_handlers_share_one_pool(self):
+        queue = RedisQueue('test_registry_queue')
+        kv_store = RedisKeyValue('test_registry_kv')
+        self.assertIs(queue._conn.connection_pool, kv_store._conn.connection_pool)
+        self.assertIs(queue._conn.connection_pool, registry.get_pool())
+
+    def test_distinct_servers_get_distinct_pools(self):
+        local_registry = ConnectionRegistry(max_connections=5)
+        pool_db0 = local_registry.get_pool(db=0)
+        pool_db1 = local_registry.get_pool(db=1)
+        self.assertIsNot(pool_db0, pool_db1)
+        self.assertIs(pool_db0, local_registry.get_pool(db=0))
+        self.assertEqual(pool_db0.max_connections, 5)
+        self.assertEqual(len(local_registry), 2)
+
+    def test_existing_pool_and_client(self):
+        local_registry = ConnectionRegistry()
+        pool = local_registry.get_pool()
+        queue = RedisQueue('test_registry_queue', connection_pool=pool)
+        self.assertIs(queue._conn.connection_pool, pool)
+
+        client = local_registry.get_client()
+        stack = RedisStack('test_registry_stack', client=client)
+        self.assertIs(stack._conn, client)
+
+    def test_forked_child_drops_inherited_pools(self):
+        local_registry = ConnectionRegistry()
+        pool = local_registry.get_pool()
+        local_registry._pid = -1
+        self.assertIsNot(local_registry.get_pool(), pool)
+
+    def test_asyncio_pools_are_per_event_loop(self):
+        local_registry = aio.AsyncConnectionRegistry()
+        if SERVER is not None:
+            local_registry.redirect('localhost', 6379, (SERVER.host, SERVER.port))
+
+        async def use():
+            queue = aio.RedisQueue('test_registry_aio_queue', client=local_registry.get_client())
+            await queue.clear()
+            await queue.set(1)
+            self.assertEqual(await queue.size(), 1)
+            await queue.clear()
+            self.assertIs(local_registry.get_pool(), queue._conn.connection_pool)
+            return queue._conn.connection_pool
+
+        first = asyncio.run(use())
+        second = asyncio.run(use())
+        self.assertIsNot(first, second)
+        self.assertIsNot(local_registry.get_pool(), local_registry.get_pool())
+        asyncio.run(local_registry.reset())
+        self.assertEqual(len(local_registry), 0)
+
+
+class TestCodecs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.value = {'name': 'Ozan Metin', 'tags': ['a', 'b'], 'nested': {'count': 3}}
+
+    def test_round_trip(self):
+        for name in ('json', 'fastjson', 'pickle', 'msgpack'):
+            try:
+                codec = get_codec(name)
+            except ImportError:
+                continue
+            with self.subTest(codec=name):
+                self.assertEqual(codec.loads(codec.dumps(self.value)), self.value)
+
+    def test_json_codec_matches_legacy_encoding(self):
+        self.assertEqual(JSONCodec().dumps(self.value), json.dumps(self.value).encode('utf-8'))
+
+    def test_compression_threshold_and_header(self):
+        codec = CompressedCodec(JSONCodec(), threshold=100)
+        small = codec.dumps({'a': 1})
+        large_value = {'data': 'x' * 1000}
+        large = codec.dumps(large_value)
+        self.assertEqual(small[0], CompressedCodec.RAW)
+        self.assertEqual(large[0], CompressedCodec.ZLIB)
+        self.assertLess(len(large), 1000)
+        self.assertEqual(codec.loads(large), large_value)
+        # A reader configured differently still detects the format from the header.
+        reader = CompressedCodec(JSONCodec(), threshold=10 ** 6)
+        self.assertEqual(reader.loads(large), large_value)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            get_codec('yaml')
+
+    def test_handler_uses_codec(self):
+        kv_store = RedisKeyValue('test_codec_kv', codec=PickleCodec())
+        kv_store.set('key', {'data': {1, 2, 3}})
+        self.assertEqual(kv_store.get('key'), {'data': {1, 2, 3}})
+        kv_store.clear()
+
+        hash_set = RedisHashSet('test_codec_hash_set', codec=FastJSONCodec())
+        hash_set.set('key', self.value)
+        self.assertEqual(hash_set.get_all(), {'key': self.value})
+        hash_set.clear()
+
+
+class TestAsyncHandlers(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await aio.registry.reset()
+
+    async def test_queue_first_in_first_out(self):
+        queue = aio.RedisQueue('test_aio_queue')
+        await queue.clear()
+        await queue.set({'n': 1})
+        await queue.set({'n': 2})
+        self.assertEqual(await queue.size(), 2)
+        self.assertEqual(await queue.get(), {'n': 1})
+        self.assertEqual(await queue.get_many(5), [{'n': 2}])
+        self.assertTrue(await queue.is_empty())
+
+    async def test_key_value_shared_with_sync_handler(self):
+        kv_store = aio.RedisKeyValue('test_aio_kv')
+        sync_kv_store = RedisKeyValue('test_aio_kv')
+        await kv_store.set('key', {'data': 'value'})
+        self.assertEqual(sync_kv_store.get('key'), {'data': 'value'})
+        sync_kv_store.set('other', [1, 2])
+        self.assertEqual(await kv_store.get('other'), [1, 2])
+        await kv_store.clear()
+        self.assertFalse(await kv_store.exists('key'))
+
+    async def test_hash_set_and_sorted_set(self):
+        hash_set = aio.RedisHashSet('test_aio_hash_set')
+        await hash_set.clear()
+        await hash_set.set('key', {'data': 'value'})
+        self.assertEqual(await hash_set.get_all(), {'key': {'data': 'value'}})
+
+        sorted_set = aio.RedisSortedSet('test_aio_sorted_set')
+        await sorted_set.clear()
+        await sorted_set.set({'name': 'Bob'}, 2.0)
+        await sorted_set.set({'name': 'Alice'}, 1.0)
+        self.assertEqual(await sorted_set.get_all(), [{'name': 'Alice'}, {'name': 'Bob'}])
+        await hash_set.clear()
+        await sorted_set.clear()
+
+    async def test_scripted_operations(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        hash_set = aio.RedisHashSet('test_aio_hash_set')
+        await hash_set.clear()
+        self.assertTrue(await hash_set.compare_and_set('key', None, 1))
+        self.assertFalse(await hash_set.compare_and_set('key', 2, 3))
+        self.assertEqual(await hash_set.get('key'), 1)
+
+        kv_store = aio.RedisKeyValue('test_aio_kv')
+        await kv_store.set('key', 1)
+        self.assertEqual(await kv_store.get_set('key', 2), 1)
+        self.assertFalse(await kv_store.set_if_absent('key', 3))
+
+        queue = aio.RedisQueue('test_aio_queue')
+        target = aio.RedisList('test_aio_list')
+        await queue.clear()
+        await target.clear()
+        for n in range(3):
+            await queue.set(n)
+        self.assertEqual(await queue.transfer(target, count=2), [0, 1])
+        self.assertEqual(await target.push_capped([2, 3], max_length=3), 3)
+        self.assertEqual(await target.get_all(), [1, 2, 3])
+        target._lpos_supported = False
+        self.assertEqual(await target.count(2), 1)
+        await hash_set.clear()
+        await kv_store.clear()
+        await queue.clear()
+        await target.clear()
+
+    async def test_stream_async_iterator(self):
+        stream = aio.RedisStream('test_aio_stream', group_name='test_group')
+        await stream.clear()
+        await stream.set({'n': '1'})
+        await stream.set({'n': '2'})
+        received = []
+        async for message in stream.iter_messages(count=10, block=100):
+            received.append(message['data'])
+            if len(received) == 2:
+                break
+        self.assertEqual(received, [{b'n': b'1'}, {b'n': b'2'}])
+        await stream.clear()
+
+    async def test_pubsub_listen(self):
+        pubsub = aio.RedisPubSub()
+        messages = pubsub.listen('test_aio_channel')
+        receiver = asyncio.ensure_future(messages.__anext__())
+        while not receiver.done():
+            await pubsub.publish('test_aio_channel', {'message': 'Hello'})
+            await asyncio.sleep(0.01)
+        self.assertEqual(receiver.result()['data'], {'message': 'Hello'})
+        await messages.aclose()
+
+    async def test_pubsub_failing_callback_keeps_subscription(self):
+        pubsub = aio.RedisPubSub()
+        received = []
+
+        def callback(message):
+            received.append(message['data'])
+            if message['data'] == 1:
+                raise ValueError('callback failed')
+
+        await pubsub.subscribe('test_aio_failing_channel', callback)
+        while await pubsub._conn.pubsub_numsub('test_aio_failing_channel') != [(b'test_aio_failing_channel', 1)]:
+            await asyncio.sleep(0.01)
+        with self.assertLogs('handlers.aio.pubsub', 'ERROR'):
+            await pubsub.publish('test_aio_failing_channel', 1)
+            await pubsub.publish('test_aio_failing_channel', 2)
+            for _ in range(100):
+                if len(received) == 2:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertEqual(received, [1, 2])
+        await pubsub.close()
+
+
+class TestBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hash_set = RedisHashSet('test_batch_hash_set')
+        cls.sorted_set = RedisSortedSet('test_batch_sorted_set')
+        cls.queue = RedisQueue('test_batch_queue')
+
+    def setUp(self):
+        self.hash_set.clear()
+        self.sorted_set.clear()
+        self.queue.clear()
+
+    def test_results_in_call_order(self):
+        with self.hash_set.batch() as batch:
+            self.assertIsNone(self.hash_set.set('key1', {'data': 1}))
+            self.hash_set.set('key2', {'data': 2})
+            self.hash_set.get('key1')
+            self.hash_set.get('missing')
+            self.hash_set.exists('key2')
+            self.assertEqual(len(batch), 5)
+        self.assertEqual(batch.results, [None, None, {'data': 1}, None, True])
+        self.assertEqual(self.hash_set.get('key2'), {'data': 2})
+
+    def test_multiple_handlers_and_nested_calls(self):
+        with Batch(self.sorted_set, self.queue, transaction=True) as batch:
+            self.sorted_set.set({'name': 'Alice'}, 1.0)
+            self.queue.set({'n': 1})
+            self.queue.is_empty()
+            self.sorted_set.get({'name': 'Alice'})
+        self.assertEqual(batch.results, [None, None, False, 1.0])
+
+    def test_auto_flush(self):
+        with self.queue.batch(max_size=10) as batch:
+            for n in range(25):
+                self.queue.set(n)
+            self.assertEqual(self.queue.size(), None)
+            self.assertEqual(len(batch), 6)
+        self.assertEqual(batch.results[-1], 25)
+        self.assertEqual(self.queue.get_all(), list(range(25)))
+
+    def test_handler_restored_after_batch(self):
+        with self.assertRaises(RuntimeError):
+            with self.hash_set.batch():
+                self.hash_set.set('key', {'data': 1})
+                raise RuntimeError('abort')
+        self.assertNotIn('set', vars(self.hash_set))
+        self.assertFalse(self.hash_set.exists('key'))
+
+    def test_side_effects_happen_once(self):
+        metrics = Metrics()
+        cache = NearCache(invalidation='none')
+        kv_store = RedisKeyValue('test_batch_near_cache', near_cache=cache, instrumentation=metrics)
+        kv_store.set('key', 1)
+        self.assertEqual(kv_store.get('key'), 1)
+        metrics.reset()
+        invalidations = cache.invalidations
+        with kv_store.batch() as batch:
+            kv_store.set('key', 2)
+            kv_store.get('key')
+        self.assertEqual(batch.results, [None, 2])
+        self.assertEqual(cache.invalidations, invalidations + 1)
+        self.assertEqual(metrics.snapshot()['codec']['dumps']['count'], 1)
+        self.assertEqual(metrics.snapshot()['codec']['loads']['count'], 1)
+        self.assertEqual(kv_store.get('key'), 2)
+        kv_store.clear()
+
+    def test_replay_client_only_answers_commands(self):
+        replay = _ReplayClient([])
+        self.assertIs(getattr(replay, '_pipeline', replay), replay)
+        with self.assertRaises(AttributeError):
+            replay.__deepcopy__
+
+    def test_reply_dependent_calls_are_rejected(self):
+        kv_store = RedisKeyValue('test_batch_kv')
+        kv_store.set('key', 1)
+        with self.assertRaises(BatchError):
+            with kv_store.batch():
+                kv_store.get_all()
+        kv_store.clear()
+
+
+class TestScriptRegistry(unittest.TestCase):
+    def setUp(self):
+        if SERVER is not None and not SERVER.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        self.queue = RedisQueue('test_scripts_queue')
+        self.queue.clear()
+
+    def tearDown(self):
+        self.queue.clear()
+
+    def test_builtin_scripts_are_registered(self):
+        self.assertIn('pop_push', self.queue.scripts)
+        self.assertEqual(self.queue.scripts.get('pop_head').sha, hashlib.sha1(BUILTIN_SCRIPTS['pop_head'].encode()).hexdigest())
+        with self.assertRaises(KeyError):
+            self.queue.scripts.get('missing')
+
+    def test_reload_after_script_flush(self):
+        self.queue.set(1)
+        self.queue.set(2)
+        self.assertEqual(self.queue.transfer('test_scripts_queue'), [1])
+        self.queue._conn.script_flush()
+        self.assertEqual(self.queue.transfer('test_scripts_queue'), [2])
+        self.assertEqual(self.queue.get_all(), [1, 2])
+
+    def test_custom_script(self):
+        sha = self.queue.scripts.register('push_twice', "return redis.call('RPUSH', KEYS[1], ARGV[1], ARGV[1])")
+        self.assertEqual(self.queue.scripts.get('push_twice').sha, sha)
+        self.assertEqual(self.queue.scripts('push_twice', keys=['test_scripts_queue'], args=['"x"']), 2)
+        self.assertEqual(self.queue.get_all(), ['x', 'x'])
+
+    def test_batched_script_call(self):
+        self.queue._conn.script_flush()
+        for n in range(3):
+            self.queue.set(n)
+        with self.queue.batch() as batch:
+            self.queue.transfer('test_scripts_queue', count=2)
+            self.queue.size()
+        self.assertEqual(batch.results, [[0, 1], 3])
+        self.assertEqual(self.queue.get_all(), [2, 0, 1])
+
+    def test_batches_reload_after_script_flush(self):
+        for n in range(3):
+            self.queue.set(n)
+        client = self.queue._conn
+        with self.queue.batch() as batch:
+            for _ in range(2):
+                self.queue.transfer('test_scripts_queue')
+                batch.flush()
+                client.script_flush()
+        self.assertEqual(batch.results, [[0], [1]])
+        self.assertEqual(self.queue.get_all(), [2, 0, 1])
+
+    def test_pipeline_reload_after_script_flush(self):
+        for n in range(2):
+            self.queue.set(n)
+        client = self.queue._conn
+        pipeline = client.pipeline(transaction=False)
+        for value in (b'0', b'1'):
+            pipeline.llen('test_scripts_queue')
+            self.queue.scripts('pop_head', keys=['test_scripts_queue'], args=[1], client=pipeline)
+            self.assertEqual(pipeline.execute()[1], [value])
+            client.script_flush()
+
+
+class TestNearCache(unittest.TestCase):
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_hits_and_local_invalidation(self):
+        cache = NearCache(invalidation='none')
+        kv_store = RedisKeyValue('test_near_cache_kv', near_cache=cache)
+        kv_store.set('key', {'data': 1})
+        self.assertEqual(kv_store.get('key'), {'data': 1})
+        self.assertEqual(kv_store.get('key'), {'data': 1})
+        kv_store.set('key', {'data': 2})
+        self.assertEqual(kv_store.get('key'), {'data': 2})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (1, 2, 1))
+        kv_store.clear()
+        self.assertIsNone(kv_store.get('key'))
+
+    def test_bounded_by_entries_and_bytes(self):
+        cache = NearCache(max_entries=2, max_bytes=100, invalidation='none')
+        hash_set = RedisHashSet('test_near_cache_hash_set', near_cache=cache)
+        hash_set.set_many({'a': 1, 'b': 2, 'c': 3, 'big': 'x' * 200})
+        for key in ('a', 'b', 'c', 'big'):
+            hash_set.get(key)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(hash_set.get('big'), 'x' * 200)
+        hash_set.delete('c')
+        self.assertIsNone(hash_set.get('c'))
+        hash_set.clear()
+
+    def test_pubsub_invalidation(self):
+        reader_cache = NearCache(invalidation='pubsub')
+        writer_cache = NearCache(invalidation='pubsub')
+        reader = RedisKeyValue('test_near_cache_pubsub', near_cache=reader_cache)
+        writer = RedisKeyValue('test_near_cache_pubsub', near_cache=writer_cache)
+        # Written without a near cache, so that no invalidation of it arrives late.
+        RedisKeyValue('test_near_cache_pubsub').set('key', 'old')
+        self.assertEqual(reader.get('key'), 'old')
+        writer.set('key', 'new')
+        self.wait_for(lambda: reader_cache.stats()['invalidations'] == 1)
+        self.assertEqual(reader.get('key'), 'new')
+        writer.clear()
+        reader_cache.close()
+        writer_cache.close()
+
+    def test_tracking_invalidation(self):
+        cache = NearCache(invalidation='tracking')
+        writer = RedisKeyValue('test_near_cache_tracking')
+        # Written before tracking starts, so that no invalidation of it arrives late.
+        writer.set('key', 'old')
+        try:
+            reader = RedisKeyValue('test_near_cache_tracking', near_cache=cache)
+        except redis.exceptions.ResponseError as err:
+            self.skipTest(f'client tracking unavailable: {err}')
+        self.assertEqual(reader.get('key'), 'old')
+        writer.set('key', 'new')
+        self.wait_for(lambda: cache.stats()['invalidations'] == 1)
+        self.assertEqual(reader.get('key'), 'new')
+        writer.clear()
+        cache.close()
+
+    def test_tracking_connection_lost(self):
+        if SERVER is None:
+            self.skipTest('finding the tracking connection needs the fake server')
+        cache = NearCache(invalidation='tracking', reconnect_delay=0.05)
+        writer = RedisKeyValue('test_near_cache_tracker_lost')
+        writer.set('key', 'old')
+        reader = RedisKeyValue('test_near_cache_tracker_lost', near_cache=cache)
+        self.assertEqual(reader.get('key'), 'old')
+        tracker = cache._tracker
+        [client_id] = [client.id for client in SERVER._clients.values() if client.tracking is not None]
+        with self.assertLogs('handlers.near_cache', 'WARNING'):
+            writer._conn.execute_command('CLIENT', 'KILL', 'ID', client_id)
+            self.wait_for(lambda: cache._tracker not in (None, tracker))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(reader.get('key'), 'old')
+        writer.set('key', 'new')
+        self.wait_for(lambda: reader.get('key') == 'new')
+        writer.clear()
+        cache.close()
+
+
+class TestCached(unittest.TestCase):
+    def setUp(self):
+        self.kv_store = RedisKeyValue('test_cached')
+        self.kv_store.clear()
+        self.calls = []
+
+    def tearDown(self):
+        self.kv_store.clear()
 
-        self.assertEqual(received_message, message)
+    def test_hits_misses_and_invalidate(self):
+        metrics = Metrics()
+
+        @cached(self.kv_store, ttl=30, key='square:{0}', beta=0, instrumentation=metrics)
+        def square(number):
+            self.calls.append(number)
+            return number * number
+
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(self.calls, [3])
+        self.assertEqual(square.cache_key(3), 'square:3')
+        self.assertEqual(self.kv_store.get('square:3')[0], 9)
+        square.invalidate(3)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(self.calls, [3, 3])
+        stats = square.cache_stats.snapshot()
+        self.assertEqual((stats['hits'], stats['misses'], stats['recomputations']), (1, 2, 2))
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3)
+        calls = [name for name in metrics.snapshot()['calls'] if name.startswith('cached.')]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(metrics.snapshot()['calls'][calls[0]]['count'], 2)
+
+    def test_default_key_depends_on_arguments(self):
+        @cached(self.kv_store, ttl=30)
+        def add(a, b=0):
+            return a + b
+
+        self.assertEqual(add.cache_key(1, b=2), add.cache_key(1, b=2))
+        self.assertNotEqual(add.cache_key(1, b=2), add.cache_key(2, b=1))
+        self.assertIn('add', add.cache_key(1))
+
+    def test_single_flight(self):
+        @cached(self.kv_store, ttl=30, key='slow', beta=0, poll_interval=0.01)
+        def slow():
+            self.calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: slow(), range(8)))
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(self.calls), 1)
+        self.assertGreaterEqual(slow.cache_stats.lock_waits, 1)
+
+    def test_serves_stale_while_refreshing(self):
+        refresher = ThreadPoolExecutor(1)
+
+        @cached(self.kv_store, ttl=0.5, key='version', stale_ttl=30, beta=0, executor=refresher)
+        def version():
+            self.calls.append(1)
+            return len(self.calls)
+
+        self.assertEqual(version(), 1)
+        time.sleep(0.55)
+        self.assertEqual(version(), 1)
+        refresher.shutdown(wait=True)
+        self.assertEqual(version(), 2)
+        self.assertEqual((version.cache_stats.stale_hits, version.cache_stats.hits), (1, 1))
+
+    def test_early_refresh(self):
+        @cached(self.kv_store, ttl=30, key='early', beta=1e9)
+        def early():
+            self.calls.append(1)
+            time.sleep(0.01)
+            return len(self.calls)
+
+        self.assertEqual(early(), 1)
+        self.assertEqual(early(), 2)
+        self.assertEqual(early.cache_stats.early_refreshes, 1)
+
+    def test_negative_caching(self):
+        @cached(self.kv_store, ttl=30, key='missing', beta=0)
+        def uncached():
+            self.calls.append(1)
+
+        @cached(self.kv_store, ttl=30, key='missing_negative', negative_ttl=30, beta=0)
+        def negative():
+            self.calls.append(2)
+
+        self.assertIsNone(uncached())
+        self.assertIsNone(uncached())
+        self.assertIsNone(negative())
+        self.assertIsNone(negative())
+        self.assertEqual(self.calls, [1, 1, 2])
+        self.assertEqual(negative.cache_stats.negative_hits, 1)
+
+    def test_errors_release_the_lock(self):
+        @cached(self.kv_store, ttl=30, key='failing', beta=0, lock_timeout=30)
+        def failing():
+            self.calls.append(1)
+            raise ValueError('failed')
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                failing()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(failing.cache_stats.errors, 2)
+        self.assertFalse(self.kv_store.exists('failing:lock'))
+
+    def _one_at_a_time(self, function):
+        running, guard = [], threading.Lock()
+
+        def wrapper():
+            with guard:
+                running.append(1)
+                self.calls.append(len(running))
+            try:
+                time.sleep(0.05)
+                return function()
+            finally:
+                with guard:
+                    running.pop()
+        return wrapper
+
+    def test_waiters_take_over_uncached_results(self):
+        uncached = cached(self.kv_store, ttl=30, key='uncached', beta=0, lock_timeout=5, poll_interval=0.01)(
+            self._one_at_a_time(lambda: None))
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: uncached(), range(4)))
+        self.assertEqual(results, [None] * 4)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.calls, [1] * 4)
+
+    def test_waiters_take_over_after_errors(self):
+        def fail():
+            raise ValueError('failed')
+
+        failing = cached(self.kv_store, ttl=30, key='failing', beta=0, lock_timeout=5, poll_interval=0.01)(
+            self._one_at_a_time(fail))
+
+        def call(_):
+            with self.assertRaises(ValueError):
+                failing()
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(call, range(4)))
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(self.calls, [1] * 4)
+        self.assertFalse(self.kv_store.exists('failing:lock'))
+
+    def test_refuses_mismatched_store(self):
+        with self.assertRaises(TypeError):
+            cached(aio.RedisKeyValue('test_cached'), ttl=30)(lambda: None)
+
+        async def load():
+            return None
+
+        with self.assertRaises(TypeError):
+            cached(self.kv_store, ttl=30)(load)
+
+
+class TestAsyncCached(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await aio.RedisKeyValue('test_aio_cached').clear()
+        await aio.registry.reset()
+
+    async def test_hits_and_stale_refresh(self):
+        kv_store = aio.RedisKeyValue('test_aio_cached')
+        await kv_store.clear()
+        calls = []
+
+        @cached(kv_store, ttl=0.5, key='version:{0}', stale_ttl=30, beta=0)
+        async def version(name):
+            calls.append(name)
+            return len(calls)
+
+        self.assertEqual(await version('a'), 1)
+        self.assertEqual(await version('a'), 1)
+        await asyncio.sleep(0.55)
+        self.assertEqual(await version('a'), 1)
+        for _ in range(50):
+            if version.cache_stats.recomputations == 2:
+                break
+            await asyncio.sleep(0.02)
+        self.assertEqual(await version('a'), 2)
+        self.assertEqual(version.cache_stats.stale_hits, 1)
+        await version.invalidate('a')
+        self.assertIsNone(await kv_store.get('version:a'))
+
+    async def test_waiters_take_over_uncached_results(self):
+        kv_store = aio.RedisKeyValue('test_aio_cached')
+        calls = []
+
+        @cached(kv_store, ttl=30, key='uncached', beta=0, lock_timeout=5, poll_interval=0.01)
+        async def uncached():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+
+        start = time.monotonic()
+        self.assertEqual(await asyncio.gather(*(uncached() for _ in range(4))), [None] * 4)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(len(calls), 4)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_calls_commands_and_codec(self):
+        metrics = Metrics()
+        hash_set = RedisHashSet('test_instrumentation_hash_set', instrumentation=metrics)
+        hash_set.set('key1', {'data': 1})
+        hash_set.set_many({'key2': 2, 'key3': 3})
+        self.assertEqual(hash_set.get('key1'), {'data': 1})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['calls']['RedisHashSet.set']['count'], 1)
+        self.assertEqual(snapshot['calls']['RedisHashSet.get']['round_trips'], 1)
+        self.assertEqual(snapshot['commands']['HSET']['count'], 1)
+        self.assertIn('HGET', snapshot['commands'])
+        self.assertGreaterEqual(snapshot['codec']['dumps']['count'], 3)
+        self.assertEqual(snapshot['codec']['loads']['bytes'], len(b'{"data": 1}'))
+        hash_set.clear()
+
+    def test_slow_calls_and_exporters(self):
+        slow, exported = [], []
+        metrics = Metrics(slow_threshold=0.0, on_slow=lambda *args: slow.append(args),
+                          exporters=[CallbackExporter(exported.append)])
+        kv_store = RedisKeyValue('test_instrumentation_kv', instrumentation=metrics)
+        kv_store.set('key', 'value')
+        self.assertIn(('call', 'RedisKeyValue.set'), [(kind, name) for kind, name, _ in slow])
+        metrics.export()
+        self.assertEqual(exported[0]['calls']['RedisKeyValue.set']['count'], 1)
+        text = metrics.prometheus()
+        self.assertIn('redis_handler_call_seconds_bucket{handler="RedisKeyValue",method="set",le="+Inf"} 1', text)
+        self.assertIn('redis_handler_command_seconds_count{command="SET"} 1', text)
+        kv_store.clear()
+
+    def test_batch_with_instrumented_handler(self):
+        metrics = Metrics()
+        queue = RedisQueue('test_instrumentation_queue', instrumentation=metrics)
+        queue.clear()
+        with queue.batch() as batch:
+            queue.set(1)
+            queue.set(2)
+        self.assertEqual(len(batch.results), 2)
+        self.assertEqual(queue.get_all(), [1, 2])
+        self.assertEqual(metrics.snapshot()['commands']['PIPELINE']['commands'], 2)
+        self.assertEqual(metrics.snapshot()['calls']['RedisQueue.get_all']['count'], 1)
+        queue.clear()
+
+    def test_bulk_reads_take_one_round_trip(self):
+        metrics = Metrics()
+        kv_store = RedisKeyValue('test_instrumentation_bulk', instrumentation=metrics)
+        hash_set = RedisHashSet('test_instrumentation_bulk_hash', instrumentation=metrics)
+        kv_store.set_many({f'key{n}': n for n in range(10)})
+        hash_set.set_many({f'key{n}': n for n in range(10)})
+        self.assertEqual(kv_store.get_many([f'key{n}' for n in range(12)], chunk_size=3), {f'key{n}': n for n in range(10)})
+        self.assertEqual(hash_set.get_many([f'key{n}' for n in range(12)], chunk_size=3), {f'key{n}': n for n in range(10)})
+        calls = metrics.snapshot()['calls']
+        self.assertEqual(calls['RedisKeyValue.get_many']['round_trips'], 1)
+        self.assertEqual(calls['RedisHashSet.get_many']['round_trips'], 1)
+        kv_store.clear()
+        hash_set.clear()
+
+    def test_disabled_by_default(self):
+        kv_store = RedisKeyValue('test_instrumentation_default')
+        self.assertNotIn('get', vars(kv_store))
+
+
+class TestFakeRedisServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeRedisServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.flushall()
+        self.client = self.server.client()
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_clock_expires_keys(self):
+        self.client.set('key', 'value', ex=10)
+        self.client.set('other', 'value', px=20500)
+        self.server.clock.advance(9)
+        self.assertEqual(self.client.get('key'), b'value')
+        self.assertEqual(self.client.ttl('key'), 1)
+        self.server.clock.advance(1)
+        self.assertIsNone(self.client.get('key'))
+        self.assertEqual(self.client.keys('*'), [b'other'])
+        self.assertEqual(int(self.client.time()[0]), int(self.server.clock.time()))
+
+    def test_resp2_and_resp3(self):
+        self.client.hset('hash', mapping={'field': 'value'})
+        self.client.zadd('zset', {'member': 1.5})
+        for protocol in (2, 3):
+            with self.subTest(protocol=protocol):
+                client = self.server.client(protocol=protocol, decode_responses=True)
+                self.assertEqual(client.hgetall('hash'), {'field': 'value'})
+                # RESP3 replies come back as lists, RESP2 ones as tuples.
+                self.assertEqual([list(pair) for pair in client.zrange('zset', 0, -1, withscores=True)], [['member', 1.5]])
+                self.assertIsNone(client.get('missing'))
+                client.close()
+
+    def test_watch_aborts_transaction(self):
+        self.client.set('counter', 1)
+        with self.client.pipeline() as pipe:
+            pipe.watch('counter')
+            self.server.client().incr('counter')
+            pipe.multi()
+            pipe.set('counter', 10)
+            self.assertRaises(redis.exceptions.WatchError, pipe.execute)
+        self.assertEqual(self.client.get('counter'), b'2')
+        with self.client.pipeline() as pipe:
+            pipe.watch('counter')
+            pipe.multi()
+            pipe.incr('counter')
+            self.assertEqual(pipe.execute(), [3])
+
+    def test_scan_while_deleting(self):
+        self.client.mset({f'key{index}': index for index in range(500)})
+        seen = set()
+        for key in self.client.scan_iter(count=50):
+            seen.add(key)
+            self.client.delete(key)
+        self.assertEqual(len(seen), 500)
+        self.assertEqual(self.client.dbsize(), 0)
+
+    def test_unknown_command(self):
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.client.execute_command('NOSUCHCOMMAND')
+
+
+class TestHashRing(unittest.TestCase):
+    def test_spreads_keys_evenly(self):
+        ring = HashRing(['a', 'b', 'c'])
+        counts = {node: len(keys) for node, keys in ring.group(str(index) for index in range(30000)).items()}
+        self.assertEqual(set(counts), {'a', 'b', 'c'})
+        for count in counts.values():
+            self.assertAlmostEqual(count / 10000, 1, delta=0.15)
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        ring = HashRing(['a', 'b', 'c'])
+        keys = [str(index) for index in range(10000)]
+        before = {key: ring.get_node(key) for key in keys}
+        ring.add_node('d')
+        moved = [key for key in keys if ring.get_node(key) != before[key]]
+        self.assertTrue(all(ring.get_node(key) == 'd' for key in moved))
+        self.assertAlmostEqual(len(moved) / len(keys), 0.25, delta=0.05)
+        ring.remove_node('d')
+        self.assertEqual({key: ring.get_node(key) for key in keys}, before)
+
+    def test_weights(self):
+        ring = HashRing({'small': 1, 'large': 3})
+        counts = {node: len(keys) for node, keys in ring.group(str(index) for index in range(20000)).items()}
+        self.assertAlmostEqual(counts['large'] / counts['small'], 3, delta=0.6)
+        self.assertRaises(ValueError, ring.add_node, 'small')
+        self.assertRaises(LookupError, HashRing().get_node, 'key')
+
+
+class TestShardedKeyValue(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [FakeRedisServer().start() for _ in range(4)]
+        cls.nodes = [f'{server.host}:{server.port}' for server in cls.servers]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.stop()
+
+    def setUp(self):
+        for server in self.servers:
+            server.flushall()
+        self.kv_store = ShardedKeyValue('test_sharded', self.nodes[:3])
+
+    def tearDown(self):
+        self.kv_store.close()
+
+    def sizes(self):
+        return [server.client().dbsize() for server in self.servers]
+
+    def test_bulk_operations_span_servers(self):
+        data = {f'key{index}': {'n': index} for index in range(300)}
+        self.kv_store.set_many(data)
+        self.assertTrue(all(size > 50 for size in self.sizes()[:3]))
+        self.assertEqual(self.kv_store.get_many(list(data) + ['missing']), data)
+        self.assertEqual(self.kv_store.get('key7'), {'n': 7})
+        self.assertEqual(self.kv_store.get_all(), data)
+        self.assertEqual(sorted(self.kv_store.iter_keys()), sorted(data))
+        self.assertEqual(self.kv_store.delete_many(['key1', 'key2', 'missing']), 2)
+        self.assertFalse(self.kv_store.exists('key1'))
+        self.kv_store.clear()
+        self.assertEqual(self.sizes(), [0, 0, 0, 0])
+
+    def test_hash_tags_share_a_server(self):
+        self.kv_store.set_many({f'cart:{{42}}:{index}': index for index in range(20)})
+        self.assertEqual(sorted(self.sizes()), [0, 0, 0, 20])
+        self.assertEqual(len({self.kv_store.shard_for(f'cart:{{42}}:{index}') for index in range(20)}), 1)
+
+    def test_adding_and_removing_servers_moves_keys(self):
+        data = {f'key{index}': index for index in range(400)}
+        self.kv_store.set_many(data, ttl=100)
+        moved = self.kv_store.add_node(self.nodes[3])
+        self.assertEqual(moved, self.sizes()[3])
+        self.assertGreater(moved, 40)
+        self.assertEqual(self.kv_store.get_many(data), data)
+        self.assertEqual(sum(self.sizes()), 400)
+        key = next(key for key in data if self.kv_store.shard_for(key) == self.nodes[3])
+        self.assertGreater(self.servers[3].client().ttl(f'test_sharded:{key}'), 90)
+        self.kv_store.remove_node(self.nodes[0])
+        self.assertEqual(self.sizes()[0], 0)
+        self.assertEqual(self.kv_store.get_all(), data)
+        self.assertRaises(KeyError, self.kv_store.remove_node, self.nodes[0])
+
+    def test_migration_moves_any_type_and_resizes_the_executor(self):
+        self.kv_store.set_many({f'key{index}': index for index in range(30)})
+        self.assertEqual(self.kv_store._executor._max_workers, 3)
+        names = [f'hash{index}' for index in range(40)]
+        for name in names:
+            client = self.servers[self.nodes.index(self.kv_store.shard_for(name))].client()
+            client.hset(f'test_sharded:{name}', 'field', name)
+        self.kv_store.add_node(self.nodes[3])
+        moved = [name for name in names if self.kv_store.shard_for(name) == self.nodes[3]]
+        self.assertGreater(len(moved), 0)
+        client = self.servers[3].client()
+        self.assertEqual([client.hget(f'test_sharded:{name}', 'field') for name in moved], [name.encode() for name in moved])
+        self.assertEqual(self.kv_store.get_many([f'key{index}' for index in range(30)]), {f'key{index}': index for index in range(30)})
+        self.assertEqual(self.kv_store._executor._max_workers, 4)
+        self.kv_store.remove_node(self.nodes[0])
+        self.kv_store.get_many([f'key{index}' for index in range(30)])
+        self.assertEqual(self.kv_store._executor._max_workers, 3)
+
+
+class TestRedisCluster(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeRedisServer(cluster=True).start()
+        cls.registry = ConnectionRegistry()
+        cls.client = cls.registry.get_cluster_client(cls.server.host, cls.server.port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.registry.reset()
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.flushall()
+
+    def test_hash_tag(self):
+        self.assertEqual(hash_tag('orders'), '{orders}')
+        self.assertEqual(hash_tag('{orders}:high'), '{orders}:high')
+        self.assertEqual(self.client.keyslot('orders'), self.client.keyslot('{orders}:deadlines'))
+        self.assertRaises(ValueError, hash_tag, 'a}b')
+
+    def test_single_key_handlers(self):
+        queue = RedisQueue('test_cluster_queue', client=self.client)
+        for value in (1, 2, 3):
+            queue.set(value)
+        self.assertEqual(queue.get_many(2), [1, 2])
+        hash_set = RedisHashSet('test_cluster_hash', client=self.client)
+        hash_set.set_many({'a': 1, 'b': 2})
+        self.assertEqual(hash_set.get_all(), {'a': 1, 'b': 2})
+        stream = RedisStream('test_cluster_stream', group_name='test_group', client=self.client)
+        stream._create_consumer_group()
+        stream.add_many([{'n': '1'}, {'n': '2'}])
+        self.assertEqual(len(stream.get(count=10, block=100)['datas']), 2)
+        with queue.batch() as batch:
+            queue.set(4)
+            queue.get_all()
+        self.assertEqual(batch.results, [None, [3, 4]])
+
+    def test_reliable_queue_keys_share_a_slot(self):
+        if not self.server.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        queue = RedisReliableQueue('test_cluster_reliable', consumer_name='worker1', visibility_timeout=1, client=self.client)
+        self.assertEqual(self.client.keyslot(queue._processing), self.client.keyslot('test_cluster_reliable'))
+        queue.set_many([1, 2])
+        messages = queue.get_many(2)
+        self.assertEqual(queue.ack([messages[0]]), 1)
+        self.server.clock.advance(2)
+        self.assertEqual(queue.reap(), (1, 0))
+        self.assertEqual(queue.get().value, 2)
+        queue.clear()
+        self.assertEqual(self.server.client().dbsize(), 0)
+
+    def test_bucketed_key_value(self):
+        if not self.server.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        kv_store = BucketedKeyValue('test_cluster_bucketed', buckets=4, native_ttl=False, client=self.client)
+        self.assertEqual(self.client.keyslot(kv_store._bucket_key(1)), self.client.keyslot(kv_store._deadlines_key(1)))
+        kv_store.set_many({f'key{n}': n for n in range(10)}, ttl=100)
+        self.assertEqual(kv_store.get_many(['key1', 'key2']), {'key1': 1, 'key2': 2})
+        self.assertEqual(len(kv_store.get_all()), 10)
+        self.assertEqual(kv_store.purge_expired(), 0)
+        kv_store.clear()
+        self.assertEqual(self.server.client().dbsize(), 0)
+
+    def test_cross_slot_script_is_rejected(self):
+        if not self.server.scripting:
+            self.skipTest('Lua scripting on the fake server needs the lupa package')
+        with self.assertRaises(redis.exceptions.ResponseError):
+            self.client.eval("return redis.call('GET', 'other')", 1, 'key')
+
+
+def _run_case(name):
+    """
+    Run one TestCase class with its module fixtures, in a worker process.
+
+    Returns the class name, the number of tests run and skipped, the
+    failing tests with their tracebacks, and the errors raised by the
+    class fixtures (setUpClass, tearDownClass), which belong to no test.
+    """
+    suite = unittest.defaultTestLoader.loadTestsFromName(name, sys.modules[__name__])
+    result = unittest.TestResult()
+    setUpModule()
+    try:
+        suite.run(result)
+    finally:
+        tearDownModule()
+    failures, fixture_errors = [], []
+    for test, trace in result.failures + result.errors:
+        # Fixture errors are reported against a placeholder instead of a TestCase.
+        if isinstance(test, unittest.TestCase):
+            failures.append((str(test), trace))
+        else:
+            fixture_errors.append((str(test), trace))
+    return name, suite.countTestCases(), result.testsRun, len(result.skipped), failures, fixture_errors
+
+
+def run_parallel(workers=None):
+    """
+    Run every TestCase class in its own process, each against its own server.
+
+    A class is reported as passed only when every one of its tests ran and
+    none failed, and its class fixtures raised nothing; tests that share
+    state through setUpClass are never run without it.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    names = [
+        name for name, value in sorted(globals().items())
+        if isinstance(value, type) and issubclass(value, unittest.TestCase)
+    ]
+    started = time.perf_counter()
+    total = skipped = 0
+    problems = []
+    failed_classes = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name, expected, ran, skips, failures, fixture_errors in executor.map(_run_case, names):
+            total += ran
+            skipped += skips
+            failed_tests = len({test for test, _ in failures})
+            passed = not failures and not fixture_errors and ran == expected
+            if not passed:
+                failed_classes.append(name)
+            problems.extend(failures + fixture_errors)
+            summary = f"{ran}/{expected} tests ran, {ran - failed_tests - skips} passed, {failed_tests} failed, {skips} skipped"
+            if fixture_errors:
+                summary += f", {len(fixture_errors)} class fixture errors"
+            print(f"{name}: {'ok' if passed else 'FAILED'} ({summary})")
+    for test, trace in problems:
+        print('=' * 70, f"FAIL: {test}", '-' * 70, trace, sep='\n')
+    print(
+        f"Ran {total} tests in {time.perf_counter() - started:.2f}s: "
+        f"{len(failed_classes)} of {len(names)} classes failed, {skipped} tests skipped"
+    )
+    return not failed_classes
 
 
 if __name__ == '__main__':
+    # python run_tests.py --parallel [WORKERS] runs the test classes in separate processes.
+    if len(sys.argv) > 1 and sys.argv[1] == '--parallel':
+        sys.exit(0 if run_parallel(int(sys.argv[2]) if len(sys.argv) > 2 else None) else 1)
     unittest.main()